@@ -14,11 +14,6 @@ import logging
 import sys
 from sqlalchemy import text
 import json
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
-from reportlab.lib import colors
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 import traceback
 import werkzeug.exceptions
 import time
@@ -30,9 +25,22 @@ from flask_jwt_extended import JWTManager, create_access_token, jwt_required, ge
 import sqlite3
 from config.config import Config
 from models import db, User, Patient, Image as DBImage
-from threading import Thread
+from threading import Thread, BoundedSemaphore
 import shutil
 from app.routes.patient_routes import patient_bp
+from app.routes.volume_routes import volume_bp
+from app.routes.download_routes import download_bp
+from app.routes.dicomweb_routes import dicomweb_bp
+from app.routes.metrics_routes import metrics_bp
+from app.routes.measurement_routes import measurement_bp
+from app.routes.report_routes import report_bp
+from app.services.dicomweb_service import index_dicom_file
+from app.services import storage, migration_service, db_engine, identity_cache, summary_service, purge_service, measurement_service, trend_service, normative_service, preview_service, report_service, task_metrics
+from app.services.cache_service import init_cache, image_tags, task_tag
+from app.services.scratch_service import TaskScratch, ScratchSpaceError, check_scratch_capacity, scratch_path
+from app.services.volume_store import write_task_volume_stores
+from app.services.task_queue import task_queue
+from app.utils.access_utils import user_owns_patient
 from functools import wraps
 import jwt
 from io import BytesIO
@@ -68,6 +76,12 @@ CORS(app, resources={
 
 # 注册蓝图
 app.register_blueprint(patient_bp, url_prefix='/api')
+app.register_blueprint(volume_bp, url_prefix='/api')
+app.register_blueprint(download_bp, url_prefix='/api')
+app.register_blueprint(dicomweb_bp, url_prefix='/api/dicomweb')
+app.register_blueprint(metrics_bp, url_prefix='/api')
+app.register_blueprint(measurement_bp, url_prefix='/api')
+app.register_blueprint(report_bp, url_prefix='/api')
 
 # 全局请求处理
 @app.after_request
@@ -80,11 +94,11 @@ BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 print(f"\n当前工作目录: {os.getcwd()}")
 print(f"BASE_DIR: {BASE_DIR}\n")
 
-app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{os.path.join(BASE_DIR, "brain_mri.db")}'
-app.config['UPLOAD_FOLDER'] = os.path.join(BASE_DIR, 'uploads')
-app.config['PROCESSED_FOLDER'] = os.path.join(BASE_DIR, 'processed')
-app.config['REPORTS_FOLDER'] = os.path.join(BASE_DIR, 'reports')
-app.config['LOG_FOLDER'] = os.path.join(BASE_DIR, 'logs')
+# 数据目录默认位于backend下，可用同名环境变量指定（基准测试等使用临时目录）
+app.config['UPLOAD_FOLDER'] = os.environ.get('UPLOAD_FOLDER') or os.path.join(BASE_DIR, 'uploads')
+app.config['PROCESSED_FOLDER'] = os.environ.get('PROCESSED_FOLDER') or os.path.join(BASE_DIR, 'processed')
+app.config['REPORTS_FOLDER'] = os.environ.get('REPORTS_FOLDER') or os.path.join(BASE_DIR, 'reports')
+app.config['LOG_FOLDER'] = os.environ.get('LOG_FOLDER') or os.path.join(BASE_DIR, 'logs')
 app.config['ALLOWED_EXTENSIONS'] = {'png', 'jpg', 'jpeg', 'dcm', 'nii', 'nii.gz'}
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max-limit
 
@@ -96,11 +110,6 @@ app.config['JWT_TOKEN_LOCATION'] = Config.JWT_TOKEN_LOCATION
 app.config['JWT_HEADER_NAME'] = Config.JWT_HEADER_NAME
 app.config['JWT_HEADER_TYPE'] = Config.JWT_HEADER_TYPE
 
-# 添加 CAT12 配置
-app.config['CAT12_PATH'] = 'D:/Matlab/toolbox/spm12/toolbox/cat12'  # CAT12 路径
-app.config['SPM12_PATH'] = 'D:/Matlab/toolbox/spm12'  # SPM12 路径
-app.config['MATLAB_PATH'] = 'D:/Matlab/bin/matlab.exe'  # MATLAB 路径
-
 # 初始化JWT
 jwt = JWTManager(app)
 
@@ -118,7 +127,7 @@ def user_lookup_callback(_jwt_header, jwt_data):
         return None
     try:
         user_id = int(identity)
-        return User.query.filter_by(id=user_id).first()
+        return identity_cache.get_user(user_id)
     except (ValueError, TypeError):
         return None
 
@@ -154,8 +163,20 @@ for folder in ['UPLOAD_FOLDER', 'PROCESSED_FOLDER', 'REPORTS_FOLDER', 'LOG_FOLDE
     except Exception as e:
         print(f"✗ 创建目录失败: {str(e)}")
 
-# 初始化数据库
+# 初始化数据库：引擎参数按数据库类型生成（SQLite启用WAL和busy timeout）
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = db_engine.engine_options(app.config)
 db.init_app(app)
+db_engine.init_engine(app, db)
+identity_cache.configure(app.config['IDENTITY_CACHE_SIZE'], app.config['IDENTITY_CACHE_TTL'])
+trend_service.configure(app.config['TREND_CACHE_SIZE'], app.config['TREND_CACHE_TTL'])
+init_cache(app)
+preview_service.configure(app.config['CACHE_PREVIEW_TIMEOUT'])
+report_service.configure(app.config['REPORT_RENDER_WORKERS'], app.config['REPORT_TILE_WORKERS'],
+                         app.config['REPORT_JOB_TTL'], app.config['REPORT_RENDER_LOCK_TIMEOUT'],
+                         app.config['REPORT_BULK_TTL'])
+
+# 同时运行的MATLAB处理数，其余任务在各自的后台线程中排队等待
+processing_slots = BoundedSemaphore(app.config['MAX_CONCURRENT_PROCESSES'])
 
 def allowed_file(filename):
     print(f"\n检查文件类型: {filename}")
@@ -178,43 +199,9 @@ def allowed_file(filename):
     print(f"是否允许上传: {allowed}")
     return allowed
 
-# 添加任务队列类
-class TaskQueue:
-    def __init__(self):
-        self.tasks = {}
-        self.progress = {}
-        self.results = {}  # 添加结果存储
-
-    def add_task(self, task_id):
-        self.tasks[task_id] = 'processing'
-        self.progress[task_id] = 0
-        self.results[task_id] = None
-
-    def update_progress(self, task_id, progress):
-        if task_id in self.progress:
-            self.progress[task_id] = progress
-
-    def get_progress(self, task_id):
-        return self.progress.get(task_id, 0)
-
-    def complete_task(self, task_id, results=None):
-        if task_id in self.tasks:
-            self.tasks[task_id] = 'completed'
-            self.progress[task_id] = 100
-            self.results[task_id] = results
-            print(f"任务 {task_id} 已完成，结果: {results}")
-
-    def fail_task(self, task_id):
-        if task_id in self.tasks:
-            self.tasks[task_id] = 'failed'
-            
-    def get_results(self, task_id):
-        return self.results.get(task_id)
-
-# 创建任务队列实例
-task_queue = TaskQueue()
-
-def process_dicom_image(full_filepath, task_dir, nifti_file, file_ext):
+def process_dicom_image(full_filepath, task_dir, nifti_file, file_ext, timer=None):
+    """转换输入、运行CAT12并计算体积；timer（StageTimer）按阶段记录耗时和资源占用"""
+    timer = timer or task_metrics.StageTimer()
     try:
         print(f"\n=== 开始处理图像 ===")
         print(f"输入文件: {full_filepath}")
@@ -224,8 +211,9 @@ def process_dicom_image(full_filepath, task_dir, nifti_file, file_ext):
         if file_ext == '.dcm':
             print("处理DICOM文件...")
             # 处理DICOM文件
-            ds = pydicom.dcmread(full_filepath)
-            pixel_array = ds.pixel_array
+            with timer.stage('conversion'):
+                ds = pydicom.dcmread(full_filepath)
+                pixel_array = ds.pixel_array
             
             # 确保是3D数组
             if len(pixel_array.shape) == 2:
@@ -233,46 +221,50 @@ def process_dicom_image(full_filepath, task_dir, nifti_file, file_ext):
             print(f"图像形状: {pixel_array.shape}")
             
             # 使用PIL处理图像
-            img = PILImage.fromarray(pixel_array[0].astype('uint8'))
-            preview_path = os.path.join(task_dir, 'preview.png')
-            img.save(preview_path)
+            with timer.stage('preview'):
+                img = PILImage.fromarray(pixel_array[0].astype('uint8'))
+                preview_path = os.path.join(task_dir, 'preview.png')
+                img.save(preview_path)
             print(f"预览图已保存: {preview_path}")
             
             # 转换为NIfTI
-            nifti_img = nib.Nifti1Image(pixel_array, np.eye(4))
-            nib.save(nifti_img, nifti_file)
+            with timer.stage('conversion'):
+                nifti_img = nib.Nifti1Image(pixel_array, np.eye(4))
+                nib.save(nifti_img, nifti_file)
             print(f"已转换为NIfTI: {nifti_file}")
             
         elif file_ext in ['.nii', '.gz']:
             print("处理NIfTI文件...")
             # 处理NIfTI文件
-            img = nib.load(full_filepath)
-            data = img.get_fdata()
-            print(f"NIfTI图像形状: {data.shape}")
-            
-            # 获取中间切片
-            mid_slice = data.shape[2] // 2
-            slice_data = data[:, :, mid_slice]
-            
-            # 归一化到0-255
-            slice_data = ((slice_data - slice_data.min()) * 255 / (slice_data.max() - slice_data.min())).astype('uint8')
-            
-            # 使用PIL保存预览图
-            preview_img = PILImage.fromarray(slice_data)
-            preview_path = os.path.join(task_dir, 'preview.png')
-            preview_img.save(preview_path)
+            with timer.stage('preview'):
+                img = nib.load(full_filepath)
+                data = img.get_fdata()
+                print(f"NIfTI图像形状: {data.shape}")
+                
+                # 获取中间切片
+                mid_slice = data.shape[2] // 2
+                slice_data = data[:, :, mid_slice]
+                
+                # 归一化到0-255
+                slice_data = ((slice_data - slice_data.min()) * 255 / (slice_data.max() - slice_data.min())).astype('uint8')
+                
+                # 使用PIL保存预览图
+                preview_img = PILImage.fromarray(slice_data)
+                preview_path = os.path.join(task_dir, 'preview.png')
+                preview_img.save(preview_path)
             print(f"预览图已保存: {preview_path}")
             
             # 复制NIfTI文件
-            shutil.copy2(full_filepath, nifti_file)
+            with timer.stage('conversion'):
+                shutil.copy2(full_filepath, nifti_file)
             print(f"已复制NIfTI文件: {nifti_file}")
         else:
             raise Exception(f"不支持的文件格式: {file_ext}")
 
-        # 检查MATLAB和SPM12路径
-        spm12_path = app.config['SPM12_PATH'].replace('/', '\\')
-        cat12_path = app.config['CAT12_PATH'].replace('/', '\\')
-        matlab_path = app.config['MATLAB_PATH'].replace('/', '\\')
+        # 检查MATLAB和SPM12路径（由环境变量MATLAB_PATH/SPM12_PATH/CAT12_PATH配置），按当前平台规范化分隔符
+        spm12_path = os.path.normpath(app.config['SPM12_PATH'])
+        cat12_path = os.path.normpath(app.config['CAT12_PATH'])
+        matlab_path = os.path.normpath(app.config['MATLAB_PATH'])
 
         print(f"\n=== 检查环境配置 ===")
         print(f"MATLAB路径: {matlab_path}")
@@ -291,12 +283,12 @@ def process_dicom_image(full_filepath, task_dir, nifti_file, file_ext):
         tpm_path = os.path.join(spm12_path, 'tpm', 'TPM.nii')
         if not os.path.exists(tpm_path):
             raise Exception(f"TPM文件不存在: {tpm_path}")
-        tpm_path = tpm_path.replace('/', '\\')
         print(f"TPM文件路径: {tpm_path}")
 
         print("\n=== 准备MATLAB处理 ===")
         # 创建MATLAB脚本
         matlab_script = '''
+        diary('{log_file}');
         try
             addpath('{spm12_path}');
             addpath('{cat12_path}');
@@ -350,7 +342,8 @@ def process_dicom_image(full_filepath, task_dir, nifti_file, file_ext):
             spm12_path=spm12_path.replace('\\', '\\\\'),
             cat12_path=cat12_path.replace('\\', '\\\\'),
             nifti_file=nifti_file.replace('\\', '\\\\'),
-            tpm_path=tpm_path.replace('\\', '\\\\')
+            tpm_path=tpm_path.replace('\\', '\\\\'),
+            log_file=os.path.join(task_dir, 'matlab.log').replace('\\', '\\\\')
         )
 
         # 保存MATLAB脚本
@@ -359,19 +352,22 @@ def process_dicom_image(full_filepath, task_dir, nifti_file, file_ext):
             f.write(matlab_script)
         print(f"MATLAB脚本已保存: {script_path}")
 
-        # 运行MATLAB脚本
-        matlab_cmd = f'"{matlab_path}" -nodesktop -nosplash -wait -r "run(\'{script_path}\')"'
+        # 运行MATLAB脚本；参数列表不经过shell，路径中的空格无需转义。-wait只在Windows上有效
+        matlab_cmd = [matlab_path, '-nodesktop', '-nosplash', '-r', f"run('{script_path}')"]
+        if platform.system() == 'Windows':
+            matlab_cmd.insert(3, '-wait')
         print(f"\n=== 执行MATLAB处理 ===")
-        print(f"执行命令: {matlab_cmd}")
-        
-        process = subprocess.Popen(
-            matlab_cmd, 
-            shell=True, 
-            stdout=subprocess.PIPE, 
-            stderr=subprocess.PIPE,
-            cwd=task_dir  # 设置工作目录
-        )
-        stdout, stderr = process.communicate()
+        print(f"执行命令: {subprocess.list2cmdline(matlab_cmd)}")
+        
+        with timer.stage('cat12'):
+            process = subprocess.Popen(
+                matlab_cmd, 
+                stdout=subprocess.PIPE, 
+                stderr=subprocess.PIPE,
+                cwd=task_dir  # 设置工作目录
+            )
+            timer.watch(process.pid)  # MATLAB及其子进程的CPU和内存计入该阶段
+            stdout, stderr = process.communicate()
 
         # 检查MATLAB执行结果
         print("\n=== MATLAB执行结果 ===")
@@ -409,15 +405,10 @@ def process_dicom_image(full_filepath, task_dir, nifti_file, file_ext):
 
         # 计算体积
         print("\n=== 计算组织体积 ===")
-        volumes = {}
-        for tissue, path in result_files.items():
-            img = nib.load(path)
-            voxel_volume = np.prod(img.header.get_zooms())  # 体素体积（mm³）
-            tissue_volume = np.sum(img.get_fdata()) * voxel_volume
-            volumes[f"{tissue}_volume"] = float(tissue_volume)
-            print(f"{tissue}体积: {tissue_volume:.2f}mm³")
-
-        volumes['tiv_volume'] = float(sum(volumes.values()))
+        with timer.stage('volumes'):
+            volumes = measurement_service.compute_tissue_volumes(result_files)
+        for tissue in result_files:
+            print(f"{tissue}体积: {volumes[f'{tissue}_volume']:.2f}mm³")
         print(f"总颅内体积: {volumes['tiv_volume']:.2f}mm³")
 
         # 保存结果
@@ -431,6 +422,20 @@ def process_dicom_image(full_filepath, task_dir, nifti_file, file_ext):
         shutil.copy2(result_files['gm'], segmented_path)
         print(f"灰质分割结果已复制到: {segmented_path}")
 
+        # 生成分块多分辨率存储，供前端渐进式加载
+        print("\n=== 生成分块体数据 ===")
+        try:
+            with timer.stage('volume_store'):
+                stores = write_task_volume_stores(
+                    task_dir,
+                    chunk_size=app.config['VOLUME_CHUNK_SIZE'],
+                    compression_level=app.config['COMPRESSION_LEVEL']
+                )
+            print(f"分块体数据已生成: {', '.join(stores.keys())}")
+        except Exception as e:
+            # 分块存储失败不影响分析结果
+            print(f"生成分块体数据失败: {str(e)}")
+
         print("\n=== 处理完成 ===")
         return volumes
 
@@ -476,18 +481,15 @@ def upload_image():
             return jsonify({'error': '未提供患者ID'}), 400
             
         # 验证患者是否属于当前用户
-        patient = Patient.query.filter_by(id=patient_id, user_id=int(current_user_id)).first()
-        if not patient:
+        if not user_owns_patient(current_user_id, patient_id):
             print(f"错误: 患者不存在或无权访问 (ID: {patient_id})")
             return jsonify({'error': '患者不存在或无权访问'}), 403
             
-        # 生成安全的文件名
-        filename = secure_filename(file.filename)
-        unique_filename = f"p{datetime.now().strftime('%Y%m%d_%H%M%S')}{filename}"
+        # 分配唯一的分片存储路径
+        unique_filename, file_path = storage.new_upload_path(file.filename)
         print(f"生成的文件名: {unique_filename}")
         
         # 保存文件
-        file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], unique_filename)
         print(f"保存文件到: {file_path}")
         file.save(file_path)
         
@@ -495,15 +497,26 @@ def upload_image():
         new_image = DBImage(
             filename=unique_filename,
             original_filename=file.filename,
-            patient_id=patient.id,
+            patient_id=int(patient_id),
             check_date=datetime.now(),
             processed_filename=None
         )
         
         db.session.add(new_image)
+        db.session.flush()
+        summary_service.image_added(new_image)
         db.session.commit()
         print(f"创建图像记录: {new_image.id}")
         
+        # DICOM文件写入DICOMweb索引
+        if unique_filename.lower().endswith('.dcm'):
+            try:
+                index_dicom_file(new_image, file_path)
+            except Exception as e:
+                # 索引失败不影响上传
+                db.session.rollback()
+                print(f"DICOM索引失败: {str(e)}")
+        
         print("=== 上传成功 ===")
         return jsonify({
             'message': '文件上传成功',
@@ -536,31 +549,33 @@ def process_image():
             return jsonify({'error': '图像不存在'}), 404
 
         # 验证患者权限
-        patient = Patient.query.get(image.patient_id)
-        if not patient:
-            return jsonify({'error': '患者不存在'}), 404
-
         current_user_id = get_jwt_identity()
-        if patient.user_id != int(current_user_id):
+        if not user_owns_patient(current_user_id, image.patient_id):
             return jsonify({'error': '无权访问此患者的图像'}), 403
 
         # 生成任务ID
         task_id = str(uuid.uuid4())
         
-        # 创建任务目录
-        task_dir = os.path.join(app.config['PROCESSED_FOLDER'], task_id)
-        os.makedirs(task_dir, exist_ok=True)
-        os.makedirs(os.path.join(task_dir, 'mri'), exist_ok=True)
+        # 最终结果目录，处理过程在临时目录中进行，成功后才发布到这里
+        task_dir = storage.task_dir(task_id)
 
         # 获取原始文件路径和扩展名
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], image.filename)
+        file_path = storage.upload_path(image.filename)
         file_ext = os.path.splitext(image.filename)[1].lower()
         
-        # 设置NIfTI文件路径
-        nifti_file = os.path.join(task_dir, 'input.nii')
+        # 开始前检查临时目录空间
+        scratch_root = app.config['SCRATCH_ROOT']
+        scratch_required = os.path.getsize(file_path) * app.config['SCRATCH_SIZE_FACTOR']
+        try:
+            check_scratch_capacity(scratch_root, scratch_required, app.config['SCRATCH_MIN_FREE_BYTES'])
+        except ScratchSpaceError as e:
+            print(f"临时目录空间不足: {str(e)}")
+            return jsonify({'error': str(e)}), 507
 
-        # 添加任务到队列
-        task_queue.add_task(task_id)
+        # 添加任务到队列，记录入队时间用于统计排队等待
+        queued_at = time.time()
+        task_queue.add_task(task_id, {'type': 'process', 'image_id': image_id,
+                                      'user_id': int(current_user_id), 'queued_at': queued_at})
         
         # 保存任务ID到图像记录
         image.task_id = task_id
@@ -568,17 +583,48 @@ def process_image():
         
         # 创建后台线程处理图像
         def process_task():
+            # 等待空闲的处理槽位，排队期间不占用数据库连接
+            processing_slots.acquire()
+            started_at = time.time()
+            task_queue.update_details(task_id, started_at=started_at, queue_wait=started_at - queued_at)
+
+            # 各阶段完成后更新任务详情，处理过程中即可通过状态接口查看
+            timer = task_metrics.StageTimer(
+                on_update=lambda metrics: task_queue.update_details(task_id, metrics=metrics))
+
+            def mark_finished():
+                finished_at = time.time()
+                task_queue.update_details(task_id, finished_at=finished_at, run_seconds=finished_at - started_at)
+
             try:
                 print(f"\n=== 开始处理任务 ===")
-                with app.app_context():  # 添加应用上下文
-                    # 处理图像
-                    results = process_dicom_image(file_path, task_dir, nifti_file, file_ext)
-                    print(f"处理结果: {results}")
+                with db_engine.worker_session(app, db):  # 后台线程使用独立的会话和连接
+                    # 在临时目录中处理图像，失败时自动清理
+                    with TaskScratch(task_id, scratch_root, scratch_required,
+                                     app.config['SCRATCH_MIN_FREE_BYTES']) as scratch:
+                        os.makedirs(os.path.join(scratch.path, 'mri'), exist_ok=True)
+                        nifti_file = os.path.join(scratch.path, 'input.nii')
+                        results = process_dicom_image(file_path, scratch.path, nifti_file, file_ext, timer)
+                        print(f"处理结果: {results}")
+                        
+                        # 处理期间患者可能已被删除，此时不发布结果，临时目录在退出时删除
+                        discarded = purge_service.image_deleted(image_id)
+                        if not discarded:
+                            # 只把最终产物移动到结果目录
+                            with timer.stage('publish'):
+                                scratch.promote(task_dir)
+
+                    if discarded:
+                        print(f"患者已删除，丢弃处理结果: {task_id}")
+                        mark_finished()
+                        task_queue.complete_task(task_id, {'discarded': True})
+                        return
                     
                     # 更新图像记录 - 在这里重新查询Image对象，避免使用分离的实例
                     image_instance = DBImage.query.get(image_id)
                     if image_instance:
-                        image_instance.processed_filename = f"{task_id}/segmented.nii.gz"
+                        before = summary_service.snapshot(image_instance)
+                        image_instance.processed_filename = storage.processed_filename(task_id, 'segmented.nii.gz')
                         image_instance.processed = True
                         image_instance.processing_completed = datetime.now()
                         image_instance.gm_volume = results.get('gm_volume')
@@ -586,6 +632,12 @@ def process_image():
                         image_instance.csf_volume = results.get('csf_volume')
                         image_instance.tiv_volume = results.get('tiv_volume')
                         image_instance.processing_error = None
+                        summary_service.image_updated(image_instance, before)
+                        previous = measurement_service.get_metrics(image_instance.id)
+                        measurement_service.record_volumes(image_instance.id, results)
+                        # 增量更新人群常模统计量，重新处理时先移出旧的测量值
+                        normative_service.update_scan(normative_service.group_of(image_instance.patient), previous,
+                                                      measurement_service.get_metrics(image_instance.id))
                         db.session.commit()
                         print(f"数据库记录已更新: {image_instance.id}")
                         
@@ -599,23 +651,34 @@ def process_image():
                         for log in log_messages:
                             print(log)
                     else:
-                        print(f"无法找到图像记录: {image_id}")
+                        # 发布期间图像已被清理，清理任务不会再删除这个任务目录
+                        print(f"无法找到图像记录: {image_id}，删除已发布的结果")
+                        shutil.rmtree(task_dir, ignore_errors=True)
+                        mark_finished()
+                        task_queue.complete_task(task_id, {'discarded': True})
+                        return
                     
-                    # 完成任务
+                    # 完成任务，阶段耗时随结果保存在任务目录
+                    mark_finished()
+                    task_metrics.write(task_dir, timer, queue_wait=started_at - queued_at)
+                    task_metrics.record(timer)
                     task_queue.complete_task(task_id, results)
                     print(f"任务已完成: {task_id}")
             except Exception as e:
                 print(f"\n=== 任务失败 ===")
                 print(f"错误信息: {str(e)}")
                 print(f"错误堆栈:\n{traceback.format_exc()}")
-                with app.app_context():
+                with db_engine.worker_session(app, db):
                     # 同样在这里重新查询Image对象
                     image_instance = DBImage.query.get(image_id)
                     if image_instance:
                         image_instance.processing_error = str(e)
                         db.session.commit()
-                task_queue.fail_task(task_id)
+                mark_finished()
+                task_queue.fail_task(task_id, str(e))
                 print(f"任务已标记为失败: {task_id}")
+            finally:
+                processing_slots.release()
                 
         thread = Thread(target=process_task)
         thread.daemon = True
@@ -651,8 +714,10 @@ def get_task_status_new(task_id):
         print(f"任务状态: {status}")
         print(f"任务进度: {task_queue.get_progress(task_id)}")
         
-        # 获取MATLAB日志
-        log_file = os.path.join(app.config['PROCESSED_FOLDER'], task_id, 'matlab.log')
+        # 获取MATLAB日志，任务处理中时日志位于临时目录
+        log_file = storage.task_file(task_id, 'matlab.log')
+        if not os.path.exists(log_file):
+            log_file = os.path.join(scratch_path(app.config['SCRATCH_ROOT'], task_id), 'matlab.log')
         matlab_log = None
         if os.path.exists(log_file):
             with open(log_file, 'r', encoding='utf-8', errors='ignore') as f:
@@ -665,10 +730,14 @@ def get_task_status_new(task_id):
         results = task_queue.get_results(task_id)
         print(f"处理结果: {results}")
         
+        details = task_queue.get_details(task_id)
         response_data = {
             'status': status,
             'progress': task_queue.get_progress(task_id),
             'results': results,
+            'details': details,  # 入队/开始/结束时间和排队时长
+            # 各阶段的墙钟时间、CPU时间和峰值内存
+            'metrics': details.get('metrics') or task_metrics.load(storage.task_dir(task_id)),
             'matlab_log': matlab_log
         }
         print(f"返回数据: {response_data}")
@@ -724,31 +793,23 @@ def get_task_by_id(task_id):
         print(f"\n=== 获取任务详情 ===")
         print(f"任务ID: {task_id}")
         
+        # 从measurement表读取处理结果，服务重启后任务队列为空时也能查到已完成的任务
+        image, results = measurement_service.get_task_volumes(task_id)
+        
         # 检查任务是否存在
-        if task_id not in task_queue.tasks:
+        status = task_queue.tasks.get(task_id)
+        if status is None and image is None:
             print(f"任务不存在: {task_id}")
             return jsonify({'error': '任务不存在'}), 404
-            
-        # 获取任务信息
-        task_info = task_queue.tasks.get(task_id)
         
-        # 获取处理结果
-        results_file = os.path.join(app.config['PROCESSED_FOLDER'], task_id, 'results.json')
-        results = None
-        
-        if os.path.exists(results_file):
-            try:
-                with open(results_file, 'r') as f:
-                    results = json.load(f)
-                print(f"找到结果文件: {results_file}")
-            except Exception as e:
-                print(f"读取结果文件失败: {str(e)}")
-        else:
-            # 尝试从task_info获取结果
-            results = task_info.results if hasattr(task_info, 'results') else None
+        if results is None:
+            # 尚未写入数据库的结果从任务队列获取
+            results = task_queue.get_results(task_id)
+        if status is None:
+            status = 'completed' if image.processed else ('failed' if image.processing_error else 'unknown')
         
         # 获取MATLAB日志
-        log_file = os.path.join(app.config['PROCESSED_FOLDER'], task_id, 'matlab.log')
+        log_file = storage.task_file(task_id, 'matlab.log')
         matlab_log = None
         
         if os.path.exists(log_file):
@@ -759,22 +820,24 @@ def get_task_by_id(task_id):
             except Exception as e:
                 print(f"读取日志文件失败: {str(e)}")
         
-        # 返回任务信息
+        # 返回任务信息；阶段耗时在任务完成前从任务队列读取，之后（包括服务重启后）从任务目录读取
+        details = task_queue.get_details(task_id)
         response_data = {
             'task_id': task_id,
-            'status': task_info.status.value if hasattr(task_info, 'status') else 'unknown',
-            'progress': task_info.progress if hasattr(task_info, 'progress') else 0,
+            'status': status,
+            'progress': 100 if status == 'completed' else task_queue.get_progress(task_id),
             'results': results,
             'matlab_log': matlab_log,
-            'error': task_info.error if hasattr(task_info, 'error') else None,
-            'start_time': task_info.start_time.isoformat() if hasattr(task_info, 'start_time') and task_info.start_time else None,
-            'end_time': task_info.end_time.isoformat() if hasattr(task_info, 'end_time') and task_info.end_time else None
+            'error': details.get('error') or (image.processing_error if image else None),
+            'start_time': datetime.fromtimestamp(details['started_at']).isoformat() if details.get('started_at') else None,
+            'end_time': image.processing_completed.isoformat() if image and image.processing_completed else None,
+            'metrics': details.get('metrics') or task_metrics.load(storage.task_dir(task_id))
         }
         
         # 添加处理结果的图像路径
         if results:
             # 检查分割图像是否存在
-            mri_dir = os.path.join(app.config['PROCESSED_FOLDER'], task_id, 'mri')
+            mri_dir = storage.task_file(task_id, 'mri')
             if os.path.exists(mri_dir):
                 response_data['images'] = {
                     'gm': f"/api/preview/{task_id}?type=gm",
@@ -816,6 +879,9 @@ def index():
         'endpoints': {
             'upload': '/api/upload',
             'task_status': '/api/tasks/<task_id>',
+            'volumes': '/api/volumes/<task_id>',
+            'dicomweb': '/api/dicomweb/studies',
+            'metrics': '/api/metrics',
             'health': '/health'
         },
         'supported_formats': list(app.config['ALLOWED_EXTENSIONS'])
@@ -862,7 +928,7 @@ def generate_preview():
             return jsonify({'status': 'error', 'message': '没有选择文件'})
             
         # 临时保存文件
-        temp_path = os.path.join(app.config['UPLOAD_FOLDER'], 'temp_' + file.filename)
+        temp_path = storage.temp_upload_path(file.filename)
         file.save(temp_path)
         
         try:
@@ -938,9 +1004,9 @@ def get_processed_image(task_id, filename):
     try:
         # 构建文件路径
         if filename == 'segmented.nii.gz':
-            filepath = os.path.join(app.config['PROCESSED_FOLDER'], task_id, filename)
+            filepath = storage.task_file(task_id, filename)
         else:
-            filepath = os.path.join(app.config['PROCESSED_FOLDER'], task_id, 'mri', filename)
+            filepath = storage.task_file(task_id, 'mri', filename)
         
         # 检查文件是否存在
         if not os.path.exists(filepath):
@@ -969,7 +1035,7 @@ def get_processed_image(task_id, filename):
         img = PILImage.fromarray(slice_data)
         
         # 保存为临时PNG文件
-        temp_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{task_id}_{filename}.png")
+        temp_path = storage.temp_upload_path(f"{task_id}_{filename}.png")
         img.save(temp_path, 'PNG')
         
         # 读取PNG文件并转换为base64
@@ -1011,20 +1077,22 @@ def get_analysis_results(task_id):
         return response
     
     try:
-        # 构建结果文件路径
-        result_file = os.path.join(app.config['PROCESSED_FOLDER'], task_id, 'results.json')
-        
-        # 检查文件是否存在
-        if not os.path.exists(result_file):
-            print(f"结果文件不存在: {result_file}")
-            return jsonify({
-                'status': 'error',
-                'message': '结果文件不存在'
-            }), 404
+        # 优先从measurement表读取，没有对应图像记录的旧任务再读取结果文件
+        _, results = measurement_service.get_task_volumes(task_id)
+        if results is None:
+            result_file = storage.task_file(task_id, 'results.json')
             
-        # 读取结果文件
-        with open(result_file, 'r') as f:
-            results = json.load(f)
+            # 检查文件是否存在
+            if not os.path.exists(result_file):
+                print(f"结果文件不存在: {result_file}")
+                return jsonify({
+                    'status': 'error',
+                    'message': '结果文件不存在'
+                }), 404
+                
+            # 读取结果文件
+            with open(result_file, 'r') as f:
+                results = json.load(f)
             
         response = jsonify({
             'status': 'success',
@@ -1154,51 +1222,15 @@ def get_db():
 # 更新init_db函数
 def init_db():
     try:
-        db_path = os.path.join(BASE_DIR, "brain_mri.db")
-        if not os.path.exists(db_path):
-            print("创建新数据库...")
-            with app.app_context():
-                db.create_all()
-            print("数据库创建成功")
-        else:
-            print("数据库已存在，检查是否需要更新...")
-            with app.app_context():
-                # 检查是否需要添加新列
-                conn = sqlite3.connect(db_path)
-                cursor = conn.cursor()
-                
-                # 获取现有列
-                cursor.execute("PRAGMA table_info(image)")
-                columns = [col[1] for col in cursor.fetchall()]
-                
-                # 需要添加的新列
-                new_columns = [
-                    ('gm_volume', 'FLOAT'),
-                    ('wm_volume', 'FLOAT'),
-                    ('csf_volume', 'FLOAT'),
-                    ('tiv_volume', 'FLOAT'),
-                    ('processing_completed', 'DATETIME'),
-                    ('processed', 'BOOLEAN'),
-                    ('processing_error', 'TEXT')
-                ]
-                
-                # 添加缺失的列
-                for col_name, col_type in new_columns:
-                    if col_name not in columns:
-                        print(f"添加新列: {col_name}")
-                        cursor.execute(f"ALTER TABLE image ADD COLUMN {col_name} {col_type}")
-                
-                # 更新现有记录的processed字段
-                cursor.execute("UPDATE image SET processed = 0 WHERE processed IS NULL")
-                
-                conn.commit()
-                conn.close()
-                print("数据库更新完成")
+        with app.app_context():
+            # 执行尚未执行的版本化迁移，需要升级时先创建缺少的表
+            version = migration_service.upgrade(db.engine, create_all=db.create_all)
+            print(f"数据库schema版本: {version}")
             
         # 确保所需目录存在
-        required_dirs = ['uploads', 'processed', 'reports', 'logs']
+        required_dirs = ['UPLOAD_FOLDER', 'PROCESSED_FOLDER', 'REPORTS_FOLDER', 'LOG_FOLDER']
         for dir_name in required_dirs:
-            dir_path = os.path.join(BASE_DIR, dir_name)
+            dir_path = app.config[dir_name]
             if not os.path.exists(dir_path):
                 print(f"创建目录: {dir_path}")
                 os.makedirs(dir_path)
@@ -1223,12 +1255,17 @@ def process_image(image_id):
             return False
             
         # 更新处理状态
+        before = summary_service.snapshot(image)
         image.processed = False
         image.processing_error = None
+        summary_service.image_updated(image, before)
+        normative_service.update_scan(normative_service.group_of(image.patient),
+                                      measurement_service.get_metrics(image.id), None)
+        measurement_service.clear_measurements(image.id)
         db.session.commit()
         
         # 检查输入文件是否存在
-        input_file = os.path.join(app.config['UPLOAD_FOLDER'], image.filename)
+        input_file = storage.upload_path(image.filename)
         if not os.path.exists(input_file):
             logger.error(f"输入文件不存在: {input_file}")
             image.processing_error = "输入文件不存在"
@@ -1236,8 +1273,10 @@ def process_image(image_id):
             return False
             
         # 生成唯一的输出文件名
-        output_filename = f"processed_{uuid.uuid4()}.nii"
-        output_file = os.path.join(app.config['PROCESSED_FOLDER'], output_filename)
+        output_task_id = str(uuid.uuid4())
+        output_filename = storage.processed_filename(output_task_id, 'processed.nii')
+        output_file = storage.processed_path(output_filename)
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
         
         # 执行MATLAB脚本
         matlab_script = os.path.join(app.config['CAT12_PATH'], 'cat_standalone_segment.m')
@@ -1277,6 +1316,7 @@ def process_image(image_id):
                     tiv_volume = float(line.split(':')[1].strip())
             
             # 更新图像记录
+            before = summary_service.snapshot(image)
             image.processed_filename = output_filename
             image.processed = True
             image.processing_completed = datetime.utcnow()
@@ -1285,6 +1325,15 @@ def process_image(image_id):
             image.csf_volume = csf_volume
             image.tiv_volume = tiv_volume
             image.processing_error = None
+            summary_service.image_updated(image, before)
+            measurement_service.record_volumes(image.id, {
+                'gm_volume': gm_volume,
+                'wm_volume': wm_volume,
+                'csf_volume': csf_volume,
+                'tiv_volume': tiv_volume
+            })
+            normative_service.update_scan(normative_service.group_of(image.patient), None,
+                                          measurement_service.get_metrics(image.id))
             
             db.session.commit()
             logger.info(f"图像处理完成: {image_id}")
@@ -1352,7 +1401,7 @@ def get_image_preview(image_id):
             return jsonify({'error': '患者不存在'}), 404
 
         # 构建文件路径
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], image.filename)
+        file_path = storage.upload_path(image.filename)
         if not os.path.exists(file_path):
             # 如果原始文件不存在但有task_id，尝试获取处理后的图像
             if image.task_id and image.processed:
@@ -1360,36 +1409,8 @@ def get_image_preview(image_id):
                 return redirect(f"/api/preview/{image.task_id}?type={type_param}")
             return jsonify({'error': '图像文件不存在'}), 404
 
-        # 读取图像文件
-        if image.filename.lower().endswith('.dcm'):
-            ds = pydicom.dcmread(file_path)
-            img_data = ds.pixel_array
-        else:
-            img = nib.load(file_path)
-            img_data = img.get_fdata()
-
-        # 如果是3D数据，取中间切片
-        if len(img_data.shape) == 3:
-            mid_slice = img_data.shape[2] // 2
-            img_data = img_data[:, :, mid_slice]
-
-        # 归一化到0-255
-        if img_data.max() > img_data.min():
-            img_data = ((img_data - img_data.min()) * 255 / (img_data.max() - img_data.min())).astype('uint8')
-
-        # 转换为PNG
-        img = PILImage.fromarray(img_data)
-        
-        # 保存为临时PNG文件
-        temp_path = os.path.join(app.config['UPLOAD_FOLDER'], f"preview_{image_id}.png")
-        img.save(temp_path, 'PNG')
-        
-        # 读取PNG文件并转换为base64
-        with open(temp_path, 'rb') as f:
-            img_data = base64.b64encode(f.read()).decode()
-            
-        # 删除临时文件
-        os.remove(temp_path)
+        # 解码中间层并编码为PNG，结果经两级缓存共享
+        img_data = preview_service.get_preview(file_path, tags=image_tags(image.id, image.patient_id))
         
         response = jsonify({
             'status': 'success',
@@ -1434,75 +1455,20 @@ def get_processed_preview(task_id):
                 'message': f'无效的图像类型。支持的类型: {", ".join(valid_types)}'
             }), 400
             
-        # 根据图像类型确定文件名
-        filename = None
-        if image_type == 'gm':
-            filename = 'p1input.nii'  # 灰质
-        elif image_type == 'wm':
-            filename = 'p2input.nii'  # 白质
-        elif image_type == 'csf':
-            filename = 'p3input.nii'  # 脑脊液
-        elif image_type == 'original':
-            filename = 'p0input.nii'  # 原始图像
-            # 如果p0不存在，尝试使用其他可能的文件名
-            fallback_files = ['input.nii', 'wminput.nii']
-        
-        # 构建文件路径
-        task_dir = os.path.join(current_app.config['PROCESSED_FOLDER'], task_id, 'mri')
-        file_path = os.path.join(task_dir, filename)
-        
-        # 检查文件是否存在
-        if not os.path.exists(file_path):
-            logger.warning(f"文件不存在: {file_path}")
-            
-            # 如果是original类型且主文件不存在，尝试使用备用文件
-            if image_type == 'original':
-                for fallback_file in fallback_files:
-                    fallback_path = os.path.join(task_dir, fallback_file)
-                    if os.path.exists(fallback_path):
-                        logger.info(f"使用备用文件: {fallback_path}")
-                        file_path = fallback_path
-                        break
-                    
-            # 如果所有选项都不存在，返回错误
-            if not os.path.exists(file_path):
-                return jsonify({
-                    'status': 'error',
-                    'message': f'找不到{image_type}图像文件'
-                }), 404
+        # 查找对应类型的文件，original类型在p0不存在时尝试备用文件
+        file_path = preview_service.find_task_file(task_id, image_type)
+        if file_path is None:
+            logger.warning(f"找不到{image_type}图像文件 - 任务ID: {task_id}")
+            return jsonify({
+                'status': 'error',
+                'message': f'找不到{image_type}图像文件'
+            }), 404
         
         logger.info(f"找到文件: {file_path}")
         
-        # 使用nibabel读取NIfTI文件
-        nii_img = nib.load(file_path)
-        nii_data = nii_img.get_fdata()
-        
-        logger.info(f"成功读取NIfTI文件，形状: {nii_data.shape}")
-        
-        # 如果是3D数据，取中间的切片作为预览
-        if len(nii_data.shape) == 3:
-            middle_slice = nii_data.shape[2] // 2
-            image_data = nii_data[:, :, middle_slice]
-            logger.info(f"提取3D数据的中间切片，索引: {middle_slice}")
-        else:
-            image_data = nii_data
-        
-        # 归一化数据到0-255
-        image_data = (image_data - image_data.min()) / (image_data.max() - image_data.min()) * 255
-        image_data = image_data.astype(np.uint8)
-        logger.info(f"数据归一化完成，范围: [0, 255]")
-        
-        # 创建PIL图像
-        image = PILImage.fromarray(image_data)
-        logger.info(f"成功创建PIL图像，大小: {image.size}")
-        
-        # 将图像编码为base64
-        buffered = BytesIO()
-        image.save(buffered, format="PNG")
-        logger.info(f"成功保存图像到缓冲区")
-        
-        img_str = base64.b64encode(buffered.getvalue()).decode('ascii')
-        logger.info(f"成功编码为base64，数据长度: {len(img_str)}")
+        # 解码中间层并编码为PNG，结果经两级缓存共享
+        img_str = preview_service.get_preview(file_path, tags=[task_tag(task_id)])
+        logger.info(f"预览数据长度: {len(img_str)}")
         
         logger.info(f"成功处理预览请求 - 任务ID: {task_id}, 类型: {image_type}")
         response = jsonify({
@@ -1555,6 +1521,7 @@ def get_image_data(image_id):
             'processed': image.processed,
             'task_id': image.task_id,
             'preview_url': preview_url,
+            'download_url': f"/api/download/images/{image.id}",
             'created_at': image.created_at.isoformat() if image.created_at else None,
         }
         
@@ -1575,6 +1542,11 @@ def get_image_data(image_id):
                     'wm': f"/api/preview/{image.task_id}?type=wm",
                     'csf': f"/api/preview/{image.task_id}?type=csf"
                 }
+                image_data['segment_downloads'] = {
+                    'gm': f"/api/download/{image.task_id}/mri/p1input.nii",
+                    'wm': f"/api/download/{image.task_id}/mri/p2input.nii",
+                    'csf': f"/api/download/{image.task_id}/mri/p3input.nii"
+                }
         
         return jsonify({
             'success': True,
@@ -1589,136 +1561,9 @@ def get_image_data(image_id):
             'error': f'获取图像数据失败: {str(e)}'
         }), 500
 
-# 添加报告生成和下载路由
-@app.route('/api/reports/<int:patient_id>', methods=['GET'])
-@jwt_required()
-def generate_patient_report(patient_id):
-    try:
-        # 获取当前用户ID
-        current_user_id = get_jwt_identity()
-        logger.info(f"生成患者报告，患者ID: {patient_id}, 用户ID: {current_user_id}")
-        
-        # 查找患者及其图像
-        patient = Patient.query.filter_by(id=patient_id, user_id=current_user_id).first()
-        if not patient:
-            logger.warning(f"未找到患者: {patient_id}")
-            return jsonify({'error': '未找到患者'}), 404
-        
-        # 创建PDF文件
-        report_filename = f"patient_report_{patient_id}_{int(time.time())}.pdf"
-        report_path = os.path.join(app.config['REPORTS_FOLDER'], report_filename)
-        
-        # 使用reportlab生成PDF
-        doc = SimpleDocTemplate(report_path, pagesize=letter)
-        styles = getSampleStyleSheet()
-        elements = []
-        
-        # 添加标题
-        title_style = styles['Heading1']
-        title = Paragraph(f"患者脑组织分析报告", title_style)
-        elements.append(title)
-        elements.append(Spacer(1, 20))
-        
-        # 添加患者信息
-        patient_info = [
-            ["姓名", patient.name],
-            ["患者ID", patient.patient_id],
-            ["年龄", str(patient.age)],
-            ["性别", patient.gender],
-            ["报告生成日期", datetime.now().strftime("%Y-%m-%d %H:%M")]
-        ]
-        
-        patient_table = Table(patient_info, colWidths=[100, 300])
-        patient_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (0, -1), colors.lightgrey),
-            ('TEXTCOLOR', (0, 0), (0, -1), colors.black),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
-            ('FONTSIZE', (0, 0), (-1, -1), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
-            ('BACKGROUND', (1, 0), (-1, -1), colors.white),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black)
-        ]))
-        
-        elements.append(Paragraph("患者基本信息", styles['Heading2']))
-        elements.append(Spacer(1, 10))
-        elements.append(patient_table)
-        elements.append(Spacer(1, 20))
-        
-        # 添加图像信息和分析结果
-        if patient.images:
-            elements.append(Paragraph("脑组织体积分析结果", styles['Heading2']))
-            elements.append(Spacer(1, 10))
-            
-            for idx, image in enumerate(patient.images):
-                if image.processed and image.gm_volume is not None:
-                    elements.append(Paragraph(f"图像 {idx+1}: {image.original_filename}", styles['Heading3']))
-                    elements.append(Spacer(1, 5))
-                    
-                    # 计算百分比
-                    gm_percent = (image.gm_volume / image.tiv_volume * 100) if image.tiv_volume else 0
-                    wm_percent = (image.wm_volume / image.tiv_volume * 100) if image.tiv_volume else 0
-                    csf_percent = (image.csf_volume / image.tiv_volume * 100) if image.tiv_volume else 0
-                    
-                    # 创建体积数据表格
-                    volume_data = [
-                        ["组织类型", "体积 (ml)", "占比 (%)"],
-                        ["灰质 (GM)", f"{image.gm_volume/1000:.2f}", f"{gm_percent:.1f}"],
-                        ["白质 (WM)", f"{image.wm_volume/1000:.2f}", f"{wm_percent:.1f}"],
-                        ["脑脊液 (CSF)", f"{image.csf_volume/1000:.2f}", f"{csf_percent:.1f}"],
-                        ["颅内总体积 (TIV)", f"{image.tiv_volume/1000:.2f}", "100.0"]
-                    ]
-                    
-                    volume_table = Table(volume_data, colWidths=[150, 100, 100])
-                    volume_table.setStyle(TableStyle([
-                        ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
-                        ('TEXTCOLOR', (0, 0), (-1, 0), colors.black),
-                        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                        ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
-                        ('FONTSIZE', (0, 0), (-1, -1), 10),
-                        ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
-                        ('GRID', (0, 0), (-1, -1), 1, colors.black)
-                    ]))
-                    
-                    elements.append(volume_table)
-                    elements.append(Spacer(1, 15))
-                    
-                    # 扫描日期信息
-                    scan_date = image.check_date.strftime("%Y-%m-%d") if image.check_date else "未知"
-                    elements.append(Paragraph(f"扫描日期: {scan_date}", styles['Normal']))
-                    elements.append(Spacer(1, 5))
-                    
-                    # 处理完成日期
-                    proc_date = image.processing_completed.strftime("%Y-%m-%d %H:%M") if image.processing_completed else "未知"
-                    elements.append(Paragraph(f"处理完成时间: {proc_date}", styles['Normal']))
-                    elements.append(Spacer(1, 20))
-                else:
-                    elements.append(Paragraph(f"图像 {idx+1}: {image.original_filename} - 未处理", styles['Heading3']))
-                    elements.append(Spacer(1, 10))
-        else:
-            elements.append(Paragraph("无图像数据", styles['Normal']))
-        
-        # 添加页脚
-        elements.append(Spacer(1, 30))
-        footer = Paragraph("本报告由脑MRI分析系统自动生成", styles['Normal'])
-        elements.append(footer)
-        
-        # 生成PDF
-        doc.build(elements)
-        logger.info(f"报告生成成功，保存至: {report_path}")
-        
-        # 返回PDF文件
-        return send_file(
-            report_path,
-            mimetype='application/pdf',
-            as_attachment=True,
-            download_name=f"patient_report_{patient.name}.pdf"
-        )
-        
-    except Exception as e:
-        logger.error(f"生成报告失败: {str(e)}")
-        logger.error(traceback.format_exc())
-        return jsonify({'error': f'生成报告失败: {str(e)}'}), 500
-
 if __name__ == '__main__':
+    # 报告渲染进程在服务器启动前fork；导入应用时（测试、gunicorn）不创建，首次生成报告时再创建
+    report_service.start_pool()
+    # 继续清理上次未完成的已删除患者；患者按数据库认领，多个进程同时执行也不会重复清理
+    purge_service.resume_pending_purges(app)
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,144 @@
+from flask import Blueprint, request, jsonify, Response
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from app.services.dicomweb_service import (
+    frame_cache, search_studies, search_series, search_instances, get_instance,
+    read_frames, frame_transfer_syntax, read_instance_metadata
+)
+import logging
+import os
+import uuid
+import traceback
+from app.services import storage
+
+logger = logging.getLogger(__name__)
+dicomweb_bp = Blueprint('dicomweb', __name__)
+
+DICOM_JSON = 'application/dicom+json'
+
+
+@dicomweb_bp.record_once
+def _configure_frame_cache(state):
+    frame_cache.max_bytes = state.app.config.get('DICOM_FRAME_CACHE_BYTES', frame_cache.max_bytes)
+
+
+def _base_url():
+    return request.url_root.rstrip('/') + '/api/dicomweb'
+
+
+def _dicom_json(payload):
+    # QIDO-RS规定无结果时返回204
+    if not payload:
+        return Response(status=204)
+    response = jsonify(payload)
+    response.mimetype = DICOM_JSON
+    return response
+
+
+def _instance_file(instance):
+    return storage.upload_path(instance.image.filename)
+
+
+@dicomweb_bp.route('/studies', methods=['GET'])
+@jwt_required()
+def qido_studies():
+    """QIDO-RS: 检索检查"""
+    try:
+        return _dicom_json(search_studies(get_jwt_identity(), request.args, _base_url()))
+    except Exception as e:
+        logger.error(f"检索检查失败: {str(e)}")
+        logger.error(f"错误详情: {traceback.format_exc()}")
+        return jsonify({'error': f'检索检查失败: {str(e)}'}), 500
+
+
+@dicomweb_bp.route('/studies/<study_uid>/series', methods=['GET'])
+@jwt_required()
+def qido_series(study_uid):
+    """QIDO-RS: 检索序列"""
+    try:
+        return _dicom_json(search_series(get_jwt_identity(), study_uid, request.args, _base_url()))
+    except Exception as e:
+        logger.error(f"检索序列失败: {str(e)}")
+        logger.error(f"错误详情: {traceback.format_exc()}")
+        return jsonify({'error': f'检索序列失败: {str(e)}'}), 500
+
+
+@dicomweb_bp.route('/studies/<study_uid>/series/<series_uid>/instances', methods=['GET'])
+@jwt_required()
+def qido_instances(study_uid, series_uid):
+    """QIDO-RS: 检索实例"""
+    try:
+        return _dicom_json(search_instances(get_jwt_identity(), study_uid, series_uid, request.args, _base_url()))
+    except Exception as e:
+        logger.error(f"检索实例失败: {str(e)}")
+        logger.error(f"错误详情: {traceback.format_exc()}")
+        return jsonify({'error': f'检索实例失败: {str(e)}'}), 500
+
+
+@dicomweb_bp.route('/studies/<study_uid>/series/<series_uid>/instances/<sop_uid>/metadata', methods=['GET'])
+@jwt_required()
+def wado_metadata(study_uid, series_uid, sop_uid):
+    """WADO-RS: 获取实例元数据（DICOM JSON）"""
+    try:
+        instance = get_instance(get_jwt_identity(), study_uid, series_uid, sop_uid)
+        if not instance:
+            return jsonify({'error': '实例不存在'}), 404
+
+        file_path = _instance_file(instance)
+        if not file_path or not os.path.isfile(file_path):
+            return jsonify({'error': '实例文件不存在'}), 404
+
+        bulk_uri = f"{_base_url()}/studies/{study_uid}/series/{series_uid}/instances/{sop_uid}/frames/1"
+        return _dicom_json([read_instance_metadata(instance, file_path, bulk_uri)])
+    except Exception as e:
+        logger.error(f"获取实例元数据失败: {str(e)}")
+        logger.error(f"错误详情: {traceback.format_exc()}")
+        return jsonify({'error': f'获取实例元数据失败: {str(e)}'}), 500
+
+
+@dicomweb_bp.route('/studies/<study_uid>/series/<series_uid>/instances/<sop_uid>/frames/<frame_list>',
+                   methods=['GET'])
+@jwt_required()
+def wado_frames(study_uid, series_uid, sop_uid, frame_list):
+    """WADO-RS: 以multipart/related返回原始位深的帧数据"""
+    try:
+        try:
+            frame_numbers = [int(n) for n in frame_list.split(',')]
+        except ValueError:
+            return jsonify({'error': '无效的帧号'}), 400
+
+        instance = get_instance(get_jwt_identity(), study_uid, series_uid, sop_uid)
+        if not instance:
+            return jsonify({'error': '实例不存在'}), 404
+
+        file_path = _instance_file(instance)
+        if not file_path or not os.path.isfile(file_path):
+            return jsonify({'error': '实例文件不存在'}), 404
+
+        try:
+            frames = read_frames(instance, file_path, frame_numbers)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 404
+
+        boundary = uuid.uuid4().hex
+        part_type = f'application/octet-stream; transfer-syntax={frame_transfer_syntax(instance)}'
+        frames_url = request.base_url.rsplit('/', 1)[0]
+
+        def generate():
+            for number, data in zip(frame_numbers, frames):
+                yield (f"--{boundary}\r\n"
+                       f"Content-Type: {part_type}\r\n"
+                       f"Content-Location: {frames_url}/{number}\r\n"
+                       f"Content-Length: {len(data)}\r\n\r\n").encode()
+                yield data
+                yield b"\r\n"
+            yield f"--{boundary}--\r\n".encode()
+
+        response = Response(generate(), direct_passthrough=True)
+        response.headers['Content-Type'] = \
+            f'multipart/related; type="application/octet-stream"; boundary={boundary}'
+        response.headers['Cache-Control'] = 'private, max-age=3600'
+        return response
+    except Exception as e:
+        logger.error(f"获取帧数据失败: {str(e)}")
+        logger.error(f"错误详情: {traceback.format_exc()}")
+        return jsonify({'error': f'获取帧数据失败: {str(e)}'}), 500
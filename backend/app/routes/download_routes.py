@@ -0,0 +1,124 @@
+from flask import Blueprint, request, jsonify, send_file, current_app, Response
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+from app.utils.access_utils import get_owned_image, get_owned_task_image
+from app.services import storage
+import logging
+import os
+import zlib
+import traceback
+
+logger = logging.getLogger(__name__)
+download_bp = Blueprint('download', __name__)
+
+# 允许下载的体数据文件类型
+DOWNLOADABLE_EXTENSIONS = ('.nii', '.nii.gz', '.dcm')
+
+# 即时gzip压缩时每次读取的字节数
+GZIP_READ_SIZE = 1024 * 1024
+
+
+def _wants_gzip(file_path):
+    """未压缩的.nii且客户端接受gzip、且不是Range请求时才进行即时压缩"""
+    if not file_path.lower().endswith('.nii'):
+        return False
+    if request.range is not None:
+        return False
+    return request.accept_encodings['gzip'] > 0
+
+
+def _iter_gzip(file_path, level):
+    """分块读取文件并输出gzip流，内存占用与文件大小无关"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    with open(file_path, 'rb') as f:
+        while True:
+            block = f.read(GZIP_READ_SIZE)
+            if not block:
+                break
+            data = compressor.compress(block)
+            if data:
+                yield data
+    yield compressor.flush()
+
+
+def _send_volume(file_path, download_name):
+    """发送体数据文件：默认走send_file（支持Range和sendfile），可协商即时gzip"""
+    if _wants_gzip(file_path):
+        stat = os.stat(file_path)
+        response = Response(
+            _iter_gzip(file_path, current_app.config['COMPRESSION_LEVEL']),
+            mimetype='application/octet-stream',
+            direct_passthrough=True
+        )
+        response.headers['Content-Encoding'] = 'gzip'
+        response.headers['Content-Disposition'] = f'attachment; filename="{download_name}"'
+        response.set_etag(f"{stat.st_mtime_ns}-{stat.st_size}-gzip", weak=True)
+        response.last_modified = stat.st_mtime
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response.make_conditional(request)
+
+    # 不支持multipart/byteranges：多段Range按RFC 7233忽略，返回完整文件
+    multi_range = request.range is not None and len(request.range.ranges) > 1
+    try:
+        response = send_file(
+            file_path,
+            mimetype='application/octet-stream',
+            as_attachment=True,
+            download_name=download_name,
+            conditional=not multi_range,
+            etag=True
+        )
+    except RequestedRangeNotSatisfiable as e:
+        # 直接返回416（带Content-Range: bytes */长度），不能落到路由的通用异常处理变成500
+        return e.get_response()
+    if multi_range:
+        response = response.make_conditional(request, accept_ranges=False)
+        response.accept_ranges = 'bytes'
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+
+@download_bp.route('/download/images/<int:image_id>', methods=['GET'])
+@jwt_required()
+def download_original(image_id):
+    """下载原始上传的体数据文件"""
+    try:
+        image = get_owned_image(image_id, get_jwt_identity())
+        if not image:
+            return jsonify({'error': '图像不存在或无权访问'}), 404
+
+        file_path = storage.upload_path(image.filename)
+        if not os.path.isfile(file_path):
+            return jsonify({'error': '图像文件不存在'}), 404
+
+        return _send_volume(file_path, image.original_filename)
+    except Exception as e:
+        logger.error(f"下载原始图像失败: {str(e)}")
+        logger.error(f"错误详情: {traceback.format_exc()}")
+        return jsonify({'error': f'下载原始图像失败: {str(e)}'}), 500
+
+
+@download_bp.route('/download/<task_id>/<path:filename>', methods=['GET'])
+@jwt_required()
+def download_processed(task_id, filename):
+    """下载任务目录中的处理结果体数据，例如segmented.nii.gz或mri/p1input.nii"""
+    try:
+        if not filename.lower().endswith(DOWNLOADABLE_EXTENSIONS):
+            return jsonify({'error': '不支持下载该类型的文件'}), 400
+
+        image = get_owned_task_image(task_id, get_jwt_identity())
+        if not image:
+            return jsonify({'error': '任务不存在或无权访问'}), 404
+
+        try:
+            file_path = storage.task_file(task_id, filename)
+        except ValueError:
+            return jsonify({'error': '非法的文件路径'}), 400
+        if not os.path.isfile(file_path):
+            return jsonify({'error': '文件不存在'}), 404
+
+        return _send_volume(file_path, os.path.basename(filename))
+    except Exception as e:
+        logger.error(f"下载处理结果失败: {str(e)}")
+        logger.error(f"错误详情: {traceback.format_exc()}")
+        return jsonify({'error': f'下载处理结果失败: {str(e)}'}), 500
@@ -0,0 +1,128 @@
+from datetime import datetime, timedelta
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from app.services.measurement_service import (
+    query_cohort, decode_cohort_cursor, METRICS, OPERATORS, DEFAULT_REGION
+)
+from app.services import export_service, normative_service
+from app.utils.access_utils import get_owned_image
+import logging
+import traceback
+
+logger = logging.getLogger(__name__)
+measurement_bp = Blueprint('measurement', __name__)
+
+
+@measurement_bp.route('/measurements/cohort', methods=['GET'])
+@jwt_required()
+def cohort_query():
+    """按测量值筛选图像，例如 ?metric=gm_tiv_ratio&op=lt&value=0.4（键集分页）"""
+    try:
+        metric = request.args.get('metric', '').strip()
+        op = request.args.get('op', 'lt')
+        region = request.args.get('region', DEFAULT_REGION)
+        if metric not in METRICS:
+            return jsonify({'error': f'不支持的指标，可选: {", ".join(METRICS)}'}), 400
+        if op not in OPERATORS:
+            return jsonify({'error': f'不支持的比较运算，可选: {", ".join(OPERATORS)}'}), 400
+
+        try:
+            value = float(request.args['value'])
+        except (KeyError, ValueError):
+            return jsonify({'error': '缺少或无效的筛选数值'}), 400
+
+        try:
+            limit = int(request.args.get('limit', current_app.config['PATIENT_PAGE_SIZE']))
+            cursor = request.args.get('cursor')
+            cursor = decode_cohort_cursor(cursor) if cursor else None
+        except ValueError:
+            return jsonify({'error': '无效的分页参数'}), 400
+        limit = max(1, min(limit, current_app.config['PATIENT_PAGE_MAX']))
+
+        images, next_cursor = query_cohort(get_jwt_identity(), metric, op, value, limit,
+                                           region=region, cursor=cursor)
+        return jsonify({
+            'images': images,
+            'next_cursor': next_cursor,
+            'has_more': next_cursor is not None
+        })
+    except Exception as e:
+        logger.error(f"队列查询失败: {str(e)}")
+        logger.error(f"错误详情: {traceback.format_exc()}")
+        return jsonify({'error': f'队列查询失败: {str(e)}'}), 500
+
+
+@measurement_bp.route('/images/<int:image_id>/normative', methods=['GET'])
+@jwt_required()
+def image_normative_scores(image_id):
+    """图像各指标相对同年龄段、同性别人群的z分数和百分位"""
+    try:
+        if get_owned_image(image_id, get_jwt_identity()) is None:
+            return jsonify({'error': '图像不存在'}), 404
+        scores = normative_service.score_image(image_id, current_app.config['NORMATIVE_MIN_COUNT'])
+        return jsonify({'success': True, 'image_id': image_id, 'normative': scores})
+    except Exception as e:
+        logger.error(f"获取常模评分失败: {str(e)}")
+        logger.error(f"错误详情: {traceback.format_exc()}")
+        return jsonify({'error': f'获取常模评分失败: {str(e)}'}), 500
+
+
+@measurement_bp.route('/normative/<metric>', methods=['GET'])
+@jwt_required()
+def normative_reference(metric):
+    """指标在各年龄段和性别分组中的人群参考值"""
+    try:
+        if metric not in METRICS:
+            return jsonify({'error': f'不支持的指标，可选: {", ".join(METRICS)}'}), 400
+        min_count = current_app.config['NORMATIVE_MIN_COUNT']
+        # 样本过少的分组不返回，避免泄露个别患者的测量值
+        groups = [group for group in normative_service.norms(metric) if group['count'] >= min_count]
+        return jsonify({'success': True, 'metric': metric, 'groups': groups})
+    except Exception as e:
+        logger.error(f"获取人群参考值失败: {str(e)}")
+        logger.error(f"错误详情: {traceback.format_exc()}")
+        return jsonify({'error': f'获取人群参考值失败: {str(e)}'}), 500
+
+
+def _parse_date(value, end=False):
+    """解析日期参数（YYYY-MM-DD或ISO时间），只给日期的结束时间包含当天"""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if end and len(value) <= 10:
+        parsed += timedelta(days=1)
+    return parsed
+
+
+@measurement_bp.route('/export/measurements', methods=['GET'])
+@jwt_required()
+def export_measurements():
+    """流式导出当前用户全部图像的测量值（每张图像一行），支持CSV和Parquet
+
+    参数: format=csv|parquet, columns=逗号分隔的列名, date_from/date_to=检查日期范围,
+    processed=true只导出已处理的图像, patient_id=只导出指定患者
+    """
+    try:
+        fmt = request.args.get('format', 'csv').lower()
+        try:
+            columns = export_service.parse_columns(request.args.get('columns'))
+            filters = {
+                'date_from': _parse_date(request.args.get('date_from')),
+                'date_to': _parse_date(request.args.get('date_to'), end=True),
+                'processed_only': request.args.get('processed', 'false').lower() == 'true',
+                'patient_id': request.args.get('patient_id', type=int),
+            }
+            stream, mimetype, extension = export_service.export_measurements(
+                fmt, get_jwt_identity(), columns, current_app.config['EXPORT_BATCH_SIZE'], **filters)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        filename = f"measurements-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{extension}"
+        response = Response(stream_with_context(stream), mimetype=mimetype)
+        response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+    except Exception as e:
+        logger.error(f"导出测量值失败: {str(e)}")
+        logger.error(f"错误详情: {traceback.format_exc()}")
+        return jsonify({'error': f'导出测量值失败: {str(e)}'}), 500
@@ -0,0 +1,29 @@
+from flask import Blueprint, jsonify
+from flask_jwt_extended import jwt_required
+from models import db
+from app.services import db_engine, identity_cache, trend_service, cache_service, task_metrics
+import logging
+import traceback
+
+logger = logging.getLogger(__name__)
+metrics_bp = Blueprint('metrics', __name__)
+
+
+@metrics_bp.route('/metrics', methods=['GET'])
+@jwt_required()
+def get_metrics():
+    """获取运行指标：数据库语句耗时、写语句耗时和锁定错误、连接池状态、各缓存命中率和处理任务各阶段的耗时"""
+    try:
+        return jsonify({
+            'success': True,
+            'database': db_engine.metrics.snapshot(),
+            'pool': db_engine.pool_status(db.engine),
+            'identity_cache': identity_cache.stats(),
+            'trend_cache': trend_service.stats(),
+            'cache': cache_service.stats(),
+            'pipeline': task_metrics.stats()
+        })
+    except Exception as e:
+        logger.error(f"获取运行指标失败: {str(e)}")
+        logger.error(f"错误详情: {traceback.format_exc()}")
+        return jsonify({'error': f'获取运行指标失败: {str(e)}'}), 500
@@ -2,9 +2,15 @@ from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from models import db, Patient
 import logging
-import os
 from flask import current_app
 import traceback
+from app.services import summary_service, purge_service, trend_service, normative_service
+from app.utils.access_utils import user_owns_patient
+from app.services.task_queue import task_queue
+from app.services.cache_service import cache, patient_tag
+from app.services.patient_service import (
+    list_patient_summaries, list_patient_images, search_patients, decode_search_cursor
+)
 
 logger = logging.getLogger(__name__)
 patient_bp = Blueprint('patient', __name__)
@@ -48,6 +54,8 @@ def patients():
                 )
                 
                 db.session.add(new_patient)
+                db.session.flush()
+                summary_service.ensure_summary(new_patient.id)
                 db.session.commit()
                 logger.info(f"成功创建新患者: {new_patient.id}")
                 
@@ -61,24 +69,92 @@ def patients():
                 db.session.rollback()
                 return jsonify({'error': '创建患者失败'}), 500
         
-        # GET 请求处理
+        # GET 请求处理：键集分页返回患者摘要，图像列表按需获取
         try:
-            logger.debug(f"获取用户 {current_user_id} 的患者列表")
-            patients = Patient.query.filter_by(user_id=current_user_id).all()
+            try:
+                limit = int(request.args.get('limit', current_app.config['PATIENT_PAGE_SIZE']))
+                cursor = request.args.get('cursor', type=int)
+            except ValueError:
+                return jsonify({'error': '无效的分页参数'}), 400
+            limit = max(1, min(limit, current_app.config['PATIENT_PAGE_MAX']))
+            include_images = 'images' in request.args.get('include', '').split(',')
+
+            logger.debug(f"获取用户 {current_user_id} 的患者列表，cursor={cursor}, limit={limit}")
+            patients, next_cursor = list_patient_summaries(
+                current_user_id, limit, cursor=cursor, include_images=include_images
+            )
             logger.info(f"成功获取患者列表，数量: {len(patients)}")
             
             return jsonify({
                 'success': True,
-                'patients': [patient.to_dict() for patient in patients]
+                'patients': patients,
+                'next_cursor': next_cursor,
+                'has_more': next_cursor is not None
             })
         except Exception as e:
             logger.error(f"获取患者列表失败: {str(e)}")
+            logger.error(f"错误详情: {traceback.format_exc()}")
             return jsonify({'error': '获取患者列表失败'}), 500
             
     except Exception as e:
         logger.error(f"处理患者请求时发生错误: {str(e)}")
         return jsonify({'error': '服务器内部错误'}), 500
 
+@patient_bp.route('/patients/search', methods=['GET'])
+@jwt_required()
+def search_patient_list():
+    """按姓名或患者编号搜索患者（前缀匹配，按相关度排序，键集分页）"""
+    try:
+        q = request.args.get('q', '').strip()
+        if not q:
+            return jsonify({'error': '缺少搜索关键词'}), 400
+
+        try:
+            limit = int(request.args.get('limit', current_app.config['PATIENT_PAGE_SIZE']))
+            cursor = request.args.get('cursor')
+            cursor = decode_search_cursor(cursor) if cursor else None
+        except ValueError:
+            return jsonify({'error': '无效的分页参数'}), 400
+        limit = max(1, min(limit, current_app.config['PATIENT_PAGE_MAX']))
+
+        patients, next_cursor = search_patients(get_jwt_identity(), q, limit, cursor=cursor)
+        return jsonify({
+            'success': True,
+            'patients': patients,
+            'next_cursor': next_cursor,
+            'has_more': next_cursor is not None
+        })
+    except Exception as e:
+        logger.error(f"搜索患者失败: {str(e)}")
+        logger.error(f"错误详情: {traceback.format_exc()}")
+        return jsonify({'error': f'搜索患者失败: {str(e)}'}), 500
+
+def _patient_detail(patient_id):
+    """患者详情，包括所有关联的图像和汇总信息"""
+    patient = db.session.get(Patient, patient_id)
+    
+    # 转换为字典格式，包括图像信息
+    patient_data = patient.to_dict()
+    
+    # 确保图像数据包含所有必要的字段
+    for image in patient_data.get('images', []):
+        if image.get('processed'):
+            # 添加处理结果相关字段
+            image.update({
+                'gm_volume': float(image['gm_volume']) if image.get('gm_volume') else None,
+                'wm_volume': float(image['wm_volume']) if image.get('wm_volume') else None,
+                'csf_volume': float(image['csf_volume']) if image.get('csf_volume') else None,
+                'tiv_volume': float(image['tiv_volume']) if image.get('tiv_volume') else None,
+                'processing_completed': image.get('processing_completed'),
+                'processing_error': image.get('processing_error')
+            })
+        
+        # 添加预览图URL
+        image['preview_url'] = f"/api/preview/{image['id']}"
+    
+    patient_data['summary'] = summary_service.get_summary(patient.id)
+    return patient_data
+
 @patient_bp.route('/patients/<int:patient_id>', methods=['GET'])
 @jwt_required()
 def get_patient_detail(patient_id):
@@ -86,30 +162,13 @@ def get_patient_detail(patient_id):
         current_user_id = get_jwt_identity()
         logger.info(f"获取患者详情，患者ID: {patient_id}，用户ID: {current_user_id}")
         
-        # 获取患者信息，包括所有关联的图像
-        patient = Patient.query.filter_by(id=patient_id, user_id=current_user_id).first()
-        if not patient:
+        if not user_owns_patient(current_user_id, patient_id):
             logger.warning(f"未找到患者: {patient_id}")
             return jsonify({'error': '未找到患者'}), 404
-            
-        # 转换为字典格式，包括图像信息
-        patient_data = patient.to_dict()
-        
-        # 确保图像数据包含所有必要的字段
-        for image in patient_data.get('images', []):
-            if image.get('processed'):
-                # 添加处理结果相关字段
-                image.update({
-                    'gm_volume': float(image['gm_volume']) if image.get('gm_volume') else None,
-                    'wm_volume': float(image['wm_volume']) if image.get('wm_volume') else None,
-                    'csf_volume': float(image['csf_volume']) if image.get('csf_volume') else None,
-                    'tiv_volume': float(image['tiv_volume']) if image.get('tiv_volume') else None,
-                    'processing_completed': image.get('processing_completed'),
-                    'processing_error': image.get('processing_error')
-                })
-            
-            # 添加预览图URL
-            image['preview_url'] = f"/api/preview/{image['id']}"
+
+        # 患者或其图像写入时患者标签版本递增，缓存随之失效
+        patient_data = cache.get_or_set(f"patient_detail:{patient_id}", lambda: _patient_detail(patient_id),
+                                        tags=[patient_tag(patient_id)])
         
         logger.info(f"成功获取患者详情: {patient_id}")
         return jsonify({
@@ -122,6 +181,42 @@ def get_patient_detail(patient_id):
         logger.error(f"错误详情: {traceback.format_exc()}")
         return jsonify({'error': f'获取患者详情失败: {str(e)}'}), 500
 
+@patient_bp.route('/patients/<int:patient_id>/images', methods=['GET'])
+@jwt_required()
+def get_patient_images(patient_id):
+    """按需获取患者的完整图像列表"""
+    try:
+        images = list_patient_images(patient_id, get_jwt_identity())
+        if images is None:
+            return jsonify({'error': '未找到患者'}), 404
+
+        return jsonify({
+            'success': True,
+            'images': [image.to_dict() for image in images]
+        })
+    except Exception as e:
+        logger.error(f"获取患者图像列表失败: {str(e)}")
+        logger.error(f"错误详情: {traceback.format_exc()}")
+        return jsonify({'error': f'获取患者图像列表失败: {str(e)}'}), 500
+
+@patient_bp.route('/patients/<int:patient_id>/trends', methods=['GET'])
+@jwt_required()
+def get_patient_trends(patient_id):
+    """获取患者的纵向趋势：各指标的年化变化率、回归拟合和相邻两次检查之间的变化"""
+    try:
+        if not user_owns_patient(get_jwt_identity(), patient_id):
+            return jsonify({'error': '未找到患者'}), 404
+
+        return jsonify({
+            'success': True,
+            'patient_id': patient_id,
+            'trends': trend_service.get_trends(patient_id)
+        })
+    except Exception as e:
+        logger.error(f"获取患者趋势失败: {str(e)}")
+        logger.error(f"错误详情: {traceback.format_exc()}")
+        return jsonify({'error': f'获取患者趋势失败: {str(e)}'}), 500
+
 @patient_bp.route('/patients/<int:patient_id>', methods=['PUT'])
 @jwt_required()
 def update_patient(patient_id):
@@ -133,7 +228,7 @@ def update_patient(patient_id):
             logger.error("未找到用户ID")
             return jsonify({'error': '未授权访问'}), 401
         
-        patient = Patient.query.filter_by(id=patient_id, user_id=current_user_id).first()
+        patient = Patient.query.filter_by(id=patient_id, user_id=current_user_id, deleted_at=None).first()
         if not patient:
             logger.warning(f"未找到患者: {patient_id}")
             return jsonify({'error': '未找到患者'}), 404
@@ -157,10 +252,13 @@ def update_patient(patient_id):
             return jsonify({'error': '患者ID已存在'}), 400
             
         # 更新患者信息
+        old_group = normative_service.group_of(patient)
         patient.name = data['name']
         patient.patient_id = data['patient_id']
         patient.age = data['age']
         patient.gender = data['gender']
+        # 年龄段或性别变化时，测量值移到对应的人群统计分组
+        normative_service.move_patient(patient.id, old_group, normative_service.group_of(patient))
         
         db.session.commit()
         logger.info(f"成功更新患者信息: {patient_id}")
@@ -187,7 +285,7 @@ def delete_patient(patient_id):
             return jsonify({'error': '未授权访问'}), 401
         
         # 获取患者信息
-        patient = Patient.query.filter_by(id=patient_id, user_id=current_user_id).first()
+        patient = Patient.query.filter_by(id=patient_id, user_id=current_user_id, deleted_at=None).first()
         if not patient:
             logger.warning(f"未找到患者: {patient_id}")
             return jsonify({'error': '未找到患者'}), 404
@@ -195,51 +293,49 @@ def delete_patient(patient_id):
         # 记录患者信息
         logger.info(f"找到患者: {patient.name} (ID: {patient.id})")
         
-        # 删除患者的所有图像记录
-        for image in patient.images:
-            try:
-                # 删除物理文件
-                if image.filename:
-                    file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], image.filename)
-                    if os.path.exists(file_path):
-                        logger.info(f"删除原始图像文件: {file_path}")
-                        os.remove(file_path)
-                    else:
-                        logger.warning(f"原始图像文件不存在: {file_path}")
-                        
-                if image.processed_filename:
-                    processed_path = os.path.join(current_app.config['PROCESSED_FOLDER'], image.processed_filename)
-                    if os.path.exists(processed_path):
-                        logger.info(f"删除处理后的图像文件: {processed_path}")
-                        os.remove(processed_path)
-                    else:
-                        logger.warning(f"处理后的图像文件不存在: {processed_path}")
-                        
-                logger.info(f"删除图像记录: {image.id}")
-                db.session.delete(image)
-            except Exception as e:
-                logger.error(f"删除图像 {image.id} 时出错: {str(e)}")
-                logger.error(f"错误详情: {traceback.format_exc()}")
-                continue
-            
-        # 删除患者记录
+        # 逻辑删除后立即返回，图像记录、原始文件和任务目录由后台任务分批清理
         try:
-            logger.info(f"删除患者记录: {patient_id}")
-            db.session.delete(patient)
+            purge_service.mark_deleted(patient)
             db.session.commit()
-            logger.info(f"成功删除患者: {patient_id}")
-            return jsonify({
-                'success': True,
-                'message': '患者删除成功'
-            })
         except Exception as e:
             logger.error(f"提交删除操作时出错: {str(e)}")
             logger.error(f"错误详情: {traceback.format_exc()}")
             db.session.rollback()
             return jsonify({'error': '删除患者失败'}), 500
         
+        job_id = purge_service.start_purge(current_app._get_current_object(), patient.id, int(current_user_id))
+        logger.info(f"患者已标记删除: {patient_id}，清理任务: {job_id}")
+        return jsonify({
+            'success': True,
+            'message': '患者删除成功，正在后台清理数据',
+            'job_id': job_id,
+            'status_url': f'/api/patients/purge/{job_id}' if job_id else None
+        }), 202
+        
     except Exception as e:
         logger.error(f"删除患者失败: {str(e)}")
         logger.error(f"错误详情: {traceback.format_exc()}")
         db.session.rollback()
-        return jsonify({'error': '删除患者失败'}), 500 
\ No newline at end of file
+        return jsonify({'error': '删除患者失败'}), 500
+
+@patient_bp.route('/patients/purge/<job_id>', methods=['GET'])
+@jwt_required()
+def get_purge_status(job_id):
+    """查询患者数据清理任务的进度"""
+    try:
+        details = task_queue.get_details(job_id)
+        status = task_queue.tasks.get(job_id)
+        if not status or details.get('type') != 'purge' or details.get('user_id') != int(get_jwt_identity()):
+            return jsonify({'error': '任务不存在'}), 404
+
+        return jsonify({
+            'success': True,
+            'status': status,
+            'progress': task_queue.get_progress(job_id),
+            'details': details,
+            'results': task_queue.get_results(job_id)
+        })
+    except Exception as e:
+        logger.error(f"获取清理任务状态失败: {str(e)}")
+        logger.error(f"错误详情: {traceback.format_exc()}")
+        return jsonify({'error': f'获取清理任务状态失败: {str(e)}'}), 500
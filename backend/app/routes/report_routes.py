@@ -0,0 +1,158 @@
+from datetime import datetime
+from flask import Blueprint, request, jsonify, send_file, current_app, Response, stream_with_context
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from models import db, Patient
+from app.services import report_service
+from app.services.task_queue import task_queue
+from app.utils.access_utils import user_owns_patient
+import logging
+import traceback
+
+logger = logging.getLogger(__name__)
+report_bp = Blueprint('report', __name__)
+
+
+@report_bp.route('/reports/<int:patient_id>', methods=['GET'])
+@jwt_required()
+def get_patient_report(patient_id):
+    """下载患者报告：当前版本已生成时直接返回PDF，否则在后台生成并返回202和查询地址"""
+    try:
+        current_user_id = get_jwt_identity()
+        logger.info(f"获取患者报告，患者ID: {patient_id}, 用户ID: {current_user_id}")
+        if not user_owns_patient(current_user_id, patient_id):
+            logger.warning(f"未找到患者: {patient_id}")
+            return jsonify({'error': '未找到患者'}), 404
+
+        path, version, job_id = report_service.request_report(
+            patient_id, int(current_user_id), current_app.config['NORMATIVE_MIN_COUNT'])
+        if path is None:
+            response = jsonify({
+                'success': True,
+                'status': 'processing',
+                'version': version,
+                'job_id': job_id,
+                'status_url': f'/api/reports/jobs/{job_id}',
+                'download_url': f'/api/reports/{patient_id}'
+            })
+            response.headers['Retry-After'] = '1'
+            return response, 202
+
+        patient = db.session.get(Patient, patient_id)
+        return send_file(
+            path,
+            mimetype='application/pdf',
+            as_attachment=True,
+            download_name=f"patient_report_{patient.name}.pdf",
+            etag=version
+        )
+    except Exception as e:
+        logger.error(f"生成报告失败: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({'error': f'生成报告失败: {str(e)}'}), 500
+
+
+@report_bp.route('/reports/jobs/<job_id>', methods=['GET'])
+@jwt_required()
+def get_report_job(job_id):
+    """查询报告生成任务的状态，完成后通过download_url下载
+
+    批量任务由其他工作进程执行（或任务已移出队列）时按磁盘上的清单返回状态。
+    """
+    try:
+        details = task_queue.get_details(job_id)
+        status = task_queue.tasks.get(job_id)
+        progress, results = task_queue.get_progress(job_id), task_queue.get_results(job_id)
+        if not status:
+            manifest = report_service.bulk_manifest(job_id)
+            if manifest is not None:
+                status = manifest['status']
+                details = {'type': 'report', 'bulk': True, 'user_id': manifest['user_id']}
+                if manifest.get('error'):
+                    details['error'] = manifest['error']
+                progress = 100 if status == 'completed' else 0
+                results = manifest.get('stats')
+        if not status or details.get('type') != 'report' or details.get('user_id') != int(get_jwt_identity()):
+            return jsonify({'error': '任务不存在'}), 404
+
+        return jsonify({
+            'success': True,
+            'status': status,
+            'progress': progress,
+            'details': details,
+            'results': results,
+            'download_url': f"/api/reports/jobs/{job_id}/archive" if details.get('bulk')
+            else f"/api/reports/{details['patient_id']}"
+        })
+    except Exception as e:
+        logger.error(f"获取报告任务状态失败: {str(e)}")
+        logger.error(f"错误详情: {traceback.format_exc()}")
+        return jsonify({'error': f'获取报告任务状态失败: {str(e)}'}), 500
+
+
+@report_bp.route('/reports:bulk', methods=['POST'])
+@jwt_required()
+def bulk_reports():
+    """批量生成报告：按患者ID、检查月份（YYYY-MM）和是否已处理筛选，在进程池中并行渲染
+
+    返回202和任务查询地址，完成后从download_url下载ZIP压缩包。
+    """
+    try:
+        current_user_id = int(get_jwt_identity())
+        data = request.get_json(silent=True) or {}
+        try:
+            month = datetime.strptime(data['month'], '%Y-%m') if data.get('month') else None
+            patient_ids = [int(pid) for pid in data.get('patient_ids') or []]
+        except (TypeError, ValueError):
+            return jsonify({'error': '参数格式错误：month应为YYYY-MM，patient_ids应为整数列表'}), 400
+
+        patient_ids = report_service.select_patients(current_user_id, patient_ids, month,
+                                                     bool(data.get('processed_only')))
+        if not patient_ids:
+            return jsonify({'error': '没有符合条件的患者'}), 400
+        limit = current_app.config['REPORT_BULK_MAX_PATIENTS']
+        if len(patient_ids) > limit:
+            return jsonify({'error': f'一次最多生成{limit}份报告，当前筛选到{len(patient_ids)}名患者'}), 400
+
+        job_id = report_service.start_bulk(current_app._get_current_object(), current_user_id, patient_ids,
+                                           current_app.config['NORMATIVE_MIN_COUNT'])
+        logger.info(f"批量报告任务已启动: {job_id}，患者数: {len(patient_ids)}")
+        return jsonify({
+            'success': True,
+            'job_id': job_id,
+            'patient_count': len(patient_ids),
+            'status_url': f'/api/reports/jobs/{job_id}',
+            'download_url': f'/api/reports/jobs/{job_id}/archive'
+        }), 202
+    except Exception as e:
+        logger.error(f"启动批量报告失败: {str(e)}")
+        logger.error(f"错误详情: {traceback.format_exc()}")
+        return jsonify({'error': f'启动批量报告失败: {str(e)}'}), 500
+
+
+@report_bp.route('/reports/jobs/<job_id>/archive', methods=['GET'])
+@jwt_required()
+def download_bulk_reports(job_id):
+    """以流的方式下载批量报告的ZIP压缩包，任何工作进程都可按清单打包"""
+    try:
+        manifest = report_service.bulk_manifest(job_id)
+        if manifest is None or manifest.get('user_id') != int(get_jwt_identity()):
+            return jsonify({'error': '任务不存在或已过期'}), 404
+        if manifest['status'] != 'completed':
+            return jsonify({'error': '报告尚未生成完成', 'status': manifest['status'],
+                            'progress': task_queue.get_progress(job_id)}), 409
+        entries = manifest['entries']
+        # 清单中的报告不会被GC删除，仍缺失说明患者已被删除，不打包缺少患者的压缩包
+        missing = report_service.missing_reports(entries)
+        if missing:
+            return jsonify({'error': '部分报告已被删除，请重新生成批量报告', 'missing': missing}), 410
+
+        filename = f"reports_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
+        return Response(
+            stream_with_context(report_service.stream_archive(entries)),
+            mimetype='application/zip',
+            headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+        )
+    except Exception as e:
+        logger.error(f"下载批量报告失败: {str(e)}")
+        logger.error(f"错误详情: {traceback.format_exc()}")
+        return jsonify({'error': f'下载批量报告失败: {str(e)}'}), 500
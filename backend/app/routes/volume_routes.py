@@ -0,0 +1,109 @@
+from flask import Blueprint, jsonify, send_file, request, make_response
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from app.services.volume_store import list_task_stores, read_store_meta, get_chunk_path, fill_chunk_payload
+import logging
+import os
+import traceback
+from app.utils.access_utils import get_owned_task_image
+from app.services import storage
+
+logger = logging.getLogger(__name__)
+volume_bp = Blueprint('volume', __name__)
+
+# 块内容在任务完成后不再变化，可以长期缓存
+CHUNK_MAX_AGE = 365 * 24 * 3600
+
+
+def _get_owned_task_dir(task_id):
+    """校验任务属于当前用户，返回任务目录"""
+    image = get_owned_task_image(task_id, get_jwt_identity())
+    if not image:
+        return None
+    return storage.task_dir(task_id)
+
+
+@volume_bp.route('/volumes/<task_id>', methods=['GET'])
+@jwt_required()
+def list_volumes(task_id):
+    """列出任务可用的分块体数据"""
+    try:
+        task_dir = _get_owned_task_dir(task_id)
+        if not task_dir:
+            return jsonify({'error': '任务不存在或无权访问'}), 404
+
+        stores = list_task_stores(task_dir)
+        return jsonify({
+            'success': True,
+            'task_id': task_id,
+            'volumes': {
+                name: {
+                    'meta_url': f"/api/volumes/{task_id}/{name}/meta",
+                    'shape': meta['shape'],
+                    'levels': len(meta['levels'])
+                } for name, meta in stores.items()
+            }
+        })
+    except Exception as e:
+        logger.error(f"获取体数据列表失败: {str(e)}")
+        logger.error(f"错误详情: {traceback.format_exc()}")
+        return jsonify({'error': f'获取体数据列表失败: {str(e)}'}), 500
+
+
+@volume_bp.route('/volumes/<task_id>/<volume>/meta', methods=['GET'])
+@jwt_required()
+def get_volume_meta(task_id, volume):
+    """获取分块体数据的元数据"""
+    try:
+        task_dir = _get_owned_task_dir(task_id)
+        if not task_dir:
+            return jsonify({'error': '任务不存在或无权访问'}), 404
+
+        meta = read_store_meta(task_dir, volume)
+        if meta is None:
+            return jsonify({'error': '体数据不存在'}), 404
+
+        meta['chunk_url_template'] = f"/api/volumes/{task_id}/{volume}/{{level}}/{{key}}"
+        response = jsonify(meta)
+        response.headers['Cache-Control'] = 'private, max-age=300'
+        return response
+    except Exception as e:
+        logger.error(f"获取体数据元数据失败: {str(e)}")
+        logger.error(f"错误详情: {traceback.format_exc()}")
+        return jsonify({'error': f'获取体数据元数据失败: {str(e)}'}), 500
+
+
+@volume_bp.route('/volumes/<task_id>/<volume>/<int:level>/<chunk_key>', methods=['GET'])
+@jwt_required()
+def get_volume_chunk(task_id, volume, level, chunk_key):
+    """获取单个压缩块（zlib），未落盘的块返回全部为fill_value的块"""
+    try:
+        task_dir = _get_owned_task_dir(task_id)
+        if not task_dir:
+            return jsonify({'error': '任务不存在或无权访问'}), 404
+
+        chunk_path = get_chunk_path(task_dir, volume, level, chunk_key)
+        if chunk_path is None:
+            return jsonify({'error': '无效的块坐标'}), 400
+
+        if not os.path.exists(chunk_path):
+            # 与zarr一致：块不存在表示全部为填充值，直接返回填充块，客户端不需要区分
+            response = make_response(fill_chunk_payload(read_store_meta(task_dir, volume)))
+            response.mimetype = 'application/octet-stream'
+            response.headers['X-Chunk-Fill'] = 'true'
+            response.headers['Cache-Control'] = f'private, max-age={CHUNK_MAX_AGE}, immutable'
+            response.add_etag()
+            return response.make_conditional(request)
+
+        response = send_file(
+            chunk_path,
+            mimetype='application/octet-stream',
+            conditional=True,
+            etag=True,
+            max_age=CHUNK_MAX_AGE
+        )
+        response.headers['Cache-Control'] = f'private, max-age={CHUNK_MAX_AGE}, immutable'
+        return response
+    except Exception as e:
+        logger.error(f"获取体数据块失败: {str(e)}")
+        logger.error(f"错误详情: {traceback.format_exc()}")
+        return jsonify({'error': f'获取体数据块失败: {str(e)}'}), 500
@@ -0,0 +1,159 @@
+import struct
+import hashlib
+from datetime import date, datetime
+import msgpack
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 载荷前两个字节：数据类型 + 压缩方式
+KIND_ARRAY = b'A'     # 单个ndarray：头部(dtype, shape) + 原始内存
+KIND_MSGPACK = b'M'   # 其他数据：msgpack，嵌套的ndarray和日期用扩展类型
+CODEC_NONE = b'0'
+CODEC_LZ4 = b'4'
+
+EXT_ARRAY = 1
+EXT_DATETIME = 2
+EXT_DATE = 3
+
+_HEADER_LENGTH = struct.Struct('<I')
+
+
+def _lz4():
+    """LZ4为可选依赖，未安装时不压缩"""
+    try:
+        import lz4.block
+        return lz4.block
+    except ImportError:
+        return None
+
+
+def lz4_available():
+    return _lz4() is not None
+
+
+def _encode_array(array):
+    """ndarray编码为 头部长度 + msgpack([dtype, shape]) + C连续内存"""
+    if array.dtype.hasobject:
+        raise TypeError('不支持序列化object类型的数组')
+    # ascontiguousarray会把0维数组变为(1,)，require保留原形状
+    array = np.require(array, requirements='C')
+    header = msgpack.packb([array.dtype.str, list(array.shape)])
+    return b''.join((_HEADER_LENGTH.pack(len(header)), header, array.data))
+
+
+def _decode_array(buffer):
+    """在原缓冲区上构造只读数组，不复制数据"""
+    view = memoryview(buffer)
+    length, = _HEADER_LENGTH.unpack_from(view)
+    dtype, shape = msgpack.unpackb(view[4:4 + length])
+    return np.frombuffer(view, dtype=np.dtype(dtype), offset=4 + length).reshape(shape)
+
+
+def _default(obj):
+    if isinstance(obj, np.ndarray):
+        return msgpack.ExtType(EXT_ARRAY, _encode_array(obj))
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, datetime):
+        return msgpack.ExtType(EXT_DATETIME, obj.isoformat().encode())
+    if isinstance(obj, date):
+        return msgpack.ExtType(EXT_DATE, obj.isoformat().encode())
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"无法序列化的类型: {type(obj).__name__}")
+
+
+def _ext_hook(code, data):
+    if code == EXT_ARRAY:
+        return _decode_array(data)
+    if code == EXT_DATETIME:
+        return datetime.fromisoformat(data.decode())
+    if code == EXT_DATE:
+        return date.fromisoformat(data.decode())
+    return msgpack.ExtType(code, data)
+
+
+def dumps(value, compress_threshold=16 * 1024):
+    """序列化缓存值；超过阈值且安装了LZ4时压缩，压缩无收益则保留原文"""
+    if isinstance(value, np.ndarray):
+        kind, body = KIND_ARRAY, _encode_array(value)
+    else:
+        kind, body = KIND_MSGPACK, msgpack.packb(value, default=_default, use_bin_type=True)
+    codec = CODEC_NONE
+    lz4 = _lz4() if compress_threshold is not None and len(body) >= compress_threshold else None
+    if lz4 is not None:
+        compressed = lz4.compress(body, store_size=True)
+        if len(compressed) < len(body):
+            codec, body = CODEC_LZ4, compressed
+    return kind + codec + body
+
+
+def loads(payload):
+    """反序列化缓存值；未压缩的数组直接引用载荷内存（只读）"""
+    view = memoryview(payload)
+    kind, codec = bytes(view[:1]), bytes(view[1:2])
+    body = view[2:]
+    if codec == CODEC_LZ4:
+        lz4 = _lz4()
+        if lz4 is None:
+            raise ValueError('缓存数据经LZ4压缩，但未安装lz4')
+        body = lz4.decompress(body)
+    elif codec != CODEC_NONE:
+        raise ValueError(f"未知的压缩方式: {codec!r}")
+    if kind == KIND_ARRAY:
+        return _decode_array(body)
+    if kind == KIND_MSGPACK:
+        return msgpack.unpackb(body, ext_hook=_ext_hook, raw=False, strict_map_key=False)
+    raise ValueError(f"未知的缓存数据类型: {kind!r}")
+
+
+def _feed(h, obj):
+    """按类型写入带类型标记和长度前缀的规范编码，保证不同值的编码不会拼接出相同序列"""
+    if obj is None:
+        h.update(b'N')
+    elif isinstance(obj, bool):
+        h.update(b'T' if obj else b'F')
+    elif isinstance(obj, int):
+        h.update(b'i%d;' % obj)
+    elif isinstance(obj, float):
+        h.update(b'f' + obj.hex().encode() + b';')
+    elif isinstance(obj, str):
+        data = obj.encode()
+        h.update(b's%d:' % len(data) + data)
+    elif isinstance(obj, (bytes, bytearray, memoryview)):
+        data = bytes(obj)
+        h.update(b'b%d:' % len(data) + data)
+    elif isinstance(obj, np.ndarray):
+        array = np.require(obj, requirements='C')
+        _feed(h, array.dtype.str)
+        _feed(h, list(array.shape))
+        h.update(b'a%d:' % array.nbytes)
+        h.update(array.data)
+    elif isinstance(obj, np.generic):
+        _feed(h, obj.item())
+    elif isinstance(obj, (list, tuple)):
+        h.update(b'l%d:' % len(obj))
+        for item in obj:
+            _feed(h, item)
+    elif isinstance(obj, dict):
+        h.update(b'd%d:' % len(obj))
+        for key_digest, value in sorted(((digest(key), value) for key, value in obj.items()),
+                                        key=lambda item: item[0]):
+            h.update(key_digest)
+            _feed(h, value)
+    elif isinstance(obj, (datetime, date)):
+        h.update(b't')
+        _feed(h, obj.isoformat())
+    else:
+        h.update(b'r')
+        _feed(h, repr(obj))
+
+
+def digest(*parts):
+    """参数的稳定摘要（BLAKE2b，16字节），与进程和哈希随机化无关"""
+    h = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        _feed(h, part)
+    return h.digest()
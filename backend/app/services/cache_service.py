@@ -1,68 +1,433 @@
 from functools import wraps
-import hashlib
-import json
+import random
+import threading
+import time
 import logging
-from datetime import datetime, timedelta
-from flask_caching import Cache
-from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from models import Patient, Image
+from app.services.ttl_cache import TTLCache, MISSING
+from app.services import cache_serializer
 
 logger = logging.getLogger(__name__)
 
-cache = Cache()
+
+class LocalBackend:
+    """进程内的共享层替身：未配置Redis或测试时使用，接口与RedisBackend一致"""
+
+    name = 'local'
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            if item[0] <= time.monotonic():
+                del self._data[key]
+                return None
+            return item[1]
+
+    def set(self, key, payload, ttl):
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, payload)
+
+    def add(self, key, payload, ttl):
+        """键不存在时写入并返回True（相当于SET NX）"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and item[0] > time.monotonic():
+                return False
+            self._data[key] = (time.monotonic() + ttl, payload)
+            return True
+
+    def get_many(self, keys):
+        return [self.get(key) for key in keys]
+
+    def incr(self, key):
+        """版本计数器加一，不过期"""
+        with self._lock:
+            item = self._data.get(key)
+            value = (item[1] if item is not None else 0) + 1
+            self._data[key] = (float('inf'), value)
+            return value
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class RedisBackend:
+    """多个工作进程共享的Redis层"""
+
+    name = 'redis'
+
+    def __init__(self, url):
+        import redis
+        self.client = redis.Redis.from_url(url, socket_timeout=1, socket_connect_timeout=1)
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def set(self, key, payload, ttl):
+        self.client.set(key, payload, px=max(int(ttl * 1000), 1))
+
+    def add(self, key, payload, ttl):
+        return bool(self.client.set(key, payload, px=max(int(ttl * 1000), 1), nx=True))
+
+    def get_many(self, keys):
+        return self.client.mget(keys)
+
+    def incr(self, key):
+        return self.client.incr(key)
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*keys)
+
+    def clear(self):
+        pass
+
+
+class _Flight:
+    """同一进程内正在计算的键，后到的线程等待首个线程的结果"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class TwoTierCache:
+    """进程内LRU（L1）+ 共享后端（L2）的两级缓存
+
+    未命中时按键单飞：同一进程内只有一个线程计算，其余线程等待其结果；
+    跨进程由L2上的锁键保证只有一个进程计算，其他进程轮询L2。
+    写入时对过期时间加随机抖动，避免同一批键同时过期。
+
+    条目可以带标签（如 patient:1、image:5），每个标签在共享层有一个版本号，
+    版本号是键的一部分。数据变化时只需把标签版本加一，依赖它的条目
+    不再被读到并随TTL淘汰，失效代价与条目数量无关。
+    版本号在进程内缓存version_ttl秒，L1命中时不访问共享层；本进程的bump立即生效，
+    其他进程的bump最多滞后version_ttl秒。
+    """
+
+    def __init__(self, backend=None, prefix='', l1_size=256, l1_ttl=60, default_timeout=300,
+                 jitter=0.1, lock_timeout=30, compress_threshold=16 * 1024, version_ttl=1):
+        self.backend = backend
+        self.prefix = prefix
+        self.l1 = TTLCache(maxsize=l1_size, ttl=l1_ttl)
+        self.version_cache = TTLCache(maxsize=10000, ttl=version_ttl)
+        self.default_timeout = default_timeout
+        self.jitter = jitter
+        self.lock_timeout = lock_timeout
+        self.compress_threshold = compress_threshold
+        self._flights = {}
+        self._local_versions = {}
+        self._flights_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.counters = {'l2_hits': 0, 'l2_misses': 0, 'l2_errors': 0, 'computes': 0,
+                         'flight_waits': 0, 'lock_waits': 0, 'version_bumps': 0,
+                         'l2_bytes_read': 0, 'l2_bytes_written': 0}
+
+    def _count(self, name, amount=1):
+        with self._stats_lock:
+            self.counters[name] += amount
+
+    def jittered(self, ttl):
+        """在 ttl×(1±jitter) 范围内随机取过期时间"""
+        if not self.jitter:
+            return ttl
+        return ttl * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def _l2_key(self, key):
+        return self.prefix + key
+
+    def _l2_get(self, key):
+        if self.backend is None:
+            return MISSING
+        try:
+            payload = self.backend.get(self._l2_key(key))
+        except Exception as e:
+            self._count('l2_errors')
+            logger.warning(f"读取共享缓存失败: {str(e)}")
+            return MISSING
+        if payload is None:
+            self._count('l2_misses')
+            return MISSING
+        try:
+            value = cache_serializer.loads(payload)
+        except Exception as e:
+            self._count('l2_errors')
+            logger.warning(f"解析共享缓存失败: {str(e)}")
+            return MISSING
+        self._count('l2_hits')
+        self._count('l2_bytes_read', len(payload))
+        return value
+
+    def _l2_set(self, key, value, ttl):
+        if self.backend is None:
+            return
+        try:
+            payload = cache_serializer.dumps(value, self.compress_threshold)
+            self.backend.set(self._l2_key(key), payload, ttl)
+            self._count('l2_bytes_written', len(payload))
+        except Exception as e:
+            self._count('l2_errors')
+            logger.warning(f"写入共享缓存失败: {str(e)}")
+
+    def get(self, key, default=None):
+        value = self.l1.get(key)
+        if value is not MISSING:
+            return value
+        value = self._l2_get(key)
+        if value is MISSING:
+            return default
+        self.l1.set(key, value, min(self.l1.ttl, self.default_timeout))
+        return value
+
+    def set(self, key, value, timeout=None):
+        ttl = self.jittered(timeout or self.default_timeout)
+        self.l1.set(key, value, min(self.l1.ttl, ttl))
+        self._l2_set(key, value, ttl)
+
+    def delete(self, *keys):
+        for key in keys:
+            self.l1.invalidate(key)
+        if self.backend is not None and keys:
+            try:
+                self.backend.delete(*(self._l2_key(key) for key in keys))
+            except Exception as e:
+                self._count('l2_errors')
+                logger.warning(f"删除共享缓存失败: {str(e)}")
+
+    def clear(self):
+        self.l1.clear()
+        self.version_cache.clear()
+        self._local_versions.clear()
+        if self.backend is not None:
+            self.backend.clear()
+
+    def versions(self, tags):
+        """标签的当前版本号，从未变化过的标签为0"""
+        if not tags:
+            return []
+        if self.backend is None:
+            return [self._local_versions.get(tag, 0) for tag in tags]
+        versions = [self.version_cache.get(tag) for tag in tags]
+        missing = [tag for tag, version in zip(tags, versions) if version is MISSING]
+        if not missing:
+            return versions
+        try:
+            values = self.backend.get_many([self._l2_key('ver:' + tag) for tag in missing])
+        except Exception as e:
+            self._count('l2_errors')
+            logger.warning(f"读取缓存版本失败: {str(e)}")
+            return [self._local_versions.get(tag, 0) for tag in tags]
+        fetched = {}
+        for tag, value in zip(missing, values):
+            fetched[tag] = int(value) if value is not None else 0
+            self.version_cache.set(tag, fetched[tag])
+        return [fetched[tag] if version is MISSING else version for tag, version in zip(tags, versions)]
+
+    def bump(self, *tags):
+        """标签版本加一，使依赖这些标签的条目全部失效"""
+        for tag in tags:
+            self._count('version_bumps')
+            if self.backend is not None:
+                try:
+                    self.version_cache.set(tag, int(self.backend.incr(self._l2_key('ver:' + tag))))
+                    continue
+                except Exception as e:
+                    self._count('l2_errors')
+                    logger.warning(f"更新缓存版本失败: {str(e)}")
+            with self._stats_lock:
+                self._local_versions[tag] = self._local_versions.get(tag, 0) + 1
+
+    def tagged_key(self, key, tags):
+        """把标签的当前版本号拼入键"""
+        if not tags:
+            return key
+        tags = sorted(tags)
+        return key + '@' + ','.join(f"{tag}={version}" for tag, version in zip(tags, self.versions(tags)))
+
+    def get_or_set(self, key, compute, timeout=None, tags=None):
+        """读取缓存，未命中时单飞计算并写入两级缓存"""
+        key = self.tagged_key(key, tags)
+        value = self.get(key, MISSING)
+        if value is not MISSING:
+            return value
+
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            self._count('flight_waits')
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = self._compute_once(key, compute, timeout)
+            return flight.value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._flights_lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def _compute_once(self, key, compute, timeout):
+        """跨进程单飞：持有L2锁键的进程计算，其他进程等待结果出现在L2中"""
+        lock_key = self._l2_key('lock:' + key)
+        locked = self._acquire(lock_key)
+        if not locked:
+            self._count('lock_waits')
+            deadline = time.monotonic() + self.lock_timeout
+            while time.monotonic() < deadline:
+                time.sleep(0.05)
+                value = self.get(key, MISSING)
+                if value is not MISSING:
+                    return value
+                locked = self._acquire(lock_key)
+                if locked:
+                    break
+            # 等待超时（持锁进程异常退出）时自行计算
+        try:
+            # 取得锁前其他进程可能刚写入结果
+            value = self.get(key, MISSING)
+            if value is not MISSING:
+                return value
+            self._count('computes')
+            value = compute()
+            if value is not None:
+                self.set(key, value, timeout)
+            return value
+        finally:
+            if locked:
+                self._release(lock_key)
+
+    def acquire_lock(self, name, timeout=None):
+        """获取跨进程锁（共享层上timeout秒后过期的键），返回是否获得；共享层不可用时总是获得"""
+        return self._acquire(self._l2_key('lock:' + name), timeout)
+
+    def release_lock(self, name):
+        self._release(self._l2_key('lock:' + name))
+
+    def _acquire(self, lock_key, timeout=None):
+        if self.backend is None:
+            return True
+        try:
+            return self.backend.add(lock_key, b'1', timeout or self.lock_timeout)
+        except Exception as e:
+            self._count('l2_errors')
+            logger.warning(f"获取缓存锁失败: {str(e)}")
+            return True
+
+    def _release(self, lock_key):
+        if self.backend is None:
+            return
+        try:
+            self.backend.delete(lock_key)
+        except Exception as e:
+            self._count('l2_errors')
+            logger.warning(f"释放缓存锁失败: {str(e)}")
+
+    def stats(self):
+        with self._stats_lock:
+            counters = dict(self.counters)
+        return {
+            'backend': self.backend.name if self.backend is not None else None,
+            'l1': self.l1.stats(),
+            'versions': self.version_cache.stats(),
+            **counters,
+            'in_flight': len(self._flights),
+            'lz4': cache_serializer.lz4_available(),
+        }
+
+
+cache = TwoTierCache(backend=LocalBackend())
+
+
+def _create_backend(app):
+    """按CACHE_TYPE创建共享层：redis不可用时退回到进程内替身"""
+    cache_type = app.config.get('CACHE_TYPE', 'simple')
+    if cache_type == 'null':
+        return None
+    if cache_type == 'redis':
+        url = app.config.get('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+        try:
+            backend = RedisBackend(url)
+            backend.client.ping()
+            return backend
+        except Exception as e:
+            logger.warning(f"无法连接Redis({url})，使用进程内缓存: {str(e)}")
+    return LocalBackend()
+
 
 def init_cache(app):
     """初始化缓存服务"""
-    cache_config = {
-        'CACHE_TYPE': app.config.get('CACHE_TYPE', 'simple'),
-        'CACHE_DEFAULT_TIMEOUT': app.config.get('CACHE_DEFAULT_TIMEOUT', 300),
-    }
-    
-    if app.config.get('CACHE_TYPE') == 'redis':
-        cache_config.update({
-            'CACHE_REDIS_URL': app.config.get('CACHE_REDIS_URL', 'redis://localhost:6379/0'),
-            'CACHE_KEY_PREFIX': app.config.get('CACHE_KEY_PREFIX', 'mri_app:')
-        })
-    
-    cache.init_app(app, config=cache_config)
-    logger.info(f"缓存服务已初始化，类型: {cache_config['CACHE_TYPE']}")
+    cache.backend = _create_backend(app)
+    cache.prefix = app.config.get('CACHE_KEY_PREFIX', 'mri_app:')
+    cache.default_timeout = app.config.get('CACHE_DEFAULT_TIMEOUT', 300)
+    cache.jitter = app.config.get('CACHE_TTL_JITTER', 0.1)
+    cache.lock_timeout = app.config.get('CACHE_LOCK_TIMEOUT', 30)
+    cache.compress_threshold = app.config.get('CACHE_COMPRESS_THRESHOLD', 16 * 1024)
+    cache.l1.maxsize = app.config.get('CACHE_L1_SIZE', 256)
+    cache.l1.ttl = app.config.get('CACHE_L1_TTL', 60)
+    cache.version_cache.ttl = app.config.get('CACHE_VERSION_TTL', 1)
+    cache.clear()
+    logger.info(f"缓存服务已初始化，类型: {app.config.get('CACHE_TYPE', 'simple')}, "
+                f"共享层: {cache.backend.name if cache.backend is not None else '无'}")
+
 
 def cache_key(*args, **kwargs):
-    """生成缓存键"""
-    key_parts = [str(arg) for arg in args]
-    key_parts.extend(f"{k}:{v}" for k, v in sorted(kwargs.items()))
-    key_string = "|".join(key_parts)
-    return hashlib.md5(key_string.encode()).hexdigest()
+    """生成缓存键：参数按类型规范编码后取BLAKE2b摘要，数组按内容而不是str()参与哈希"""
+    return cache_serializer.digest(args, kwargs).hex()
+
 
 def cached(timeout=300, key_prefix=''):
-    """缓存装饰器"""
+    """缓存装饰器，并发未命中时只计算一次"""
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
             cache_key_string = key_prefix + cache_key(*args, **kwargs)
-            
-            # 尝试从缓存获取
-            rv = cache.get(cache_key_string)
-            if rv is not None:
-                logger.debug(f"缓存命中: {cache_key_string}")
-                return rv
-                
-            # 执行原函数
-            rv = f(*args, **kwargs)
-            
-            # 存入缓存
             try:
-                cache.set(cache_key_string, rv, timeout=timeout)
-                logger.debug(f"已缓存: {cache_key_string}, 超时: {timeout}秒")
+                return cache.get_or_set(cache_key_string, lambda: f(*args, **kwargs), timeout=timeout)
             except Exception as e:
-                logger.error(f"缓存存储失败: {str(e)}")
-                
-            return rv
+                logger.error(f"缓存计算失败: {cache_key_string}, {str(e)}")
+                raise
         return decorated_function
     return decorator
 
+
+def patient_tag(patient_id):
+    return f"patient:{patient_id}"
+
+
+def image_tag(image_id):
+    return f"image:{image_id}"
+
+
+def task_tag(task_id):
+    return f"task:{task_id}"
+
+
 def cache_patient_data(patient_id, data, timeout=3600):
     """缓存患者数据"""
-    key = f"patient:{patient_id}"
+    key = cache.tagged_key(f"patient:{patient_id}", [patient_tag(patient_id)])
     try:
         cache.set(key, data, timeout=timeout)
         logger.info(f"已缓存患者数据: {patient_id}")
@@ -71,9 +436,10 @@ def cache_patient_data(patient_id, data, timeout=3600):
         logger.error(f"缓存患者数据失败: {str(e)}")
         return False
 
+
 def get_cached_patient_data(patient_id):
     """获取缓存的患者数据"""
-    key = f"patient:{patient_id}"
+    key = cache.tagged_key(f"patient:{patient_id}", [patient_tag(patient_id)])
     try:
         data = cache.get(key)
         if data:
@@ -83,9 +449,10 @@ def get_cached_patient_data(patient_id):
         logger.error(f"获取缓存患者数据失败: {str(e)}")
         return None
 
+
 def cache_processing_result(task_id, result, timeout=86400):
     """缓存处理结果"""
-    key = f"task_result:{task_id}"
+    key = cache.tagged_key(f"task_result:{task_id}", [task_tag(task_id)])
     try:
         cache.set(key, result, timeout=timeout)
         logger.info(f"已缓存处理结果: {task_id}")
@@ -94,9 +461,10 @@ def cache_processing_result(task_id, result, timeout=86400):
         logger.error(f"缓存处理结果失败: {str(e)}")
         return False
 
+
 def get_cached_processing_result(task_id):
     """获取缓存的处理结果"""
-    key = f"task_result:{task_id}"
+    key = cache.tagged_key(f"task_result:{task_id}", [task_tag(task_id)])
     try:
         result = cache.get(key)
         if result:
@@ -106,22 +474,71 @@ def get_cached_processing_result(task_id):
         logger.error(f"获取缓存处理结果失败: {str(e)}")
         return None
 
+
 def clear_patient_cache(patient_id):
-    """清除患者相关的所有缓存"""
+    """清除患者相关的所有缓存（患者JSON、预览、报告等带患者标签的条目）"""
     try:
-        cache.delete(f"patient:{patient_id}")
+        cache.bump(patient_tag(patient_id))
         logger.info(f"已清除患者缓存: {patient_id}")
         return True
     except Exception as e:
         logger.error(f"清除患者缓存失败: {str(e)}")
         return False
 
+
 def clear_task_cache(task_id):
     """清除任务相关的所有缓存"""
     try:
-        cache.delete(f"task_result:{task_id}")
+        cache.bump(task_tag(task_id))
         logger.info(f"已清除任务缓存: {task_id}")
         return True
     except Exception as e:
         logger.error(f"清除任务缓存失败: {str(e)}")
-        return False 
\ No newline at end of file
+        return False
+
+
+def image_tags(image_id, patient_id=None, task_id=None):
+    """图像变化时需要失效的标签：图像本身、所属患者和处理任务"""
+    tags = [image_tag(image_id)]
+    if patient_id is not None:
+        tags.append(patient_tag(patient_id))
+    if task_id:
+        tags.append(task_tag(task_id))
+    return tags
+
+
+def stats():
+    return cache.stats()
+
+
+# 患者或图像写入时递增标签版本。flush时立即递增，提交后再递增一次，
+# 避免其他线程在提交前按新版本号读到旧数据并写入缓存；
+# 绕过ORM的批量SQL（如清理患者）需要调用方自行bump。
+def _changed_tags(session):
+    tags = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Patient) and obj.id is not None:
+            tags.add(patient_tag(obj.id))
+        elif isinstance(obj, Image) and obj.id is not None:
+            tags.update(image_tags(obj.id, obj.patient_id, obj.task_id))
+    return tags
+
+
+@event.listens_for(Session, 'after_flush')
+def _bump_after_flush(session, flush_context):
+    tags = _changed_tags(session)
+    if tags:
+        cache.bump(*tags)
+        session.info.setdefault('cache_tags', set()).update(tags)
+
+
+@event.listens_for(Session, 'after_commit')
+def _bump_after_commit(session):
+    tags = session.info.pop('cache_tags', None)
+    if tags:
+        cache.bump(*tags)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_after_rollback(session):
+    session.info.pop('cache_tags', None)
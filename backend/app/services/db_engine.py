@@ -0,0 +1,180 @@
+import time
+import threading
+import logging
+from contextlib import contextmanager
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+logger = logging.getLogger(__name__)
+
+
+def is_sqlite(uri):
+    return make_url(uri).get_backend_name() == 'sqlite'
+
+
+def engine_options(config):
+    """根据数据库URL生成SQLALCHEMY_ENGINE_OPTIONS
+
+    SQLite使用连接级busy timeout等待写锁，连接可在请求线程和后台处理线程之间复用；
+    服务器数据库（PostgreSQL/MySQL）使用带预检测的连接池。
+    """
+    uri = config['SQLALCHEMY_DATABASE_URI']
+    options = {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+    }
+    if is_sqlite(uri):
+        if make_url(uri).database in (None, '', ':memory:'):
+            # 内存数据库只能使用单连接池，不做调整
+            return {}
+        options['connect_args'] = {
+            'timeout': config['SQLITE_BUSY_TIMEOUT_MS'] / 1000,
+            'check_same_thread': False,
+        }
+    else:
+        options['pool_pre_ping'] = True
+        options['pool_recycle'] = config['DB_POOL_RECYCLE']
+    return options
+
+
+class DatabaseMetrics:
+    """数据库语句耗时、慢查询和写语句统计
+
+    慢查询只计数，语句文本仅写入服务端日志，不通过指标接口返回。
+    """
+
+    def __init__(self, slow_seconds=0.5):
+        self.slow_seconds = slow_seconds
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.statements = 0
+            self.total_seconds = 0.0
+            self.max_seconds = 0.0
+            self.slow_statements = 0
+            self.write_statements = 0
+            self.write_seconds = 0.0
+            self.max_write_seconds = 0.0
+            self.locked_errors = 0
+
+    def record(self, statement, elapsed):
+        is_write = not statement.lstrip().upper().startswith(('SELECT', 'PRAGMA', 'WITH'))
+        with self._lock:
+            self.statements += 1
+            self.total_seconds += elapsed
+            self.max_seconds = max(self.max_seconds, elapsed)
+            if is_write:
+                # 写语句的总执行时间，包含但不等于等待写锁的时间（busy timeout内的重试）
+                self.write_statements += 1
+                self.write_seconds += elapsed
+                self.max_write_seconds = max(self.max_write_seconds, elapsed)
+            if elapsed >= self.slow_seconds:
+                self.slow_statements += 1
+        if elapsed >= self.slow_seconds:
+            logger.warning(f"慢查询 {elapsed:.3f}s: {statement[:200]}")
+
+    def record_locked(self):
+        with self._lock:
+            self.locked_errors += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'statements': self.statements,
+                'total_seconds': round(self.total_seconds, 6),
+                'avg_ms': round(self.total_seconds / self.statements * 1000, 3) if self.statements else 0.0,
+                'max_ms': round(self.max_seconds * 1000, 3),
+                'slow_statements': self.slow_statements,
+                'slow_threshold_ms': self.slow_seconds * 1000,
+                'write_statements': self.write_statements,
+                'write_seconds': round(self.write_seconds, 6),
+                'max_write_ms': round(self.max_write_seconds * 1000, 3),
+                'locked_errors': self.locked_errors,
+            }
+
+
+metrics = DatabaseMetrics()
+
+
+def _install_sqlite_pragmas(engine, config):
+    busy_timeout = int(config['SQLITE_BUSY_TIMEOUT_MS'])
+    synchronous = config['SQLITE_SYNCHRONOUS']
+    mmap_size = int(config['SQLITE_MMAP_SIZE'])
+
+    @event.listens_for(engine, 'connect')
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            # WAL模式下读不阻塞写，后台线程提交时请求线程仍可读取
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute(f"PRAGMA synchronous={synchronous}")
+            cursor.execute(f"PRAGMA busy_timeout={busy_timeout}")
+            cursor.execute(f"PRAGMA mmap_size={mmap_size}")
+        finally:
+            cursor.close()
+
+
+def _install_metrics(engine):
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after_execute(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('query_start')
+        if starts:
+            metrics.record(statement, time.perf_counter() - starts.pop())
+
+    @event.listens_for(engine, 'handle_error')
+    def _handle_error(context):
+        starts = context.connection.info.get('query_start') if context.connection is not None else None
+        if starts:
+            starts.pop()
+        if 'database is locked' in str(context.original_exception):
+            metrics.record_locked()
+            logger.warning(f"数据库被锁定: {context.statement}")
+
+
+def init_engine(app, db):
+    """为应用的数据库引擎安装SQLite参数和统计事件，需在db.init_app之后调用"""
+    metrics.slow_seconds = app.config['DB_SLOW_QUERY_SECONDS']
+    with app.app_context():
+        engine = db.engine
+        if is_sqlite(app.config['SQLALCHEMY_DATABASE_URI']):
+            _install_sqlite_pragmas(engine, app.config)
+            # 丢弃初始化前已建立的连接，保证所有连接都应用了上述参数
+            engine.dispose()
+        _install_metrics(engine)
+    logger.info(f"数据库引擎已配置: {engine.url.render_as_string(hide_password=True)}")
+    return engine
+
+
+def pool_status(engine):
+    """连接池使用情况"""
+    pool = engine.pool
+    status = {'class': type(pool).__name__}
+    for name in ('size', 'checkedin', 'checkedout', 'overflow'):
+        getter = getattr(pool, name, None)
+        if callable(getter):
+            status[name] = getter()
+    return status
+
+
+@contextmanager
+def worker_session(app, db):
+    """后台线程使用的数据库会话：进入应用上下文，退出时归还连接
+
+    Flask-SQLAlchemy的会话按应用上下文隔离，每个工作线程拿到独立的会话和连接，
+    结束时显式remove，避免长时间运行的线程占用连接池。
+    """
+    with app.app_context():
+        try:
+            yield db.session
+        except Exception:
+            db.session.rollback()
+            raise
+        finally:
+            db.session.remove()
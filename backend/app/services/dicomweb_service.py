@@ -0,0 +1,364 @@
+import os
+import threading
+import logging
+from collections import OrderedDict
+import numpy as np
+import pydicom
+from sqlalchemy import func
+from models import db, Patient, DicomInstance
+
+logger = logging.getLogger(__name__)
+
+# 可以直接按偏移量从磁盘读取帧数据的传输语法（未压缩、小端）
+NATIVE_LITTLE_ENDIAN_SYNTAXES = {
+    '1.2.840.10008.1.2',    # Implicit VR Little Endian
+    '1.2.840.10008.1.2.1',  # Explicit VR Little Endian
+}
+EXPLICIT_VR_LITTLE_ENDIAN = '1.2.840.10008.1.2.1'
+
+DEFAULT_QIDO_LIMIT = 100
+MAX_QIDO_LIMIT = 1000
+
+
+class FrameCache:
+    """按字节数限制的LRU帧缓存，缓存解码后的帧数据
+
+    键为 (图像ID, SOP实例UID, 文件mtime, 文件大小, 帧号)，不使用dicom_instance的行ID：
+    清理患者后SQLite会复用行ID，新上传的实例不能读到已删除实例的帧。
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._frames = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            data = self._frames.get(key)
+            if data is not None:
+                self._frames.move_to_end(key)
+            return data
+
+    def put(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._frames.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._frames[key] = data
+            self._size += len(data)
+            while self._size > self.max_bytes:
+                _, evicted = self._frames.popitem(last=False)
+                self._size -= len(evicted)
+
+    def discard_images(self, image_ids):
+        """删除指定图像的全部帧（清理患者时调用）"""
+        image_ids = set(image_ids)
+        with self._lock:
+            for key in [key for key in self._frames if key[0] in image_ids]:
+                self._size -= len(self._frames.pop(key))
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+            self._size = 0
+
+
+frame_cache = FrameCache()
+
+
+def _int_or_none(value):
+    try:
+        return int(value) if value not in (None, '') else None
+    except (TypeError, ValueError):
+        return None
+
+
+def index_dicom_file(image, file_path):
+    """读取DICOM头信息并写入索引表，记录像素数据在文件中的偏移量"""
+    with open(file_path, 'rb') as f:
+        # 延迟读取大元素，只获取像素数据的位置而不加载内容
+        ds = pydicom.dcmread(f, defer_size='1 KB', force=True)
+        pixel_elem = ds.get_item(0x7FE00010)
+
+    transfer_syntax = str(ds.file_meta.TransferSyntaxUID) if 'TransferSyntaxUID' in getattr(ds, 'file_meta', {}) else None
+    instance = DicomInstance.query.filter_by(image_id=image.id).first() or DicomInstance(image_id=image.id)
+    instance.patient_id = image.patient_id
+    instance.study_instance_uid = str(ds.get('StudyInstanceUID', '')) or pydicom.uid.generate_uid()
+    instance.series_instance_uid = str(ds.get('SeriesInstanceUID', '')) or pydicom.uid.generate_uid()
+    instance.sop_instance_uid = str(ds.get('SOPInstanceUID', '')) or pydicom.uid.generate_uid()
+    instance.sop_class_uid = str(ds.get('SOPClassUID', '')) or None
+    instance.dicom_patient_id = str(ds.get('PatientID', '')) or None
+    instance.dicom_patient_name = str(ds.get('PatientName', '')) or None
+    instance.study_date = str(ds.get('StudyDate', '')) or None
+    instance.study_time = str(ds.get('StudyTime', '')) or None
+    instance.study_description = str(ds.get('StudyDescription', '')) or None
+    instance.accession_number = str(ds.get('AccessionNumber', '')) or None
+    instance.modality = str(ds.get('Modality', '')) or None
+    instance.series_number = _int_or_none(ds.get('SeriesNumber'))
+    instance.series_description = str(ds.get('SeriesDescription', '')) or None
+    instance.instance_number = _int_or_none(ds.get('InstanceNumber'))
+    instance.rows = _int_or_none(ds.get('Rows'))
+    instance.columns = _int_or_none(ds.get('Columns'))
+    instance.number_of_frames = _int_or_none(ds.get('NumberOfFrames')) or 1
+    instance.samples_per_pixel = _int_or_none(ds.get('SamplesPerPixel')) or 1
+    instance.bits_allocated = _int_or_none(ds.get('BitsAllocated'))
+    instance.transfer_syntax_uid = transfer_syntax
+    if pixel_elem is not None and pixel_elem.length not in (None, 0xFFFFFFFF):
+        instance.pixel_data_offset = pixel_elem.value_tell
+        instance.pixel_data_length = pixel_elem.length
+    else:
+        # 封装（压缩）像素数据没有固定的帧偏移，取帧时需要解码
+        instance.pixel_data_offset = None
+        instance.pixel_data_length = None
+
+    db.session.add(instance)
+    db.session.commit()
+    logger.info(f"DICOM实例已索引: {instance.sop_instance_uid}")
+    return instance
+
+
+def _frame_length(instance):
+    return instance.rows * instance.columns * instance.samples_per_pixel * instance.bits_allocated // 8
+
+
+def can_read_frames_directly(instance):
+    """未压缩小端数据且按字节对齐时，可以直接从磁盘读取帧"""
+    return (
+        instance.pixel_data_offset is not None
+        and instance.transfer_syntax_uid in NATIVE_LITTLE_ENDIAN_SYNTAXES
+        and instance.bits_allocated in (8, 16, 32)
+        and instance.rows and instance.columns
+        and _frame_length(instance) * instance.number_of_frames <= instance.pixel_data_length
+    )
+
+
+def _frame_key(instance, file_path):
+    """帧缓存键的前缀：文件被替换后mtime或大小变化，旧的缓存帧不再被读到"""
+    stat = os.stat(file_path)
+    return (instance.image_id, instance.sop_instance_uid, stat.st_mtime_ns, stat.st_size)
+
+
+def _decode_frames(instance, file_path, key):
+    """解码全部帧并写入缓存（用于压缩或非常规传输语法）"""
+    ds = pydicom.dcmread(file_path, force=True)
+    pixels = ds.pixel_array
+    if instance.number_of_frames == 1:
+        pixels = pixels[np.newaxis, ...]
+    frames = []
+    for idx, frame in enumerate(pixels, start=1):
+        data = np.ascontiguousarray(frame).astype(frame.dtype.newbyteorder('<'), copy=False).tobytes()
+        frame_cache.put(key + (idx,), data)
+        frames.append(data)
+    return frames
+
+
+def read_frames(instance, file_path, frame_numbers):
+    """读取指定帧（从1开始编号）的原始像素数据，保持原始位深"""
+    frames = []
+    missing = []
+    key = _frame_key(instance, file_path)
+    for number in frame_numbers:
+        if number < 1 or number > instance.number_of_frames:
+            raise ValueError(f"帧号超出范围: {number}")
+        cached = frame_cache.get(key + (number,))
+        frames.append(cached)
+        if cached is None:
+            missing.append(number)
+
+    if not missing:
+        return frames
+
+    if can_read_frames_directly(instance):
+        # 未压缩数据直接按偏移从磁盘读取，不经过解码
+        length = _frame_length(instance)
+        fd = os.open(file_path, os.O_RDONLY)
+        try:
+            for idx, number in enumerate(frame_numbers):
+                if frames[idx] is None:
+                    offset = instance.pixel_data_offset + (number - 1) * length
+                    frames[idx] = os.pread(fd, length, offset)
+        finally:
+            os.close(fd)
+        return frames
+
+    decoded = _decode_frames(instance, file_path, key)
+    return [frames[idx] if frames[idx] is not None else decoded[number - 1]
+            for idx, number in enumerate(frame_numbers)]
+
+
+def frame_transfer_syntax(instance):
+    """返回帧数据对应的传输语法（解码后的帧统一为Explicit VR Little Endian）"""
+    if can_read_frames_directly(instance):
+        return instance.transfer_syntax_uid
+    return EXPLICIT_VR_LITTLE_ENDIAN
+
+
+def read_instance_metadata(instance, file_path, bulk_data_uri):
+    """读取实例的DICOM JSON元数据，像素数据以BulkDataURI表示"""
+    ds = pydicom.dcmread(file_path, stop_before_pixels=True, force=True)
+    metadata = ds.to_json_dict(bulk_data_threshold=1024 * 1024,
+                               bulk_data_element_handler=lambda elem: bulk_data_uri)
+    if 'TransferSyntaxUID' in ds.file_meta:
+        metadata['00020010'] = {'vr': 'UI', 'Value': [frame_transfer_syntax(instance)]}
+    metadata['7FE00010'] = {'vr': 'OW', 'BulkDataURI': bulk_data_uri}
+    return metadata
+
+
+def _attr(vr, value):
+    """构造DICOM JSON属性"""
+    if value is None or value == '':
+        return {'vr': vr}
+    if vr == 'PN':
+        return {'vr': vr, 'Value': [{'Alphabetic': value}]}
+    return {'vr': vr, 'Value': value if isinstance(value, list) else [value]}
+
+
+def _apply_wildcard(query, column, value):
+    """支持QIDO-RS的*和?通配符"""
+    if '*' in value or '?' in value:
+        pattern = value.replace('%', r'\%').replace('_', r'\_').replace('*', '%').replace('?', '_')
+        return query.filter(column.like(pattern, escape='\\'))
+    return query.filter(column == value)
+
+
+def _apply_date_range(query, column, value):
+    """支持YYYYMMDD、YYYYMMDD-、-YYYYMMDD和YYYYMMDD-YYYYMMDD格式"""
+    if '-' in value:
+        start, end = value.split('-', 1)
+        if start:
+            query = query.filter(column >= start)
+        if end:
+            query = query.filter(column <= end)
+        return query
+    return query.filter(column == value)
+
+
+def _base_query(user_id):
+    """当前用户可见的实例；同一SOP实例被上传多次时只返回最新的一份"""
+    latest = db.session.query(func.max(DicomInstance.id)).join(
+        Patient, DicomInstance.patient_id == Patient.id
+    ).filter(
+        Patient.user_id == int(user_id),
+        Patient.deleted_at.is_(None)
+    ).group_by(DicomInstance.sop_instance_uid)
+    return DicomInstance.query.filter(DicomInstance.id.in_(latest))
+
+
+def _paginate(query, params):
+    limit = min(_int_or_none(params.get('limit')) or DEFAULT_QIDO_LIMIT, MAX_QIDO_LIMIT)
+    offset = _int_or_none(params.get('offset')) or 0
+    return query.limit(limit).offset(offset)
+
+
+def _study_filters(query, params):
+    if params.get('StudyInstanceUID'):
+        query = query.filter(DicomInstance.study_instance_uid.in_(params['StudyInstanceUID'].split(',')))
+    if params.get('PatientID'):
+        query = _apply_wildcard(query, DicomInstance.dicom_patient_id, params['PatientID'])
+    if params.get('PatientName'):
+        query = _apply_wildcard(query, DicomInstance.dicom_patient_name, params['PatientName'])
+    if params.get('AccessionNumber'):
+        query = _apply_wildcard(query, DicomInstance.accession_number, params['AccessionNumber'])
+    if params.get('StudyDate'):
+        query = _apply_date_range(query, DicomInstance.study_date, params['StudyDate'])
+    modality = params.get('ModalitiesInStudy') or params.get('Modality')
+    if modality:
+        query = query.filter(DicomInstance.modality == modality)
+    return query
+
+
+def search_studies(user_id, params, base_url):
+    """QIDO-RS: 检索检查（Study）"""
+    query = _study_filters(_base_query(user_id), params)
+    rows = _paginate(query.with_entities(
+        DicomInstance.study_instance_uid,
+        func.min(DicomInstance.study_date),
+        func.min(DicomInstance.study_time),
+        func.min(DicomInstance.study_description),
+        func.min(DicomInstance.accession_number),
+        func.min(DicomInstance.dicom_patient_id),
+        func.min(DicomInstance.dicom_patient_name),
+        func.group_concat(DicomInstance.modality.distinct()),
+        func.count(DicomInstance.series_instance_uid.distinct()),
+        func.count(DicomInstance.id)
+    ).group_by(DicomInstance.study_instance_uid).order_by(DicomInstance.study_instance_uid), params).all()
+
+    results = []
+    for (study_uid, study_date, study_time, description, accession, pid, pname,
+         modalities, series_count, instance_count) in rows:
+        results.append({
+            '0020000D': _attr('UI', study_uid),
+            '00080020': _attr('DA', study_date),
+            '00080030': _attr('TM', study_time),
+            '00081030': _attr('LO', description),
+            '00080050': _attr('SH', accession),
+            '00100020': _attr('LO', pid),
+            '00100010': _attr('PN', pname),
+            '00080061': _attr('CS', sorted(set(modalities.split(','))) if modalities else None),
+            '00201206': _attr('IS', series_count),
+            '00201208': _attr('IS', instance_count),
+            '00081190': _attr('UR', f"{base_url}/studies/{study_uid}"),
+        })
+    return results
+
+
+def search_series(user_id, study_uid, params, base_url):
+    """QIDO-RS: 检索检查下的序列（Series）"""
+    query = _base_query(user_id).filter(DicomInstance.study_instance_uid == study_uid)
+    if params.get('SeriesInstanceUID'):
+        query = query.filter(DicomInstance.series_instance_uid.in_(params['SeriesInstanceUID'].split(',')))
+    if params.get('Modality'):
+        query = query.filter(DicomInstance.modality == params['Modality'])
+    rows = _paginate(query.with_entities(
+        DicomInstance.series_instance_uid,
+        func.min(DicomInstance.modality),
+        func.min(DicomInstance.series_number),
+        func.min(DicomInstance.series_description),
+        func.count(DicomInstance.id)
+    ).group_by(DicomInstance.series_instance_uid).order_by(func.min(DicomInstance.series_number)), params).all()
+
+    return [{
+        '0020000D': _attr('UI', study_uid),
+        '0020000E': _attr('UI', series_uid),
+        '00080060': _attr('CS', modality),
+        '00200011': _attr('IS', series_number),
+        '0008103E': _attr('LO', description),
+        '00201209': _attr('IS', instance_count),
+        '00081190': _attr('UR', f"{base_url}/studies/{study_uid}/series/{series_uid}"),
+    } for series_uid, modality, series_number, description, instance_count in rows]
+
+
+def search_instances(user_id, study_uid, series_uid, params, base_url):
+    """QIDO-RS: 检索序列下的实例（Instance）"""
+    query = _base_query(user_id).filter(
+        DicomInstance.study_instance_uid == study_uid,
+        DicomInstance.series_instance_uid == series_uid
+    )
+    if params.get('SOPInstanceUID'):
+        query = query.filter(DicomInstance.sop_instance_uid.in_(params['SOPInstanceUID'].split(',')))
+    instances = _paginate(query.order_by(DicomInstance.instance_number, DicomInstance.id), params).all()
+
+    return [{
+        '0020000D': _attr('UI', study_uid),
+        '0020000E': _attr('UI', series_uid),
+        '00080016': _attr('UI', inst.sop_class_uid),
+        '00080018': _attr('UI', inst.sop_instance_uid),
+        '00200013': _attr('IS', inst.instance_number),
+        '00280010': _attr('US', inst.rows),
+        '00280011': _attr('US', inst.columns),
+        '00280008': _attr('IS', inst.number_of_frames),
+        '00280100': _attr('US', inst.bits_allocated),
+        '00081190': _attr('UR', f"{base_url}/studies/{study_uid}/series/{series_uid}/instances/{inst.sop_instance_uid}"),
+    } for inst in instances]
+
+
+def get_instance(user_id, study_uid, series_uid, sop_uid):
+    """获取属于当前用户的DICOM实例"""
+    return _base_query(user_id).filter(
+        DicomInstance.study_instance_uid == study_uid,
+        DicomInstance.series_instance_uid == series_uid,
+        DicomInstance.sop_instance_uid == sop_uid
+    ).first()
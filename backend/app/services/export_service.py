@@ -0,0 +1,194 @@
+from datetime import datetime, date
+from sqlalchemy import select, func, case, and_
+from models import db, Patient, Image, Measurement
+from app.services.measurement_service import METRICS, DEFAULT_REGION
+import io
+import csv
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 可导出的基础列：列名 -> (查询表达式, Parquet类型名)
+BASE_COLUMNS = {
+    'patient_code': (Patient.patient_id, 'string'),
+    'patient_name': (Patient.name, 'string'),
+    'age': (Patient.age, 'int64'),
+    'gender': (Patient.gender, 'string'),
+    'image_id': (Image.id, 'int64'),
+    'check_date': (Image.check_date, 'timestamp'),
+    'processed': (Image.processed, 'bool'),
+    'processing_completed': (Image.processing_completed, 'timestamp'),
+}
+
+COLUMNS = tuple(BASE_COLUMNS) + METRICS
+
+FORMATS = ('csv', 'parquet')
+
+
+def parse_columns(value):
+    """解析逗号分隔的列名，未指定时导出全部列"""
+    if not value:
+        return list(COLUMNS)
+    columns = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in columns if name not in COLUMNS]
+    if unknown:
+        raise ValueError(f"不支持的导出列: {', '.join(unknown)}，可选: {', '.join(COLUMNS)}")
+    return list(dict.fromkeys(columns))
+
+
+def build_query(user_id, columns, date_from=None, date_to=None, processed_only=False,
+                patient_id=None, region=DEFAULT_REGION):
+    """构造导出查询：每张图像一行，测量值按指标透视为列，按 (患者, 图像ID) 排序
+
+    排序与ix_patient_user_id、ix_image_patient_id的索引顺序一致，分组不需要临时B树，查询边扫描边输出；
+    测量列通过 (image_id, metric, region) 唯一索引逐图像取值，只选择基础列时不关联measurement表。
+    """
+    selected = []
+    metrics = [name for name in columns if name in METRICS]
+    for name in columns:
+        if name in BASE_COLUMNS:
+            selected.append(BASE_COLUMNS[name][0].label(name))
+        else:
+            selected.append(func.max(case((Measurement.metric == name, Measurement.value))).label(name))
+
+    query = (
+        select(*selected)
+        .select_from(Image)
+        .join(Patient, Patient.id == Image.patient_id)
+        .where(Patient.user_id == int(user_id), Patient.deleted_at.is_(None))
+        .order_by(Patient.id, Image.id)
+    )
+    if metrics:
+        query = (
+            query.outerjoin(Measurement, and_(Measurement.image_id == Image.id,
+                                              Measurement.region == region,
+                                              Measurement.metric.in_(metrics)))
+            .group_by(Patient.id, Image.id)
+        )
+    if date_from is not None:
+        query = query.where(Image.check_date >= date_from)
+    if date_to is not None:
+        query = query.where(Image.check_date < date_to)
+    if processed_only:
+        query = query.where(Image.processed.is_(True))
+    if patient_id is not None:
+        query = query.where(Image.patient_id == patient_id)
+    return query
+
+
+def _iter_batches(query, batch_size):
+    """以yield_per分批读取结果，内存占用只与批大小有关"""
+    result = db.session.execute(query, execution_options={'yield_per': batch_size})
+    try:
+        for rows in result.partitions():
+            yield rows
+    finally:
+        result.close()
+
+
+def _csv_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, bool):
+        return int(value)
+    return value
+
+
+def stream_csv(query, columns, batch_size):
+    """逐批输出CSV文本"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in _iter_batches(query, batch_size):
+        writer.writerows([_csv_value(value) for value in row] for row in rows)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+class ChunkSink:
+    """流式输出用的只写文件对象（ParquetWriter、ZipFile）：缓存写入的数据，由生成器取走后发送"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def parquet_available():
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _parquet_schema(pa, columns):
+    types = {
+        'string': pa.string(),
+        'int64': pa.int64(),
+        'bool': pa.bool_(),
+        'float64': pa.float64(),
+        'timestamp': pa.timestamp('us'),
+    }
+    fields = []
+    for name in columns:
+        type_name = BASE_COLUMNS[name][1] if name in BASE_COLUMNS else 'float64'
+        fields.append(pa.field(name, types[type_name]))
+    return pa.schema(fields)
+
+
+def stream_parquet(query, columns, batch_size):
+    """每批写入一个Parquet行组并输出已生成的字节，文件尾在最后输出"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = _parquet_schema(pa, columns)
+    sink = ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression='snappy')
+    try:
+        for rows in _iter_batches(query, batch_size):
+            arrays = [pa.array([row[i] for row in rows], type=schema.field(i).type)
+                      for i in range(len(columns))]
+            writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def export_measurements(fmt, user_id, columns, batch_size, **filters):
+    """检查参数并返回 (生成器, MIME类型, 扩展名)，参数错误时在开始输出前抛出ValueError"""
+    if fmt not in FORMATS:
+        raise ValueError(f"不支持的导出格式: {fmt}，可选: {', '.join(FORMATS)}")
+    if fmt == 'parquet' and not parquet_available():
+        raise ValueError("服务器未安装pyarrow，无法导出Parquet格式")
+
+    query = build_query(user_id, columns, **filters)
+    if fmt == 'csv':
+        return stream_csv(query, columns, batch_size), 'text/csv; charset=utf-8', 'csv'
+    return stream_parquet(query, columns, batch_size), 'application/vnd.apache.parquet', 'parquet'
@@ -0,0 +1,100 @@
+"""JWT用户和患者归属的进程内缓存
+
+缓存和失效都只在当前进程内生效：本进程的ORM变更会立即失效对应条目，
+其他工作进程（多进程部署的gunicorn worker等）则要等条目过期，
+因此用户或患者变更（包括删除患者）在其他进程最多滞后IDENTITY_CACHE_TTL秒。
+需要更严格的一致性时调小IDENTITY_CACHE_TTL。
+"""
+import logging
+from sqlalchemy import event
+from sqlalchemy.orm import Session, make_transient_to_detached
+from models import db, User, Patient
+from app.services.ttl_cache import TTLCache, MISSING
+
+logger = logging.getLogger(__name__)
+
+# 用户ID -> 用户列值；患者ID -> 所属用户ID（患者不存在时为None）
+user_cache = TTLCache()
+patient_owner_cache = TTLCache()
+
+_USER_COLUMNS = [column.key for column in User.__table__.columns]
+
+
+def configure(maxsize, ttl):
+    """按配置调整缓存容量和过期时间"""
+    for cache in (user_cache, patient_owner_cache):
+        cache.maxsize = maxsize
+        cache.ttl = ttl
+
+
+def get_user(user_id):
+    """解析JWT中的用户，命中缓存时不查询数据库
+
+    缓存保存列值，命中时构造detached实例并以merge(load=False)挂到当前会话，
+    返回的对象与查询得到的User用法一致。
+    """
+    values = user_cache.get(user_id)
+    if values is MISSING:
+        user = db.session.get(User, user_id)
+        user_cache.set(user_id, {key: getattr(user, key) for key in _USER_COLUMNS} if user else None)
+        return user
+    if values is None:
+        return None
+    user = User(**values)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+
+def get_patient_owner(patient_id):
+    """获取患者所属的用户ID，患者不存在或已删除时返回None"""
+    owner = patient_owner_cache.get(patient_id)
+    if owner is MISSING:
+        owner = db.session.execute(
+            db.select(Patient.user_id).where(Patient.id == patient_id, Patient.deleted_at.is_(None))
+        ).scalar()
+        patient_owner_cache.set(patient_id, owner)
+    return owner
+
+
+def user_owns_patient(user_id, patient_id):
+    """检查患者是否属于指定用户"""
+    try:
+        patient_id = int(patient_id)
+    except (TypeError, ValueError):
+        return False
+    owner = get_patient_owner(patient_id)
+    return owner is not None and owner == int(user_id)
+
+
+def stats():
+    return {name: cache.stats() for name, cache in _CACHES.items()}
+
+
+# 用户或患者变更时失效本进程的缓存。flush时立即失效，提交后再失效一次，
+# 避免其他线程在提交前读到旧值并重新写入缓存；绕过ORM的批量SQL依赖TTL过期。
+_CACHES = {'users': user_cache, 'patient_owners': patient_owner_cache}
+
+
+def _remember(session, name, key):
+    _CACHES[name].invalidate(key)
+    session.info.setdefault('identity_cache_keys', set()).add((name, key))
+
+
+@event.listens_for(Session, 'after_flush')
+def _invalidate_after_flush(session, flush_context):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, User) and obj.id is not None:
+            _remember(session, 'users', obj.id)
+        elif isinstance(obj, Patient) and obj.id is not None:
+            _remember(session, 'patient_owners', obj.id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session):
+    for name, key in session.info.pop('identity_cache_keys', ()):
+        _CACHES[name].invalidate(key)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_after_rollback(session):
+    session.info.pop('identity_cache_keys', None)
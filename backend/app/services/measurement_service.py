@@ -0,0 +1,170 @@
+from sqlalchemy import select, delete, and_, or_
+from models import db, Patient, Image, Measurement
+import numpy as np
+import nibabel as nib
+import json
+import base64
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REGION = 'whole_brain'
+
+# 流水线结果中的体积字段 -> (指标名, 单位)
+VOLUME_METRICS = {
+    'gm_volume': ('gm_volume', 'mm3'),
+    'wm_volume': ('wm_volume', 'mm3'),
+    'csf_volume': ('csf_volume', 'mm3'),
+    'tiv_volume': ('tiv_volume', 'mm3'),
+}
+
+# 写入时一并计算的比值指标，队列筛选可直接按比值走索引
+RATIO_METRICS = {
+    'gm_tiv_ratio': 'gm_volume',
+    'wm_tiv_ratio': 'wm_volume',
+    'csf_tiv_ratio': 'csf_volume',
+}
+
+METRICS = tuple(metric for metric, _ in VOLUME_METRICS.values()) + tuple(RATIO_METRICS)
+
+# 队列查询支持的比较运算
+OPERATORS = {
+    'lt': lambda column, value: column < value,
+    'le': lambda column, value: column <= value,
+    'gt': lambda column, value: column > value,
+    'ge': lambda column, value: column >= value,
+    'eq': lambda column, value: column == value,
+}
+
+
+def compute_tissue_volumes(tissue_files):
+    """根据组织概率图计算体积（mm³）：{组织: 路径} -> {组织_volume: 体积}，TIV为各组织之和"""
+    volumes = {}
+    for tissue, path in tissue_files.items():
+        img = nib.load(path)
+        voxel_volume = np.prod(img.header.get_zooms())  # 体素体积（mm³）
+        volumes[f"{tissue}_volume"] = float(np.sum(img.get_fdata()) * voxel_volume)
+    volumes['tiv_volume'] = float(sum(volumes.values()))
+    return volumes
+
+
+def measurement_rows(image_id, volumes, region=DEFAULT_REGION):
+    """把流水线的体积结果转换为measurement行，值为空的指标跳过"""
+    rows = []
+    for key, (metric, unit) in VOLUME_METRICS.items():
+        value = volumes.get(key)
+        if value is not None:
+            rows.append({'image_id': image_id, 'metric': metric, 'region': region,
+                         'value': float(value), 'unit': unit})
+    tiv = volumes.get('tiv_volume')
+    if tiv:
+        for metric, key in RATIO_METRICS.items():
+            value = volumes.get(key)
+            if value is not None:
+                rows.append({'image_id': image_id, 'metric': metric, 'region': region,
+                             'value': float(value) / float(tiv), 'unit': 'ratio'})
+    return rows
+
+
+def record_volumes(image_id, volumes, region=DEFAULT_REGION):
+    """用一次批量INSERT写入图像的测量值，替换该区域已有的结果（由调用方提交）"""
+    rows = measurement_rows(image_id, volumes, region)
+    db.session.execute(
+        delete(Measurement)
+        .where(Measurement.image_id == image_id, Measurement.region == region)
+        .execution_options(synchronize_session=False)
+    )
+    if rows:
+        # 直接使用表级INSERT执行executemany，不经过ORM的批量插入流程
+        db.session.execute(Measurement.__table__.insert(), rows)
+    return len(rows)
+
+
+def clear_measurements(image_id):
+    """图像重新处理时清除旧的测量值"""
+    db.session.execute(
+        delete(Measurement).where(Measurement.image_id == image_id).execution_options(synchronize_session=False)
+    )
+
+
+def get_metrics(image_id, region=DEFAULT_REGION):
+    """读取图像全部指标的测量值 {指标: 数值}"""
+    return dict(db.session.execute(
+        select(Measurement.metric, Measurement.value)
+        .where(Measurement.image_id == image_id, Measurement.region == region)
+    ).all())
+
+
+def get_volumes(image_id, region=DEFAULT_REGION):
+    """读取图像的体积结果，格式与results.json相同；没有测量值时返回None"""
+    values = get_metrics(image_id, region)
+    if not values:
+        return None
+    return {key: values.get(metric) for key, (metric, _) in VOLUME_METRICS.items()}
+
+
+def get_task_volumes(task_id):
+    """按任务ID读取处理结果，返回 (图像, 体积结果)；任务没有对应图像时返回 (None, None)"""
+    image = db.session.execute(select(Image).where(Image.task_id == task_id)).scalars().first()
+    if image is None:
+        return None, None
+    return image, get_volumes(image.id)
+
+
+def encode_cohort_cursor(value, image_id):
+    """队列查询的键集游标：(测量值, 图像ID)"""
+    raw = json.dumps([value, image_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cohort_cursor(cursor):
+    """解析队列查询游标，格式错误时抛出ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        value, image_id = json.loads(raw)
+        return float(value), int(image_id)
+    except Exception:
+        raise ValueError(f"无效的队列查询游标: {cursor}")
+
+
+def query_cohort(user_id, metric, op, value, limit, region=DEFAULT_REGION, cursor=None):
+    """按测量值筛选当前用户的图像，例如 gm_tiv_ratio < 0.4
+
+    先在 (metric, region, value, image_id) 覆盖索引上做范围扫描，再按图像ID关联图像和患者；
+    结果按 (测量值, 图像ID) 排序并键集分页。返回 (结果列表, 下一页游标)。
+    """
+    if op not in OPERATORS:
+        raise ValueError(f"不支持的比较运算: {op}")
+
+    M = Measurement
+    query = (
+        select(M.image_id, M.value, M.unit, Image.patient_id, Image.check_date,
+               Patient.name, Patient.patient_id.label('patient_code'))
+        .join(Image, Image.id == M.image_id)
+        .join(Patient, Patient.id == Image.patient_id)
+        .where(M.metric == metric, M.region == region, OPERATORS[op](M.value, value),
+               Patient.user_id == int(user_id), Patient.deleted_at.is_(None))
+        .order_by(M.value, M.image_id)
+        .limit(limit + 1)
+    )
+    if cursor is not None:
+        last_value, last_id = cursor
+        query = query.where(or_(M.value > last_value, and_(M.value == last_value, M.image_id > last_id)))
+
+    rows = db.session.execute(query).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    results = [{
+        'image_id': row.image_id,
+        'patient_id': row.patient_id,
+        'patient_name': row.name,
+        'patient_code': row.patient_code,
+        'check_date': row.check_date.isoformat() if row.check_date else None,
+        'metric': metric,
+        'region': region,
+        'value': row.value,
+        'unit': row.unit,
+    } for row in rows]
+    next_cursor = encode_cohort_cursor(rows[-1].value, rows[-1].image_id) if has_more and rows else None
+    return results, next_cursor
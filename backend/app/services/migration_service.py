@@ -0,0 +1,321 @@
+from datetime import datetime
+from sqlalchemy import inspect, text
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_VERSION_TABLE = 'schema_version'
+
+
+def _add_missing_columns(conn, table, columns):
+    existing = {col['name'] for col in inspect(conn).get_columns(table)}
+    for name, col_type in columns:
+        if name not in existing:
+            logger.info(f"添加新列: {table}.{name}")
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {col_type}"))
+
+
+def _create_indexes(conn, indexes):
+    for name, table, columns in indexes:
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})"))
+
+
+def _m001_image_columns(conn):
+    """补齐旧数据库中image表缺少的列（原init_db/update_schema.py中的ALTER TABLE）"""
+    _add_missing_columns(conn, 'image', [
+        ('gm_volume', 'FLOAT'),
+        ('wm_volume', 'FLOAT'),
+        ('csf_volume', 'FLOAT'),
+        ('tiv_volume', 'FLOAT'),
+        ('processing_completed', 'DATETIME'),
+        ('processed', 'BOOLEAN'),
+        ('processing_error', 'TEXT'),
+        ('task_id', 'VARCHAR(255)'),
+    ])
+    conn.execute(text("UPDATE image SET processed = 0 WHERE processed IS NULL"))
+
+
+def _m002_lookup_indexes(conn):
+    """为路由中常用的过滤条件建立索引"""
+    _create_indexes(conn, [
+        ('ix_image_patient_id', 'image', ['patient_id']),
+        ('ix_image_task_id', 'image', ['task_id']),
+        ('ix_patient_user_id', 'patient', ['user_id']),
+        ('ix_image_patient_check_date', 'image', ['patient_id', 'check_date']),
+    ])
+
+
+def _m003_patient_fts(conn):
+    """建立患者姓名/编号的FTS5全文索引，并用触发器与patient表保持同步"""
+    if conn.dialect.name != 'sqlite':
+        logger.info("非SQLite数据库，跳过FTS5索引，患者搜索使用LIKE查询")
+        return
+    try:
+        conn.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS patient_fts USING fts5("
+            "name, patient_id, content='patient', content_rowid='id', "
+            "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        ))
+    except Exception as e:
+        # 部分SQLite编译版本不包含FTS5
+        logger.warning(f"无法创建FTS5索引，患者搜索使用LIKE查询: {str(e)}")
+        return
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS patient_fts_ai AFTER INSERT ON patient BEGIN "
+        "INSERT INTO patient_fts(rowid, name, patient_id) VALUES (new.id, new.name, new.patient_id); "
+        "END"
+    ))
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS patient_fts_ad AFTER DELETE ON patient BEGIN "
+        "INSERT INTO patient_fts(patient_fts, rowid, name, patient_id) "
+        "VALUES ('delete', old.id, old.name, old.patient_id); "
+        "END"
+    ))
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS patient_fts_au AFTER UPDATE OF name, patient_id ON patient BEGIN "
+        "INSERT INTO patient_fts(patient_fts, rowid, name, patient_id) "
+        "VALUES ('delete', old.id, old.name, old.patient_id); "
+        "INSERT INTO patient_fts(rowid, name, patient_id) VALUES (new.id, new.name, new.patient_id); "
+        "END"
+    ))
+    # 为已有患者建立索引
+    conn.execute(text("INSERT INTO patient_fts(patient_fts) VALUES ('rebuild')"))
+
+
+def _m004_patient_summary(conn):
+    """创建patient_summary汇总表并按现有图像回填"""
+    from models import PatientSummary
+    from app.services.summary_service import compute_summary
+
+    PatientSummary.__table__.create(conn, checkfirst=True)
+    existing = set(conn.execute(text("SELECT patient_id FROM patient_summary")).scalars())
+    rows = conn.execute(text(
+        "SELECT patient_id, id, check_date, processed, gm_volume, wm_volume, csf_volume, tiv_volume "
+        "FROM image ORDER BY patient_id"
+    ))
+    images = {}
+    for patient_id, *row in rows:
+        # 原生SQL取出的日期是字符串，转换成datetime参与比较和回归计算
+        if isinstance(row[1], str):
+            row[1] = datetime.fromisoformat(row[1])
+        images.setdefault(patient_id, []).append(row)
+
+    now = datetime.utcnow()
+    for patient_id in conn.execute(text("SELECT id FROM patient")).scalars():
+        if patient_id in existing:
+            continue
+        values = compute_summary(images.get(patient_id, []))
+        values.update({'patient_id': patient_id, 'last_activity': now, 'updated_at': now})
+        conn.execute(PatientSummary.__table__.insert().values(**values))
+
+
+def _m005_patient_deleted_at(conn):
+    """患者逻辑删除标记"""
+    _add_missing_columns(conn, 'patient', [('deleted_at', 'DATETIME')])
+    _create_indexes(conn, [('ix_patient_deleted_at', 'patient', ['deleted_at'])])
+
+
+def _read_task_results(task_id):
+    """读取旧任务目录中的results.json，找不到或无法解析时返回None"""
+    from flask import has_app_context
+    from config.config import Config
+    from app.services import storage
+
+    processed_root = None if has_app_context() else Config.PROCESSED_FOLDER
+    try:
+        path = storage.task_file(task_id, 'results.json', processed_root=processed_root)
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _m006_measurements(conn):
+    """创建measurement测量值表，从image表的体积列回填，体积列为空时读取任务的results.json"""
+    from models import Measurement
+    from app.services.measurement_service import measurement_rows
+
+    Measurement.__table__.create(conn, checkfirst=True)
+    done = set(conn.execute(text("SELECT DISTINCT image_id FROM measurement")).scalars())
+    images = conn.execute(text(
+        "SELECT id, task_id, gm_volume, wm_volume, csf_volume, tiv_volume FROM image WHERE processed = 1"
+    )).all()
+
+    rows = []
+    for image_id, task_id, gm, wm, csf, tiv in images:
+        if image_id in done:
+            continue
+        volumes = {'gm_volume': gm, 'wm_volume': wm, 'csf_volume': csf, 'tiv_volume': tiv}
+        if all(value is None for value in volumes.values()) and task_id:
+            volumes = _read_task_results(task_id) or volumes
+        rows.extend(measurement_rows(image_id, volumes))
+    if rows:
+        conn.execute(Measurement.__table__.insert(), rows)
+    logger.info(f"已回填 {len(rows)} 条测量值")
+
+
+def _m007_summary_results_version(conn):
+    """患者汇总表的结果版本号，作为趋势缓存的失效依据"""
+    _add_missing_columns(conn, 'patient_summary', [('results_version', 'INTEGER NOT NULL DEFAULT 0')])
+
+
+def _m008_normative_aggregates(conn):
+    """创建人群统计量和分位数草图表，按现有测量值回填"""
+    from models import NormativeAggregate, NormativeSketchBin
+    from app.services import normative_service
+
+    NormativeAggregate.__table__.create(conn, checkfirst=True)
+    NormativeSketchBin.__table__.create(conn, checkfirst=True)
+    if conn.execute(text("SELECT COUNT(*) FROM normative_aggregate")).scalar():
+        return
+
+    rows = conn.execute(text(
+        "SELECT p.age, p.gender, m.metric, m.value FROM measurement m "
+        "JOIN image i ON i.id = m.image_id JOIN patient p ON p.id = i.patient_id "
+        "WHERE p.deleted_at IS NULL AND m.region = :region"
+    ), {'region': 'whole_brain'})
+    aggregates, bins = {}, {}
+    for age, gender, metric, value in rows:
+        key = (metric, normative_service.age_bucket(age), normative_service.normalize_gender(gender))
+        aggregates[key] = normative_service.merge(aggregates.get(key, (0, 0.0, 0.0)), (1, value, 0.0))
+        index = normative_service.sketch_index(value)
+        if index is not None:
+            bins[key + (index,)] = bins.get(key + (index,), 0) + 1
+
+    now = datetime.utcnow()
+    if aggregates:
+        conn.execute(NormativeAggregate.__table__.insert(), [
+            {'metric': metric, 'age_bucket': bucket, 'gender': gender,
+             'count': n, 'mean': mean, 'm2': m2, 'updated_at': now}
+            for (metric, bucket, gender), (n, mean, m2) in aggregates.items()
+        ])
+    if bins:
+        conn.execute(NormativeSketchBin.__table__.insert(), [
+            {'metric': metric, 'age_bucket': bucket, 'gender': gender, 'bin_index': index, 'count': count}
+            for (metric, bucket, gender, index), count in bins.items()
+        ])
+    logger.info(f"已回填 {len(aggregates)} 个人群统计分组")
+
+
+def _m009_dicom_instance_scope(conn):
+    """dicom_instance的SOP实例UID从全局唯一改为按图像唯一，重复上传的DICOM也能写入索引"""
+    from models import DicomInstance
+
+    inspector = inspect(conn)
+    if not inspector.has_table('dicom_instance'):
+        DicomInstance.__table__.create(conn)
+        return
+    if conn.dialect.name == 'sqlite':
+        # 列上内联的UNIQUE不会出现在get_unique_constraints中，直接查唯一索引
+        global_unique = [
+            name for _, name, unique, *_ in conn.execute(text("PRAGMA index_list('dicom_instance')"))
+            if unique and [row[2] for row in conn.execute(text(f"PRAGMA index_info('{name}')"))] == ['sop_instance_uid']
+        ]
+    else:
+        global_unique = [uc['name'] for uc in inspector.get_unique_constraints('dicom_instance')
+                         if uc['column_names'] == ['sop_instance_uid']]
+    if global_unique and conn.dialect.name == 'sqlite':
+        # SQLite不能删除约束，按当前模型重建表；索引名在库内全局唯一，先删掉旧表的索引
+        existing = {column['name'] for column in inspector.get_columns('dicom_instance')}
+        for index in inspector.get_indexes('dicom_instance'):
+            conn.execute(text(f"DROP INDEX IF EXISTS {index['name']}"))
+        conn.execute(text("ALTER TABLE dicom_instance RENAME TO dicom_instance_old"))
+        DicomInstance.__table__.create(conn)
+        columns = ', '.join(column.name for column in DicomInstance.__table__.columns if column.name in existing)
+        conn.execute(text(f"INSERT INTO dicom_instance ({columns}) SELECT {columns} FROM dicom_instance_old"))
+        conn.execute(text("DROP TABLE dicom_instance_old"))
+        return
+    for name in global_unique:
+        if conn.dialect.name == 'mysql':
+            conn.execute(text(f"ALTER TABLE dicom_instance DROP INDEX {name}"))
+        else:
+            conn.execute(text(f"ALTER TABLE dicom_instance DROP CONSTRAINT {name}"))
+    if global_unique:
+        conn.execute(text("CREATE UNIQUE INDEX uq_dicom_instance_image_sop "
+                          "ON dicom_instance (image_id, sop_instance_uid)"))
+    _create_indexes(conn, [('ix_dicom_instance_sop_instance_uid', 'dicom_instance', ['sop_instance_uid'])])
+
+
+def _m010_patient_purge_claim(conn):
+    """患者清理任务的认领时间，多个进程不会同时清理同一患者"""
+    _add_missing_columns(conn, 'patient', [('purge_started_at', 'DATETIME')])
+
+
+# 按版本号排列的迁移列表：(版本号, 说明, 迁移函数)
+# 迁移函数必须可重复执行：新建的数据库已由create_all建好表和索引；
+# 之后新增的表也要通过迁移创建，schema为最新版本时启动不会再调用create_all
+MIGRATIONS = [
+    (1, 'image表补齐体积和处理状态列', _m001_image_columns),
+    (2, '添加image/patient查询索引', _m002_lookup_indexes),
+    (3, '患者全文搜索索引', _m003_patient_fts),
+    (4, '患者汇总表', _m004_patient_summary),
+    (5, '患者逻辑删除', _m005_patient_deleted_at),
+    (6, '图像测量值表', _m006_measurements),
+    (7, '患者汇总结果版本号', _m007_summary_results_version),
+    (8, '人群常模统计量', _m008_normative_aggregates),
+    (9, 'DICOM实例UID按图像唯一', _m009_dicom_instance_scope),
+    (10, '患者清理任务认领', _m010_patient_purge_claim),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(conn):
+    """读取数据库当前的schema版本，版本表不存在时返回0"""
+    if not inspect(conn).has_table(SCHEMA_VERSION_TABLE):
+        return 0
+    return conn.execute(text(f"SELECT MAX(version) FROM {SCHEMA_VERSION_TABLE}")).scalar() or 0
+
+
+def _ensure_version_table(conn):
+    conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {SCHEMA_VERSION_TABLE} ("
+        "version INTEGER PRIMARY KEY, "
+        "description VARCHAR(255) NOT NULL, "
+        "applied_at DATETIME NOT NULL)"
+    ))
+
+
+def pending_migrations(engine):
+    """返回尚未执行的迁移"""
+    with engine.connect() as conn:
+        version = get_schema_version(conn)
+    return [m for m in MIGRATIONS if m[0] > version]
+
+
+def upgrade(engine, create_all=None):
+    """依次执行尚未执行的迁移，每个迁移和它的版本记录在同一个事务中提交
+
+    schema已是最新版本时只执行一条查询；否则先调用create_all创建缺少的表。
+    """
+    with engine.connect() as conn:
+        try:
+            # 绝大多数启动只需要这一条查询
+            version = conn.execute(text(f"SELECT MAX(version) FROM {SCHEMA_VERSION_TABLE}")).scalar() or 0
+        except Exception:
+            conn.rollback()
+            version = 0
+        if version >= LATEST_VERSION:
+            return version
+
+    if create_all is not None:
+        create_all()
+    with engine.begin() as conn:
+        _ensure_version_table(conn)
+
+    for number, description, migrate in MIGRATIONS:
+        if number <= version:
+            continue
+        logger.info(f"执行数据库迁移 {number}: {description}")
+        with engine.begin() as conn:
+            migrate(conn)
+            conn.execute(
+                text(f"INSERT INTO {SCHEMA_VERSION_TABLE} (version, description, applied_at) "
+                     "VALUES (:version, :description, :applied_at)"),
+                {'version': number, 'description': description, 'applied_at': datetime.utcnow()}
+            )
+        version = number
+
+    logger.info(f"数据库schema已更新到版本 {version}")
+    return version
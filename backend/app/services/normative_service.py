@@ -0,0 +1,302 @@
+import math
+from sqlalchemy import select, update, func, case, tuple_
+from models import db, Patient, Image, Measurement, NormativeAggregate, NormativeSketchBin
+from app.services import measurement_service
+from app.services.measurement_service import METRICS, DEFAULT_REGION
+import logging
+
+logger = logging.getLogger(__name__)
+
+AGE_BUCKET_YEARS = 10
+UNKNOWN_AGE = -1
+UNKNOWN_GENDER = 'U'
+
+# 分位数草图的相对误差：值落在 [gamma^(i-1), gamma^i) 的对数桶中
+SKETCH_RELATIVE_ACCURACY = 0.01
+_GAMMA = (1 + SKETCH_RELATIVE_ACCURACY) / (1 - SKETCH_RELATIVE_ACCURACY)
+_LOG_GAMMA = math.log(_GAMMA)
+
+_GENDERS = {'男': 'M', 'm': 'M', 'male': 'M', '女': 'F', 'f': 'F', 'female': 'F'}
+
+
+def age_bucket(age):
+    """年龄段下限，例如 67 -> 60；年龄未知时为-1"""
+    try:
+        age = int(age)
+    except (TypeError, ValueError):
+        return UNKNOWN_AGE
+    if age < 0:
+        return UNKNOWN_AGE
+    return age // AGE_BUCKET_YEARS * AGE_BUCKET_YEARS
+
+
+def normalize_gender(gender):
+    return _GENDERS.get(str(gender or '').strip().lower(), UNKNOWN_GENDER)
+
+
+def group_of(patient):
+    """患者所属的 (年龄段, 性别) 分组"""
+    return age_bucket(patient.age), normalize_gender(patient.gender)
+
+
+def sketch_index(value):
+    """数值所在的对数桶编号，非正数不进入草图"""
+    if value is None or value <= 0:
+        return None
+    return math.ceil(math.log(value) / _LOG_GAMMA)
+
+
+def sketch_value(index):
+    """对数桶的代表值，与桶内任意值的相对误差不超过SKETCH_RELATIVE_ACCURACY"""
+    return 2 * _GAMMA ** index / (_GAMMA + 1)
+
+
+def _upsert(table):
+    """按数据库方言返回支持ON CONFLICT的insert"""
+    if db.session.get_bind().dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table)
+
+
+def _apply(metric, group, value, sign):
+    """以单条UPDATE原子地把一个值加入（sign=1）或移出（sign=-1）分组的Welford统计量"""
+    A = NormativeAggregate
+    if sign > 0:
+        values = {
+            'count': A.count + 1,
+            'mean': A.mean + (value - A.mean) / (A.count + 1),
+            'm2': A.m2 + (value - A.mean) * (value - A.mean) * A.count / (A.count + 1),
+        }
+    else:
+        empty = A.count <= 1
+        values = {
+            'count': case((empty, 0), else_=A.count - 1),
+            'mean': case((empty, 0.0), else_=(A.mean * A.count - value) / (A.count - 1)),
+            'm2': case((empty, 0.0), else_=A.m2 - (value - A.mean) * (value - A.mean) * A.count / (A.count - 1)),
+        }
+    db.session.execute(
+        update(A)
+        .where(A.metric == metric, A.age_bucket == group[0], A.gender == group[1])
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def update_scan(group, before, after):
+    """任务完成时调用：把图像旧的测量值移出分组统计量并加入新的值（由调用方提交）
+
+    group为group_of(patient)，before/after为 {指标: 数值}，首次处理时before为空。
+    """
+    changes = [(metric, value, -1) for metric, value in (before or {}).items() if metric in METRICS]
+    changes += [(metric, value, 1) for metric, value in (after or {}).items() if metric in METRICS]
+    if not changes:
+        return
+
+    metrics = sorted({metric for metric, _, _ in changes})
+    db.session.execute(
+        _upsert(NormativeAggregate).on_conflict_do_nothing(),
+        [{'metric': metric, 'age_bucket': group[0], 'gender': group[1], 'count': 0, 'mean': 0.0, 'm2': 0.0}
+         for metric in metrics]
+    )
+    bins = {}
+    for metric, value, sign in changes:
+        _apply(metric, group, value, sign)
+        index = sketch_index(value)
+        if index is not None:
+            bins[(metric, index)] = bins.get((metric, index), 0) + sign
+    bins = [{'metric': metric, 'age_bucket': group[0], 'gender': group[1], 'bin_index': index, 'count': count}
+            for (metric, index), count in bins.items() if count]
+    if bins:
+        stmt = _upsert(NormativeSketchBin)
+        db.session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=['metric', 'age_bucket', 'gender', 'bin_index'],
+                set_={'count': NormativeSketchBin.count + stmt.excluded.count}
+            ),
+            bins
+        )
+
+
+def _image_metrics(image_ids, region):
+    rows = db.session.execute(
+        select(Measurement.image_id, Measurement.metric, Measurement.value)
+        .where(Measurement.image_id.in_(image_ids), Measurement.region == region)
+    ).all()
+    by_image = {}
+    for image_id, metric, value in rows:
+        by_image.setdefault(image_id, {})[metric] = value
+    return by_image
+
+
+def remove_images(patient, image_ids, region=DEFAULT_REGION):
+    """删除图像前把它们的测量值移出统计量（清理患者数据时按批调用）"""
+    group = group_of(patient)
+    by_image = _image_metrics(image_ids, region)
+    for values in by_image.values():
+        update_scan(group, values, None)
+    return len(by_image)
+
+
+def move_patient(patient_id, old_group, new_group, region=DEFAULT_REGION):
+    """患者年龄或性别修改后，把其全部测量值从旧分组移到新分组"""
+    if old_group == new_group:
+        return 0
+    image_ids = db.session.execute(select(Image.id).where(Image.patient_id == patient_id)).scalars().all()
+    by_image = _image_metrics(image_ids, region) if image_ids else {}
+    for values in by_image.values():
+        update_scan(old_group, values, None)
+        update_scan(new_group, None, values)
+    return len(by_image)
+
+
+def merge(a, b):
+    """合并两组 (count, mean, M2)，即Chan等人的并行方差公式"""
+    n_a, mean_a, m2_a = a
+    n_b, mean_b, m2_b = b
+    n = n_a + n_b
+    if n == 0:
+        return 0, 0.0, 0.0
+    delta = mean_b - mean_a
+    mean = mean_a + delta * n_b / n
+    m2 = m2_a + m2_b + delta * delta * n_a * n_b / n
+    return n, mean, m2
+
+
+def _reference_levels(group):
+    """参照组从精确到宽泛：同年龄段同性别、同年龄段、同性别、全部人群"""
+    bucket, gender = group
+    return (
+        ('age_gender', lambda row: row.age_bucket == bucket and row.gender == gender),
+        ('age', lambda row: row.age_bucket == bucket),
+        ('gender', lambda row: row.gender == gender),
+        ('all', lambda row: True),
+    )
+
+
+def _load_aggregates(metrics):
+    """一次读取多个指标的全部分组统计量（每个指标最多几十行）"""
+    rows = db.session.execute(
+        select(NormativeAggregate)
+        .where(NormativeAggregate.metric.in_(metrics), NormativeAggregate.count > 0)
+    ).scalars().all()
+    by_metric = {}
+    for row in rows:
+        by_metric.setdefault(row.metric, []).append(row)
+    return by_metric
+
+
+def reference(rows, group, min_count):
+    """从指标的分组统计量中选择样本量不少于min_count的最精确参照组
+
+    返回 (级别, 分组列表, (count, mean, M2))，样本不足时级别为None。
+    """
+    for level, matches in _reference_levels(group):
+        selected = [row for row in rows if matches(row)]
+        stats = (0, 0.0, 0.0)
+        for row in selected:
+            stats = merge(stats, (row.count, row.mean, row.m2))
+        if stats[0] >= min_count:
+            return level, [(row.age_bucket, row.gender) for row in selected], stats
+    return None, [], (0, 0.0, 0.0)
+
+
+def _empirical_percentile(metric, groups, value):
+    """由分组草图的桶计数估计数值所在的百分位（同桶计一半）"""
+    index = sketch_index(value)
+    if index is None or not groups:
+        return None
+    B = NormativeSketchBin
+    below, same, total = db.session.execute(
+        select(
+            func.coalesce(func.sum(case((B.bin_index < index, B.count), else_=0)), 0),
+            func.coalesce(func.sum(case((B.bin_index == index, B.count), else_=0)), 0),
+            func.coalesce(func.sum(B.count), 0),
+        ).where(B.metric == metric, tuple_(B.age_bucket, B.gender).in_(groups))
+    ).one()
+    if not total:
+        return None
+    return (below + 0.5 * same) / total * 100
+
+
+def score(metric, value, group, min_count, rows=None):
+    """计算单个测量值相对参照组的z分数和百分位
+
+    z分数和正态百分位只需分组的count/mean/M2；经验百分位由草图的桶计数得到。
+    """
+    if rows is None:
+        rows = _load_aggregates([metric]).get(metric, [])
+    level, groups, (n, mean, m2) = reference(rows, group, min_count)
+    if level is None or value is None:
+        return {'value': value, 'reference': None, 'z_score': None, 'normal_percentile': None, 'percentile': None}
+    std = math.sqrt(max(m2, 0.0) / (n - 1)) if n > 1 else 0.0
+    z = (value - mean) / std if std > 0 else None
+    return {
+        'value': value,
+        'reference': {'level': level, 'count': n, 'mean': mean, 'std': std},
+        'z_score': z,
+        'normal_percentile': 50 * (1 + math.erf(z / math.sqrt(2))) if z is not None else None,
+        'percentile': _empirical_percentile(metric, groups, value),
+    }
+
+
+def score_image(image_id, min_count, region=DEFAULT_REGION):
+    """图像各指标相对同年龄段、同性别人群的z分数和百分位；图像不存在时返回None"""
+    row = db.session.execute(
+        select(Patient.age, Patient.gender).join(Image, Image.patient_id == Patient.id).where(Image.id == image_id)
+    ).first()
+    if row is None:
+        return None
+    group = (age_bucket(row.age), normalize_gender(row.gender))
+    values = measurement_service.get_metrics(image_id, region)
+    aggregates = _load_aggregates(list(values))
+    return {
+        'age_bucket': group[0],
+        'gender': group[1],
+        'metrics': {metric: score(metric, values[metric], group, min_count, aggregates.get(metric, []))
+                    for metric in METRICS if metric in values},
+    }
+
+
+def _quantiles(bins, count, quantiles):
+    """按桶编号顺序累加计数，返回各分位数的代表值"""
+    results = {}
+    cumulative = 0
+    targets = list(quantiles)
+    for index, bin_count in bins:
+        cumulative += bin_count
+        while targets and cumulative >= targets[0] * count:
+            results[targets.pop(0)] = sketch_value(index)
+    return results
+
+
+def norms(metric, quantiles=(0.05, 0.25, 0.5, 0.75, 0.95)):
+    """指标在各年龄段和性别分组中的参考值：样本量、均值、标准差和分位数"""
+    aggregates = db.session.execute(
+        select(NormativeAggregate)
+        .where(NormativeAggregate.metric == metric, NormativeAggregate.count > 0)
+        .order_by(NormativeAggregate.age_bucket, NormativeAggregate.gender)
+    ).scalars().all()
+    bins = {}
+    for bucket, gender, index, count in db.session.execute(
+        select(NormativeSketchBin.age_bucket, NormativeSketchBin.gender,
+               NormativeSketchBin.bin_index, NormativeSketchBin.count)
+        .where(NormativeSketchBin.metric == metric, NormativeSketchBin.count > 0)
+        .order_by(NormativeSketchBin.bin_index)
+    ):
+        bins.setdefault((bucket, gender), []).append((index, count))
+
+    groups = []
+    for row in aggregates:
+        group_bins = bins.get((row.age_bucket, row.gender), [])
+        total = sum(count for _, count in group_bins)
+        groups.append({
+            'age_bucket': row.age_bucket,
+            'gender': row.gender,
+            'count': row.count,
+            'mean': row.mean,
+            'std': math.sqrt(max(row.m2, 0.0) / (row.count - 1)) if row.count > 1 else 0.0,
+            'quantiles': {str(q): v for q, v in _quantiles(group_bins, total, quantiles).items()} if total else {},
+        })
+    return groups
@@ -0,0 +1,162 @@
+from sqlalchemy import select, or_, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import selectinload
+from models import db, Patient, Image, PatientSummary
+from app.services import identity_cache
+import json
+import base64
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _summary_query(include_images=False):
+    """患者摘要查询：患者字段加上patient_summary中预先汇总的统计"""
+    query = select(Patient, PatientSummary).outerjoin(PatientSummary, PatientSummary.patient_id == Patient.id)
+    if include_images:
+        query = query.options(selectinload(Patient.images))
+    return query
+
+
+def _summary_dict(row, include_images=False):
+    patient, summary = row
+    data = patient.to_dict(include_images=include_images)
+    summary = summary.to_dict() if summary else {}
+    data.update({
+        'image_count': summary.get('scan_count', 0),
+        'processed_count': summary.get('processed_count', 0),
+        'first_check_date': summary.get('first_check_date'),
+        'latest_check_date': summary.get('latest_check_date'),
+        'first_volumes': summary.get('first_volumes'),
+        'latest_volumes': summary.get('latest_volumes'),
+        'gm_tiv_trend': summary.get('gm_tiv_trend'),
+        'last_activity': summary.get('last_activity'),
+    })
+    return data
+
+
+def list_patient_summaries(user_id, limit, cursor=None, include_images=False):
+    """按患者ID键集分页获取患者摘要
+
+    每个患者只读取一行patient_summary，得到图像数量、检查日期和首次/最近一次处理的体积结果；
+    include_images为True时再用一条IN查询批量加载本页患者的图像列表。
+    返回 (患者列表, 下一页游标)，没有下一页时游标为None。
+    """
+    query = (
+        _summary_query(include_images)
+        .where(Patient.user_id == int(user_id), Patient.deleted_at.is_(None))
+        .order_by(Patient.id)
+        .limit(limit + 1)
+    )
+    if cursor is not None:
+        query = query.where(Patient.id > cursor)
+
+    rows = db.session.execute(query).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    patients = [_summary_dict(row, include_images) for row in rows]
+    next_cursor = rows[-1][0].id if has_more and rows else None
+    return patients, next_cursor
+
+
+def encode_search_cursor(rank, patient_id):
+    """搜索结果的键集游标：(相关度, 患者ID)"""
+    raw = json.dumps([rank, patient_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_search_cursor(cursor):
+    """解析搜索游标，格式错误时抛出ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        rank, patient_id = json.loads(raw)
+        return float(rank), int(patient_id)
+    except Exception:
+        raise ValueError(f"无效的搜索游标: {cursor}")
+
+
+def build_fts_query(q):
+    """把用户输入转换为FTS5查询：每个词作为带引号的前缀词，多个词之间为AND"""
+    terms = []
+    for token in q.split():
+        token = token.replace('"', '""')
+        terms.append(f'"{token}"*')
+    return ' '.join(terms)
+
+
+def _search_fts(user_id, q, limit, cursor):
+    """FTS5检索，按bm25相关度（越小越相关）和患者ID排序"""
+    params = {'match': build_fts_query(q), 'user_id': int(user_id), 'limit': limit + 1}
+    after = ''
+    if cursor is not None:
+        params['rank'], params['after_id'] = cursor
+        after = "WHERE rank > :rank OR (rank = :rank AND id > :after_id) "
+    # patient_id列权重更高，编号精确命中时排在姓名命中之前
+    sql = text(
+        "SELECT id, rank FROM ("
+        "SELECT patient.id AS id, bm25(patient_fts, 1.0, 4.0) AS rank "
+        "FROM patient_fts JOIN patient ON patient.id = patient_fts.rowid "
+        "WHERE patient_fts MATCH :match AND patient.user_id = :user_id AND patient.deleted_at IS NULL"
+        ") AS hits " + after +
+        "ORDER BY rank, id LIMIT :limit"
+    )
+    return [(row.id, row.rank) for row in db.session.execute(sql, params)]
+
+
+def _search_like(user_id, q, limit, cursor):
+    """不支持FTS5时的回退：按姓名或编号前缀匹配，按患者ID排序"""
+    query = select(Patient.id).where(Patient.user_id == int(user_id), Patient.deleted_at.is_(None))
+    for token in q.split():
+        pattern = token.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        query = query.where(or_(Patient.name.like(pattern, escape='\\'),
+                                Patient.patient_id.like(pattern, escape='\\')))
+    if cursor is not None:
+        query = query.where(Patient.id > cursor[1])
+    query = query.order_by(Patient.id).limit(limit + 1)
+    return [(patient_id, 0.0) for patient_id in db.session.execute(query).scalars()]
+
+
+def search_patients(user_id, q, limit, cursor=None):
+    """搜索患者姓名和编号（前缀匹配、相关度排序、键集分页）
+
+    cursor为decode_search_cursor的结果。返回 (患者摘要列表, 下一页游标)。
+    """
+    try:
+        hits = _search_fts(user_id, q, limit, cursor)
+    except OperationalError as e:
+        # 没有FTS5索引（非SQLite或SQLite不支持FTS5）
+        db.session.rollback()
+        logger.debug(f"FTS5检索不可用，使用LIKE查询: {str(e)}")
+        hits = _search_like(user_id, q, limit, cursor)
+
+    has_more = len(hits) > limit
+    hits = hits[:limit]
+    if not hits:
+        return [], None
+
+    ids = [patient_id for patient_id, _ in hits]
+    rows = db.session.execute(_summary_query().where(Patient.id.in_(ids))).all()
+    by_id = {row[0].id: row for row in rows}
+
+    patients = []
+    for patient_id, rank in hits:
+        row = by_id.get(patient_id)
+        if row is None:
+            continue
+        data = _summary_dict(row)
+        data['rank'] = rank
+        patients.append(data)
+
+    next_cursor = encode_search_cursor(*hits[-1][::-1]) if has_more else None
+    return patients, next_cursor
+
+
+def list_patient_images(patient_id, user_id):
+    """获取属于指定用户的患者的全部图像，按检查日期倒序；患者不存在时返回None"""
+    if not identity_cache.user_owns_patient(user_id, patient_id):
+        return None
+    return (Image.query
+            .filter_by(patient_id=patient_id)
+            .order_by(Image.check_date.desc(), Image.id.desc())
+            .all())
@@ -0,0 +1,130 @@
+import os
+import base64
+from io import BytesIO
+import numpy as np
+import nibabel as nib
+import pydicom
+from PIL import Image as PILImage
+from app.services import storage
+from app.services.cache_service import cache, cache_key
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 预览类型 -> 任务目录中的候选文件，按顺序使用第一个存在的文件
+TASK_PREVIEW_FILES = {
+    'gm': ('p1input.nii',),   # 灰质
+    'wm': ('p2input.nii',),   # 白质
+    'csf': ('p3input.nii',),  # 脑脊液
+    'original': ('p0input.nii', 'input.nii', 'wminput.nii'),  # 原始图像
+}
+
+# 报告叠加图中各组织的颜色（RGB，0-1）和最大不透明度
+OVERLAY_COLORS = (('gm', (1.0, 0.35, 0.2)), ('wm', (0.25, 0.6, 1.0)), ('csf', (1.0, 0.85, 0.2)))
+OVERLAY_ALPHA = 0.45
+
+PREVIEW_TIMEOUT = 3600
+
+
+def configure(timeout):
+    global PREVIEW_TIMEOUT
+    PREVIEW_TIMEOUT = timeout
+
+
+def find_task_file(task_id, image_type):
+    """任务目录中对应类型的预览源文件，不存在时返回None"""
+    mri_dir = storage.task_file(task_id, 'mri')
+    for filename in TASK_PREVIEW_FILES[image_type]:
+        path = os.path.join(mri_dir, filename)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def _middle_slice(path):
+    """读取图像的中间层；NIfTI只读取该层而不是整个体数据"""
+    if path.lower().endswith('.dcm'):
+        data = pydicom.dcmread(path).pixel_array
+        return data[:, :, data.shape[2] // 2] if data.ndim == 3 else data
+    img = nib.load(path)
+    if len(img.shape) == 3:
+        return np.asarray(img.dataobj[:, :, img.shape[2] // 2], dtype=np.float64)
+    return img.get_fdata()
+
+
+def _normalize(data):
+    """线性归一化到0-1，常数图像返回全0"""
+    data = np.asarray(data, dtype=np.float64)
+    low, high = data.min(), data.max()
+    if high > low:
+        return (data - low) / (high - low)
+    return np.zeros_like(data)
+
+
+def _encode_png(image):
+    buffered = BytesIO()
+    image.save(buffered, format='PNG')
+    return buffered.getvalue()
+
+
+def _file_key(path):
+    stat = os.stat(path)
+    return path, stat.st_mtime_ns, stat.st_size
+
+
+def get_slice(path, tags=None):
+    """图像中间层（float32），键包含文件修改时间和大小；预览图和报告叠加图共用，每个文件只解码一次"""
+    key = 'slice:' + cache_key(*_file_key(path))
+    return cache.get_or_set(key, lambda: np.asarray(_middle_slice(path), dtype=np.float32),
+                            timeout=PREVIEW_TIMEOUT, tags=tags)
+
+
+def render_preview(path, tags=None):
+    """把图像中间层归一化到0-255并编码为base64 PNG"""
+    data = _normalize(get_slice(path, tags)) * 255
+    return base64.b64encode(_encode_png(PILImage.fromarray(data.astype(np.uint8)))).decode('ascii')
+
+
+def get_preview(path, tags=None):
+    """获取预览图，键包含文件修改时间和大小，文件被替换或标签版本变化后自动失效
+
+    多个请求同时打开同一检查时只解码一次。
+    """
+    key = 'preview:' + cache_key(*_file_key(path))
+    return cache.get_or_set(key, lambda: render_preview(path, tags), timeout=PREVIEW_TIMEOUT, tags=tags)
+
+
+def overlay_sources(task_id):
+    """任务的叠加图源文件 {类型: 路径}，不存在的类型不包含在内"""
+    sources = {}
+    for image_type in TASK_PREVIEW_FILES:
+        path = find_task_file(task_id, image_type)
+        if path:
+            sources[image_type] = path
+    return sources
+
+
+def render_overlay(sources, tags=None):
+    """原始图像中间层上按概率叠加灰质/白质/脑脊液的颜色，返回PNG字节"""
+    masks = [(get_slice(sources[tissue], tags), color) for tissue, color in OVERLAY_COLORS if tissue in sources]
+    if 'original' in sources:
+        base = _normalize(get_slice(sources['original'], tags))
+    elif masks:
+        base = np.zeros(masks[0][0].shape)
+    else:
+        raise ValueError('没有可用于叠加图的文件')
+
+    rgb = np.repeat(base[..., np.newaxis], 3, axis=2)
+    for mask, color in masks:
+        if mask.shape != base.shape:
+            logger.warning(f"分割图与原始图像尺寸不一致，跳过: {mask.shape} != {base.shape}")
+            continue
+        weight = OVERLAY_ALPHA * np.clip(np.nan_to_num(mask), 0, 1)[..., np.newaxis]
+        rgb = rgb * (1 - weight) + np.asarray(color) * weight
+    return _encode_png(PILImage.fromarray((rgb * 255).astype(np.uint8), 'RGB'))
+
+
+def get_overlay(sources, tags=None):
+    """获取叠加图（PNG字节），任一源文件变化或标签版本变化后失效"""
+    key = 'overlay:' + cache_key(sorted((image_type, *_file_key(path)) for image_type, path in sources.items()))
+    return cache.get_or_set(key, lambda: render_overlay(sources, tags), timeout=PREVIEW_TIMEOUT, tags=tags)
@@ -0,0 +1,170 @@
+import os
+import uuid
+import shutil
+import logging
+import traceback
+from datetime import datetime, timedelta
+from threading import Thread
+from sqlalchemy import select, delete, update, func, or_
+from models import db, Patient, Image, DicomInstance, PatientSummary, Measurement
+from app.services import storage, db_engine, normative_service, cache_service, report_service
+from app.services.task_queue import task_queue
+from app.services.dicomweb_service import frame_cache
+
+logger = logging.getLogger(__name__)
+
+
+def mark_deleted(patient):
+    """逻辑删除患者：之后的查询和权限检查都会忽略该患者，数据由后台任务清理"""
+    patient.deleted_at = datetime.utcnow()
+
+
+def image_deleted(image_id):
+    """图像记录已被清理或所属患者已逻辑删除"""
+    row = db.session.execute(
+        select(Patient.deleted_at).join(Image, Image.patient_id == Patient.id).where(Image.id == image_id)
+    ).first()
+    return row is None or row.deleted_at is not None
+
+
+def claim_purge(patient_id, timeout):
+    """认领已逻辑删除患者的清理任务，返回是否认领成功
+
+    用条件UPDATE在数据库层面认领：只有未被认领、或认领超过timeout秒未刷新
+    （原进程已退出）的患者才能认领，多个进程同时启动时每个患者只由一个进程清理。
+    """
+    now = datetime.utcnow()
+    result = db.session.execute(
+        update(Patient)
+        .where(Patient.id == patient_id, Patient.deleted_at.isnot(None),
+               or_(Patient.purge_started_at.is_(None),
+                   Patient.purge_started_at < now - timedelta(seconds=timeout)))
+        .values(purge_started_at=now)
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def _purge_image_files(image_id, filename, processed_filename, task_id):
+    """删除图像的原始文件和整个任务目录，文件已不存在时跳过"""
+    removed = 0
+    if filename:
+        removed += _remove_file(storage.upload_path(filename))
+    if task_id:
+        task_dir = storage.task_dir(task_id)
+        if os.path.isdir(task_dir):
+            shutil.rmtree(task_dir, ignore_errors=True)
+            removed += 1
+    # 旧版本生成的平铺结果文件不在任务目录中
+    if processed_filename and not (task_id and processed_filename.startswith(storage.task_relpath(task_id))):
+        removed += _remove_file(storage.processed_path(processed_filename))
+    return removed
+
+
+def purge_patient(patient_id, job_id=None, batch_size=200):
+    """清理已逻辑删除的患者：按批删除文件和图像记录，最后删除患者记录
+
+    每批先删除文件再用 DELETE ... WHERE id IN 删除数据库记录并提交，
+    中途中断后重新执行会从剩余的图像继续。
+    """
+    total = db.session.execute(
+        select(func.count(Image.id)).where(Image.patient_id == patient_id)
+    ).scalar()
+    patient = db.session.get(Patient, patient_id)
+    deleted_images = removed_files = 0
+    if job_id:
+        task_queue.update_progress(job_id, 0, total_images=total)
+
+    while True:
+        rows = db.session.execute(
+            select(Image.id, Image.filename, Image.processed_filename, Image.task_id)
+            .where(Image.patient_id == patient_id)
+            .order_by(Image.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+
+        for row in rows:
+            removed_files += _purge_image_files(*row)
+
+        ids = [row.id for row in rows]
+        if patient is not None:
+            # 已删除患者的测量值不再参与人群常模
+            normative_service.remove_images(patient, ids)
+        db.session.execute(delete(DicomInstance).where(DicomInstance.image_id.in_(ids)))
+        frame_cache.discard_images(ids)
+        db.session.execute(delete(Measurement).where(Measurement.image_id.in_(ids)))
+        db.session.execute(delete(Image).where(Image.id.in_(ids)))
+        # 刷新认领时间，清理大患者时不会被其他进程视为已退出
+        db.session.execute(update(Patient).where(Patient.id == patient_id).values(purge_started_at=datetime.utcnow()))
+        db.session.commit()
+        # 批量DELETE不经过ORM事件，手动使依赖这些图像的缓存失效
+        cache_service.cache.bump(*(tag for row in rows for tag in cache_service.image_tags(row.id, task_id=row.task_id)))
+
+        deleted_images += len(ids)
+        if job_id:
+            progress = int(deleted_images * 100 / total) if total else 100
+            task_queue.update_progress(job_id, min(progress, 99),
+                                       deleted_images=deleted_images, removed_files=removed_files)
+        logger.info(f"患者 {patient_id} 已清理 {deleted_images}/{total} 条图像记录")
+
+    db.session.execute(delete(PatientSummary).where(PatientSummary.patient_id == patient_id))
+    db.session.execute(delete(Patient).where(Patient.id == patient_id))
+    db.session.commit()
+    cache_service.clear_patient_cache(patient_id)
+    report_service.remove_reports(patient_id)
+    return {'patient_id': patient_id, 'deleted_images': deleted_images, 'removed_files': removed_files}
+
+
+def _run_purge(app, patient_id, job_id):
+    try:
+        with db_engine.worker_session(app, db):
+            results = purge_patient(patient_id, job_id, app.config['PURGE_BATCH_SIZE'])
+        task_queue.complete_task(job_id, results)
+        logger.info(f"患者 {patient_id} 数据清理完成: {results}")
+    except Exception as e:
+        logger.error(f"患者 {patient_id} 数据清理失败: {str(e)}")
+        logger.error(f"错误详情: {traceback.format_exc()}")
+        task_queue.fail_task(job_id, str(e))
+
+
+def start_purge(app, patient_id, user_id=None):
+    """认领并启动后台清理任务，返回任务ID，可通过任务队列查询进度
+
+    需在应用上下文中调用；患者已由其他进程清理时返回None。
+    """
+    if not claim_purge(patient_id, app.config['PURGE_CLAIM_TIMEOUT']):
+        logger.info(f"患者 {patient_id} 的清理任务已由其他进程认领，跳过")
+        return None
+    job_id = f"purge-{uuid.uuid4()}"
+    task_queue.add_task(job_id, {'type': 'purge', 'patient_id': patient_id, 'user_id': user_id})
+    thread = Thread(target=_run_purge, args=(app, patient_id, job_id))
+    thread.daemon = True
+    thread.start()
+    return job_id
+
+
+def resume_pending_purges(app):
+    """启动时继续清理上次未完成的已删除患者，返回本进程认领的任务数
+
+    由服务器启动入口显式调用，导入应用时不执行；多个进程同时调用时靠claim_purge保证同一患者只由一个进程清理。
+    """
+    started = 0
+    with app.app_context():
+        patient_ids = db.session.execute(
+            select(Patient.id).where(Patient.deleted_at.isnot(None))
+        ).scalars().all()
+        for patient_id in patient_ids:
+            if start_purge(app, patient_id):
+                logger.info(f"继续清理已删除的患者: {patient_id}")
+                started += 1
+    return started
@@ -0,0 +1,644 @@
+import os
+import re
+import json
+import time
+import glob
+import uuid
+import zipfile
+import logging
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from io import BytesIO
+from datetime import datetime
+from threading import Thread, Lock
+from sqlalchemy import select
+from reportlab.lib.pagesizes import letter
+from reportlab.lib import colors
+from reportlab.lib.utils import ImageReader
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image as ReportImage
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.graphics.shapes import Drawing, String
+from reportlab.graphics.charts.lineplots import LinePlot
+from reportlab.graphics.charts.legends import Legend
+from reportlab.graphics.widgets.markers import makeMarker
+from models import db, Patient, Image
+from app.services import storage, db_engine, normative_service, trend_service, cache_serializer, preview_service
+from app.services import measurement_service
+from app.services.export_service import ChunkSink
+from app.services.cache_service import cache, patient_tag, task_tag
+from app.services.task_queue import task_queue
+
+logger = logging.getLogger(__name__)
+
+# 报告版式版本：修改render_report的输出时递增，已生成的旧版式报告随之重新生成
+TEMPLATE_VERSION = 2
+
+VOLUME_ROWS = (('gm_volume', '灰质 (GM)'), ('wm_volume', '白质 (WM)'),
+               ('csf_volume', '脑脊液 (CSF)'), ('tiv_volume', '颅内总体积 (TIV)'))
+TREND_ROWS = (('gm_volume', '灰质 (GM)', 1000, 'ml'),
+              ('wm_volume', '白质 (WM)', 1000, 'ml'),
+              ('tiv_volume', '颅内总体积 (TIV)', 1000, 'ml'),
+              ('gm_tiv_ratio', 'GM/TIV', 1, ''))
+# 趋势图中的曲线：(指标, 图例, 颜色)，与叠加图的组织颜色一致
+CHART_SERIES = (('gm_volume', 'GM', colors.Color(1.0, 0.35, 0.2)),
+                ('wm_volume', 'WM', colors.Color(0.25, 0.6, 1.0)),
+                ('csf_volume', 'CSF', colors.Color(0.85, 0.7, 0.1)))
+TILE_WIDTH = 200  # 叠加图在报告中的宽度（点）
+
+# (患者ID, 报告版本) -> 正在生成的任务ID，同一进程内同一版本的并发请求共用一个任务；
+# 跨进程由共享缓存上的锁保证同一版本只由一个进程渲染
+_jobs = {}
+_jobs_lock = Lock()
+
+# 批量任务的清单保存在 REPORTS_FOLDER/bulk/<任务ID>.json，任何进程都能据此下载压缩包；
+# 清单过期前其中列出的报告版本不会被collect_garbage删除
+BULK_TTL = 24 * 3600
+_BULK_JOB_ID = re.compile(r'^report-bulk-[0-9a-f-]{36}$')
+
+# reportlab排版是纯Python计算，放到进程池中执行，不占用请求线程和GIL
+RENDER_WORKERS = 2
+_pool = None
+_pool_lock = Lock()
+
+# 缓存中没有的叠加图在线程池中并发渲染（NIfTI解压和numpy运算大部分时间不持有GIL）
+TILE_WORKERS = 4
+
+# 报告任务结束后在任务队列中保留的时间（秒），之后查询任务状态返回404
+JOB_TTL = 3600
+# 跨进程渲染锁的过期时间（秒），持锁进程异常退出后其他进程可重新渲染
+RENDER_LOCK_TIMEOUT = 300
+
+
+def configure(workers, tile_workers=None, job_ttl=None, lock_timeout=None, bulk_ttl=None):
+    global RENDER_WORKERS, TILE_WORKERS, JOB_TTL, RENDER_LOCK_TIMEOUT, BULK_TTL
+    RENDER_WORKERS = max(1, int(workers))
+    if tile_workers is not None:
+        TILE_WORKERS = max(1, int(tile_workers))
+    if job_ttl is not None:
+        JOB_TTL = job_ttl
+    if lock_timeout is not None:
+        RENDER_LOCK_TIMEOUT = lock_timeout
+    if bulk_ttl is not None:
+        BULK_TTL = bulk_ttl
+
+
+def render_pool():
+    """报告渲染进程池（首次使用时创建，工作进程异常退出后重建）
+
+    使用fork启动：spawn会在每个子进程中重新执行主模块（python app.py时即整个应用初始化）。
+    不支持fork的平台（Windows）退回到线程池。
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None or getattr(_pool, '_broken', False):
+            if 'fork' in multiprocessing.get_all_start_methods():
+                _pool = ProcessPoolExecutor(max_workers=RENDER_WORKERS,
+                                            mp_context=multiprocessing.get_context('fork'))
+            else:
+                _pool = ThreadPoolExecutor(max_workers=RENDER_WORKERS, thread_name_prefix='report')
+        return _pool
+
+
+def start_pool():
+    """预先创建工作进程，在应用启动后台线程之前fork，子进程不会继承被其他线程持有的锁
+
+    只在服务器入口（python app.py）调用，导入应用时不创建；
+    其他部署方式（gunicorn等）在首次生成报告时创建。
+    """
+    render_pool().submit(os.getpid).result()
+
+
+def percentile_text(normative, metric):
+    """报告中的人群百分位文字，参照组样本不足时显示横线"""
+    score = normative.get('metrics', {}).get(metric)
+    if not score or score['percentile'] is None:
+        return "-"
+    if score['z_score'] is None:
+        return f"{score['percentile']:.0f}"
+    return f"{score['percentile']:.0f} (z={score['z_score']:+.2f})"
+
+
+def collect_report_data(patient_id, min_count):
+    """读取报告需要的全部数据，返回只含基本类型的字典，渲染时不再访问数据库
+
+    只保留报告中实际显示的内容（百分位保存为显示文字），
+    因此数据摘要只在报告内容变化时才改变。
+    """
+    patient = db.session.get(Patient, patient_id)
+    images = Image.query.filter_by(patient_id=patient_id).order_by(Image.id).all()
+    image_rows = []
+    for image in images:
+        row = {'original_filename': image.original_filename, 'processed': False}
+        # 体积取自测量值表，image表上的旧体积列不再读取
+        volumes = measurement_service.get_volumes(image.id) if image.processed else None
+        if volumes and volumes['gm_volume'] is not None:
+            normative = normative_service.score_image(image.id, min_count) or {}
+            row.update({
+                'processed': True,
+                'task_id': image.task_id,
+                'volumes': {metric: volumes[metric] for metric, _ in VOLUME_ROWS},
+                'percentiles': {metric: percentile_text(normative, metric) for metric, _ in VOLUME_ROWS},
+                'check_date': image.check_date.strftime("%Y-%m-%d") if image.check_date else None,
+                'processing_completed': image.processing_completed.strftime("%Y-%m-%d %H:%M")
+                if image.processing_completed else None,
+            })
+        image_rows.append(row)
+
+    trends = trend_service.get_trends(patient_id)
+    return {
+        'patient': {'name': patient.name, 'patient_id': patient.patient_id,
+                    'age': patient.age, 'gender': patient.gender},
+        'images': image_rows,
+        'trends': {
+            'scan_count': trends['scan_count'],
+            'points': [{key: point[key] for key in ('years', *(metric for metric, _, _ in CHART_SERIES))}
+                       for point in trends['points']],
+            'metrics': {metric: {key: fit[key] for key in ('slope_per_year', 'annual_percent_change', 'r2')}
+                        for metric, fit in trends['metrics'].items()},
+        },
+    }
+
+
+def get_report_data(patient_id, min_count):
+    """报告数据，患者或其图像写入后随患者标签失效；人群百分位的变化在缓存过期后反映"""
+    return cache.get_or_set(f"report_data:{patient_id}", lambda: collect_report_data(patient_id, min_count),
+                            tags=[patient_tag(patient_id)])
+
+
+def report_version(data):
+    """报告版本：数据摘要 + 版式版本"""
+    return f"{cache_serializer.digest(data).hex()[:16]}-t{TEMPLATE_VERSION}"
+
+
+def report_path(patient_id, version, reports_root=None):
+    return os.path.join(storage.report_dir(patient_id, reports_root), f"report_{version}.pdf")
+
+
+def tile_sources(data):
+    """报告中各已处理检查的叠加图源文件 {任务ID: {类型: 路径}}，需要在应用上下文中调用"""
+    sources = {}
+    for image in data['images']:
+        task_id = image.get('task_id')
+        if not task_id or task_id in sources:
+            continue
+        try:
+            files = preview_service.overlay_sources(task_id)
+        except ValueError as e:
+            logger.warning(f"任务 {task_id} 的叠加图源文件无效: {str(e)}")
+            continue
+        if files:
+            sources[task_id] = files
+    return sources
+
+
+def render_tiles(sources):
+    """获取叠加图 {任务ID: PNG字节}：预览或之前的报告已解码过的层直接从缓存读取，其余并发渲染
+
+    单个检查渲染失败时报告中省略该图，不影响整份报告。
+    """
+    tiles = {}
+    if not sources:
+        return tiles
+    with ThreadPoolExecutor(max_workers=min(TILE_WORKERS, len(sources)), thread_name_prefix='report-tile') as executor:
+        futures = {executor.submit(preview_service.get_overlay, files, [task_tag(task_id)]): task_id
+                   for task_id, files in sources.items()}
+        for future in as_completed(futures):
+            task_id = futures[future]
+            try:
+                tiles[task_id] = future.result()
+            except Exception as e:
+                logger.warning(f"任务 {task_id} 的叠加图渲染失败: {str(e)}")
+    return tiles
+
+
+def _tile_image(png):
+    """PNG叠加图转为固定宽度、保持比例的报告图片"""
+    width, height = ImageReader(BytesIO(png)).getSize()
+    return ReportImage(BytesIO(png), width=TILE_WIDTH, height=TILE_WIDTH * height / width)
+
+
+def _trend_chart(points):
+    """各组织体积随时间变化的折线图，横轴为距首次检查的年数，不足两个点的曲线不画"""
+    lines, names = [], []
+    for metric, label, color in CHART_SERIES:
+        line = [(point['years'], point[metric] / 1000) for point in points if point.get(metric) is not None]
+        if len(line) >= 2:
+            lines.append(line)
+            names.append((color, label))
+    if not lines:
+        return None
+
+    drawing = Drawing(450, 220)
+    plot = LinePlot()
+    plot.x, plot.y, plot.width, plot.height = 50, 40, 320, 160
+    plot.data = lines
+    for index, (color, _) in enumerate(names):
+        plot.lines[index].strokeColor = color
+        plot.lines[index].symbol = makeMarker('FilledCircle', size=4, fillColor=color)
+    plot.xValueAxis.labelTextFormat = '%.1f'
+    plot.yValueAxis.labelTextFormat = '%.0f'
+    drawing.add(plot)
+
+    legend = Legend()
+    legend.x, legend.y = plot.x + plot.width + 15, plot.y + plot.height
+    legend.colorNamePairs = names
+    legend.fontSize = 8
+    drawing.add(legend)
+    drawing.add(String(plot.x + plot.width / 2, 10, '距首次检查的年数', fontSize=8, textAnchor='middle'))
+    drawing.add(String(10, plot.y + plot.height + 10, 'ml', fontSize=8))
+    return drawing
+
+
+def _table_style(header_column=False):
+    style = [
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT' if header_column else 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
+        ('FONTSIZE', (0, 0), (-1, -1), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black),
+    ]
+    if header_column:
+        style += [('BACKGROUND', (0, 0), (0, -1), colors.lightgrey),
+                  ('BACKGROUND', (1, 0), (-1, -1), colors.white)]
+    else:
+        style += [('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey)]
+    return TableStyle(style)
+
+
+def render_report(data, path, tiles=None):
+    """根据collect_report_data的结果和叠加图（render_tiles）生成PDF；先写临时文件再原子替换"""
+    tiles = tiles or {}
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    doc = SimpleDocTemplate(tmp_path, pagesize=letter)
+    styles = getSampleStyleSheet()
+    elements = [Paragraph("患者脑组织分析报告", styles['Heading1']), Spacer(1, 20)]
+
+    patient = data['patient']
+    patient_table = Table([
+        ["姓名", patient['name']],
+        ["患者ID", patient['patient_id']],
+        ["年龄", str(patient['age'])],
+        ["性别", patient['gender']],
+        ["报告生成日期", datetime.now().strftime("%Y-%m-%d %H:%M")]
+    ], colWidths=[100, 300])
+    patient_table.setStyle(_table_style(header_column=True))
+    elements += [Paragraph("患者基本信息", styles['Heading2']), Spacer(1, 10), patient_table, Spacer(1, 20)]
+
+    if data['images']:
+        elements += [Paragraph("脑组织体积分析结果", styles['Heading2']), Spacer(1, 10)]
+        for idx, image in enumerate(data['images']):
+            if not image['processed']:
+                elements += [Paragraph(f"图像 {idx+1}: {image['original_filename']} - 未处理", styles['Heading3']),
+                             Spacer(1, 10)]
+                continue
+            elements += [Paragraph(f"图像 {idx+1}: {image['original_filename']}", styles['Heading3']), Spacer(1, 5)]
+
+            volumes = image['volumes']
+            tiv = volumes['tiv_volume']
+            volume_data = [["组织类型", "体积 (ml)", "占比 (%)", "人群百分位"]]
+            for metric, label in VOLUME_ROWS:
+                value = volumes[metric]
+                percent = "100.0" if metric == 'tiv_volume' else f"{(value / tiv * 100) if tiv else 0:.1f}"
+                volume_data.append([label, f"{value/1000:.2f}", percent, image['percentiles'][metric]])
+            volume_table = Table(volume_data, colWidths=[150, 100, 100, 120])
+            volume_table.setStyle(_table_style())
+            elements += [volume_table, Spacer(1, 15)]
+            if image.get('task_id') in tiles:
+                elements += [_tile_image(tiles[image['task_id']]),
+                             Paragraph("中间层叠加图：灰质（红）、白质（蓝）、脑脊液（黄）", styles['Normal']),
+                             Spacer(1, 10)]
+
+            elements += [Paragraph(f"扫描日期: {image['check_date'] or '未知'}", styles['Normal']), Spacer(1, 5)]
+            elements += [Paragraph(f"处理完成时间: {image['processing_completed'] or '未知'}", styles['Normal']),
+                         Spacer(1, 20)]
+    else:
+        elements.append(Paragraph("无图像数据", styles['Normal']))
+
+    # 多次检查时添加纵向趋势
+    trends = data['trends']
+    trend_rows = [["指标", "年变化量", "年化变化率 (%)", "R²"]]
+    for metric, label, scale, unit in TREND_ROWS:
+        fit = trends['metrics'].get(metric)
+        if fit and fit['slope_per_year'] is not None:
+            trend_rows.append([
+                label,
+                f"{fit['slope_per_year']/scale:+.3f} {unit}".strip(),
+                f"{fit['annual_percent_change']:+.2f}" if fit['annual_percent_change'] is not None else "-",
+                f"{fit['r2']:.2f}"
+            ])
+    if len(trend_rows) > 1:
+        trend_table = Table(trend_rows, colWidths=[150, 100, 100, 60])
+        trend_table.setStyle(_table_style())
+        elements += [Paragraph("纵向变化趋势", styles['Heading2']), Spacer(1, 10), trend_table,
+                     Paragraph(f"基于 {trends['scan_count']} 次已处理检查的线性回归", styles['Normal'])]
+        chart = _trend_chart(trends['points'])
+        if chart is not None:
+            elements += [Spacer(1, 10), chart]
+
+    elements += [Spacer(1, 30), Paragraph("本报告由脑MRI分析系统自动生成", styles['Normal'])]
+    try:
+        doc.build(elements)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path
+
+
+def collect_garbage(patient_id, keep=None, reports_root=None, respect_pins=True):
+    """删除患者的旧版本报告（以及旧版按时间戳命名的平铺报告文件），返回删除数量
+
+    未过期的批量清单中列出的版本保留到清单过期；respect_pins=False时一并删除。
+    """
+    paths = glob.glob(os.path.join(storage.report_dir(patient_id, reports_root), 'report_*.pdf'))
+    paths += glob.glob(os.path.join(storage.reports_folder(reports_root), f"patient_report_{int(patient_id)}_*.pdf"))
+    pinned = pinned_reports(reports_root) if respect_pins and paths else set()
+    removed = 0
+    for path in paths:
+        if keep and os.path.abspath(path) == os.path.abspath(keep):
+            continue
+        if os.path.abspath(path) in pinned:
+            continue
+        try:
+            os.remove(path)
+            removed += 1
+        except OSError as e:
+            logger.warning(f"删除旧报告失败: {path}, {str(e)}")
+    return removed
+
+
+def remove_reports(patient_id, reports_root=None):
+    """删除患者的全部报告（清理已删除患者时调用），包括批量清单中列出的版本"""
+    removed = collect_garbage(patient_id, reports_root=reports_root, respect_pins=False)
+    try:
+        os.rmdir(storage.report_dir(patient_id, reports_root))
+    except OSError:
+        pass
+    return removed
+
+
+def _render_lock(patient_id, version, path):
+    """获取同一版本报告的跨进程渲染锁；其他进程正在渲染时等待，报告出现后返回False"""
+    name = f"report:{patient_id}:{version}"
+    while not cache.acquire_lock(name, RENDER_LOCK_TIMEOUT):
+        if os.path.exists(path):
+            return False
+        time.sleep(0.2)
+    return True
+
+
+def _run_render(job_id, key, data, path, reports_root, sources):
+    patient_id, version = key
+    locked = False
+    try:
+        locked = _render_lock(patient_id, version, path)
+        # 等待锁期间其他进程可能已生成同一版本
+        if not os.path.exists(path):
+            tiles = render_tiles(sources)
+            render_pool().submit(render_report, data, path, tiles).result()
+        removed = collect_garbage(patient_id, keep=path, reports_root=reports_root)
+        task_queue.complete_task(job_id, {'patient_id': patient_id, 'version': version,
+                                          'size': os.path.getsize(path), 'removed_versions': removed})
+        logger.info(f"患者 {patient_id} 报告已生成: {path}")
+    except Exception as e:
+        logger.error(f"患者 {patient_id} 报告生成失败: {str(e)}")
+        logger.error(f"错误详情: {traceback.format_exc()}")
+        task_queue.fail_task(job_id, str(e))
+    finally:
+        if locked:
+            cache.release_lock(f"report:{patient_id}:{version}")
+        with _jobs_lock:
+            _jobs.pop(key, None)
+
+
+def request_report(patient_id, user_id, min_count, reports_root=None):
+    """获取当前版本的报告
+
+    已生成时返回 (路径, 版本, None)；否则启动（或复用）后台生成任务，返回 (None, 版本, 任务ID)。
+    """
+    reports_root = storage.reports_folder(reports_root)
+    data = get_report_data(patient_id, min_count)
+    version = report_version(data)
+    path = report_path(patient_id, version, reports_root)
+    if os.path.exists(path):
+        return path, version, None
+
+    key = (patient_id, version)
+    with _jobs_lock:
+        job_id = _jobs.get(key)
+        if job_id is not None:
+            return None, version, job_id
+        job_id = f"report-{uuid.uuid4()}"
+        task_queue.add_task(job_id, {'type': 'report', 'patient_id': patient_id, 'user_id': user_id,
+                                     'version': version}, ttl=JOB_TTL)
+        _jobs[key] = job_id
+    thread = Thread(target=_run_render, args=(job_id, key, data, path, reports_root, tile_sources(data)))
+    thread.daemon = True
+    thread.start()
+    return None, version, job_id
+
+
+def select_patients(user_id, patient_ids=None, month=None, processed_only=False):
+    """批量报告的患者：可按患者ID、检查月份（该月有检查）和是否有已处理图像筛选"""
+    query = (
+        select(Patient.id)
+        .where(Patient.user_id == int(user_id), Patient.deleted_at.is_(None))
+        .order_by(Patient.id)
+    )
+    if patient_ids:
+        query = query.where(Patient.id.in_([int(pid) for pid in patient_ids]))
+    if month is not None or processed_only:
+        images = select(Image.id).where(Image.patient_id == Patient.id)
+        if month is not None:
+            start = datetime(month.year, month.month, 1)
+            end = datetime(month.year + month.month // 12, month.month % 12 + 1, 1)
+            images = images.where(Image.check_date >= start, Image.check_date < end)
+        if processed_only:
+            images = images.where(Image.processed.is_(True))
+        query = query.where(images.exists())
+    return db.session.execute(query).scalars().all()
+
+
+def _archive_name(patient_id, data):
+    code = ''.join(c if c.isalnum() or c in '-_' else '_' for c in str(data['patient']['patient_id']))
+    return f"{patient_id}_{code}.pdf"
+
+
+def build_reports(patient_ids, min_count, job_id=None, reports_root=None):
+    """确保每名患者当前版本的报告存在：已生成的直接复用，其余提交到进程池并行渲染
+
+    返回 ([(压缩包内文件名, 报告路径)], 统计)；渲染失败的患者不列入文件列表，只记录在统计的failed中。
+    """
+    reports_root = storage.reports_folder(reports_root)
+    entries, pending, sources, futures = [], [], {}, {}
+    stats = {'total': len(patient_ids), 'cached': 0, 'rendered': 0, 'failed': []}
+    for patient_id in patient_ids:
+        data = get_report_data(patient_id, min_count)
+        path = report_path(patient_id, report_version(data), reports_root)
+        entries.append((patient_id, _archive_name(patient_id, data), path))
+        if os.path.exists(path):
+            stats['cached'] += 1
+        else:
+            patient_sources = tile_sources(data)
+            sources.update(patient_sources)
+            pending.append((patient_id, data, path, patient_sources))
+
+    # 所有待生成报告的叠加图一起并发渲染，再按患者分配
+    tiles = render_tiles(sources)
+    pool = render_pool()
+    for patient_id, data, path, patient_sources in pending:
+        patient_tiles = {task_id: tiles[task_id] for task_id in patient_sources if task_id in tiles}
+        futures[pool.submit(render_report, data, path, patient_tiles)] = patient_id
+
+    done = stats['cached']
+    for future in as_completed(futures):
+        patient_id = futures[future]
+        try:
+            path = future.result()
+            collect_garbage(patient_id, keep=path, reports_root=reports_root)
+            stats['rendered'] += 1
+        except Exception as e:
+            logger.error(f"患者 {patient_id} 报告生成失败: {str(e)}")
+            stats['failed'].append(patient_id)
+        done += 1
+        if job_id:
+            task_queue.update_progress(job_id, int(done * 100 / len(patient_ids)) if done < len(patient_ids) else 99,
+                                       done=done, rendered=stats['rendered'], cached=stats['cached'],
+                                       failed=len(stats['failed']))
+    failed = set(stats['failed'])
+    return [(name, path) for patient_id, name, path in entries if patient_id not in failed], stats
+
+
+def _manifest_dir(reports_root=None):
+    return os.path.join(storage.reports_folder(reports_root), 'bulk')
+
+
+def _manifest_path(job_id, reports_root=None):
+    if not _BULK_JOB_ID.match(job_id):
+        raise ValueError(f"无效的批量任务ID: {job_id}")
+    return os.path.join(_manifest_dir(reports_root), f"{job_id}.json")
+
+
+def _write_manifest(job_id, manifest, reports_root=None):
+    """原子写入批量清单，过期时间从本次写入起算"""
+    manifest = dict(manifest, job_id=job_id, expires_at=time.time() + BULK_TTL)
+    path = _manifest_path(job_id, reports_root)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _load_manifest(path):
+    """读取清单，文件不存在、已损坏或已过期时返回None（过期的清单顺便删除）"""
+    try:
+        with open(path, encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('expires_at', 0) <= time.time():
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return None
+    return manifest
+
+
+def bulk_manifest(job_id, reports_root=None):
+    """批量任务的清单：状态、用户、统计，完成后entries为 [(压缩包内文件名, 报告绝对路径)]
+
+    任务不存在或清单已过期时返回None。
+    """
+    try:
+        path = _manifest_path(job_id, reports_root)
+    except ValueError:
+        return None
+    manifest = _load_manifest(path)
+    if manifest is not None and manifest.get('entries') is not None:
+        root = storage.reports_folder(reports_root)
+        manifest['entries'] = [(name, os.path.join(root, relpath)) for name, relpath in manifest['entries']]
+    return manifest
+
+
+def pinned_reports(reports_root=None):
+    """未过期的批量清单中列出的报告（绝对路径），GC时保留"""
+    root = storage.reports_folder(reports_root)
+    pinned = set()
+    for path in glob.glob(os.path.join(_manifest_dir(reports_root), 'report-bulk-*.json')):
+        manifest = _load_manifest(path)
+        for _, relpath in (manifest or {}).get('entries') or ():
+            pinned.add(os.path.abspath(os.path.join(root, relpath)))
+    return pinned
+
+
+def _run_bulk(app, job_id, user_id, patient_ids, min_count):
+    try:
+        with db_engine.worker_session(app, db):
+            reports_root = storage.reports_folder()
+            entries, stats = build_reports(patient_ids, min_count, job_id, reports_root)
+            # 写入清单后列出的版本即被固定，之后的GC不会删除
+            _write_manifest(job_id, {
+                'user_id': user_id, 'status': 'completed', 'stats': stats,
+                'entries': [(name, os.path.relpath(path, reports_root)) for name, path in entries],
+            }, reports_root)
+        task_queue.complete_task(job_id, stats)
+    except Exception as e:
+        logger.error(f"批量报告 {job_id} 生成失败: {str(e)}")
+        logger.error(f"错误详情: {traceback.format_exc()}")
+        try:
+            with app.app_context():
+                _write_manifest(job_id, {'user_id': user_id, 'status': 'failed', 'error': str(e)})
+        except Exception as write_error:
+            logger.error(f"写入批量报告清单失败: {str(write_error)}")
+        task_queue.fail_task(job_id, str(e))
+
+
+def start_bulk(app, user_id, patient_ids, min_count):
+    """启动批量报告任务，返回任务ID；完成后按bulk_manifest中的清单用stream_archive下载压缩包"""
+    job_id = f"report-bulk-{uuid.uuid4()}"
+    _write_manifest(job_id, {'user_id': user_id, 'status': 'processing', 'patient_count': len(patient_ids)})
+    task_queue.add_task(job_id, {'type': 'report', 'bulk': True, 'user_id': user_id,
+                                 'patient_count': len(patient_ids)}, ttl=BULK_TTL)
+    thread = Thread(target=_run_bulk, args=(app, job_id, user_id, list(patient_ids), min_count))
+    thread.daemon = True
+    thread.start()
+    return job_id
+
+
+def missing_reports(entries):
+    """清单中已不存在的报告（例如患者已被删除），返回压缩包内文件名列表"""
+    return [name for name, path in entries if not os.path.exists(path)]
+
+
+def stream_archive(entries, chunk_size=256 * 1024):
+    """逐个读取PDF写入ZIP并随写随发，不在内存或磁盘上生成完整压缩包
+
+    PDF本身已压缩，使用ZIP_STORED；输出对象不可seek，ZipFile改用数据描述符记录大小和CRC。
+    清单中的报告不会被GC删除；仍然缺失时抛出FileNotFoundError中断下载，
+    不生成少了患者的压缩包（调用方应先用missing_reports检查）。
+    """
+    sink = ChunkSink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for name, path in entries:
+            try:
+                source = open(path, 'rb')
+            except FileNotFoundError:
+                logger.error(f"批量报告中的文件已不存在，中断打包: {path}")
+                raise
+            with source, archive.open(name, 'w') as target:
+                while True:
+                    data = source.read(chunk_size)
+                    if not data:
+                        break
+                    target.write(data)
+                    chunk = sink.drain()
+                    if chunk:
+                        yield chunk
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+    yield sink.drain()
@@ -0,0 +1,112 @@
+import os
+import shutil
+import uuid
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 处理成功后需要保留的最终产物（相对任务目录），其余中间文件随临时目录一起删除
+REQUIRED_ARTIFACTS = [
+    'results.json',
+    'segmented.nii.gz',
+    'mri/p1input.nii',
+    'mri/p2input.nii',
+    'mri/p3input.nii',
+]
+OPTIONAL_ARTIFACTS = [
+    'input.nii',
+    'preview.png',
+    'mri/p0input.nii',
+    'chunks',
+    'cat12_process.m',
+    'matlab.log',
+]
+
+
+class ScratchSpaceError(Exception):
+    """临时目录所在磁盘空间不足"""
+    pass
+
+
+def scratch_path(root, task_id):
+    """获取任务在临时根目录下的工作目录路径"""
+    return os.path.join(root, f"mri-task-{task_id}")
+
+
+def check_scratch_capacity(root, required_bytes, min_free_bytes=0):
+    """检查临时根目录剩余空间，不足时抛出ScratchSpaceError"""
+    os.makedirs(root, exist_ok=True)
+    free = shutil.disk_usage(root).free
+    needed = required_bytes + min_free_bytes
+    if free < needed:
+        raise ScratchSpaceError(
+            f"临时目录空间不足: {root} 剩余 {free / 1024 / 1024:.1f}MB，需要 {needed / 1024 / 1024:.1f}MB"
+        )
+    return free
+
+
+class TaskScratch:
+    """任务临时工作目录：在临时根目录中处理，成功后只把最终产物原子地移动到结果目录，失败时清理"""
+
+    def __init__(self, task_id, root, required_bytes=0, min_free_bytes=0):
+        self.task_id = task_id
+        self.root = root
+        self.required_bytes = required_bytes
+        self.min_free_bytes = min_free_bytes
+        self.path = scratch_path(root, task_id)
+        self.promoted = False
+
+    def __enter__(self):
+        check_scratch_capacity(self.root, self.required_bytes, self.min_free_bytes)
+        os.makedirs(self.path, exist_ok=True)
+        logger.info(f"任务 {self.task_id} 使用临时目录: {self.path}")
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is not None:
+            logger.warning(f"任务 {self.task_id} 处理失败，清理临时目录: {self.path}")
+        self.cleanup()
+        return False
+
+    def cleanup(self):
+        """删除临时目录"""
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def promote(self, dest_dir, required=REQUIRED_ARTIFACTS, optional=OPTIONAL_ARTIFACTS):
+        """将声明的最终产物移动到结果目录
+
+        产物先移动到与结果目录同一文件系统的暂存目录，全部就绪后再通过一次rename
+        原子地发布，读取方不会看到只有部分文件的结果目录。
+        """
+        missing = [rel for rel in required if not os.path.exists(os.path.join(self.path, rel))]
+        if missing:
+            raise FileNotFoundError(f"缺少最终产物: {', '.join(missing)}")
+
+        parent = os.path.dirname(dest_dir.rstrip(os.sep))
+        os.makedirs(parent, exist_ok=True)
+        staging = f"{dest_dir.rstrip(os.sep)}.incoming-{uuid.uuid4().hex}"
+        os.makedirs(staging)
+        try:
+            for rel in list(required) + list(optional):
+                src = os.path.join(self.path, rel)
+                if not os.path.exists(src):
+                    continue
+                dst = os.path.join(staging, rel)
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                shutil.move(src, dst)
+
+            # 结果目录已存在（例如重新处理）时先整体替换再删除旧目录
+            retired = None
+            if os.path.exists(dest_dir):
+                retired = f"{dest_dir.rstrip(os.sep)}.retired-{uuid.uuid4().hex}"
+                os.rename(dest_dir, retired)
+            os.rename(staging, dest_dir)
+            if retired:
+                shutil.rmtree(retired, ignore_errors=True)
+        except Exception:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+
+        self.promoted = True
+        logger.info(f"任务 {self.task_id} 的最终产物已发布到: {dest_dir}")
+        return dest_dir
@@ -0,0 +1,127 @@
+import os
+import uuid
+import hashlib
+import logging
+from flask import current_app
+from werkzeug.utils import secure_filename, safe_join
+
+logger = logging.getLogger(__name__)
+
+# 双层哈希前缀分片：ab/cd/<key>，每层最多256个子目录
+SHARD_DEPTH = 2
+SHARD_WIDTH = 2
+
+# 需要完整保留的多段扩展名
+COMPOUND_EXTENSIONS = ('.nii.gz',)
+
+
+def shard_prefix(key):
+    """根据键的哈希生成分片前缀，例如 'ab/cd'"""
+    digest = hashlib.sha1(str(key).encode('utf-8')).hexdigest()
+    return '/'.join(digest[i * SHARD_WIDTH:(i + 1) * SHARD_WIDTH] for i in range(SHARD_DEPTH))
+
+
+def is_sharded(relpath):
+    """判断存储的相对路径是否已经是分片布局"""
+    return relpath.count('/') >= SHARD_DEPTH
+
+
+def file_extension(filename):
+    """获取文件扩展名，保留.nii.gz这类多段扩展名"""
+    lower = filename.lower()
+    for ext in COMPOUND_EXTENSIONS:
+        if lower.endswith(ext):
+            return ext
+    return os.path.splitext(lower)[1]
+
+
+def make_upload_name(original_filename, key=None):
+    """为上传文件生成分片相对路径，例如 'ab/cd/<uuid>.dcm'；指定key时结果是确定的"""
+    key = key or uuid.uuid4().hex
+    ext = file_extension(secure_filename(original_filename) or '')
+    return f"{shard_prefix(key)}/{key}{ext}"
+
+
+def _upload_root(upload_root=None):
+    return upload_root or current_app.config['UPLOAD_FOLDER']
+
+
+def _processed_root(processed_root=None):
+    return processed_root or current_app.config['PROCESSED_FOLDER']
+
+
+def reports_folder(reports_root=None):
+    """报告根目录，默认为REPORTS_FOLDER"""
+    return reports_root or current_app.config['REPORTS_FOLDER']
+
+
+def upload_path(filename, upload_root=None):
+    """获取上传文件的绝对路径，兼容旧的平铺文件名"""
+    path = safe_join(_upload_root(upload_root), filename)
+    if path is None:
+        raise ValueError(f"非法的文件路径: {filename}")
+    return path
+
+
+def new_upload_path(original_filename, upload_root=None):
+    """为新上传的文件分配存储位置，返回 (相对路径, 绝对路径)"""
+    name = make_upload_name(original_filename)
+    path = upload_path(name, upload_root)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return name, path
+
+
+def temp_upload_path(filename, upload_root=None):
+    """获取临时文件路径（用于预览等一次性处理）"""
+    temp_dir = os.path.join(_upload_root(upload_root), 'tmp')
+    os.makedirs(temp_dir, exist_ok=True)
+    return os.path.join(temp_dir, f"{uuid.uuid4().hex}_{secure_filename(filename)}")
+
+
+def task_relpath(task_id):
+    """任务目录相对于结果根目录的分片路径，例如 'ab/cd/<task_id>'"""
+    return f"{shard_prefix(task_id)}/{task_id}"
+
+
+def legacy_task_dir(task_id, processed_root=None):
+    """旧布局下平铺的任务目录"""
+    return safe_join(_processed_root(processed_root), task_id)
+
+
+def task_dir(task_id, processed_root=None):
+    """获取任务结果目录；尚未迁移的旧任务目录仍然可以找到"""
+    root = _processed_root(processed_root)
+    path = safe_join(root, task_relpath(task_id))
+    if path is None:
+        raise ValueError(f"非法的任务ID: {task_id}")
+    if not os.path.exists(path):
+        legacy = legacy_task_dir(task_id, root)
+        if legacy and os.path.isdir(legacy):
+            return legacy
+    return path
+
+
+def task_file(task_id, *parts, processed_root=None):
+    """获取任务目录中的文件路径，拒绝跳出任务目录的路径"""
+    path = safe_join(task_dir(task_id, processed_root), *parts)
+    if path is None:
+        raise ValueError(f"非法的文件路径: {'/'.join(parts)}")
+    return path
+
+
+def processed_filename(task_id, name):
+    """生成保存到Image.processed_filename的相对路径"""
+    return f"{task_relpath(task_id)}/{name}"
+
+
+def processed_path(filename, processed_root=None):
+    """获取处理结果文件的绝对路径"""
+    path = safe_join(_processed_root(processed_root), filename)
+    if path is None:
+        raise ValueError(f"非法的文件路径: {filename}")
+    return path
+
+
+def report_dir(patient_id, reports_root=None):
+    """患者报告目录：REPORTS_FOLDER/<患者ID>"""
+    return os.path.join(reports_folder(reports_root), str(int(patient_id)))
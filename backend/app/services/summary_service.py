@@ -0,0 +1,209 @@
+from datetime import datetime
+from sqlalchemy import select, update, case
+from models import db, Image, PatientSummary
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 趋势回归的时间轴：距离该日期的年数，避免累加量过大损失精度
+TREND_EPOCH = datetime(2000, 1, 1)
+SECONDS_PER_YEAR = 365.2425 * 24 * 3600
+
+VOLUME_FIELDS = ('gm_volume', 'wm_volume', 'csf_volume', 'tiv_volume')
+
+
+def trend_point(check_date, gm_volume, tiv_volume):
+    """图像对GM/TIV趋势的贡献点 (x=年, y=GM/TIV)，数据不完整时返回None"""
+    if not check_date or not gm_volume or not tiv_volume:
+        return None
+    x = (check_date - TREND_EPOCH).total_seconds() / SECONDS_PER_YEAR
+    return x, gm_volume / tiv_volume
+
+
+def snapshot(image):
+    """记录图像变更前与汇总相关的字段，传给image_updated"""
+    data = {'id': image.id, 'processed': bool(image.processed), 'check_date': image.check_date}
+    for field in VOLUME_FIELDS:
+        data[field] = getattr(image, field)
+    return data
+
+
+def compute_summary(rows):
+    """根据患者全部图像计算汇总列
+
+    rows为 (id, check_date, processed, gm, wm, csf, tiv) 序列，供重建和迁移回填使用。
+    """
+    values = {
+        'scan_count': 0, 'processed_count': 0,
+        'first_check_date': None, 'latest_check_date': None,
+        'trend_n': 0, 'trend_sum_x': 0.0, 'trend_sum_y': 0.0, 'trend_sum_xx': 0.0, 'trend_sum_xy': 0.0,
+    }
+    first = latest = None
+    for row in rows:
+        image_id, check_date, processed, gm, wm, csf, tiv = row
+        values['scan_count'] += 1
+        if check_date:
+            if values['first_check_date'] is None or check_date < values['first_check_date']:
+                values['first_check_date'] = check_date
+            if values['latest_check_date'] is None or check_date > values['latest_check_date']:
+                values['latest_check_date'] = check_date
+        if not processed:
+            continue
+        values['processed_count'] += 1
+        key = (check_date or datetime.min, image_id)
+        if first is None or key < first[0]:
+            first = (key, row)
+        if latest is None or key > latest[0]:
+            latest = (key, row)
+        point = trend_point(check_date, gm, tiv)
+        if point:
+            x, y = point
+            values['trend_n'] += 1
+            values['trend_sum_x'] += x
+            values['trend_sum_y'] += y
+            values['trend_sum_xx'] += x * x
+            values['trend_sum_xy'] += x * y
+
+    for prefix, extreme in (('first', first), ('latest', latest)):
+        row = extreme[1] if extreme else (None,) * 7
+        values[f'{prefix}_image_id'] = row[0]
+        values[f'{prefix}_processed_date'] = row[1]
+        for field, value in zip(VOLUME_FIELDS, row[3:]):
+            values[f'{prefix}_{field}'] = value
+    return values
+
+
+def _image_rows(patient_id, exclude_id=None):
+    query = select(Image.id, Image.check_date, Image.processed, Image.gm_volume,
+                   Image.wm_volume, Image.csf_volume, Image.tiv_volume).where(Image.patient_id == patient_id)
+    if exclude_id is not None:
+        query = query.where(Image.id != exclude_id)
+    return db.session.execute(query).all()
+
+
+def rebuild(patient_id, exclude_id=None):
+    """从图像表完整重建患者汇总（回填和异常修复使用）"""
+    values = compute_summary(_image_rows(patient_id, exclude_id))
+    summary = db.session.get(PatientSummary, patient_id)
+    if summary is None:
+        summary = PatientSummary(patient_id=patient_id)
+        db.session.add(summary)
+    for key, value in values.items():
+        setattr(summary, key, value)
+    summary.results_version = (summary.results_version or 0) + 1
+    summary.last_activity = datetime.utcnow()
+    db.session.flush()
+    return summary
+
+
+def ensure_summary(patient_id):
+    """新建患者时创建空的汇总行"""
+    summary = db.session.get(PatientSummary, patient_id)
+    if summary is None:
+        summary = PatientSummary(patient_id=patient_id, scan_count=0, processed_count=0, trend_n=0,
+                                 trend_sum_x=0.0, trend_sum_y=0.0, trend_sum_xx=0.0, trend_sum_xy=0.0,
+                                 results_version=0, last_activity=datetime.utcnow())
+        db.session.add(summary)
+    return summary
+
+
+def _apply(patient_id, values):
+    """以单条UPDATE原子地应用增量，多个处理线程同时完成时不会丢失更新"""
+    values['last_activity'] = datetime.utcnow()
+    result = db.session.execute(
+        update(PatientSummary)
+        .where(PatientSummary.patient_id == patient_id)
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount
+
+
+def _point_delta(data, sign):
+    """已处理图像对计数和趋势累加量的增量"""
+    S = PatientSummary
+    values = {'processed_count': S.processed_count + sign, 'results_version': S.results_version + 1}
+    point = trend_point(data['check_date'], data['gm_volume'], data['tiv_volume'])
+    if point:
+        x, y = point
+        values.update({
+            'trend_n': S.trend_n + sign,
+            'trend_sum_x': S.trend_sum_x + sign * x,
+            'trend_sum_y': S.trend_sum_y + sign * y,
+            'trend_sum_xx': S.trend_sum_xx + sign * x * x,
+            'trend_sum_xy': S.trend_sum_xy + sign * x * y,
+        })
+    return values
+
+
+def _extreme_delta(data):
+    """新增已处理图像时，按检查日期条件更新首次/最近一次的体积结果"""
+    S = PatientSummary
+    date = data['check_date']
+    is_first = (S.first_processed_date.is_(None)) | (S.first_processed_date > date)
+    is_latest = (S.latest_processed_date.is_(None)) | (S.latest_processed_date <= date)
+    values = {
+        'first_image_id': case((is_first, data['id']), else_=S.first_image_id),
+        'first_processed_date': case((is_first, date), else_=S.first_processed_date),
+        'latest_image_id': case((is_latest, data['id']), else_=S.latest_image_id),
+        'latest_processed_date': case((is_latest, date), else_=S.latest_processed_date),
+    }
+    for field in VOLUME_FIELDS:
+        values[f'first_{field}'] = case((is_first, data[field]), else_=getattr(S, f'first_{field}'))
+        values[f'latest_{field}'] = case((is_latest, data[field]), else_=getattr(S, f'latest_{field}'))
+    return values
+
+
+def _refresh_extremes(patient_id, exclude_id):
+    """首次/最近的已处理图像不再是已处理状态后，从该患者的图像重新取两端的值"""
+    values = compute_summary(_image_rows(patient_id, exclude_id))
+    keep = {key: value for key, value in values.items()
+            if key.startswith(('first_', 'latest_')) and not key.endswith('_check_date')}
+    _apply(patient_id, keep)
+
+
+def image_added(image):
+    """上传新图像后调用（在同一事务中，由调用方提交）"""
+    S = PatientSummary
+    date = image.check_date
+    values = {'scan_count': S.scan_count + 1}
+    if date:
+        values['first_check_date'] = case(
+            ((S.first_check_date.is_(None)) | (S.first_check_date > date), date), else_=S.first_check_date)
+        values['latest_check_date'] = case(
+            ((S.latest_check_date.is_(None)) | (S.latest_check_date < date), date), else_=S.latest_check_date)
+    data = snapshot(image)
+    if data['processed']:
+        values.update(_point_delta(data, 1))
+        values.update(_extreme_delta(data))
+    if not _apply(image.patient_id, values):
+        db.session.flush()
+        rebuild(image.patient_id)
+
+
+def image_updated(image, before):
+    """图像处理完成或处理状态被重置后调用，before为变更前的snapshot"""
+    summary = db.session.get(PatientSummary, image.patient_id)
+    if summary is None:
+        db.session.flush()
+        rebuild(image.patient_id)
+        return
+
+    after = snapshot(image)
+    if before['processed']:
+        _apply(image.patient_id, _point_delta(before, -1))
+        if image.id in (summary.first_image_id, summary.latest_image_id):
+            db.session.flush()
+            _refresh_extremes(image.patient_id, image.id)
+    if after['processed']:
+        values = _point_delta(after, 1)
+        values.update(_extreme_delta(after))
+        _apply(image.patient_id, values)
+    elif not before['processed']:
+        _apply(image.patient_id, {})
+    db.session.expire(summary)
+
+
+def get_summary(patient_id):
+    summary = db.session.get(PatientSummary, patient_id)
+    return summary.to_dict() if summary else None
@@ -0,0 +1,195 @@
+import os
+import json
+import time
+import threading
+import logging
+from contextlib import contextmanager
+import psutil
+
+logger = logging.getLogger(__name__)
+
+METRICS_FILENAME = 'metrics.json'
+
+# RSS和子进程CPU时间的采样间隔（秒）；子进程最后一次采样之后的CPU时间不计入
+SAMPLE_INTERVAL = 0.1
+
+STAGE_FIELDS = ('wall_seconds', 'cpu_seconds', 'child_cpu_seconds')
+PEAK_FIELDS = ('peak_rss', 'child_peak_rss')
+
+
+class _Sampler:
+    """阶段执行期间在后台线程中采样本进程和被监视的子进程树的RSS及CPU时间"""
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.process = psutil.Process()
+        self.roots = []
+        self.child_cpu = {}  # pid -> 最后一次采样到的CPU时间，已退出的后代进程保留最后的值
+        self.peak_rss = 0
+        self.child_peak_rss = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stage-sampler', daemon=True)
+
+    def start(self):
+        self.sample()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+    def watch(self, pid):
+        try:
+            with self._lock:
+                self.roots.append(psutil.Process(pid))
+        except psutil.NoSuchProcess:
+            return
+        self.sample()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def _tree(self):
+        processes = []
+        for root in self.roots:
+            processes.append(root)
+            try:
+                processes.extend(root.children(recursive=True))
+            except psutil.Error:
+                pass
+        return processes
+
+    def sample(self):
+        with self._lock:
+            child_rss = 0
+            for proc in self._tree():
+                try:
+                    with proc.oneshot():
+                        rss = proc.memory_info().rss
+                        cpu = proc.cpu_times()
+                except psutil.Error:
+                    continue
+                child_rss += rss
+                self.child_cpu[proc.pid] = cpu.user + cpu.system
+            try:
+                own_rss = self.process.memory_info().rss
+            except psutil.Error:
+                own_rss = 0
+            self.child_peak_rss = max(self.child_peak_rss, child_rss)
+            self.peak_rss = max(self.peak_rss, own_rss + child_rss)
+
+    @property
+    def child_cpu_seconds(self):
+        with self._lock:
+            return sum(self.child_cpu.values())
+
+
+class StageTimer:
+    """按阶段记录一个任务的墙钟时间、CPU时间和峰值内存
+
+    cpu_seconds为执行阶段的线程CPU时间加上子进程树的CPU时间；peak_rss为本进程与子进程树RSS之和的采样峰值
+    （本进程RSS包含同时处理的其他请求）。同名阶段多次进入时累加时间、取内存峰值。
+    """
+
+    def __init__(self, on_update=None, interval=SAMPLE_INTERVAL):
+        self.on_update = on_update
+        self.interval = interval
+        self.stages = {}
+        self._sampler = None
+
+    @contextmanager
+    def stage(self, name):
+        sampler = _Sampler(self.interval)
+        sampler.start()
+        self._sampler = sampler
+        wall_start, cpu_start = time.perf_counter(), time.thread_time()
+        try:
+            yield self
+        finally:
+            wall, cpu = time.perf_counter() - wall_start, time.thread_time() - cpu_start
+            sampler.stop()
+            self._sampler = None
+            child_cpu = sampler.child_cpu_seconds
+            record = self.stages.setdefault(name, dict.fromkeys(STAGE_FIELDS + PEAK_FIELDS, 0) | {'calls': 0})
+            record['calls'] += 1
+            record['wall_seconds'] += wall
+            record['cpu_seconds'] += cpu + child_cpu
+            record['child_cpu_seconds'] += child_cpu
+            record['peak_rss'] = max(record['peak_rss'], sampler.peak_rss)
+            record['child_peak_rss'] = max(record['child_peak_rss'], sampler.child_peak_rss)
+            if self.on_update:
+                try:
+                    self.on_update(self.to_dict())
+                except Exception as e:
+                    logger.warning(f"更新阶段耗时失败: {str(e)}")
+
+    def watch(self, pid):
+        """把子进程（及其后代）计入当前阶段，在启动子进程后立即调用"""
+        if self._sampler is not None:
+            self._sampler.watch(pid)
+
+    def to_dict(self):
+        stages = [{'stage': name, **{key: round(value, 3) if isinstance(value, float) else value
+                                     for key, value in record.items()}}
+                  for name, record in self.stages.items()]
+        total = {key: round(sum(record[key] for record in self.stages.values()), 3) for key in STAGE_FIELDS}
+        total.update({key: max((record[key] for record in self.stages.values()), default=0) for key in PEAK_FIELDS})
+        return {'stages': stages, 'total': total}
+
+
+def write(task_dir, timer, **extra):
+    """把阶段耗时保存到任务目录的metrics.json，服务重启后仍可查询"""
+    data = {**timer.to_dict(), **extra, 'host': {'cpu_count': os.cpu_count(),
+                                                 'memory_total': psutil.virtual_memory().total}}
+    path = os.path.join(task_dir, METRICS_FILENAME)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load(task_dir):
+    """读取任务目录中的metrics.json，不存在时返回None"""
+    try:
+        with open(os.path.join(task_dir, METRICS_FILENAME), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"读取任务耗时失败: {task_dir}, {str(e)}")
+        return None
+
+
+# 本进程完成的任务按阶段汇总，供 /api/metrics 查看时间主要花在哪里
+_totals = {}
+_totals_lock = threading.Lock()
+
+
+def record(timer):
+    with _totals_lock:
+        for name, stage in timer.stages.items():
+            total = _totals.setdefault(name, {'tasks': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0,
+                                              'max_wall_seconds': 0.0, 'max_peak_rss': 0})
+            total['tasks'] += 1
+            total['wall_seconds'] += stage['wall_seconds']
+            total['cpu_seconds'] += stage['cpu_seconds']
+            total['max_wall_seconds'] = max(total['max_wall_seconds'], stage['wall_seconds'])
+            total['max_peak_rss'] = max(total['max_peak_rss'], stage['peak_rss'])
+
+
+def stats():
+    """各阶段的任务数、平均/最长耗时、平均CPU时间和最大内存峰值"""
+    with _totals_lock:
+        return {
+            name: {
+                'tasks': total['tasks'],
+                'mean_wall_seconds': round(total['wall_seconds'] / total['tasks'], 3),
+                'max_wall_seconds': round(total['max_wall_seconds'], 3),
+                'mean_cpu_seconds': round(total['cpu_seconds'] / total['tasks'], 3),
+                'max_peak_rss': total['max_peak_rss'],
+            } for name, total in _totals.items()
+        }
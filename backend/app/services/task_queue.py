@@ -0,0 +1,86 @@
+import time
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class TaskQueue:
+    """后台任务的状态、进度和结果（图像处理任务和患者数据清理任务共用）
+
+    添加任务时可指定ttl：任务完成或失败ttl秒后从队列中移除，
+    用于报告这类按请求频繁创建的任务，避免队列无限增长。
+    """
+
+    def __init__(self):
+        self.tasks = {}
+        self.progress = {}
+        self.results = {}  # 添加结果存储
+        self.details = {}  # 任务附加信息，例如清理任务已删除的数量
+        self._ttls = {}  # 任务ID -> 结束后保留的秒数
+        self._expires = {}  # 已结束任务ID -> 移除时间
+        self._lock = threading.Lock()
+
+    def add_task(self, task_id, details=None, ttl=None):
+        with self._lock:
+            self._prune(time.monotonic())
+            self.tasks[task_id] = 'processing'
+            self.progress[task_id] = 0
+            self.results[task_id] = None
+            self.details[task_id] = dict(details or {})
+            if ttl is not None:
+                self._ttls[task_id] = ttl
+
+    def _finish(self, task_id):
+        ttl = self._ttls.pop(task_id, None)
+        if ttl is not None:
+            self._expires[task_id] = time.monotonic() + ttl
+
+    def _prune(self, now):
+        """移除已过保留时间的任务，调用方持有锁"""
+        for task_id in [task_id for task_id, deadline in self._expires.items() if deadline <= now]:
+            del self._expires[task_id]
+            for store in (self.tasks, self.progress, self.results, self.details):
+                store.pop(task_id, None)
+
+    def update_progress(self, task_id, progress, **details):
+        with self._lock:
+            if task_id in self.progress:
+                self.progress[task_id] = progress
+                self.details[task_id].update(details)
+
+    def update_details(self, task_id, **details):
+        with self._lock:
+            if task_id in self.details:
+                self.details[task_id].update(details)
+
+    def get_progress(self, task_id):
+        return self.progress.get(task_id, 0)
+
+    def get_details(self, task_id):
+        with self._lock:
+            return dict(self.details.get(task_id, {}))
+
+    def complete_task(self, task_id, results=None):
+        with self._lock:
+            if task_id in self.tasks:
+                self.tasks[task_id] = 'completed'
+                self.progress[task_id] = 100
+                self.results[task_id] = results
+                self._finish(task_id)
+        print(f"任务 {task_id} 已完成，结果: {results}")
+
+    def fail_task(self, task_id, error=None):
+        with self._lock:
+            if task_id in self.tasks:
+                self.tasks[task_id] = 'failed'
+                if error:
+                    self.details[task_id]['error'] = error
+                self._finish(task_id)
+
+    def get_results(self, task_id):
+        return self.results.get(task_id)
+
+
+# 创建任务队列实例
+task_queue = TaskQueue()
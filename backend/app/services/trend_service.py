@@ -0,0 +1,139 @@
+from sqlalchemy import select
+from models import db, Image, Measurement, PatientSummary
+from app.services.ttl_cache import TTLCache
+from app.services.measurement_service import DEFAULT_REGION
+from app.services.summary_service import SECONDS_PER_YEAR
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 计算纵向趋势的指标
+TREND_METRICS = ('gm_volume', 'wm_volume', 'csf_volume', 'tiv_volume', 'gm_tiv_ratio')
+
+# (患者ID, 结果版本号) -> 趋势结果；版本号随已处理图像变化递增，旧版本的条目自然淘汰
+trend_cache = TTLCache(maxsize=2000, ttl=3600)
+
+
+def configure(maxsize, ttl):
+    """按配置调整缓存容量和过期时间"""
+    trend_cache.maxsize = maxsize
+    trend_cache.ttl = ttl
+
+
+def _load_series(patient_id, region=DEFAULT_REGION):
+    """读取患者已处理图像的测量值，返回按检查日期排序的 (图像ID, 检查日期, {指标: 数组})"""
+    rows = db.session.execute(
+        select(Image.id, Image.check_date, Measurement.metric, Measurement.value)
+        .join(Measurement, Measurement.image_id == Image.id)
+        .where(Image.patient_id == patient_id, Image.processed.is_(True),
+               Measurement.region == region, Measurement.metric.in_(TREND_METRICS))
+        .order_by(Image.check_date, Image.id)
+    ).all()
+
+    image_ids, dates, index = [], [], {}
+    for image_id, check_date, _, _ in rows:
+        if image_id not in index:
+            index[image_id] = len(image_ids)
+            image_ids.append(image_id)
+            dates.append(check_date)
+    values = {metric: np.full(len(image_ids), np.nan) for metric in TREND_METRICS}
+    for image_id, _, metric, value in rows:
+        values[metric][index[image_id]] = value
+    return image_ids, dates, values
+
+
+def _fit(x, y):
+    """最小二乘线性拟合 y = a + b*x，返回斜率、截距、R²和残差标准差"""
+    mask = ~np.isnan(y)
+    x, y = x[mask], y[mask]
+    n = len(y)
+    result = {'n': int(n), 'slope_per_year': None, 'intercept': None, 'r2': None,
+              'residual_std': None, 'annual_percent_change': None}
+    if n < 2 or np.ptp(x) == 0:
+        return result
+
+    design = np.column_stack([np.ones(n), x])
+    (intercept, slope), _, _, _ = np.linalg.lstsq(design, y, rcond=None)
+    residuals = y - design @ np.array([intercept, slope])
+    total = np.sum((y - y.mean()) ** 2)
+    result.update({
+        'slope_per_year': float(slope),
+        'intercept': float(intercept),
+        'r2': float(1 - np.sum(residuals ** 2) / total) if total > 0 else 1.0,
+        'residual_std': float(np.sqrt(np.sum(residuals ** 2) / (n - 2))) if n > 2 else 0.0,
+        # 相对首次检查时拟合值的年化变化百分比
+        'annual_percent_change': float(slope / intercept * 100) if intercept else None,
+    })
+    return result
+
+
+def _optional(array):
+    return [None if np.isnan(value) else float(value) for value in array]
+
+
+def compute_trends(image_ids, dates, values):
+    """根据时间序列计算每个指标的回归趋势和相邻两次检查之间的变化"""
+    if not image_ids:
+        return {'scan_count': 0, 'points': [], 'metrics': {}, 'intervals': []}
+
+    # 时间轴为距首次检查的年数，截距即首次检查时的拟合值
+    seconds = np.array([(date - dates[0]).total_seconds() for date in dates])
+    years = seconds / SECONDS_PER_YEAR
+    metrics = {metric: _fit(years, series) for metric, series in values.items()}
+
+    intervals = []
+    if len(image_ids) > 1:
+        dt = np.diff(years)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            deltas = {metric: np.diff(series) for metric, series in values.items()}
+            rates = {metric: np.where(dt > 0, delta / dt, np.nan) for metric, delta in deltas.items()}
+            percents = {metric: deltas[metric] / series[:-1] * 100 for metric, series in values.items()}
+        delta_lists = {metric: _optional(array) for metric, array in deltas.items()}
+        rate_lists = {metric: _optional(array) for metric, array in rates.items()}
+        percent_lists = {metric: _optional(array) for metric, array in percents.items()}
+        for i in range(len(image_ids) - 1):
+            intervals.append({
+                'from_image_id': image_ids[i],
+                'to_image_id': image_ids[i + 1],
+                'years': float(dt[i]),
+                'changes': {
+                    metric: {
+                        'delta': delta_lists[metric][i],
+                        'rate_per_year': rate_lists[metric][i],
+                        'percent': percent_lists[metric][i],
+                    } for metric in values
+                },
+            })
+
+    value_lists = {metric: _optional(series) for metric, series in values.items()}
+    points = [{
+        'image_id': image_id,
+        'check_date': date.isoformat() if date else None,
+        'years': float(years[i]),
+        **{metric: value_lists[metric][i] for metric in values},
+    } for i, (image_id, date) in enumerate(zip(image_ids, dates))]
+
+    return {'scan_count': len(image_ids), 'points': points, 'metrics': metrics, 'intervals': intervals}
+
+
+def _results_version(patient_id):
+    return db.session.execute(
+        select(PatientSummary.results_version).where(PatientSummary.patient_id == patient_id)
+    ).scalar()
+
+
+def get_trends(patient_id):
+    """获取患者的纵向趋势，结果版本号未变化时直接返回缓存"""
+    version = _results_version(patient_id) or 0
+    key = (patient_id, version)
+    trends = trend_cache.get(key, None)
+    if trends is None:
+        trends = compute_trends(*_load_series(patient_id))
+        trends['results_version'] = version
+        trend_cache.set(key, trends)
+    return trends
+
+
+def stats():
+    return trend_cache.stats()
@@ -0,0 +1,228 @@
+import os
+import re
+import json
+import zlib
+import shutil
+import uuid
+import logging
+from functools import lru_cache
+import numpy as np
+import nibabel as nib
+
+logger = logging.getLogger(__name__)
+
+# 分块存储配置（类zarr布局）
+STORE_DIRNAME = 'chunks'
+META_FILENAME = 'meta.json'
+DEFAULT_CHUNK_SIZE = 64
+DEFAULT_COMPRESSION_LEVEL = 6
+STORE_FORMAT_VERSION = 1
+
+# 体数据名称与任务目录中源文件的对应关系，按顺序查找第一个存在的文件
+TASK_VOLUME_SOURCES = {
+    'original': ['mri/p0input.nii', 'input.nii'],
+    'gm': ['mri/p1input.nii'],
+    'wm': ['mri/p2input.nii'],
+    'csf': ['mri/p3input.nii'],
+}
+
+CHUNK_KEY_PATTERN = re.compile(r'^\d+\.\d+\.\d+$')
+
+
+def _normalize_dtype(data):
+    """统一数据类型：浮点统一为float32，整数保持原类型"""
+    if np.issubdtype(data.dtype, np.floating):
+        return data.astype('<f4', copy=False)
+    if data.dtype == np.bool_:
+        return data.astype('u1')
+    return data.astype(data.dtype.newbyteorder('<'), copy=False)
+
+
+def downsample(data):
+    """按2x2x2块求均值进行降采样，奇数边长时复制边缘"""
+    pad = [(0, dim % 2) for dim in data.shape]
+    if any(p[1] for p in pad):
+        data = np.pad(data, pad, mode='edge')
+    x, y, z = data.shape
+    blocks = data.reshape(x // 2, 2, y // 2, 2, z // 2, 2).astype(np.float32)
+    reduced = blocks.mean(axis=(1, 3, 5))
+    if np.issubdtype(data.dtype, np.integer):
+        reduced = np.rint(reduced)
+    return reduced.astype(data.dtype)
+
+
+def build_pyramid(data, chunk_size=DEFAULT_CHUNK_SIZE):
+    """构建多分辨率金字塔，直到最粗层级可以放入单个块"""
+    levels = [data]
+    while max(levels[-1].shape) > chunk_size:
+        levels.append(downsample(levels[-1]))
+    return levels
+
+
+def _chunk_grid(shape, chunk_size):
+    return [int(np.ceil(dim / chunk_size)) for dim in shape]
+
+
+def write_volume_store(nifti_path, store_dir, chunk_size=DEFAULT_CHUNK_SIZE,
+                       compression_level=DEFAULT_COMPRESSION_LEVEL):
+    """将NIfTI体数据写入分块、压缩、多分辨率的存储目录"""
+    img = nib.load(nifti_path)
+    data = np.asanyarray(img.dataobj)
+    # 4D数据只取第一个体积
+    while data.ndim > 3:
+        data = data[..., 0]
+    while data.ndim < 3:
+        data = data[..., np.newaxis]
+    data = _normalize_dtype(np.ascontiguousarray(data))
+
+    # 先写入临时目录，完成后再整体替换，避免读取到写了一半的存储
+    tmp_dir = f"{store_dir}.tmp-{uuid.uuid4().hex}"
+    os.makedirs(tmp_dir)
+    try:
+        levels_meta = []
+        fill_value = 0
+        for level, level_data in enumerate(build_pyramid(data, chunk_size)):
+            level_dir = os.path.join(tmp_dir, str(level))
+            os.makedirs(level_dir)
+            grid = _chunk_grid(level_data.shape, chunk_size)
+            written = 0
+            for i in range(grid[0]):
+                for j in range(grid[1]):
+                    for k in range(grid[2]):
+                        chunk = level_data[i * chunk_size:(i + 1) * chunk_size,
+                                           j * chunk_size:(j + 1) * chunk_size,
+                                           k * chunk_size:(k + 1) * chunk_size]
+                        # 全部为填充值的块不落盘，由客户端按fill_value补齐
+                        if not chunk.any():
+                            continue
+                        # 边缘块补齐到完整块大小，保证每个块的形状一致
+                        if chunk.shape != (chunk_size,) * 3:
+                            padded = np.full((chunk_size,) * 3, fill_value, dtype=chunk.dtype)
+                            padded[:chunk.shape[0], :chunk.shape[1], :chunk.shape[2]] = chunk
+                            chunk = padded
+                        payload = zlib.compress(np.ascontiguousarray(chunk).tobytes(), compression_level)
+                        with open(os.path.join(level_dir, f"{i}.{j}.{k}"), 'wb') as f:
+                            f.write(payload)
+                        written += 1
+            levels_meta.append({
+                'level': level,
+                'scale': 2 ** level,
+                'shape': list(level_data.shape),
+                'chunk_grid': grid,
+                'chunks_written': written,
+            })
+
+        meta = {
+            'format': STORE_FORMAT_VERSION,
+            'shape': list(data.shape),
+            'chunks': [chunk_size] * 3,
+            'dtype': data.dtype.str,
+            'order': 'C',
+            'compressor': {'id': 'zlib', 'level': compression_level},
+            'fill_value': fill_value,
+            'min': float(data.min()) if data.size else 0.0,
+            'max': float(data.max()) if data.size else 0.0,
+            'affine': np.asarray(img.affine, dtype=float).tolist(),
+            'zooms': [float(z) for z in img.header.get_zooms()[:3]],
+            'levels': levels_meta,
+        }
+        with open(os.path.join(tmp_dir, META_FILENAME), 'w') as f:
+            json.dump(meta, f)
+
+        if os.path.exists(store_dir):
+            shutil.rmtree(store_dir)
+        os.replace(tmp_dir, store_dir)
+        logger.info(f"分块存储已写入: {store_dir}, 层级数: {len(levels_meta)}")
+        return meta
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+
+def write_task_volume_stores(task_dir, chunk_size=DEFAULT_CHUNK_SIZE,
+                             compression_level=DEFAULT_COMPRESSION_LEVEL):
+    """为任务目录中的原始图像和各组织分割结果生成分块存储"""
+    store_root = os.path.join(task_dir, STORE_DIRNAME)
+    os.makedirs(store_root, exist_ok=True)
+    stores = {}
+    for name, candidates in TASK_VOLUME_SOURCES.items():
+        source = next((os.path.join(task_dir, c) for c in candidates
+                       if os.path.exists(os.path.join(task_dir, c))), None)
+        if source is None:
+            logger.warning(f"未找到{name}体数据，跳过分块存储")
+            continue
+        stores[name] = write_volume_store(
+            source,
+            os.path.join(store_root, name),
+            chunk_size=chunk_size,
+            compression_level=compression_level
+        )
+    return stores
+
+
+def get_store_dir(task_dir, volume):
+    """获取体数据存储目录，体数据名称不合法时返回None"""
+    if volume not in TASK_VOLUME_SOURCES:
+        return None
+    return os.path.join(task_dir, STORE_DIRNAME, volume)
+
+
+def read_store_meta(task_dir, volume):
+    """读取体数据存储的元数据，不存在时返回None"""
+    store_dir = get_store_dir(task_dir, volume)
+    if store_dir is None:
+        return None
+    meta_path = os.path.join(store_dir, META_FILENAME)
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, 'r') as f:
+        return json.load(f)
+
+
+def list_task_stores(task_dir):
+    """列出任务已生成的所有体数据存储"""
+    stores = {}
+    for volume in TASK_VOLUME_SOURCES:
+        meta = read_store_meta(task_dir, volume)
+        if meta is not None:
+            stores[volume] = meta
+    return stores
+
+
+def get_chunk_path(task_dir, volume, level, chunk_key):
+    """获取块文件路径，参数不合法或超出范围时返回None"""
+    meta = read_store_meta(task_dir, volume)
+    if meta is None or not CHUNK_KEY_PATTERN.match(chunk_key):
+        return None
+    if level < 0 or level >= len(meta['levels']):
+        return None
+    grid = meta['levels'][level]['chunk_grid']
+    indices = [int(part) for part in chunk_key.split('.')]
+    if any(idx >= dim for idx, dim in zip(indices, grid)):
+        return None
+    return os.path.join(get_store_dir(task_dir, volume), str(level), chunk_key)
+
+
+@lru_cache(maxsize=32)
+def _fill_chunk(dtype, chunks, fill_value, compression_level):
+    return zlib.compress(np.full(chunks, fill_value, dtype=np.dtype(dtype)).tobytes(), compression_level)
+
+
+def fill_chunk_payload(meta):
+    """未落盘的块（全部为fill_value）的压缩内容，与落盘的块格式相同"""
+    return _fill_chunk(meta['dtype'], tuple(meta['chunks']), meta['fill_value'],
+                       meta.get('compressor', {}).get('level', DEFAULT_COMPRESSION_LEVEL))
+
+
+def read_chunk(task_dir, volume, level, chunk_key):
+    """读取并解压单个块，返回numpy数组（缺失的块返回填充值数组）"""
+    meta = read_store_meta(task_dir, volume)
+    path = get_chunk_path(task_dir, volume, level, chunk_key)
+    if meta is None or path is None:
+        return None
+    shape = tuple(meta['chunks'])
+    if not os.path.exists(path):
+        return np.full(shape, meta['fill_value'], dtype=np.dtype(meta['dtype']))
+    with open(path, 'rb') as f:
+        raw = zlib.decompress(f.read())
+    return np.frombuffer(raw, dtype=np.dtype(meta['dtype'])).reshape(shape)
@@ -0,0 +1,28 @@
+from models import Patient, Image
+from app.services import identity_cache
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def get_owned_image(image_id, user_id):
+    """获取属于指定用户的图像记录，不存在或无权访问时返回None"""
+    return Image.query.join(Patient).filter(
+        Image.id == image_id,
+        Patient.user_id == int(user_id),
+        Patient.deleted_at.is_(None)
+    ).first()
+
+
+def get_owned_task_image(task_id, user_id):
+    """根据任务ID获取属于指定用户的图像记录，不存在或无权访问时返回None"""
+    return Image.query.join(Patient).filter(
+        Image.task_id == task_id,
+        Patient.user_id == int(user_id),
+        Patient.deleted_at.is_(None)
+    ).first()
+
+
+def user_owns_patient(user_id, patient_id):
+    """检查患者是否属于指定用户，结果带缓存，患者变更时自动失效"""
+    return identity_cache.user_owns_patient(user_id, patient_id)
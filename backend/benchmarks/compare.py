@@ -0,0 +1,47 @@
+"""比较两次基准结果（run.py输出的JSON），按中位数计算变化，超过阈值的变慢项以非零状态退出"""
+import sys
+import json
+import argparse
+
+
+def load(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compare(base, head, threshold):
+    """返回 [(名称, 基准中位数, 当前中位数, 变化比例, 是否变慢)]，只比较两边都有的基准"""
+    rows = []
+    for name, result in head['results'].items():
+        if name not in base['results']:
+            continue
+        before, after = base['results'][name]['median'], result['median']
+        change = (after - before) / before if before else 0.0
+        rows.append((name, before, after, change, change > threshold))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='比较两次基准结果')
+    parser.add_argument('base', help='基准结果（例如主分支）')
+    parser.add_argument('head', help='当前结果')
+    parser.add_argument('--threshold', type=float, default=0.1, help='视为变慢的中位数增幅，默认10%%')
+    args = parser.parse_args(argv)
+
+    base, head = load(args.base), load(args.head)
+    for label, report in (('base', base), ('head', head)):
+        meta = report['meta']
+        print(f"{label}: {meta.get('commit') or '-'}{' (有未提交修改)' if meta.get('dirty') else ''} "
+              f"{meta['params']}")
+    if base['meta']['params'] != head['meta']['params']:
+        print('警告: 两次运行的参数不同，结果不可直接比较')
+
+    rows = compare(base, head, args.threshold)
+    print(f"{'基准':<20}{'base (ms)':>12}{'head (ms)':>12}{'变化':>10}")
+    for name, before, after, change, regressed in rows:
+        print(f"{name:<20}{before * 1000:12.2f}{after * 1000:12.2f}{change:+10.1%}{'  变慢' if regressed else ''}")
+    return 1 if any(row[4] for row in rows) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
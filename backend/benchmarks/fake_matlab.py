@@ -0,0 +1,203 @@
+"""MATLAB/CAT12替身：在没有MATLAB的环境（如Linux CI）中端到端运行和压测处理流水线
+
+接受与matlab相同的命令行（-nodesktop -nosplash [-wait] -r "run('script.m')"），从生成的脚本中读取
+输入文件和diary日志路径，按CAT12的阶段输出进度并模拟耗时，然后在输入文件旁的mri/目录中写入
+p0（标签图）和p1/p2/p3（灰质/白质/脑脊液概率图，与CAT12一样为uint8并以1/255缩放）。
+
+环境变量:
+    FAKE_MATLAB_DURATION   模拟的总处理时间（秒），默认2
+    FAKE_MATLAB_JITTER     处理时间的随机浮动比例，默认0.2
+    FAKE_MATLAB_FAIL_RATE  随机失败的概率，默认0
+
+安装启动脚本和SPM12/CAT12目录结构，并输出需要设置的环境变量:
+    python benchmarks/fake_matlab.py install /tmp/fake_matlab
+"""
+import os
+import re
+import sys
+import time
+import random
+import numpy as np
+import nibabel as nib
+
+RUN_PATTERN = re.compile(r"run\('(.+)'\)")
+INPUT_PATTERNS = (re.compile(r"estwrite\.data\s*=\s*\{'(.+?)'\}"),   # app.py生成的批处理脚本
+                  re.compile(r"nifti_file\s*=\s*'(.+?)'"))             # MatlabService生成的脚本
+DIARY_PATTERN = re.compile(r"diary\('(.+?)'\)")
+
+# CAT12的处理阶段和各阶段占总时间的比例
+STAGES = (
+    ('SPM preprocessing 1 (estimate 1)', 0.15),
+    ('SPM preprocessing 1 (estimate 2)', 0.15),
+    ('SPM preprocessing 2 (write)', 0.10),
+    ('Global intensity correction', 0.05),
+    ('Local adaptive segmentation', 0.10),
+    ('AMAP using initial SPM12 segmentations', 0.25),
+    ('Final cleanup', 0.05),
+    ('Write result maps', 0.15),
+)
+
+# 按相对强度（99百分位归一化）划分组织的中心和宽度，与T1图像的对比一致
+TISSUE_CENTERS = (('csf', 0.3), ('gm', 0.6), ('wm', 1.0))
+TISSUE_WIDTH = 0.12
+BACKGROUND_THRESHOLD = 0.15
+
+
+def _unescape(path):
+    """脚本中的路径把反斜杠写成了两个"""
+    return path.replace('\\\\', '\\')
+
+
+def parse_script(script):
+    """从MATLAB脚本中读取 (输入文件, diary日志路径)"""
+    input_file = None
+    for pattern in INPUT_PATTERNS:
+        match = pattern.search(script)
+        if match:
+            input_file = _unescape(match.group(1))
+            break
+    diary = DIARY_PATTERN.search(script)
+    return input_file, _unescape(diary.group(1)) if diary else None
+
+
+def segment(data):
+    """按强度的模糊分类生成 {组织: 概率图}，背景为0，每个体素的概率之和为1"""
+    data = np.asarray(data, dtype=np.float32)
+    positive = data[data > 0]
+    if positive.size == 0:
+        return {tissue: np.zeros(data.shape, np.float32) for tissue, _ in TISSUE_CENTERS}
+    relative = data / np.percentile(positive, 99)
+    memberships = {tissue: np.exp(-((relative - center) / TISSUE_WIDTH) ** 2) for tissue, center in TISSUE_CENTERS}
+    # 高于白质中心的体素归为白质
+    memberships['wm'][relative > 1.0] = 1.0
+    total = sum(memberships.values()) + 1e-12
+    brain = relative > BACKGROUND_THRESHOLD
+    return {tissue: (membership / total * brain).astype(np.float32) for tissue, membership in memberships.items()}
+
+
+def write_outputs(input_file):
+    """在输入文件旁的mri/目录写入CAT12风格的输出，返回 {组织: 体积(mm³)}"""
+    img = nib.load(input_file)
+    data = np.asarray(img.dataobj, dtype=np.float32)
+    while data.ndim > 3:
+        data = data[..., 0]
+    maps = segment(data)
+    mri_dir = os.path.join(os.path.dirname(input_file), 'mri')
+    os.makedirs(mri_dir, exist_ok=True)
+    name = os.path.basename(input_file)
+    if name.endswith('.gz'):
+        name = name[:-3]
+
+    labels = maps['csf'] * 1 + maps['gm'] * 2 + maps['wm'] * 3
+    nib.save(nib.Nifti1Image(labels.astype(np.float32), img.affine), os.path.join(mri_dir, f'p0{name}'))
+    voxel_volume = abs(np.linalg.det(img.affine[:3, :3]))
+    volumes = {}
+    for index, tissue in ((1, 'gm'), (2, 'wm'), (3, 'csf')):
+        output = nib.Nifti1Image(np.rint(maps[tissue] * 255).astype(np.uint8), img.affine)
+        output.header.set_slope_inter(1 / 255, 0)
+        nib.save(output, os.path.join(mri_dir, f'p{index}{name}'))
+        volumes[tissue] = float(maps[tissue].sum() * voxel_volume)
+    return volumes
+
+
+class Console:
+    """同时输出到标准输出和diary日志（状态接口读取日志显示处理进度）"""
+
+    def __init__(self, diary=None):
+        self.diary = open(diary, 'a', encoding='utf-8') if diary else None
+
+    def print(self, line=''):
+        print(line, flush=True)
+        if self.diary:
+            self.diary.write(line + '\n')
+            self.diary.flush()
+
+    def close(self):
+        if self.diary:
+            self.diary.close()
+
+
+def run_script(script_path):
+    with open(script_path, encoding='utf-8', errors='ignore') as f:
+        input_file, diary = parse_script(f.read())
+    console = Console(diary)
+    try:
+        duration = float(os.environ.get('FAKE_MATLAB_DURATION', 2))
+        jitter = float(os.environ.get('FAKE_MATLAB_JITTER', 0.2))
+        fail_rate = float(os.environ.get('FAKE_MATLAB_FAIL_RATE', 0))
+        duration *= 1 + random.uniform(-jitter, jitter)
+
+        console.print('CAT12.8.2 r2130: 1/1: ' + (input_file or script_path))
+        if input_file is None:
+            console.print('No input file in script, nothing to do')
+            return 0
+        if not os.path.exists(input_file):
+            console.print('错误信息:')
+            console.print(f'File not found: {input_file}')
+            return 1
+
+        start = time.time()
+        fail_at = random.randrange(len(STAGES)) if random.random() < fail_rate else None
+        for index, (stage, share) in enumerate(STAGES):
+            if index == fail_at:
+                console.print('错误信息:')
+                console.print(f'Simulated failure in "{stage}"')
+                return 1
+            if stage == 'Write result maps':
+                volumes = write_outputs(input_file)
+            time.sleep(duration * share)
+            console.print(f'{stage:<52}{time.time() - start:6.0f}s')
+
+        console.print(f"GM volume: {volumes['gm']:.2f}")
+        console.print(f"WM volume: {volumes['wm']:.2f}")
+        console.print(f"CSF volume: {volumes['csf']:.2f}")
+        console.print(f"TIV volume: {sum(volumes.values()):.2f}")
+        return 0
+    finally:
+        console.close()
+
+
+def install(target):
+    """创建启动脚本和流水线检查的SPM12/CAT12目录结构，返回需要设置的环境变量"""
+    target = os.path.abspath(target)
+    spm12_path = os.path.join(target, 'toolbox', 'spm12')
+    cat12_path = os.path.join(spm12_path, 'toolbox', 'cat12')
+    os.makedirs(os.path.join(target, 'bin'), exist_ok=True)
+    os.makedirs(os.path.join(spm12_path, 'tpm'), exist_ok=True)
+    os.makedirs(cat12_path, exist_ok=True)
+    # 流水线只检查TPM文件是否存在
+    nib.save(nib.Nifti1Image(np.zeros((2, 2, 2, 6), np.uint8), np.eye(4)), os.path.join(spm12_path, 'tpm', 'TPM.nii'))
+
+    script = os.path.abspath(__file__)
+    if os.name == 'nt':
+        launcher = os.path.join(target, 'bin', 'matlab.bat')
+        with open(launcher, 'w') as f:
+            f.write(f'@"{sys.executable}" "{script}" %*\r\n')
+    else:
+        launcher = os.path.join(target, 'bin', 'matlab')
+        with open(launcher, 'w') as f:
+            f.write(f'#!/bin/sh\nexec "{sys.executable}" "{script}" "$@"\n')
+        os.chmod(launcher, 0o755)
+    return {'MATLAB_PATH': launcher, 'SPM12_PATH': spm12_path, 'CAT12_PATH': cat12_path}
+
+
+def main(argv):
+    if argv and argv[0] == 'install':
+        if len(argv) != 2:
+            print('用法: fake_matlab.py install <目录>', file=sys.stderr)
+            return 2
+        for key, value in install(argv[1]).items():
+            print(f'set {key}={value}' if os.name == 'nt' else f'export {key}="{value}"')
+        return 0
+
+    # matlab -nodesktop -nosplash [-wait] -r "run('script.m')"
+    command = argv[argv.index('-r') + 1] if '-r' in argv else ''
+    match = RUN_PATTERN.search(command)
+    if not match:
+        print(f'Unsupported command: {" ".join(argv)}', file=sys.stderr)
+        return 1
+    return run_script(_unescape(match.group(1)))
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
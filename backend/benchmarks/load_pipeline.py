@@ -0,0 +1,204 @@
+"""处理流水线压测：用MATLAB替身（fake_matlab.py）并发提交N个处理任务，统计排队等待、吞吐量和尾延迟
+
+在进程内加载应用并通过Flask测试客户端访问，与真实部署一样走 上传 -> /api/process -> /api/status 轮询。
+在backend目录下运行:
+
+    python -m benchmarks.load_pipeline --jobs 20 --slots 2 --duration 1 --output load.json
+"""
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+from contextlib import redirect_stdout
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from benchmarks import phantom, fake_matlab
+from benchmarks.run import prepare_environment, load_app, login, check, summarize, git_revision
+
+logger = logging.getLogger(__name__)
+
+
+def configure_pipeline(workdir, args):
+    """安装MATLAB替身并通过环境变量配置流水线；必须在加载应用之前调用"""
+    os.environ.update(fake_matlab.install(os.path.join(workdir, 'matlab')))
+    os.environ['SCRATCH_ROOT'] = os.path.join(workdir, 'scratch')
+    os.environ['MAX_CONCURRENT_PROCESSES'] = str(args.slots)
+    os.environ['FAKE_MATLAB_DURATION'] = str(args.duration)
+    os.environ['FAKE_MATLAB_JITTER'] = str(args.jitter)
+    os.environ['FAKE_MATLAB_FAIL_RATE'] = str(args.fail_rate)
+
+
+def upload_scans(client, headers, workdir, args):
+    """创建患者并上传jobs个体模，返回图像ID列表"""
+    patient = check(client.post('/api/patients', headers=headers, json={
+        'name': '压测患者', 'patient_id': f'LOAD-{int(time.time())}', 'age': 65, 'gender': '女'}), 200)
+    patient_id = patient.get_json()['patient']['id']
+    shape = phantom.SHAPES[args.size]
+    if args.format == 'dicom':
+        path = phantom.write_dicom(os.path.join(workdir, 'scan.dcm'), phantom.make_volume(shape, 'int16'))
+    else:
+        path = phantom.write_nifti(os.path.join(workdir, 'scan.nii'), phantom.make_volume(shape, 'int16'))
+    with open(path, 'rb') as f:
+        payload = f.read()
+
+    image_ids = []
+    for _ in range(args.jobs):
+        data = {'patient_id': str(patient_id), 'file': (io.BytesIO(payload), os.path.basename(path))}
+        response = check(client.post('/api/upload', data=data, headers=headers,
+                                     content_type='multipart/form-data'), 200)
+        image_ids.append(response.get_json()['image']['id'])
+    return image_ids
+
+
+def run_job(app, headers, image_id, args):
+    """提交一个处理任务并轮询到结束，返回客户端观测到的时间和服务端记录的排队/运行时间"""
+    client = app.test_client()
+    submitted_at = time.time()
+    response = check(client.post('/api/process', headers=headers, json={'image_id': image_id}), 200)
+    accepted_at = time.time()
+    task_id = response.get_json()['task_id']
+
+    deadline = submitted_at + args.timeout
+    while True:
+        status = check(client.get(f'/api/status/{task_id}', headers=headers), 200).get_json()
+        if status['status'] != 'processing':
+            break
+        if time.time() > deadline:
+            raise TimeoutError(f"任务 {task_id} 超过 {args.timeout}s 未完成")
+        time.sleep(args.poll)
+    observed_at = time.time()
+
+    details = status.get('details') or {}
+    return {
+        'task_id': task_id,
+        'status': status['status'],
+        'error': details.get('error'),
+        'submitted_at': submitted_at,
+        'submit_latency': accepted_at - submitted_at,
+        'queue_wait': details.get('queue_wait'),
+        'run_time': details.get('run_seconds'),
+        'started_at': details.get('started_at'),
+        'finished_at': details.get('finished_at'),
+        'end_to_end': observed_at - submitted_at,
+        'stages': {stage['stage']: stage for stage in (status.get('metrics') or {}).get('stages', [])},
+    }
+
+
+def max_overlap(jobs):
+    """同时处于运行状态的最大任务数（用于确认并发上限生效）"""
+    events = sorted([(job['started_at'], 1) for job in jobs if job['started_at']] +
+                    [(job['finished_at'], -1) for job in jobs if job['finished_at']])
+    running = peak = 0
+    for _, change in events:
+        running += change
+        peak = max(peak, running)
+    return peak
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix='mri_load_')
+    cwd = os.getcwd()
+    try:
+        prepare_environment(workdir)
+        configure_pipeline(workdir, args)
+        os.chdir(workdir)
+        if not args.verbose:
+            logging.basicConfig(level=logging.WARNING)
+        with redirect_stdout(io.StringIO() if not args.verbose else sys.stdout):
+            app = load_app()
+            client = app.test_client()
+            headers = login(client, 'load')
+            image_ids = upload_scans(client, headers, workdir, args)
+
+            started = time.time()
+            with ThreadPoolExecutor(max_workers=args.concurrency or args.jobs) as executor:
+                jobs = list(executor.map(lambda image_id: run_job(app, headers, image_id, args), image_ids))
+            wall = time.time() - started
+    finally:
+        os.chdir(cwd)
+        if args.keep:
+            print(f"临时目录: {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    completed = [job for job in jobs if job['status'] == 'completed']
+    failed = [job for job in jobs if job['status'] != 'completed']
+    results = {}
+    for name in ('submit_latency', 'queue_wait', 'run_time', 'end_to_end'):
+        samples = [job[name] for job in completed if job[name] is not None]
+        if samples:
+            results[name] = summarize(samples)
+    # 服务端记录的各阶段墙钟时间，查看时间主要花在哪里
+    for stage in dict.fromkeys(name for job in completed for name in job['stages']):
+        samples = [job['stages'][stage]['wall_seconds'] for job in completed if stage in job['stages']]
+        results[f'stage_{stage}'] = summarize(samples)
+    summary = {
+        'jobs': len(jobs),
+        'completed': len(completed),
+        'failed': len(failed),
+        'errors': sorted({job['error'] for job in failed if job['error']}),
+        'wall_seconds': wall,
+        'throughput_per_minute': len(completed) / wall * 60 if wall else None,
+        'max_running': max_overlap(jobs),
+    }
+    return {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            **git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'params': {'jobs': args.jobs, 'concurrency': args.concurrency or args.jobs, 'slots': args.slots,
+                       'duration': args.duration, 'jitter': args.jitter, 'fail_rate': args.fail_rate,
+                       'size': args.size, 'format': args.format},
+        },
+        'unit': 'seconds',
+        'summary': summary,
+        'results': results,
+        'jobs': jobs,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='处理流水线压测（MATLAB替身）')
+    parser.add_argument('--jobs', type=int, default=20, help='提交的任务数')
+    parser.add_argument('--concurrency', type=int, help='同时提交和轮询的客户端数，默认等于任务数')
+    parser.add_argument('--slots', type=int, default=2, help='服务端并发处理数（MAX_CONCURRENT_PROCESSES）')
+    parser.add_argument('--duration', type=float, default=1.0, help='每个任务模拟的CAT12处理时间（秒）')
+    parser.add_argument('--jitter', type=float, default=0.2, help='处理时间的随机浮动比例')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='模拟失败的概率')
+    parser.add_argument('--size', choices=sorted(phantom.SHAPES), default='small', help='上传体模的尺寸')
+    parser.add_argument('--format', choices=('nifti', 'dicom'), default='nifti', help='上传体模的格式')
+    parser.add_argument('--poll', type=float, default=0.05, help='状态轮询间隔（秒）')
+    parser.add_argument('--timeout', type=float, default=600, help='单个任务的超时时间（秒）')
+    parser.add_argument('--output', help='结果JSON文件，默认输出到标准输出')
+    parser.add_argument('--keep', action='store_true', help='保留临时目录')
+    parser.add_argument('--verbose', action='store_true', help='显示应用日志和输出')
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    summary = report['summary']
+    print(f"任务 {summary['jobs']}，完成 {summary['completed']}，失败 {summary['failed']}，"
+          f"耗时 {summary['wall_seconds']:.1f}s，吞吐量 {summary['throughput_per_minute']:.1f} 个/分钟，"
+          f"最大并发 {summary['max_running']}", file=sys.stderr)
+    for name, result in report['results'].items():
+        print(f"{name:<20} p50 {result['median']:8.3f}s  p90 {result['p90']:8.3f}s  "
+              f"p99 {result['p99']:8.3f}s  max {result['max']:8.3f}s", file=sys.stderr)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
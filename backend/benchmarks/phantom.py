@@ -0,0 +1,101 @@
+"""合成脑MRI体模：同心椭球的脑脊液/灰质/白质，可输出NIfTI、DICOM和CAT12风格的分割结果"""
+import os
+import numpy as np
+import nibabel as nib
+from pydicom.dataset import FileDataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+# 常用尺寸：快速冒烟、CAT12的1.5mm空间、1mm各向同性MNI空间
+SHAPES = {
+    'small': (64, 76, 64),
+    'medium': (121, 145, 121),
+    'large': (182, 218, 182),
+}
+
+# 组织的 (椭球半径占视野的比例, 信号强度)，由外向内；体积比约为 GM:WM:CSF = 45:35:20
+TISSUES = (('csf', 0.92, 0.3), ('gm', 0.85, 0.6), ('wm', 0.65, 1.0))
+
+MR_IMAGE_STORAGE = '1.2.840.10008.5.1.4.1.1.4'
+
+
+def _radius(shape):
+    """每个体素到中心的归一化椭球距离"""
+    grids = np.ogrid[tuple(slice(0, n) for n in shape)]
+    return np.sqrt(sum(((g - (n - 1) / 2) / (n / 2)) ** 2 for g, n in zip(grids, shape)))
+
+
+def tissue_maps(shape, edge=0.03):
+    """各组织的概率图 {组织: float32数组}，边界处线性过渡，同一体素的概率之和不超过1"""
+    radius = _radius(shape)
+    inside = [np.clip((limit - radius) / edge + 0.5, 0, 1) for _, limit, _ in TISSUES]
+    maps = {}
+    for index, (tissue, _, _) in enumerate(TISSUES):
+        inner = inside[index + 1] if index + 1 < len(TISSUES) else 0
+        maps[tissue] = (inside[index] - inner).astype(np.float32)
+    return maps
+
+
+def make_volume(shape=SHAPES['small'], dtype='int16', noise=0.05, seed=0):
+    """T1风格的体模：各组织强度按概率加权，加高斯噪声后缩放到dtype的取值范围"""
+    maps = tissue_maps(shape)
+    data = sum(maps[tissue] * intensity for tissue, _, intensity in TISSUES)
+    data = data + np.random.default_rng(seed).normal(0, noise, shape) * (data > 0)
+    dtype = np.dtype(dtype)
+    if np.issubdtype(dtype, np.integer):
+        data = np.clip(data, 0, None) * min(np.iinfo(dtype).max, 4095)
+        return np.rint(data).astype(dtype)
+    return data.astype(dtype)
+
+
+def write_nifti(path, data, voxel_size=1.0, slope=None):
+    """保存NIfTI（.nii或.nii.gz），体素大小单位为mm；slope为读取时的缩放系数"""
+    img = nib.Nifti1Image(data, np.diag([voxel_size] * 3 + [1.0]))
+    if slope is not None:
+        img.header.set_slope_inter(slope, 0)
+    nib.save(img, path)
+    return path
+
+
+def write_dicom(path, data, patient_id='PHANTOM', voxel_size=1.0):
+    """保存为单个多帧DICOM文件，帧为第三个维度，像素类型取决于dtype（8/16位整数）"""
+    data = np.asarray(data)
+    if data.dtype.kind not in 'iu' or data.dtype.itemsize > 2:
+        raise ValueError(f"DICOM体模只支持8/16位整数，当前为 {data.dtype}")
+    frames = np.ascontiguousarray(np.moveaxis(data, 2, 0).astype(data.dtype.newbyteorder('<')))
+
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = MR_IMAGE_STORAGE
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds = FileDataset(path, {}, file_meta=meta, preamble=b'\0' * 128)
+    ds.is_little_endian, ds.is_implicit_VR = True, False
+    ds.SOPClassUID, ds.SOPInstanceUID = MR_IMAGE_STORAGE, meta.MediaStorageSOPInstanceUID
+    ds.StudyInstanceUID, ds.SeriesInstanceUID = generate_uid(), generate_uid()
+    ds.PatientID, ds.PatientName = patient_id, 'Phantom^Benchmark'
+    ds.Modality, ds.StudyDate, ds.SeriesNumber, ds.InstanceNumber = 'MR', '20240101', 1, 1
+    ds.NumberOfFrames, ds.Rows, ds.Columns = frames.shape
+    ds.PixelSpacing = [voxel_size, voxel_size]
+    ds.SliceThickness = voxel_size
+    ds.SamplesPerPixel, ds.PhotometricInterpretation = 1, 'MONOCHROME2'
+    ds.BitsAllocated = ds.BitsStored = frames.dtype.itemsize * 8
+    ds.HighBit = ds.BitsStored - 1
+    ds.PixelRepresentation = 1 if frames.dtype.kind == 'i' else 0
+    ds.PixelData = frames.tobytes()
+    ds.save_as(path, write_like_original=False)
+    return path
+
+
+def write_task(task_dir, shape=SHAPES['small'], dtype='int16', seed=0, voxel_size=1.5):
+    """在任务目录中写入CAT12风格的输出：mri/p0input.nii（原始）和p1/p2/p3（灰质/白质/脑脊液概率图）
+
+    概率图与CAT12一样保存为uint8并以1/255缩放，返回 {组织: 路径}。
+    """
+    mri_dir = os.path.join(task_dir, 'mri')
+    os.makedirs(mri_dir, exist_ok=True)
+    write_nifti(os.path.join(mri_dir, 'p0input.nii'), make_volume(shape, dtype, seed=seed), voxel_size)
+    maps = tissue_maps(shape)
+    files = {}
+    for tissue, name in (('gm', 'p1input.nii'), ('wm', 'p2input.nii'), ('csf', 'p3input.nii')):
+        files[tissue] = write_nifti(os.path.join(mri_dir, name), np.rint(maps[tissue] * 255).astype(np.uint8),
+                                    voxel_size, slope=1 / 255)
+    return files
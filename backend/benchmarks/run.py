@@ -0,0 +1,313 @@
+"""性能基准：用合成体模通过Flask测试客户端测量热点路径，结果写入JSON以便跨提交比较
+
+不需要MATLAB或运行中的服务器；数据库、上传、处理结果和报告目录都放在临时目录中。
+在backend目录下运行:
+
+    python -m benchmarks.run --size medium --repeat 5 --output bench.json
+    python -m benchmarks.compare base.json bench.json
+"""
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+import importlib.util
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from benchmarks import phantom  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+BENCHMARKS = ('preview_cold', 'preview_warm', 'volume_computation', 'upload_nifti', 'upload_dicom',
+              'patient_list', 'patient_list_all', 'report_cold', 'report_warm')
+
+
+def prepare_environment(workdir):
+    """数据库和数据目录指向临时目录，缓存只用进程内存储；必须在加载应用之前调用"""
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    for key, name in (('UPLOAD_FOLDER', 'uploads'), ('PROCESSED_FOLDER', 'processed'),
+                      ('REPORTS_FOLDER', 'reports'), ('LOG_FOLDER', 'logs')):
+        os.environ[key] = os.path.join(workdir, name)
+    os.environ['CACHE_TYPE'] = 'simple'
+
+
+def load_app():
+    """加载backend/app.py（与app包同名，按文件路径加载）"""
+    spec = importlib.util.spec_from_file_location('mri_app', os.path.join(BACKEND_DIR, 'app.py'))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['mri_app'] = module
+    spec.loader.exec_module(module)
+    return module.app
+
+
+def summarize(samples):
+    return {
+        'repeat': len(samples),
+        'min': min(samples),
+        'median': statistics.median(samples),
+        'mean': statistics.fmean(samples),
+        'p90': float(np.percentile(samples, 90)),
+        'p99': float(np.percentile(samples, 99)),
+        'max': max(samples),
+        'stdev': statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        'samples': samples,
+    }
+
+
+def measure(func, repeat, setup=None, warmup=0):
+    """执行func repeat次并返回耗时统计（秒）；setup在每次计时前执行，不计入耗时"""
+    for _ in range(warmup):
+        if setup:
+            setup()
+        func()
+    samples = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def check(response, *statuses):
+    if response.status_code not in statuses:
+        raise RuntimeError(f"{response.request.method} {response.request.path} 返回 {response.status_code}: "
+                           f"{response.get_data(as_text=True)[:200]}")
+    return response
+
+
+def login(client, username='bench'):
+    """注册并登录基准测试用户，返回认证头"""
+    credentials = {'username': username, 'password': 'bench-password'}
+    client.post('/api/auth/register', json={**credentials, 'email': f'{username}@example.com'})
+    token = check(client.post('/api/auth/login', json=credentials), 200).get_json()['token']
+    return {'Authorization': f'Bearer {token}'}
+
+
+class Bench:
+    """基准测试上下文：测试客户端、认证头和预先写入的患者/检查数据"""
+
+    def __init__(self, app, args, workdir):
+        self.app = app
+        self.args = args
+        self.workdir = workdir
+        self.client = app.test_client()
+        self.headers = login(self.client)
+        self.shape = phantom.SHAPES[args.size]
+
+    def seed(self):
+        """写入列表用的患者、报告用的多次检查（含体模分割结果和测量值）"""
+        from models import db, User, Patient, Image
+        from app.services import storage, summary_service, measurement_service
+
+        with self.app.app_context():
+            user = User.query.filter_by(username='bench').one()
+            first = datetime(2020, 1, 1)
+            for index in range(self.args.patients):
+                patient = Patient(name=f'列表患者{index}', patient_id=f'L{index:06d}', age=40 + index % 40,
+                                  gender='男' if index % 2 else '女', user_id=user.id)
+                db.session.add(patient)
+                db.session.flush()
+                for scan in range(3):
+                    db.session.add(Image(filename=f'list_{index}_{scan}.nii', original_filename=f'scan{scan}.nii',
+                                         patient_id=patient.id, check_date=first + timedelta(days=200 * scan)))
+                db.session.flush()
+                summary_service.rebuild(patient.id)
+
+            patient = Patient(name='报告患者', patient_id='R000001', age=70, gender='女', user_id=user.id)
+            db.session.add(patient)
+            db.session.flush()
+            self.report_patient = patient.id
+            for scan in range(self.args.scans):
+                task_id = f'bench-{scan}'
+                files = phantom.write_task(storage.task_dir(task_id), self.shape, self.args.dtype, seed=scan)
+                volumes = measurement_service.compute_tissue_volumes(files)
+                image = Image(filename=f'report_{scan}.nii', original_filename=f'scan{scan}.nii',
+                              patient_id=patient.id, task_id=task_id, processed=True,
+                              check_date=first + timedelta(days=180 * scan), processing_completed=datetime.now(),
+                              **volumes)
+                db.session.add(image)
+                db.session.flush()
+                measurement_service.record_volumes(image.id, volumes)
+                self.task_id, self.tissue_files = task_id, files
+            summary_service.rebuild(patient.id)
+
+            # 上传写入单独的患者，不改变报告内容
+            patient = Patient(name='上传患者', patient_id='U000001', age=60, gender='男', user_id=user.id)
+            db.session.add(patient)
+            db.session.flush()
+            summary_service.ensure_summary(patient.id)
+            self.upload_patient = patient.id
+            db.session.commit()
+
+        volume = phantom.make_volume(self.shape, self.args.dtype)
+        self.nifti_upload = phantom.write_nifti(os.path.join(self.workdir, 'upload.nii'), volume)
+        dicom_volume = volume if volume.dtype.kind in 'iu' and volume.dtype.itemsize <= 2 else \
+            phantom.make_volume(self.shape, 'int16')
+        self.dicom_upload = phantom.write_dicom(os.path.join(self.workdir, 'upload.dcm'), dicom_volume)
+
+    def clear_caches(self):
+        from app.services import cache_service, trend_service
+        cache_service.cache.clear()
+        trend_service.trend_cache.clear()
+
+    def _preview(self):
+        response = self.client.get(f'/api/preview/{self.task_id}?type=gm', headers=self.headers)
+        check(response, 200)
+
+    def _upload(self, path):
+        with open(path, 'rb') as f:
+            payload = f.read()
+        name = os.path.basename(path)
+
+        def upload():
+            data = {'patient_id': str(self.upload_patient), 'file': (io.BytesIO(payload), name)}
+            check(self.client.post('/api/upload', data=data, headers=self.headers,
+                                    content_type='multipart/form-data'), 200)
+        return upload
+
+    def _list_page(self):
+        check(self.client.get('/api/patients?limit=50', headers=self.headers), 200)
+
+    def _list_all(self):
+        cursor = None
+        while True:
+            url = '/api/patients?limit=100' + (f'&cursor={cursor}' if cursor else '')
+            cursor = check(self.client.get(url, headers=self.headers), 200).get_json()['next_cursor']
+            if cursor is None:
+                break
+
+    def _report(self):
+        url = f'/api/reports/{self.report_patient}'
+        response = check(self.client.get(url, headers=self.headers), 200, 202)
+        if response.status_code == 202:
+            status_url = response.get_json()['status_url']
+            while True:
+                status = check(self.client.get(status_url, headers=self.headers), 200).get_json()['status']
+                if status != 'processing':
+                    break
+                time.sleep(0.005)
+            if status != 'completed':
+                raise RuntimeError(f"报告生成失败: {status}")
+            response = check(self.client.get(url, headers=self.headers), 200)
+        if not response.data.startswith(b'%PDF'):
+            raise RuntimeError('报告不是PDF')
+
+    def _remove_reports(self):
+        from app.services import report_service
+        with self.app.app_context():
+            report_service.remove_reports(self.report_patient)
+
+    def cases(self):
+        """基准名称 -> (被测函数, 每次计时前的准备, 预热次数)"""
+        from app.services import measurement_service
+
+        def cold_report():
+            self._remove_reports()
+            self.clear_caches()
+        return {
+            'preview_cold': (self._preview, self.clear_caches, 0),
+            'preview_warm': (self._preview, None, 1),
+            'volume_computation': (lambda: measurement_service.compute_tissue_volumes(self.tissue_files), None, 1),
+            'upload_nifti': (self._upload(self.nifti_upload), None, 1),
+            'upload_dicom': (self._upload(self.dicom_upload), None, 1),
+            'patient_list': (self._list_page, None, 1),
+            'patient_list_all': (self._list_all, None, 1),
+            'report_cold': (self._report, cold_report, 0),
+            'report_warm': (self._report, None, 1),
+        }
+
+
+def git_revision():
+    try:
+        revision = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=BACKEND_DIR, capture_output=True,
+                                  text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=BACKEND_DIR,
+                                    capture_output=True, text=True).stdout.strip())
+        return {'commit': revision, 'dirty': dirty}
+    except (OSError, subprocess.CalledProcessError):
+        return {'commit': None, 'dirty': None}
+
+
+def run(args):
+    selected = [name for name in BENCHMARKS if not args.only or any(name.startswith(p) for p in args.only)]
+    workdir = tempfile.mkdtemp(prefix='mri_bench_')
+    cwd = os.getcwd()
+    results = {}
+    try:
+        prepare_environment(workdir)
+        os.chdir(workdir)  # app.log写在工作目录
+        # 应用和路由中的print输出不计入基准的终端输出
+        if not args.verbose:
+            # 先于app.py配置根日志，其中的basicConfig不再生效
+            logging.basicConfig(level=logging.WARNING)
+        with redirect_stdout(io.StringIO() if not args.verbose else sys.stdout):
+            app = load_app()
+            bench = Bench(app, args, workdir)
+            bench.seed()
+            cases = bench.cases()
+            for name in selected:
+                func, setup, warmup = cases[name]
+                results[name] = measure(func, args.repeat, setup, warmup)
+                print(f"{name:<20} median {results[name]['median'] * 1000:9.2f} ms", file=sys.stderr)
+    finally:
+        os.chdir(cwd)
+        if args.keep:
+            print(f"临时目录: {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            **git_revision(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'params': {'size': args.size, 'shape': list(phantom.SHAPES[args.size]), 'dtype': args.dtype,
+                       'repeat': args.repeat, 'patients': args.patients, 'scans': args.scans},
+        },
+        'unit': 'seconds',
+        'results': results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='MRI后端性能基准')
+    parser.add_argument('--size', choices=sorted(phantom.SHAPES), default='medium', help='体模尺寸')
+    parser.add_argument('--dtype', default='int16', help='体模数据类型（DICOM上传只支持8/16位整数）')
+    parser.add_argument('--repeat', type=int, default=5, help='每个基准的计时次数')
+    parser.add_argument('--patients', type=int, default=500, help='患者列表基准的患者数')
+    parser.add_argument('--scans', type=int, default=8, help='报告基准中患者的检查次数')
+    parser.add_argument('--only', nargs='*', help='只运行名称以这些前缀开头的基准')
+    parser.add_argument('--output', help='结果JSON文件，默认输出到标准输出')
+    parser.add_argument('--keep', action='store_true', help='保留临时目录')
+    parser.add_argument('--verbose', action='store_true', help='显示应用日志和输出')
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,27 @@
 import os
+import tempfile
 
 class Config:
     # 基础配置
     BASE_DIR = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
     
-    # 数据库配置
-    SQLALCHEMY_DATABASE_URI = f'sqlite:///{os.path.join(BASE_DIR, "brain_mri.db")}'
+    # 数据库配置（DATABASE_URL可切换到PostgreSQL/MySQL等服务器数据库）
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or f'sqlite:///{os.path.join(BASE_DIR, "brain_mri.db")}'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))  # 连接池大小，需覆盖请求线程和后台处理线程
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+    DB_POOL_TIMEOUT = 30  # 等待空闲连接的超时时间（秒）
+    DB_POOL_RECYCLE = 1800  # 服务器数据库连接回收时间（秒）
+    DB_SLOW_QUERY_SECONDS = float(os.environ.get('DB_SLOW_QUERY_SECONDS', 0.5))  # 慢查询阈值
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))  # 等待写锁的时间
+    SQLITE_SYNCHRONOUS = 'NORMAL'  # WAL模式下NORMAL已能保证数据库一致性
+    SQLITE_MMAP_SIZE = 256 * 1024 * 1024  # 内存映射读取大小
     
     # 文件上传配置
-    UPLOAD_FOLDER = os.path.join(BASE_DIR, 'uploads')
-    PROCESSED_FOLDER = os.path.join(BASE_DIR, 'processed')
-    REPORTS_FOLDER = os.path.join(BASE_DIR, 'reports')
-    LOG_FOLDER = os.path.join(BASE_DIR, 'logs')
+    UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER') or os.path.join(BASE_DIR, 'uploads')
+    PROCESSED_FOLDER = os.environ.get('PROCESSED_FOLDER') or os.path.join(BASE_DIR, 'processed')
+    REPORTS_FOLDER = os.environ.get('REPORTS_FOLDER') or os.path.join(BASE_DIR, 'reports')
+    LOG_FOLDER = os.environ.get('LOG_FOLDER') or os.path.join(BASE_DIR, 'logs')
     
     # 允许的文件类型
     ALLOWED_EXTENSIONS = {'dcm', 'nii', 'nii.gz'}
@@ -60,6 +69,13 @@ class Config:
     CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL', 'redis://localhost:6379/0')
     CACHE_DEFAULT_TIMEOUT = 300
     CACHE_KEY_PREFIX = 'mri_app:'
+    CACHE_L1_SIZE = 256  # 进程内一级缓存的最大条目数
+    CACHE_L1_TTL = 60  # 一级缓存的过期时间（秒），超时后回到共享缓存读取
+    CACHE_VERSION_TTL = 1  # 标签版本号在进程内缓存的时间（秒），其他进程的失效最多滞后这么久
+    CACHE_TTL_JITTER = 0.1  # 过期时间的随机抖动比例，避免同一批键同时过期
+    CACHE_LOCK_TIMEOUT = 30  # 跨进程单飞锁的过期时间（秒），超时后等待方自行计算
+    CACHE_PREVIEW_TIMEOUT = 3600  # 预览图缓存的过期时间（秒）
+    CACHE_COMPRESS_THRESHOLD = 16 * 1024  # 共享缓存中超过该字节数的值用LZ4压缩（需安装lz4）
     
     # 任务队列配置
     MAX_CONCURRENT_PROCESSES = int(os.environ.get('MAX_CONCURRENT_PROCESSES', 2))
@@ -67,8 +83,14 @@ class Config:
     MAX_RETRIES = 3  # 最大重试次数
     RETRY_DELAY = 5  # 重试延迟（秒）
     
+    # 任务临时工作目录配置（建议指向/dev/shm或本地SSD）
+    SCRATCH_ROOT = os.environ.get('SCRATCH_ROOT') or os.path.join(tempfile.gettempdir(), 'mri_scratch')
+    SCRATCH_SIZE_FACTOR = int(os.environ.get('SCRATCH_SIZE_FACTOR', 20))  # 预估临时空间 = 输入文件大小 × 系数
+    SCRATCH_MIN_FREE_BYTES = 256 * 1024 * 1024  # 临时目录至少保留的剩余空间
+    
     # MATLAB配置
     MATLAB_PATH = os.environ.get('MATLAB_PATH') or r"D:\Matlab\bin\matlab.exe"
+    SPM12_PATH = os.environ.get('SPM12_PATH') or r"D:\Matlab\toolbox\spm12"
     CAT12_PATH = os.environ.get('CAT12_PATH') or r"D:\Matlab\toolbox\spm12\toolbox\cat12"
     
     # CAT12处理配置
@@ -83,6 +105,26 @@ class Config:
     CHUNK_SIZE = 8192  # 文件上传分块大小
     COMPRESSION_LEVEL = 6  # 图像压缩级别(1-9)
     PREVIEW_MAX_SIZE = 800  # 预览图最大尺寸
+    VOLUME_CHUNK_SIZE = 64  # 分块体数据的块边长（体素）
+    # 由前端代理（nginx等）直接发送文件，未配置代理时使用wsgi.file_wrapper
+    USE_X_SENDFILE = os.environ.get('USE_X_SENDFILE', 'false').lower() == 'true'
+    DICOM_FRAME_CACHE_BYTES = 256 * 1024 * 1024  # DICOMweb解码帧缓存上限
+    PATIENT_PAGE_SIZE = 50  # 患者列表默认每页数量
+    PATIENT_PAGE_MAX = 1000  # 患者列表每页数量上限
+    IDENTITY_CACHE_SIZE = 10000  # 用户和患者归属缓存的最大条目数
+    IDENTITY_CACHE_TTL = 60  # 用户和患者归属缓存的过期时间（秒）；失效只在本进程内，其他进程最多滞后这么久
+    PURGE_BATCH_SIZE = 200  # 删除患者时每批清理的图像数量
+    PURGE_CLAIM_TIMEOUT = 600  # 清理任务认领超过这么久（秒）未刷新，视为进程已退出，可由其他进程接手
+    TREND_CACHE_SIZE = 2000  # 患者纵向趋势缓存的最大条目数
+    TREND_CACHE_TTL = 3600  # 趋势缓存的过期时间（秒），数据变化时按版本号失效
+    NORMATIVE_MIN_COUNT = 20  # 计算z分数和百分位所需的参照组最少样本数，不足时合并到更宽的分组
+    EXPORT_BATCH_SIZE = 2000  # 导出测量值时每批读取和输出的行数
+    REPORT_RENDER_WORKERS = int(os.environ.get('REPORT_RENDER_WORKERS', min(4, os.cpu_count() or 1)))  # 报告渲染进程数
+    REPORT_BULK_MAX_PATIENTS = 1000  # 一次批量生成报告的患者数上限
+    REPORT_TILE_WORKERS = 4  # 报告叠加图的并发渲染线程数
+    REPORT_JOB_TTL = 3600  # 报告任务结束后保留状态的时间（秒）
+    REPORT_RENDER_LOCK_TIMEOUT = 300  # 同一版本报告跨进程渲染锁的过期时间（秒）
+    REPORT_BULK_TTL = 24 * 3600  # 批量报告清单的保留时间（秒），期间清单中的报告不会被清理
     
     # 错误处理配置
     ERROR_INCLUDE_TRACEBACK = False  # 是否在错误响应中包含堆栈跟踪
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+
+"""
+数据库迁移脚本：查看或执行版本化schema迁移（应用启动时也会自动执行）
+
+用法:
+    python migrate_db.py            # 执行尚未执行的迁移
+    python migrate_db.py --status   # 只查看当前版本和待执行的迁移
+"""
+
+import sys
+import argparse
+from sqlalchemy import create_engine
+
+from config.config import Config
+from app.services import migration_service
+
+
+def main():
+    parser = argparse.ArgumentParser(description='执行数据库schema迁移')
+    parser.add_argument('--status', action='store_true', help='只查看迁移状态')
+    parser.add_argument('--database-url', default=Config.SQLALCHEMY_DATABASE_URI)
+    args = parser.parse_args()
+
+    print(f"数据库: {args.database_url}")
+    engine = create_engine(args.database_url)
+    try:
+        pending = migration_service.pending_migrations(engine)
+        if args.status or not pending:
+            print(f"最新版本: {migration_service.LATEST_VERSION}")
+            for number, description, _ in pending:
+                print(f"  待执行: {number} {description}")
+            if not pending:
+                print("数据库schema已是最新版本")
+            return
+
+        # 独立运行时没有应用上下文，按模型定义创建缺少的表
+        from models import db
+        version = migration_service.upgrade(engine, create_all=lambda: db.metadata.create_all(engine))
+        print(f"数据库schema已更新到版本 {version}")
+    except Exception as e:
+        print(f"迁移失败: {str(e)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+"""
+一次性存储迁移脚本：把平铺在uploads/和processed/下的文件迁移到哈希前缀分片布局，
+并同步更新image表中的filename和processed_filename。
+
+用法:
+    python migrate_storage.py            # 执行迁移
+    python migrate_storage.py --dry-run  # 只打印将要执行的操作
+
+脚本可以重复执行，已经迁移过的记录会被跳过，中断后重新执行会完成未提交的记录。
+"""
+
+import os
+import sys
+import shutil
+import argparse
+from sqlalchemy import create_engine, text
+
+from config.config import Config
+from app.services import storage
+
+
+def move(src, dst, dry_run):
+    print(f"  移动: {src} -> {dst}")
+    if dry_run:
+        return
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    shutil.move(src, dst)
+
+
+def migrated_upload_name(image_id, filename, original_filename):
+    """迁移后的文件名由图像ID确定，重新执行时得到同一个目标路径"""
+    return storage.make_upload_name(original_filename or filename, key=f"image-{image_id}")
+
+
+def migrate_uploads(conn, upload_root, dry_run):
+    """迁移原始上传文件并更新image.filename
+
+    目标路径由图像ID确定：移动文件后、提交数据库前中断时，重新执行会发现源文件已不在、
+    目标文件已存在，直接补上数据库更新，不会把记录当作文件缺失或留下无人引用的文件。
+    """
+    moved = missing = 0
+    rows = conn.execute(text("SELECT id, filename, original_filename FROM image")).fetchall()
+    for image_id, filename, original_filename in rows:
+        if not filename or storage.is_sharded(filename):
+            continue
+        src = os.path.join(upload_root, filename)
+        new_name = migrated_upload_name(image_id, filename, original_filename)
+        dst = storage.upload_path(new_name, upload_root)
+        if os.path.exists(src):
+            move(src, dst, dry_run)
+        elif os.path.exists(dst):
+            print(f"  图像 {image_id}: 文件已在上次中断前移动到 {dst}")
+        else:
+            print(f"  跳过图像 {image_id}: 文件不存在 {src}")
+            missing += 1
+            continue
+        if not dry_run:
+            # 每条记录单独提交
+            conn.execute(text("UPDATE image SET filename = :name WHERE id = :id"),
+                         {'name': new_name, 'id': image_id})
+            conn.commit()
+        moved += 1
+    return moved, missing
+
+
+def migrate_task_dirs(conn, processed_root, dry_run):
+    """迁移任务目录并更新image.processed_filename"""
+    moved = 0
+    for entry in sorted(os.listdir(processed_root)):
+        src = os.path.join(processed_root, entry)
+        # 两位十六进制目录是分片目录本身
+        if (not os.path.isdir(src) or len(entry) == storage.SHARD_WIDTH
+                or '.incoming-' in entry or '.retired-' in entry):
+            continue
+        dst = os.path.join(processed_root, storage.task_relpath(entry))
+        if os.path.exists(dst):
+            print(f"  跳过任务目录 {entry}: 目标已存在 {dst}")
+            continue
+        move(src, dst, dry_run)
+        moved += 1
+
+    updated = 0
+    rows = conn.execute(text(
+        "SELECT id, task_id, processed_filename FROM image WHERE processed_filename IS NOT NULL"
+    )).fetchall()
+    for image_id, task_id, processed_filename in rows:
+        if storage.is_sharded(processed_filename):
+            continue
+        task_key, _, name = processed_filename.partition('/')
+        if not name:
+            # 旧版本生成的平铺文件 processed_<uuid>.nii
+            continue
+        new_name = storage.processed_filename(task_id or task_key, name)
+        print(f"  更新图像 {image_id}: {processed_filename} -> {new_name}")
+        if not dry_run:
+            conn.execute(text("UPDATE image SET processed_filename = :name WHERE id = :id"),
+                         {'name': new_name, 'id': image_id})
+            conn.commit()
+        updated += 1
+    return moved, updated
+
+
+def main():
+    parser = argparse.ArgumentParser(description='迁移上传文件和任务目录到分片存储布局')
+    parser.add_argument('--dry-run', action='store_true', help='只打印操作，不修改文件和数据库')
+    parser.add_argument('--database-url', default=Config.SQLALCHEMY_DATABASE_URI)
+    parser.add_argument('--upload-folder', default=Config.UPLOAD_FOLDER)
+    parser.add_argument('--processed-folder', default=Config.PROCESSED_FOLDER)
+    args = parser.parse_args()
+
+    print(f"数据库: {args.database_url}")
+    print(f"上传目录: {args.upload_folder}")
+    print(f"结果目录: {args.processed_folder}")
+    if args.dry_run:
+        print("*** 演练模式，不会修改任何内容 ***")
+
+    engine = create_engine(args.database_url)
+    try:
+        with engine.connect() as conn:
+            print("\n=== 迁移上传文件 ===")
+            moved, missing = migrate_uploads(conn, args.upload_folder, args.dry_run)
+            print(f"已迁移 {moved} 个文件，{missing} 个文件不存在")
+
+            print("\n=== 迁移任务目录 ===")
+            if os.path.isdir(args.processed_folder):
+                moved, updated = migrate_task_dirs(conn, args.processed_folder, args.dry_run)
+                print(f"已迁移 {moved} 个任务目录，更新 {updated} 条处理结果记录")
+    except Exception as e:
+        print(f"迁移失败: {str(e)}")
+        sys.exit(1)
+
+    print("\n存储迁移完成")
+
+
+if __name__ == '__main__':
+    main()
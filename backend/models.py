@@ -34,31 +34,38 @@ class Patient(db.Model):
     patient_id = db.Column(db.String(255), unique=True, nullable=False)
     age = db.Column(db.Integer)
     gender = db.Column(db.String(10))
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    deleted_at = db.Column(db.DateTime, index=True)  # 逻辑删除时间，数据由后台任务清理
+    purge_started_at = db.Column(db.DateTime)  # 清理任务认领时间，清理过程中每批刷新
     images = db.relationship('Image', backref='patient', lazy=True)
 
     def __repr__(self):
         return f'<Patient {self.name}>'
 
-    def to_dict(self):
-        return {
+    def to_dict(self, include_images=True):
+        data = {
             'id': self.id,
             'name': self.name,
             'patient_id': self.patient_id,
             'age': self.age,
             'gender': self.gender,
-            'created_at': self.created_at.isoformat(),
-            'images': [image.to_dict() for image in self.images]
+            'created_at': self.created_at.isoformat()
         }
+        if include_images:
+            data['images'] = [image.to_dict() for image in self.images]
+        return data
 
 class Image(db.Model):
     __tablename__ = 'image'
+    __table_args__ = (
+        db.Index('ix_image_patient_check_date', 'patient_id', 'check_date'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(255), nullable=False)
     original_filename = db.Column(db.String(255), nullable=False)
-    patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=False)
+    patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=False, index=True)
     check_date = db.Column(db.DateTime, nullable=False)
     lesion_volume = db.Column(db.Float)
     tissue_stats = db.Column(db.JSON)
@@ -71,7 +78,7 @@ class Image(db.Model):
     csf_volume = db.Column(db.Float)
     tiv_volume = db.Column(db.Float)
     processing_completed = db.Column(db.DateTime)
-    task_id = db.Column(db.String(255))
+    task_id = db.Column(db.String(255), index=True)
 
     def __repr__(self):
         return f'<Image {self.filename}>'
@@ -95,4 +102,184 @@ class Image(db.Model):
             'tiv_volume': self.tiv_volume,
             'processing_completed': self.processing_completed.isoformat() if self.processing_completed else None,
             'task_id': self.task_id
-        } 
\ No newline at end of file
+        } 
+
+
+class DicomInstance(db.Model):
+    """DICOM实例索引，供DICOMweb（QIDO-RS/WADO-RS）检索使用
+
+    同一个DICOM文件可以被多次上传（同一用户或不同用户），SOP实例UID只在所属图像内唯一。
+    """
+    __tablename__ = 'dicom_instance'
+    __table_args__ = (
+        db.UniqueConstraint('image_id', 'sop_instance_uid', name='uq_dicom_instance_image_sop'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    image_id = db.Column(db.Integer, db.ForeignKey('image.id'), nullable=False, index=True)
+    patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=False, index=True)
+    study_instance_uid = db.Column(db.String(64), nullable=False, index=True)
+    series_instance_uid = db.Column(db.String(64), nullable=False, index=True)
+    sop_instance_uid = db.Column(db.String(64), nullable=False, index=True)
+    sop_class_uid = db.Column(db.String(64))
+    dicom_patient_id = db.Column(db.String(64))
+    dicom_patient_name = db.Column(db.String(255))
+    study_date = db.Column(db.String(8))
+    study_time = db.Column(db.String(16))
+    study_description = db.Column(db.String(255))
+    accession_number = db.Column(db.String(64))
+    modality = db.Column(db.String(16))
+    series_number = db.Column(db.Integer)
+    series_description = db.Column(db.String(255))
+    instance_number = db.Column(db.Integer)
+    rows = db.Column(db.Integer)
+    columns = db.Column(db.Integer)
+    number_of_frames = db.Column(db.Integer, default=1)
+    samples_per_pixel = db.Column(db.Integer)
+    bits_allocated = db.Column(db.Integer)
+    transfer_syntax_uid = db.Column(db.String(64))
+    pixel_data_offset = db.Column(db.BigInteger)
+    pixel_data_length = db.Column(db.BigInteger)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    image = db.relationship('Image', backref=db.backref('dicom_instance', uselist=False, cascade='all, delete-orphan'))
+
+    def __repr__(self):
+        return f'<DicomInstance {self.sop_instance_uid}>'
+
+
+class PatientSummary(db.Model):
+    """患者汇总数据，在图像上传、处理完成和删除时增量维护"""
+    __tablename__ = 'patient_summary'
+
+    patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), primary_key=True)
+    scan_count = db.Column(db.Integer, nullable=False, default=0)
+    processed_count = db.Column(db.Integer, nullable=False, default=0)
+    first_check_date = db.Column(db.DateTime)
+    latest_check_date = db.Column(db.DateTime)
+    # 首次和最近一次已处理图像的体积结果
+    first_image_id = db.Column(db.Integer)
+    first_processed_date = db.Column(db.DateTime)
+    first_gm_volume = db.Column(db.Float)
+    first_wm_volume = db.Column(db.Float)
+    first_csf_volume = db.Column(db.Float)
+    first_tiv_volume = db.Column(db.Float)
+    latest_image_id = db.Column(db.Integer)
+    latest_processed_date = db.Column(db.DateTime)
+    latest_gm_volume = db.Column(db.Float)
+    latest_wm_volume = db.Column(db.Float)
+    latest_csf_volume = db.Column(db.Float)
+    latest_tiv_volume = db.Column(db.Float)
+    # GM/TIV随时间（年）的线性回归累加量
+    trend_n = db.Column(db.Integer, nullable=False, default=0)
+    trend_sum_x = db.Column(db.Float, nullable=False, default=0.0)
+    trend_sum_y = db.Column(db.Float, nullable=False, default=0.0)
+    trend_sum_xx = db.Column(db.Float, nullable=False, default=0.0)
+    trend_sum_xy = db.Column(db.Float, nullable=False, default=0.0)
+    last_activity = db.Column(db.DateTime)
+    # 已处理图像增加、减少或重新处理时递增，用作趋势等派生结果的缓存版本
+    results_version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    patient = db.relationship('Patient', backref=db.backref('summary', uselist=False, cascade='all, delete-orphan'))
+
+    def __repr__(self):
+        return f'<PatientSummary {self.patient_id}>'
+
+    def gm_tiv_trend(self):
+        """GM/TIV比值的线性趋势：平均值和每年变化量（少于两个时间点时斜率为None）"""
+        n = self.trend_n or 0
+        if n == 0:
+            return {'n': 0, 'mean_ratio': None, 'slope_per_year': None}
+        denominator = n * self.trend_sum_xx - self.trend_sum_x ** 2
+        slope = None
+        if n >= 2 and abs(denominator) > 1e-12:
+            slope = (n * self.trend_sum_xy - self.trend_sum_x * self.trend_sum_y) / denominator
+        return {'n': n, 'mean_ratio': self.trend_sum_y / n, 'slope_per_year': slope}
+
+    @staticmethod
+    def _volumes(image_id, date, gm, wm, csf, tiv):
+        if not image_id:
+            return None
+        return {
+            'image_id': image_id,
+            'check_date': date.isoformat() if date else None,
+            'gm_volume': gm,
+            'wm_volume': wm,
+            'csf_volume': csf,
+            'tiv_volume': tiv,
+        }
+
+    def to_dict(self):
+        return {
+            'scan_count': self.scan_count,
+            'processed_count': self.processed_count,
+            'first_check_date': self.first_check_date.isoformat() if self.first_check_date else None,
+            'latest_check_date': self.latest_check_date.isoformat() if self.latest_check_date else None,
+            'first_volumes': self._volumes(self.first_image_id, self.first_processed_date, self.first_gm_volume,
+                                           self.first_wm_volume, self.first_csf_volume, self.first_tiv_volume),
+            'latest_volumes': self._volumes(self.latest_image_id, self.latest_processed_date, self.latest_gm_volume,
+                                            self.latest_wm_volume, self.latest_csf_volume, self.latest_tiv_volume),
+            'gm_tiv_trend': self.gm_tiv_trend(),
+            'last_activity': self.last_activity.isoformat() if self.last_activity else None,
+            'results_version': self.results_version,
+        }
+
+
+class Measurement(db.Model):
+    """图像的分析测量值，每个 (指标, 区域) 一行，供按数值筛选的队列查询使用"""
+    __tablename__ = 'measurement'
+    __table_args__ = (
+        db.UniqueConstraint('image_id', 'metric', 'region', name='uq_measurement_image_metric_region'),
+        # 覆盖索引：按指标和数值范围筛选时只扫描索引即可得到图像ID
+        db.Index('ix_measurement_metric_region_value', 'metric', 'region', 'value', 'image_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    image_id = db.Column(db.Integer, db.ForeignKey('image.id'), nullable=False)
+    metric = db.Column(db.String(32), nullable=False)
+    region = db.Column(db.String(64), nullable=False, default='whole_brain')
+    value = db.Column(db.Float, nullable=False)
+    unit = db.Column(db.String(16))
+
+    def __repr__(self):
+        return f'<Measurement {self.image_id} {self.metric}/{self.region}>'
+
+    def to_dict(self):
+        return {
+            'image_id': self.image_id,
+            'metric': self.metric,
+            'region': self.region,
+            'value': self.value,
+            'unit': self.unit,
+        }
+
+
+class NormativeAggregate(db.Model):
+    """按指标、年龄段和性别分组的人群统计量（Welford算法的count/mean/M2），任务完成时增量更新"""
+    __tablename__ = 'normative_aggregate'
+
+    metric = db.Column(db.String(32), primary_key=True)
+    age_bucket = db.Column(db.Integer, primary_key=True)  # 年龄段下限，年龄未知时为-1
+    gender = db.Column(db.String(1), primary_key=True)  # M/F，未知为U
+    count = db.Column(db.Integer, nullable=False, default=0)
+    mean = db.Column(db.Float, nullable=False, default=0.0)
+    m2 = db.Column(db.Float, nullable=False, default=0.0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<NormativeAggregate {self.metric} {self.age_bucket} {self.gender}>'
+
+
+class NormativeSketchBin(db.Model):
+    """分位数草图的对数分桶计数（相对误差有界），同一分组的各桶可直接相加合并"""
+    __tablename__ = 'normative_sketch_bin'
+
+    metric = db.Column(db.String(32), primary_key=True)
+    age_bucket = db.Column(db.Integer, primary_key=True)
+    gender = db.Column(db.String(1), primary_key=True)
+    bin_index = db.Column(db.Integer, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<NormativeSketchBin {self.metric} {self.age_bucket} {self.gender} {self.bin_index}>'
@@ -0,0 +1,103 @@
+import logging
+from datetime import datetime
+import pytest
+from flask import Flask
+from flask_jwt_extended import JWTManager, create_access_token
+
+from config.config import Config
+from models import db, User, Patient, Image
+from app.routes.patient_routes import patient_bp
+from app.routes.volume_routes import volume_bp
+from app.routes.download_routes import download_bp
+from app.routes.dicomweb_routes import dicomweb_bp
+from app.routes.metrics_routes import metrics_bp
+from app.routes.measurement_routes import measurement_bp
+from app.routes.report_routes import report_bp
+from app.services import db_engine, identity_cache, summary_service
+from app.services.cache_service import init_cache
+
+logger = logging.getLogger(__name__)
+
+
+@pytest.fixture
+def api_app(tmp_path):
+    """注册全部蓝图的应用，数据库和数据目录位于临时目录；不加载app.py，不启动后台任务"""
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    app.config.update(
+        TESTING=True,
+        SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'api.db'}",
+        UPLOAD_FOLDER=str(tmp_path / 'uploads'),
+        PROCESSED_FOLDER=str(tmp_path / 'processed'),
+        REPORTS_FOLDER=str(tmp_path / 'reports'),
+        CACHE_TYPE='simple',
+    )
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = db_engine.engine_options(app.config)
+    db.init_app(app)
+    db_engine.init_engine(app, db)
+    JWTManager(app)
+    for blueprint, prefix in ((patient_bp, '/api'), (volume_bp, '/api'), (download_bp, '/api'),
+                              (dicomweb_bp, '/api/dicomweb'), (metrics_bp, '/api'),
+                              (measurement_bp, '/api'), (report_bp, '/api')):
+        app.register_blueprint(blueprint, url_prefix=prefix)
+    init_cache(app)
+    identity_cache.configure(Config.IDENTITY_CACHE_SIZE, Config.IDENTITY_CACHE_TTL)
+    # 各测试的数据库从头分配ID，缓存不能跨测试保留
+    identity_cache.user_cache.clear()
+    identity_cache.patient_owner_cache.clear()
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    """按文件加载app.py（包含上传、处理等未拆分到蓝图的路由），数据库和数据目录位于临时目录"""
+    from benchmarks.run import load_app
+
+    monkeypatch.chdir(tmp_path)  # app.log写在工作目录
+    for key, name in (('UPLOAD_FOLDER', 'uploads'), ('PROCESSED_FOLDER', 'processed'),
+                      ('REPORTS_FOLDER', 'reports'), ('LOG_FOLDER', 'logs')):
+        monkeypatch.setenv(key, str(tmp_path / name))
+    # Config在导入时已读取环境变量，这里直接替换类属性
+    monkeypatch.setattr(Config, 'SQLALCHEMY_DATABASE_URI', f"sqlite:///{tmp_path / 'server.db'}")
+    monkeypatch.setattr(Config, 'SCRATCH_ROOT', str(tmp_path / 'scratch'))
+    identity_cache.user_cache.clear()
+    identity_cache.patient_owner_cache.clear()
+    app = load_app()
+    with app.app_context():
+        yield app
+        db.session.remove()
+
+
+def make_user(username):
+    """创建用户并返回 (用户, 认证头)"""
+    user = User(username=username, email=f'{username}@example.com')
+    user.set_password('password')
+    db.session.add(user)
+    db.session.commit()
+    token = create_access_token(identity=str(user.id))
+    return user, {'Authorization': f'Bearer {token}'}
+
+
+def make_patient(user, patient_id, name=None, **fields):
+    """为用户创建患者（含汇总行）"""
+    patient = Patient(name=name or f'患者{patient_id}', patient_id=patient_id, age=fields.pop('age', 60),
+                      gender=fields.pop('gender', '女'), user_id=user.id, **fields)
+    db.session.add(patient)
+    db.session.flush()
+    summary_service.ensure_summary(patient.id)
+    db.session.commit()
+    return patient
+
+
+def make_image(patient, **fields):
+    """为患者创建图像记录"""
+    image = Image(filename=fields.pop('filename', 'x.nii'), original_filename=fields.pop('original_filename', 'x.nii'),
+                  patient_id=patient.id, check_date=fields.pop('check_date', datetime(2023, 1, 1)), **fields)
+    db.session.add(image)
+    db.session.flush()
+    summary_service.image_added(image)
+    db.session.commit()
+    return image
@@ -0,0 +1,177 @@
+import logging
+import threading
+import time
+from datetime import datetime
+import numpy as np
+import pytest
+from flask import Flask
+
+from models import db, User, Patient, Image
+from app.services import cache_service, cache_serializer
+from app.services.cache_service import TwoTierCache, LocalBackend
+
+logger = logging.getLogger(__name__)
+
+
+def test_concurrent_misses_compute_once():
+    """测试同一键并发未命中时只计算一次，其他进程的缓存实例从共享层读取"""
+    backend = LocalBackend()
+    cache = TwoTierCache(backend=backend, prefix='t:', jitter=0.1)
+    calls = []
+    start = threading.Barrier(10)
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.2)
+        return {'image': 'png'}
+
+    results = []
+
+    def worker():
+        start.wait()
+        results.append(cache.get_or_set('preview:1', compute, timeout=60))
+
+    threads = [threading.Thread(target=worker) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == [{'image': 'png'}] * 10
+    assert cache.stats()['flight_waits'] == 9
+
+    # 模拟另一个工作进程：L1为空，从共享层命中
+    other = TwoTierCache(backend=backend, prefix='t:')
+    assert other.get_or_set('preview:1', compute) == {'image': 'png'}
+    assert len(calls) == 1 and other.stats()['l2_hits'] == 1
+
+    # 计算失败时等待的线程得到同样的异常，且不会写入缓存
+    def fail():
+        raise RuntimeError('decode failed')
+    with pytest.raises(RuntimeError):
+        cache.get_or_set('preview:2', fail)
+    assert cache.get('preview:2') is None
+
+
+def test_ttl_jitter_bounds():
+    """测试过期时间在 ttl×(1±jitter) 范围内"""
+    cache = TwoTierCache(backend=None, jitter=0.2)
+    values = [cache.jittered(100) for _ in range(200)]
+    assert all(80 <= value <= 120 for value in values)
+    assert len(set(values)) > 1
+
+
+def test_model_writes_bump_tag_versions(tmp_path):
+    """测试患者和图像写入后带标签的条目失效，其他患者的条目不受影响"""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'cache.db'}"
+    db.init_app(app)
+    cache = cache_service.cache
+    cache.clear()
+    with app.app_context():
+        db.create_all()
+        user = User(username='u', email='u@example.com')
+        db.session.add(user)
+        db.session.flush()
+        first, second = (Patient(name=name, patient_id=name, user_id=user.id) for name in ('a', 'b'))
+        db.session.add_all([first, second])
+        db.session.commit()
+
+        computed = []
+
+        def detail(patient):
+            def compute():
+                computed.append(patient.id)
+                return {'name': patient.name}
+            return cache.get_or_set(f"detail:{patient.id}", compute, tags=[cache_service.patient_tag(patient.id)])
+
+        assert detail(first) == {'name': 'a'} and detail(second) == {'name': 'b'}
+        first.name = 'a2'
+        db.session.flush()
+        assert detail(first) == {'name': 'a2'}
+        # 提交后版本再次递增，提交前按新版本写入的条目同样失效
+        db.session.commit()
+        assert detail(first) == {'name': 'a2'} and detail(second) == {'name': 'b'}
+        assert computed == [first.id, second.id, first.id, first.id]
+
+        # 新增图像使所属患者、图像和任务标签失效
+        before = cache.versions([cache_service.patient_tag(first.id), cache_service.patient_tag(second.id)])
+        image = Image(filename='x.nii', original_filename='x.nii', patient_id=first.id, task_id='t1',
+                      check_date=datetime(2023, 1, 1))
+        db.session.add(image)
+        db.session.commit()
+        versions = cache.versions([cache_service.patient_tag(first.id), cache_service.image_tag(image.id),
+                                   cache_service.task_tag('t1'), cache_service.patient_tag(second.id)])
+        assert versions[0] > before[0] and versions[1] > 0 and versions[2] > 0
+        assert versions[3] == before[1]
+
+
+def test_serializer_round_trip_and_keys():
+    """测试数组按原始内存存储并零拷贝读取、嵌套结果的往返、压缩和稳定的键摘要"""
+    slice_ = np.arange(256 * 256, dtype=np.float32).reshape(256, 256)
+    payload = cache_serializer.dumps(slice_, compress_threshold=None)
+    assert len(payload) < slice_.nbytes + 64
+    restored = cache_serializer.loads(payload)
+    assert restored.dtype == slice_.dtype and np.array_equal(restored, slice_)
+    assert not restored.flags.writeable  # 直接引用载荷内存
+
+    result = {'scan_count': 2, 'when': datetime(2023, 1, 1, 8, 30), 'ratio': np.float64(0.4),
+              'volumes': np.ones((3, 4), dtype='<i2'), 7: [None, True, 'x']}
+    restored = cache_serializer.loads(cache_serializer.dumps(result))
+    assert restored['when'] == result['when'] and restored[7] == [None, True, 'x']
+    assert restored['ratio'] == 0.4 and np.array_equal(restored['volumes'], result['volumes'])
+    # 0维数组和非连续视图保留原形状
+    for array in (np.array(3.5), np.arange(12).reshape(3, 4)[:, ::2]):
+        restored = cache_serializer.loads(cache_serializer.dumps(array))
+        assert restored.shape == array.shape and np.array_equal(restored, array)
+
+    if cache_serializer.lz4_available():
+        zeros = np.zeros((128, 128, 64), dtype=np.float32)
+        payload = cache_serializer.dumps(zeros, compress_threshold=1024)
+        assert len(payload) < zeros.nbytes / 20
+        assert np.array_equal(cache_serializer.loads(payload), zeros)
+
+    # 字典顺序不影响键；str()相同（被省略号截断）的大数组得到不同的键
+    assert cache_service.cache_key(a=1, b={'x': 1, 'y': 2}) == cache_service.cache_key(b={'y': 2, 'x': 1}, a=1)
+    a, b = np.zeros(5000), np.zeros(5000)
+    b[2500] = 1
+    assert str(a) == str(b) and cache_service.cache_key(a) != cache_service.cache_key(b)
+    assert cache_service.cache_key('1') != cache_service.cache_key(1)
+    assert cache_service.cache_key(np.array(1.0)) != cache_service.cache_key(np.array([1.0]))
+
+
+def test_l1_hits_skip_version_lookups(monkeypatch):
+    """测试L1命中时标签版本号取自进程内缓存，不访问共享层；其他进程的bump在version_ttl后生效"""
+    class CountingBackend(LocalBackend):
+        def __init__(self):
+            super().__init__()
+            self.version_reads = 0
+
+        def get_many(self, keys):
+            self.version_reads += 1
+            return super().get_many(keys)
+
+    clock = [1000.0]
+    monkeypatch.setattr(cache_service.time, 'monotonic', lambda: clock[0])
+    backend = CountingBackend()
+    cache = TwoTierCache(backend=backend, prefix='t:', version_ttl=1)
+    other = TwoTierCache(backend=backend, prefix='t:', version_ttl=1)
+    tags = [cache_service.patient_tag(1)]
+
+    assert cache.get_or_set('detail:1', lambda: 'v1', tags=tags) == 'v1'
+    for _ in range(5):
+        assert cache.get_or_set('detail:1', lambda: 'unused', tags=tags) == 'v1'
+    assert backend.version_reads == 1
+
+    # 本进程的bump立即生效
+    cache.bump(*tags)
+    assert cache.get_or_set('detail:1', lambda: 'v2', tags=tags) == 'v2'
+    assert backend.version_reads == 1
+
+    # 其他进程的bump在版本缓存过期后生效
+    other.bump(*tags)
+    assert cache.get_or_set('detail:1', lambda: 'v3', tags=tags) == 'v2'
+    clock[0] += 2
+    assert cache.get_or_set('detail:1', lambda: 'v3', tags=tags) == 'v3'
+    assert backend.version_reads == 2
@@ -0,0 +1,45 @@
+import logging
+from sqlalchemy import text
+
+from config.config import Config
+from models import db
+from app.services import db_engine
+from conftest import make_user, make_patient
+
+logger = logging.getLogger(__name__)
+
+
+def test_sqlite_pragmas_applied(api_app):
+    """测试每个新连接都设置了WAL、busy_timeout和synchronous"""
+    for _ in range(2):
+        with db.engine.connect() as conn:
+            assert conn.execute(text('PRAGMA journal_mode')).scalar() == 'wal'
+            assert conn.execute(text('PRAGMA busy_timeout')).scalar() == Config.SQLITE_BUSY_TIMEOUT_MS
+            # NORMAL = 1
+            assert conn.execute(text('PRAGMA synchronous')).scalar() == 1
+        db.engine.dispose()
+
+
+def test_metrics_counts_statements(api_app, monkeypatch):
+    """测试语句、写语句和慢查询计数，指标接口不返回SQL文本"""
+    user, headers = make_user('metrics')
+    db_engine.metrics.reset()
+    monkeypatch.setattr(db_engine.metrics, 'slow_seconds', 0.0)
+
+    make_patient(user, 'M001', name='秘密姓名')
+    snapshot = db_engine.metrics.snapshot()
+    assert snapshot['statements'] > 0
+    assert snapshot['write_statements'] > 0
+    assert snapshot['write_seconds'] > 0
+    assert snapshot['slow_statements'] == snapshot['statements']
+
+    response = api_app.test_client().get('/api/metrics', headers=headers)
+    assert response.status_code == 200
+    body = response.get_data(as_text=True)
+    database = response.get_json()['database']
+    assert 'last_slow_statement' not in database
+    assert 'write_wait_seconds' not in database
+    assert 'INSERT' not in body and 'SELECT' not in body
+
+    db_engine.metrics.reset()
+    assert db_engine.metrics.snapshot()['statements'] == 0
@@ -0,0 +1,152 @@
+import re
+import shutil
+import logging
+import numpy as np
+import pytest
+
+from conftest import make_user, make_patient, make_image
+from benchmarks import phantom
+from models import db, Image, DicomInstance
+from app.services import storage, purge_service, dicomweb_service
+from app.services.dicomweb_service import index_dicom_file, frame_cache
+
+logger = logging.getLogger(__name__)
+
+
+def _upload(patient, source):
+    """把DICOM文件放入上传目录并写入索引，与上传接口相同"""
+    name, path = storage.new_upload_path('scan.dcm')
+    shutil.copy(source, path)
+    image = make_image(patient, filename=name, original_filename='scan.dcm')
+    return index_dicom_file(image, path)
+
+
+def _frames(response):
+    """解析multipart/related响应，返回各部分的内容"""
+    boundary = response.headers['Content-Type'].split('boundary=')[1]
+    parts = []
+    for chunk in response.data.split(f'--{boundary}'.encode())[1:-1]:
+        headers, _, body = chunk.partition(b'\r\n\r\n')
+        length = int(re.search(rb'Content-Length: (\d+)', headers).group(1))
+        parts.append(body[:length])
+    return parts
+
+
+@pytest.fixture
+def volume(tmp_path):
+    return np.arange(4 * 5 * 3, dtype=np.int16).reshape(4, 5, 3)
+
+
+@pytest.fixture
+def scans(tmp_path, volume):
+    """两个检查的DICOM文件：不同的患者编号"""
+    return (phantom.write_dicom(str(tmp_path / 'a.dcm'), volume, patient_id='MR-001'),
+            phantom.write_dicom(str(tmp_path / 'b.dcm'), volume, patient_id='CT-002'))
+
+
+def test_qido_filters(api_app, scans):
+    """测试QIDO-RS按患者编号通配符、日期范围和模态过滤，无结果时返回204"""
+    user, headers = make_user('u')
+    patient = make_patient(user, 'P001')
+    first, second = (_upload(patient, path) for path in scans)
+    client = api_app.test_client()
+
+    def studies(query=''):
+        response = client.get(f'/api/dicomweb/studies{query}', headers=headers)
+        return [] if response.status_code == 204 else [s['0020000D']['Value'][0] for s in response.get_json()]
+
+    assert sorted(studies()) == sorted([first.study_instance_uid, second.study_instance_uid])
+    assert studies('?PatientID=MR*') == [first.study_instance_uid]
+    assert studies('?PatientID=??-002') == [second.study_instance_uid]
+    assert len(studies('?StudyDate=20231201-20240101')) == 2
+    assert studies('?StudyDate=20240102-') == []
+    assert len(studies('?ModalitiesInStudy=MR')) == 2
+    assert studies('?ModalitiesInStudy=CT') == []
+
+    series = client.get(f'/api/dicomweb/studies/{first.study_instance_uid}/series', headers=headers).get_json()
+    assert [s['0020000E']['Value'][0] for s in series] == [first.series_instance_uid]
+    instances = client.get(f'/api/dicomweb/studies/{first.study_instance_uid}/series/'
+                           f'{first.series_instance_uid}/instances', headers=headers).get_json()
+    assert instances[0]['00080018']['Value'] == [first.sop_instance_uid]
+    assert instances[0]['00280008']['Value'] == [3]
+
+
+def test_wado_frames(api_app, scans, volume):
+    """测试WADO-RS按帧号返回原始位深的帧数据，帧号越界返回404"""
+    user, headers = make_user('u')
+    instance = _upload(make_patient(user, 'P001'), scans[0])
+    frame_cache.clear()
+    url = (f'/api/dicomweb/studies/{instance.study_instance_uid}/series/{instance.series_instance_uid}'
+           f'/instances/{instance.sop_instance_uid}/frames')
+    client = api_app.test_client()
+
+    response = client.get(f'{url}/3,1', headers=headers)
+    assert response.status_code == 200
+    assert b'transfer-syntax=1.2.840.10008.1.2.1' in response.data
+    frames = _frames(response)
+    assert frames == [volume[:, :, 2].astype('<i2').tobytes(), volume[:, :, 0].astype('<i2').tobytes()]
+    assert client.get(f'{url}/4', headers=headers).status_code == 404
+    assert client.get(f'{url}/x', headers=headers).status_code == 400
+
+
+def test_duplicate_upload_is_indexed_per_owner(api_app, scans):
+    """测试同一DICOM被同一用户和其他用户重复上传时都写入索引，各用户只能检索到自己的实例"""
+    alice, alice_headers = make_user('alice')
+    bob, bob_headers = make_user('bob')
+    first = _upload(make_patient(alice, 'A001'), scans[0])
+    again = _upload(make_patient(alice, 'A002'), scans[0])
+    other = _upload(make_patient(bob, 'B001'), scans[0])
+    assert DicomInstance.query.filter_by(sop_instance_uid=first.sop_instance_uid).count() == 3
+    assert len({first.image_id, again.image_id, other.image_id}) == 3
+    client = api_app.test_client()
+    frame_cache.clear()
+
+    # 同一用户的重复实例只返回最新的一份
+    studies = client.get('/api/dicomweb/studies', headers=alice_headers).get_json()
+    assert len(studies) == 1 and studies[0]['00201208']['Value'] == [1]
+    url = (f'/api/dicomweb/studies/{first.study_instance_uid}/series/{first.series_instance_uid}'
+           f'/instances/{first.sop_instance_uid}')
+    assert client.get(f'{url}/frames/1', headers=alice_headers).status_code == 200
+    assert client.get(f'{url}/frames/1', headers=bob_headers).status_code == 200
+
+    # 删除bob的图像后，bob检索不到，alice不受影响
+    db.session.delete(db.session.get(DicomInstance, other.id))
+    db.session.commit()
+    assert client.get('/api/dicomweb/studies', headers=bob_headers).status_code == 204
+    assert client.get(f'{url}/frames/1', headers=bob_headers).status_code == 404
+    assert client.get(f'{url}/metadata', headers=alice_headers).status_code == 200
+
+    # 重新索引同一图像时更新已有记录
+    image = db.session.get(Image, first.image_id)
+    index_dicom_file(image, storage.upload_path(image.filename))
+    assert DicomInstance.query.filter_by(image_id=first.image_id).count() == 1
+
+
+def test_purged_frames_not_served_after_rowid_reuse(api_app, tmp_path, volume, monkeypatch):
+    """测试清理患者后新上传的实例即使复用了行ID，也不会读到已删除实例的缓存帧"""
+    monkeypatch.setattr(dicomweb_service, 'can_read_frames_directly', lambda instance: False)  # 走解码和缓存
+    frame_cache.clear()
+    alice, alice_headers = make_user('alice')
+    bob, bob_headers = make_user('bob')
+    client = api_app.test_client()
+
+    def frames(instance, headers):
+        url = (f'/api/dicomweb/studies/{instance.study_instance_uid}/series/{instance.series_instance_uid}'
+               f'/instances/{instance.sop_instance_uid}/frames/1')
+        response = client.get(url, headers=headers)
+        assert response.status_code == 200
+        return _frames(response)[0]
+
+    patient = make_patient(alice, 'A001')
+    old = _upload(patient, phantom.write_dicom(str(tmp_path / 'old.dcm'), volume))
+    old_id = old.id
+    assert frames(old, alice_headers) == volume[:, :, 0].astype('<i2').tobytes()
+
+    purge_service.mark_deleted(patient)
+    db.session.commit()
+    purge_service.purge_patient(patient.id)
+
+    other = volume[::-1].copy()
+    new = _upload(make_patient(bob, 'B001'), phantom.write_dicom(str(tmp_path / 'new.dcm'), other))
+    assert new.id == old_id  # SQLite复用了被删除实例的行ID
+    assert frames(new, bob_headers) == other[:, :, 0].astype('<i2').tobytes()
@@ -0,0 +1,77 @@
+import os
+import gzip
+import logging
+import pytest
+
+from conftest import make_user, make_patient, make_image
+from app.services import storage
+
+logger = logging.getLogger(__name__)
+
+PAYLOAD = bytes(range(256)) * 64
+
+
+@pytest.fixture
+def download(api_app):
+    """上传一个.nii文件，返回 (测试客户端, 认证头, 下载地址)"""
+    user, headers = make_user('u')
+    name, path = storage.new_upload_path('scan.nii')
+    with open(path, 'wb') as f:
+        f.write(PAYLOAD)
+    image = make_image(make_patient(user, 'P001'), filename=name, original_filename='scan.nii')
+    return api_app.test_client(), headers, f'/api/download/images/{image.id}'
+
+
+def test_byte_ranges(download):
+    """测试单段Range返回206，超出范围返回416，多段Range退回完整内容"""
+    client, headers, url = download
+    response = client.get(url, headers={**headers, 'Range': 'bytes=100-299'})
+    assert response.status_code == 206
+    assert response.data == PAYLOAD[100:300]
+    assert response.headers['Content-Range'] == f'bytes 100-299/{len(PAYLOAD)}'
+
+    suffix = client.get(url, headers={**headers, 'Range': 'bytes=-10'})
+    assert suffix.status_code == 206 and suffix.data == PAYLOAD[-10:]
+
+    unsatisfiable = client.get(url, headers={**headers, 'Range': f'bytes={len(PAYLOAD)}-'})
+    assert unsatisfiable.status_code == 416
+    assert unsatisfiable.headers['Content-Range'] == f'bytes */{len(PAYLOAD)}'
+
+    # 不支持multipart/byteranges，多段请求返回完整文件
+    multi = client.get(url, headers={**headers, 'Range': 'bytes=0-9,20-29'})
+    assert multi.status_code == 200 and multi.data == PAYLOAD
+
+
+def test_if_range_and_etag(download):
+    """测试If-Range的ETag匹配时返回部分内容，不匹配时返回完整的新内容；If-None-Match返回304"""
+    client, headers, url = download
+    etag = client.get(url, headers=headers).headers['ETag']
+
+    matching = client.get(url, headers={**headers, 'Range': 'bytes=0-9', 'If-Range': etag})
+    assert matching.status_code == 206 and matching.data == PAYLOAD[:10]
+    stale = client.get(url, headers={**headers, 'Range': 'bytes=0-9', 'If-Range': '"outdated"'})
+    assert stale.status_code == 200 and stale.data == PAYLOAD
+
+    assert client.get(url, headers={**headers, 'If-None-Match': etag}).status_code == 304
+
+
+def test_gzip_streaming(download):
+    """测试接受gzip时.nii即时压缩输出，带弱ETag可条件请求；Range请求不压缩"""
+    client, headers, url = download
+    response = client.get(url, headers={**headers, 'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    assert response.headers['ETag'].startswith('W/')
+    assert gzip.decompress(response.data) == PAYLOAD
+
+    cached = client.get(url, headers={**headers, 'Accept-Encoding': 'gzip',
+                                      'If-None-Match': response.headers['ETag']})
+    assert cached.status_code == 304
+
+    ranged = client.get(url, headers={**headers, 'Accept-Encoding': 'gzip', 'Range': 'bytes=0-9'})
+    assert ranged.status_code == 206 and 'Content-Encoding' not in ranged.headers
+    assert ranged.data == PAYLOAD[:10]
+
+    identity = client.get(url, headers=headers)
+    assert 'Content-Encoding' not in identity.headers and identity.data == PAYLOAD
@@ -0,0 +1,65 @@
+import logging
+
+from models import db
+from app.services import identity_cache, purge_service, ttl_cache
+from app.services.ttl_cache import TTLCache
+from conftest import make_user, make_patient
+
+logger = logging.getLogger(__name__)
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_ttl_and_lru(monkeypatch):
+    """测试命中、过期和按最近使用淘汰"""
+    clock = _Clock()
+    monkeypatch.setattr(ttl_cache.time, 'monotonic', clock)
+    cache = TTLCache(maxsize=2, ttl=10)
+
+    cache.set('a', 1)
+    assert cache.get('a') == 1
+    clock.now += 11
+    assert cache.get('a', None) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')  # a变为最近使用，新条目应淘汰b
+    cache.set('c', 3)
+    assert cache.get('b', None) is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert cache.evictions == 1
+
+
+def test_owner_lookup_cached_and_invalidated_on_delete(api_app):
+    """测试归属检查命中缓存时不查询数据库，逻辑删除患者后立即失效"""
+    user, _ = make_user('owner')
+    patient = make_patient(user, 'C001')
+    cache = identity_cache.patient_owner_cache
+
+    assert identity_cache.user_owns_patient(user.id, patient.id)
+    hits = cache.hits
+    assert identity_cache.user_owns_patient(user.id, patient.id)
+    assert cache.hits == hits + 1
+
+    purge_service.mark_deleted(patient)
+    db.session.commit()
+    assert not identity_cache.user_owns_patient(user.id, patient.id)
+    assert cache.invalidations >= 1
+
+
+def test_user_cache_invalidated_on_update(api_app):
+    """测试用户变更后缓存的列值失效"""
+    user, _ = make_user('renamed')
+    user_id = user.id
+    assert identity_cache.get_user(user_id).username == 'renamed'
+    user.email = 'new@example.com'
+    db.session.commit()
+    db.session.expunge_all()
+    assert identity_cache.get_user(user_id).email == 'new@example.com'
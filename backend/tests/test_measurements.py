@@ -0,0 +1,126 @@
+import logging
+from datetime import datetime
+import numpy as np
+import pydicom
+import pytest
+from sqlalchemy import text
+
+from models import db, Measurement
+from app.services import measurement_service, export_service
+from benchmarks import phantom
+from conftest import make_user, make_patient, make_image
+
+logger = logging.getLogger(__name__)
+
+
+@pytest.fixture
+def patients(api_app):
+    """两个用户各有一名患者"""
+    return [make_patient(make_user(name)[0], f'P-{name}') for name in ('a', 'b')]
+
+
+def _processed_image(patient, gm, tiv):
+    image = make_image(patient, processed=True)
+    measurement_service.record_volumes(image.id, {
+        'gm_volume': gm, 'wm_volume': tiv * 0.35, 'csf_volume': tiv - gm - tiv * 0.35, 'tiv_volume': tiv
+    })
+    return image
+
+
+def test_cohort_query_uses_measurements(patients):
+    """测试批量写入、重新处理替换旧值，以及按GM/TIV比值筛选并分页"""
+    patient_a, patient_b = patients
+    images = [_processed_image(patient_a, gm, 1500.0) for gm in (540.0, 570.0, 600.0, 660.0)]
+    _processed_image(patient_b, 450.0, 1500.0)
+    db.session.commit()
+
+    assert Measurement.query.filter_by(image_id=images[0].id).count() == len(measurement_service.METRICS)
+    volumes = measurement_service.get_volumes(images[0].id)
+    assert volumes['gm_volume'] == 540.0 and volumes['tiv_volume'] == 1500.0
+
+    # 重新处理后旧的测量值被替换
+    measurement_service.record_volumes(images[3].id, {'gm_volume': 590.0, 'tiv_volume': 1500.0})
+    db.session.commit()
+    assert measurement_service.get_volumes(images[3].id)['wm_volume'] is None
+
+    user_id = patient_a.user_id
+    first, cursor = measurement_service.query_cohort(user_id, 'gm_tiv_ratio', 'lt', 0.4, limit=2)
+    assert [row['image_id'] for row in first] == [images[0].id, images[1].id]
+    assert cursor is not None
+    second, cursor = measurement_service.query_cohort(
+        user_id, 'gm_tiv_ratio', 'lt', 0.4, limit=2, cursor=measurement_service.decode_cohort_cursor(cursor))
+    # 其他用户的患者不会出现在结果中
+    assert [row['image_id'] for row in second] == [images[3].id]
+    assert cursor is None
+
+    plan = ' '.join(str(row[-1]) for row in db.session.execute(text(
+        "EXPLAIN QUERY PLAN SELECT image_id FROM measurement "
+        "WHERE metric = 'gm_tiv_ratio' AND region = 'whole_brain' AND value < 0.4"
+    )))
+    assert 'COVERING INDEX ix_measurement_metric_region_value' in plan
+
+
+def test_export_csv_streams_filtered_rows(patients):
+    """测试CSV导出按列选择和处理状态筛选，只包含当前用户的图像"""
+    patient_a, patient_b = patients
+    image = _processed_image(patient_a, 600.0, 1500.0)
+    make_image(patient_a, check_date=datetime(2023, 2, 1))
+    _processed_image(patient_b, 450.0, 1500.0)
+    db.session.commit()
+
+    columns = export_service.parse_columns('image_id,gm_tiv_ratio,processed')
+    stream, _, _ = export_service.export_measurements('csv', patient_a.user_id, columns, batch_size=1)
+    lines = b''.join(stream).decode('utf-8').splitlines()
+    assert lines[0] == 'image_id,gm_tiv_ratio,processed'
+    assert len(lines) == 3 and lines[2].endswith(',,0')
+
+    stream, _, _ = export_service.export_measurements('csv', patient_a.user_id, columns, batch_size=1,
+                                                      processed_only=True)
+    lines = b''.join(stream).decode('utf-8').splitlines()
+    assert lines[1:] == [f'{image.id},0.4,1']
+
+    with pytest.raises(ValueError):
+        export_service.parse_columns('image_id,unknown')
+
+
+def test_tissue_volumes_of_phantom(tmp_path):
+    """测试按体模概率图计算的体积与解析值一致，DICOM体模可按原像素读回"""
+    shape = phantom.SHAPES['small']
+    files = phantom.write_task(str(tmp_path / 'task'), shape, voxel_size=1.5)
+    volumes = measurement_service.compute_tissue_volumes(files)
+    maps = phantom.tissue_maps(shape)
+    for tissue in ('gm', 'wm', 'csf'):
+        # 概率图按uint8保存，每个体素的量化误差不超过1/510
+        expected = maps[tissue].sum() * 1.5 ** 3
+        assert volumes[f'{tissue}_volume'] == pytest.approx(expected, rel=1e-3)
+    assert volumes['tiv_volume'] == pytest.approx(sum(volumes[f'{t}_volume'] for t in ('gm', 'wm', 'csf')))
+    assert volumes['gm_volume'] > volumes['wm_volume'] > volumes['csf_volume'] > 0
+
+    volume = phantom.make_volume(shape, 'uint16')
+    ds = pydicom.dcmread(phantom.write_dicom(str(tmp_path / 'phantom.dcm'), volume))
+    assert ds.NumberOfFrames == shape[2] and np.array_equal(np.moveaxis(ds.pixel_array, 0, 2), volume)
+
+
+def test_fake_matlab_writes_cat12_outputs(tmp_path, monkeypatch):
+    """测试MATLAB替身解析流水线生成的脚本，写入p0-p3结果和diary日志，组织体积接近体模的解析值"""
+    from benchmarks import fake_matlab
+    shape = phantom.SHAPES['small']
+    nifti_file = phantom.write_nifti(str(tmp_path / 'input.nii'), phantom.make_volume(shape, noise=0.02))
+    log_file = tmp_path / 'matlab.log'
+    script = tmp_path / 'cat12_process.m'
+    script.write_text(f"diary('{log_file}');\n"
+                      f"matlabbatch{{1}}.spm.tools.cat.estwrite.data = {{'{nifti_file}'}};\n")
+    monkeypatch.setenv('FAKE_MATLAB_DURATION', '0')
+
+    assert fake_matlab.main(['-nodesktop', '-nosplash', '-r', f"run('{script}')"]) == 0
+    files = {tissue: str(tmp_path / 'mri' / f'p{index}input.nii')
+             for index, tissue in ((1, 'gm'), (2, 'wm'), (3, 'csf'))}
+    volumes = measurement_service.compute_tissue_volumes(files)
+    maps = phantom.tissue_maps(shape)
+    for tissue in ('gm', 'wm', 'csf'):
+        assert volumes[f'{tissue}_volume'] == pytest.approx(maps[tissue].sum(), rel=0.15)
+    assert (tmp_path / 'mri' / 'p0input.nii').exists()
+    assert 'Write result maps' in log_file.read_text()
+
+    monkeypatch.setenv('FAKE_MATLAB_FAIL_RATE', '1')
+    assert fake_matlab.main(['-r', f"run('{script}')"]) == 1
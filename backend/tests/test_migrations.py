@@ -0,0 +1,105 @@
+import logging
+import pytest
+from sqlalchemy import create_engine, event, inspect, text
+
+from app.services import migration_service
+from models import db
+
+logger = logging.getLogger(__name__)
+
+
+@pytest.fixture
+def legacy_engine(tmp_path):
+    """创建缺少新列和索引的旧版数据库"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE patient (id INTEGER PRIMARY KEY, name VARCHAR(255), "
+                          "patient_id VARCHAR(255), age INTEGER, gender VARCHAR(10), "
+                          "user_id INTEGER, created_at DATETIME)"))
+        conn.execute(text("CREATE TABLE image (id INTEGER PRIMARY KEY, filename VARCHAR(255), "
+                          "original_filename VARCHAR(255), patient_id INTEGER, check_date DATETIME)"))
+        conn.execute(text("INSERT INTO image (filename, original_filename, patient_id, check_date) "
+                          "VALUES ('a.dcm', 'a.dcm', 1, '2024-01-01')"))
+    return engine
+
+
+def test_upgrade_legacy_database(legacy_engine):
+    """测试旧数据库升级后补齐列、索引和版本记录"""
+    version = migration_service.upgrade(legacy_engine)
+    assert version == migration_service.LATEST_VERSION
+
+    inspector = inspect(legacy_engine)
+    columns = {col['name'] for col in inspector.get_columns('image')}
+    assert {'task_id', 'processed', 'gm_volume'} <= columns
+    indexes = {idx['name'] for idx in inspector.get_indexes('image')}
+    assert {'ix_image_patient_id', 'ix_image_task_id', 'ix_image_patient_check_date'} <= indexes
+    assert 'ix_patient_user_id' in {idx['name'] for idx in inspector.get_indexes('patient')}
+
+    with legacy_engine.connect() as conn:
+        assert conn.execute(text("SELECT processed FROM image")).scalar() == 0
+        applied = conn.execute(text("SELECT version FROM schema_version ORDER BY version")).scalars().all()
+    assert applied == [number for number, _, _ in migration_service.MIGRATIONS]
+
+
+def test_upgrade_fresh_database_matches_models(tmp_path):
+    """测试新建数据库时迁移可以在create_all之后重复执行"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'fresh.db'}")
+    migration_service.upgrade(engine, create_all=lambda: db.metadata.create_all(engine))
+    assert migration_service.pending_migrations(engine) == []
+
+
+def test_up_to_date_check_is_single_query(legacy_engine):
+    """测试schema已是最新版本时启动只执行一条查询"""
+    migration_service.upgrade(legacy_engine)
+    statements = []
+    event.listen(legacy_engine, 'before_cursor_execute',
+                 lambda conn, cursor, statement, *args: statements.append(statement))
+    migration_service.upgrade(legacy_engine, create_all=lambda: pytest.fail('不应调用create_all'))
+    assert len(statements) == 1
+
+
+def test_patient_fts_follows_patient_table(legacy_engine):
+    """测试FTS5索引通过触发器与patient表保持同步"""
+    with legacy_engine.begin() as conn:
+        conn.execute(text("INSERT INTO patient (id, name, patient_id, user_id) VALUES (1, 'Zhang Wei', 'MR001', 1)"))
+    migration_service.upgrade(legacy_engine)
+
+    def match(query):
+        with legacy_engine.connect() as conn:
+            return conn.execute(text("SELECT rowid FROM patient_fts WHERE patient_fts MATCH :q"),
+                                {'q': query}).scalars().all()
+
+    assert match('"zha"*') == [1]
+    with legacy_engine.begin() as conn:
+        conn.execute(text("INSERT INTO patient (id, name, patient_id, user_id) VALUES (2, '李四', 'MR002', 1)"))
+        conn.execute(text("UPDATE patient SET name = 'Wang Wei' WHERE id = 1"))
+    assert match('"zha"*') == []
+    assert match('"wei"*') == [1]
+    assert match('"MR00"*') == [1, 2]
+    with legacy_engine.begin() as conn:
+        conn.execute(text("DELETE FROM patient WHERE id = 2"))
+    assert match('"李"*') == []
+
+
+def test_dicom_instance_uid_unique_per_image(legacy_engine):
+    """测试旧库中全局唯一的SOP实例UID约束被改为按图像唯一，已有索引数据保留"""
+    with legacy_engine.begin() as conn:
+        conn.execute(text("CREATE TABLE dicom_instance (id INTEGER PRIMARY KEY, image_id INTEGER NOT NULL, "
+                          "patient_id INTEGER NOT NULL, study_instance_uid VARCHAR(64) NOT NULL, "
+                          "series_instance_uid VARCHAR(64) NOT NULL, sop_instance_uid VARCHAR(64) NOT NULL UNIQUE, "
+                          "number_of_frames INTEGER)"))
+        conn.execute(text("CREATE INDEX ix_dicom_instance_image_id ON dicom_instance (image_id)"))
+        conn.execute(text("INSERT INTO dicom_instance (image_id, patient_id, study_instance_uid, "
+                          "series_instance_uid, sop_instance_uid) VALUES (1, 1, '1.2', '1.2.3', '1.2.3.4')"))
+    migration_service.upgrade(legacy_engine)
+
+    insert = text("INSERT INTO dicom_instance (image_id, patient_id, study_instance_uid, series_instance_uid, "
+                  "sop_instance_uid) VALUES (:image_id, 1, '1.2', '1.2.3', '1.2.3.4')")
+    with legacy_engine.begin() as conn:
+        assert conn.execute(text("SELECT image_id FROM dicom_instance")).scalars().all() == [1]
+        conn.execute(insert, {'image_id': 2})
+    with pytest.raises(Exception):
+        with legacy_engine.begin() as conn:
+            conn.execute(insert, {'image_id': 2})
+    indexes = {idx['name'] for idx in inspect(legacy_engine).get_indexes('dicom_instance')}
+    assert {'ix_dicom_instance_sop_instance_uid', 'ix_dicom_instance_image_id'} <= indexes
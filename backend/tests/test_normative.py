@@ -0,0 +1,55 @@
+import logging
+import random
+import numpy as np
+import pytest
+
+from models import db, NormativeAggregate
+from app.services import measurement_service, normative_service
+from conftest import make_user, make_patient, make_image
+
+logger = logging.getLogger(__name__)
+
+
+def _process(patient, gm, tiv=1500.0):
+    """模拟任务完成：写入测量值并增量更新常模"""
+    image = make_image(patient, processed=True)
+    _reprocess(patient, image, gm, tiv)
+    return image
+
+
+def _reprocess(patient, image, gm, tiv=1500.0):
+    previous = measurement_service.get_metrics(image.id)
+    measurement_service.record_volumes(image.id, {'gm_volume': gm, 'wm_volume': 500.0,
+                                                  'csf_volume': tiv - gm - 500.0, 'tiv_volume': tiv})
+    normative_service.update_scan(normative_service.group_of(patient), previous,
+                                  measurement_service.get_metrics(image.id))
+    db.session.commit()
+
+
+def test_incremental_aggregates_and_scores(api_app):
+    """测试增量统计量与完整计算一致，并给出z分数、百分位和参照组回退"""
+    user, _ = make_user('u')
+    rng = random.Random(7)
+    patients = [make_patient(user, f'P{i:03d}', age=60 + i % 10, gender='男') for i in range(40)]
+    images = [_process(patient, rng.gauss(600, 30)) for patient in patients]
+
+    # 重新处理一张图像并删除另一个患者的图像
+    _reprocess(patients[0], images[0], 555.0)
+    normative_service.remove_images(patients[1], [images[1].id])
+    db.session.commit()
+
+    expected = np.array([measurement_service.get_metrics(image.id)['gm_volume'] for image in images[:1] + images[2:]])
+    aggregate = db.session.get(NormativeAggregate, ('gm_volume', 60, 'M'))
+    assert aggregate.count == len(expected)
+    assert aggregate.mean == pytest.approx(expected.mean())
+    assert aggregate.m2 / (aggregate.count - 1) == pytest.approx(expected.var(ddof=1))
+
+    scores = normative_service.score_image(images[0].id, min_count=20)
+    gm = scores['metrics']['gm_volume']
+    assert gm['reference']['level'] == 'age_gender'
+    assert gm['z_score'] == pytest.approx((555.0 - expected.mean()) / expected.std(ddof=1))
+    assert gm['percentile'] == pytest.approx((expected < 555.0).mean() * 100, abs=5)
+
+    # 样本不足的分组回退到更宽的参照组
+    image = _process(make_patient(user, 'Q001', age=30, gender='女'), 640.0)
+    assert normative_service.score_image(image.id, min_count=20)['metrics']['gm_volume']['reference']['level'] == 'all'
@@ -0,0 +1,75 @@
+import logging
+
+from models import db
+from app.services import migration_service, patient_service
+from conftest import make_user, make_patient, make_image
+
+logger = logging.getLogger(__name__)
+
+
+def _walk(client, headers, path, **params):
+    """沿next_cursor取完所有页，返回每页的患者列表"""
+    pages = []
+    cursor = None
+    while True:
+        query = dict(params, **({'cursor': cursor} if cursor is not None else {}))
+        response = client.get(path, headers=headers, query_string=query)
+        assert response.status_code == 200
+        data = response.get_json()
+        pages.append(data['patients'])
+        assert data['has_more'] == (data['next_cursor'] is not None)
+        cursor = data['next_cursor']
+        if cursor is None:
+            return pages
+
+
+def test_patient_list_cursor_pages(api_app):
+    """测试沿游标翻页时每个患者恰好出现一次，且每页的image_count按患者聚合"""
+    user, headers = make_user('pager')
+    other, _ = make_user('other')
+    expected = {}
+    for i in range(7):
+        patient = make_patient(user, f'P{i:03d}', name=f'张{i}')
+        for _ in range(i % 3):
+            make_image(patient)
+        expected[patient.id] = i % 3
+    make_image(make_patient(other, 'X001'))
+
+    client = api_app.test_client()
+    pages = _walk(client, headers, '/api/patients', limit=3)
+    assert [len(page) for page in pages] == [3, 3, 1]
+    seen = [p['id'] for page in pages for p in page]
+    assert seen == sorted(expected)
+    for page in pages:
+        for patient in page:
+            assert patient['image_count'] == expected[patient['id']]
+
+    # 搜索结果同样按游标分页
+    pages = _walk(client, headers, '/api/patients/search', q='张', limit=2)
+    assert sorted(p['id'] for page in pages for p in page) == sorted(expected)
+    assert all(p['image_count'] == expected[p['id']] for page in pages for p in page)
+
+
+def test_fts_search_pages_across_rank_cursor(api_app, monkeypatch):
+    """测试执行迁移建立FTS5索引后，搜索按bm25相关度排序并沿(rank, id)游标翻页"""
+    migration_service.upgrade(db.engine)
+
+    def no_like(*args):
+        raise AssertionError('应使用FTS5检索')
+    monkeypatch.setattr(patient_service, '_search_like', no_like)
+
+    user, headers = make_user('fts')
+    other, _ = make_user('other')
+    # 编号列权重更高：编号命中的患者排在姓名命中之前；同名患者的相关度相同，按ID排序
+    by_name = [make_patient(user, f'N00{i}', name='wang li').id for i in range(3)]
+    by_code = [make_patient(user, f'wang-{i}', name='li').id for i in range(2)]
+    make_patient(user, 'X001', name='zhao')
+    make_patient(other, 'wang-9', name='wang')
+
+    client = api_app.test_client()
+    pages = _walk(client, headers, '/api/patients/search', q='wan', limit=2)
+    hits = [(p['rank'], p['id']) for page in pages for p in page]
+    assert [len(page) for page in pages] == [2, 2, 1]
+    assert hits == sorted(hits)
+    assert [patient_id for _, patient_id in hits] == by_code + by_name
+    assert len({rank for rank, _ in hits}) == 2 and all(rank < 0 for rank, _ in hits)
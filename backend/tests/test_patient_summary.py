@@ -0,0 +1,67 @@
+import logging
+from datetime import datetime
+import pytest
+
+from models import db, PatientSummary
+from app.services import summary_service
+from conftest import make_user, make_patient, make_image
+
+logger = logging.getLogger(__name__)
+
+
+@pytest.fixture
+def patient(api_app):
+    user, _ = make_user('u')
+    return make_patient(user, 'P001')
+
+
+def _process(image, gm, tiv):
+    before = summary_service.snapshot(image)
+    image.processed = True
+    image.gm_volume = gm
+    image.wm_volume = tiv * 0.3
+    image.csf_volume = tiv * 0.2
+    image.tiv_volume = tiv
+    summary_service.image_updated(image, before)
+    db.session.commit()
+
+
+def _assert_matches_rebuild(patient_id):
+    """增量维护的结果应与从图像表完整重建的结果一致"""
+    db.session.expire_all()
+    summary = db.session.get(PatientSummary, patient_id)
+    expected = summary_service.compute_summary(summary_service._image_rows(patient_id))
+    for key, value in expected.items():
+        actual = getattr(summary, key)
+        if isinstance(value, float):
+            assert actual == pytest.approx(value, abs=1e-9), key
+        else:
+            assert actual == value, key
+    return summary
+
+
+def test_incremental_summary_matches_rebuild(patient):
+    """测试上传、处理和重新处理后的汇总与完整重建一致"""
+    patient_id = patient.id
+    first = make_image(patient, check_date=datetime(2022, 3, 1))
+    second = make_image(patient, check_date=datetime(2023, 3, 1))
+    third = make_image(patient, check_date=datetime(2021, 3, 1))
+    summary = _assert_matches_rebuild(patient_id)
+    assert summary.scan_count == 3 and summary.processed_count == 0
+
+    _process(second, 600.0, 1500.0)
+    _process(first, 630.0, 1500.0)
+    summary = _assert_matches_rebuild(patient_id)
+    assert summary.latest_image_id == second.id
+    assert summary.first_image_id == first.id
+
+    _process(third, 650.0, 1500.0)
+    # 重新处理最近一次的图像
+    _process(second, 590.0, 1480.0)
+    summary = _assert_matches_rebuild(patient_id)
+    assert summary.first_image_id == third.id
+    assert summary.latest_gm_volume == 590.0
+
+    trend = summary.gm_tiv_trend()
+    assert trend['n'] == 3
+    assert trend['slope_per_year'] < 0
@@ -0,0 +1,84 @@
+import os
+import logging
+from datetime import datetime, timedelta
+
+from models import db, Patient, Image
+from app.services import storage, purge_service
+from app.services.task_queue import task_queue
+from conftest import make_user, make_patient, make_image
+
+logger = logging.getLogger(__name__)
+
+
+def _image_with_files(patient, n):
+    """创建带原始文件和任务目录的图像"""
+    filename = storage.make_upload_name(f'scan{n}.nii')
+    path = storage.upload_path(filename)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b'raw')
+    task_id = f'purge-test-{patient.id}-{n}'
+    os.makedirs(storage.task_dir(task_id), exist_ok=True)
+    image = make_image(patient, filename=filename, task_id=task_id)
+    return image.id, path, storage.task_dir(task_id)
+
+
+def test_deleted_patient_hidden(api_app):
+    """测试逻辑删除后患者不再出现在列表、搜索和详情中"""
+    user, headers = make_user('hider')
+    kept = make_patient(user, 'H001', name='张保留')
+    removed = make_patient(user, 'H002', name='张删除')
+    removed_id = removed.id
+    purge_service.mark_deleted(removed)
+    db.session.commit()
+
+    client = api_app.test_client()
+    listed = client.get('/api/patients', headers=headers).get_json()['patients']
+    assert [p['id'] for p in listed] == [kept.id]
+    found = client.get('/api/patients/search', headers=headers, query_string={'q': '张'}).get_json()['patients']
+    assert [p['id'] for p in found] == [kept.id]
+    assert client.get(f'/api/patients/{removed_id}', headers=headers).status_code == 404
+    assert client.get(f'/api/patients/{kept.id}', headers=headers).status_code == 200
+
+
+def test_batched_purge_removes_files_and_records(api_app):
+    """测试分批清理删除全部文件和记录，并只允许一个进程认领"""
+    user, _ = make_user('purger')
+    patient = make_patient(user, 'D001')
+    patient_id = patient.id
+    files = [_image_with_files(patient, n) for n in range(5)]
+    other = make_patient(user, 'D002')
+    other_image = make_image(other)
+    purge_service.mark_deleted(patient)
+    db.session.commit()
+
+    assert purge_service.claim_purge(patient_id, timeout=600)
+    assert not purge_service.claim_purge(patient_id, timeout=600)
+    assert not purge_service.claim_purge(other.id, timeout=600)  # 未删除的患者不能认领
+
+    job_id = 'purge-test-job'
+    task_queue.add_task(job_id, {'type': 'purge', 'patient_id': patient_id})
+    results = purge_service.purge_patient(patient_id, job_id, batch_size=2)
+    assert results['deleted_images'] == 5
+    assert results['removed_files'] == 10
+    assert task_queue.details[job_id]['deleted_images'] == 5
+
+    db.session.expire_all()
+    assert db.session.get(Patient, patient_id) is None
+    assert Image.query.filter_by(patient_id=patient_id).count() == 0
+    for _, path, task_dir in files:
+        assert not os.path.exists(path) and not os.path.exists(task_dir)
+    assert db.session.get(Image, other_image.id) is not None
+    assert purge_service.image_deleted(files[0][0])
+    assert not purge_service.image_deleted(other_image.id)
+
+
+def test_stale_claim_can_be_taken_over(api_app):
+    """测试认领超时未刷新（原进程已退出）时可由其他进程接手"""
+    user, _ = make_user('stale')
+    patient = make_patient(user, 'S001')
+    patient.deleted_at = datetime.utcnow()
+    patient.purge_started_at = datetime.utcnow() - timedelta(seconds=700)
+    db.session.commit()
+    assert purge_service.claim_purge(patient.id, timeout=600)
+    assert not purge_service.claim_purge(patient.id, timeout=600)
@@ -0,0 +1,224 @@
+import io
+import os
+import time
+import zipfile
+import logging
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import nibabel as nib
+import pytest
+
+from models import db
+from app.services import report_service, measurement_service, cache_service, trend_service, preview_service, storage
+from app.services.task_queue import task_queue
+from conftest import make_user, make_patient, make_image
+
+logger = logging.getLogger(__name__)
+
+
+@pytest.fixture
+def patient(api_app):
+    """一名已处理过一次检查的患者"""
+    cache_service.cache.clear()
+    trend_service.trend_cache.clear()
+    user, _ = make_user('u')
+    patient = make_patient(user, 'P001', age=70, gender='F')
+    image = make_image(patient, processed=True, gm_volume=600.0, wm_volume=500.0, csf_volume=400.0,
+                       tiv_volume=1500.0)
+    measurement_service.record_volumes(image.id, {'gm_volume': 600.0, 'wm_volume': 500.0,
+                                                  'csf_volume': 400.0, 'tiv_volume': 1500.0})
+    db.session.commit()
+    return patient
+
+
+def _wait(job_id):
+    for _ in range(100):
+        if task_queue.tasks[job_id] != 'processing':
+            break
+        time.sleep(0.05)
+    assert task_queue.tasks[job_id] == 'completed', task_queue.get_details(job_id)
+
+
+def test_reports_are_cached_by_version_and_old_versions_removed(patient):
+    """测试首次请求后台生成，重复请求直接返回，数据变化后生成新版本并删除旧版本"""
+    path, version, job_id = report_service.request_report(patient.id, patient.user_id, 20)
+    assert path is None and job_id is not None
+    # 同一版本的并发请求共用一个任务
+    assert report_service.request_report(patient.id, patient.user_id, 20)[2] in (job_id, None)
+    _wait(job_id)
+
+    path, same_version, job = report_service.request_report(patient.id, patient.user_id, 20)
+    assert job is None and same_version == version and os.path.exists(path)
+    with open(path, 'rb') as f:
+        assert f.read(4) == b'%PDF'
+
+    patient.age = 71
+    db.session.commit()
+    new_path, new_version, job_id = report_service.request_report(patient.id, patient.user_id, 20)
+    assert new_path is None and new_version != version
+    _wait(job_id)
+    assert not os.path.exists(path)
+    assert os.listdir(os.path.dirname(path)) == [os.path.basename(report_service.report_path(patient.id, new_version))]
+
+
+def test_bulk_reports_stream_as_zip(patient):
+    """测试按月份筛选患者，进程池渲染后流式打包，已生成的报告直接复用"""
+    other = make_patient(patient.user, 'Q/002', age=50, gender='M')
+    make_image(other, check_date=datetime(2023, 2, 3))
+
+    assert report_service.select_patients(patient.user_id, month=datetime(2023, 2, 1)) == [other.id]
+    patient_ids = report_service.select_patients(patient.user_id)
+    entries, stats = report_service.build_reports(patient_ids, 20)
+    assert stats['rendered'] == 2 and not stats['failed']
+    assert report_service.build_reports(patient_ids, 20)[1]['cached'] == 2
+
+    archive = zipfile.ZipFile(io.BytesIO(b''.join(report_service.stream_archive(entries))))
+    assert archive.namelist() == [f'{patient.id}_P001.pdf', f'{other.id}_Q_002.pdf']
+    assert archive.testzip() is None
+    assert all(archive.read(name).startswith(b'%PDF') for name in archive.namelist())
+
+
+def test_report_embeds_overlays_from_cached_slices(patient, monkeypatch):
+    """测试报告嵌入叠加图和趋势图，已解码的层被预览和报告共用，缺少源文件的检查不影响报告"""
+    for day, task_id in ((2, 'task-a'), (3, 'task-b')):
+        image = make_image(patient, filename=f'{task_id}.nii', original_filename=f'{task_id}.nii', task_id=task_id,
+                           check_date=datetime(2023 + day, 1, 1), processed=True, gm_volume=590.0,
+                           wm_volume=495.0, csf_volume=410.0, tiv_volume=1495.0)
+        measurement_service.record_volumes(image.id, {'gm_volume': 590.0 - day, 'wm_volume': 495.0,
+                                                      'csf_volume': 410.0 + day, 'tiv_volume': 1495.0})
+    db.session.commit()
+    mri_dir = storage.task_file('task-a', 'mri')
+    os.makedirs(mri_dir)
+    volume = np.random.default_rng(0).random((16, 16, 8)).astype(np.float32)
+    for name in ('p0input.nii', 'p1input.nii', 'p2input.nii', 'p3input.nii'):
+        nib.save(nib.Nifti1Image(volume, np.eye(4)), os.path.join(mri_dir, name))
+
+    decoded = []
+    middle_slice = preview_service._middle_slice
+    monkeypatch.setattr(preview_service, '_middle_slice', lambda path: decoded.append(path) or middle_slice(path))
+    preview_service.get_preview(os.path.join(mri_dir, 'p1input.nii'), [cache_service.task_tag('task-a')])
+
+    data = report_service.get_report_data(patient.id, 20)
+    assert len(data['trends']['points']) == 3
+    # 报告中的体积来自测量值表而不是image表上的旧列
+    assert [row['volumes']['gm_volume'] for row in data['images']] == [600.0, 588.0, 587.0]
+    sources = report_service.tile_sources(data)
+    assert list(sources) == ['task-a']
+    tiles = report_service.render_tiles(sources)
+    assert tiles['task-a'].startswith(b'\x89PNG')
+    assert len(decoded) == 4  # 预览已解码的灰质层直接复用
+    assert report_service.render_tiles(sources) == tiles and len(decoded) == 4
+
+    path = report_service.report_path(patient.id, report_service.report_version(data))
+    report_service.render_report(data, path, tiles)
+    with open(path, 'rb') as f:
+        assert f.read(4) == b'%PDF'
+
+
+def test_render_waits_for_other_process(patient, monkeypatch):
+    """测试其他进程持有同一版本的渲染锁时不重复渲染，报告出现后任务直接完成"""
+    data = report_service.get_report_data(patient.id, 20)
+    version = report_service.report_version(data)
+    path = report_service.report_path(patient.id, version)
+    lock = f"report:{patient.id}:{version}"
+    assert cache_service.cache.acquire_lock(lock)
+
+    def no_render():
+        raise AssertionError('已由其他进程渲染')
+    monkeypatch.setattr(report_service, 'render_pool', no_render)
+    _, _, job_id = report_service.request_report(patient.id, patient.user_id, 20)
+    time.sleep(0.3)
+    assert task_queue.tasks[job_id] == 'processing'
+
+    report_service.render_report(data, path)  # 模拟持锁进程完成渲染
+    _wait(job_id)
+    assert task_queue.get_results(job_id)['version'] == version
+    cache_service.cache.release_lock(lock)
+
+
+def test_finished_report_jobs_expire(patient, monkeypatch):
+    """测试报告任务结束并超过保留时间后从任务队列中移除，未设置保留时间的任务不受影响"""
+    monkeypatch.setattr(report_service, 'JOB_TTL', 0)
+    task_queue.add_task('long-running-task')
+    _, _, job_id = report_service.request_report(patient.id, patient.user_id, 20)
+    _wait(job_id)
+    task_queue.add_task('next-task', ttl=0)
+    assert job_id not in task_queue.tasks and job_id not in task_queue.details
+    assert task_queue.tasks['long-running-task'] == 'processing'
+
+
+def test_bulk_manifest_pins_listed_versions(api_app, patient, monkeypatch):
+    """测试批量清单中的报告版本在清单过期前不被GC删除，过期后正常清理"""
+    job_id = report_service.start_bulk(api_app, patient.user_id, [patient.id], 20)
+    _wait(job_id)
+    (name, listed), = report_service.bulk_manifest(job_id)['entries']
+
+    patient.age = 71
+    db.session.commit()
+    _, _, render_job = report_service.request_report(patient.id, patient.user_id, 20)
+    _wait(render_job)
+    assert os.path.exists(listed)
+    assert b''.join(report_service.stream_archive([(name, listed)]))
+
+    # 清单过期后不再固定，下一次GC删除旧版本
+    monkeypatch.setattr(report_service.time, 'time', lambda: time.monotonic() + 10 ** 10)
+    assert report_service.bulk_manifest(job_id) is None
+    report_service.collect_garbage(patient.id)
+    assert not os.path.exists(listed)
+    with pytest.raises(FileNotFoundError):
+        b''.join(report_service.stream_archive([(name, listed)]))
+
+
+def test_bulk_archive_served_from_manifest(api_app):
+    """测试批量任务不在本进程的任务队列中时按清单返回状态和压缩包，报告缺失时返回410"""
+    user, headers = make_user('bulk')
+    patient = make_patient(user, 'B001')
+    client = api_app.test_client()
+    job_id = client.post('/api/reports:bulk', headers=headers, json={}).get_json()['job_id']
+    _wait(job_id)
+    for store in (task_queue.tasks, task_queue.progress, task_queue.results, task_queue.details):
+        store.pop(job_id)  # 模拟由其他工作进程执行的任务
+
+    status = client.get(f'/api/reports/jobs/{job_id}', headers=headers).get_json()
+    assert status['status'] == 'completed' and status['results']['rendered'] == 1
+    response = client.get(f'/api/reports/jobs/{job_id}/archive', headers=headers)
+    assert response.status_code == 200
+    assert zipfile.ZipFile(io.BytesIO(response.data)).namelist() == [f'{patient.id}_B001.pdf']
+
+    _, other_headers = make_user('other')
+    assert client.get(f'/api/reports/jobs/{job_id}/archive', headers=other_headers).status_code == 404
+    assert client.get('/api/reports/jobs/report-bulk-x/archive', headers=headers).status_code == 404
+
+    report_service.remove_reports(patient.id)
+    response = client.get(f'/api/reports/jobs/{job_id}/archive', headers=headers)
+    assert response.status_code == 410 and response.get_json()['missing'] == [f'{patient.id}_B001.pdf']
+
+
+def test_failed_render_left_out_of_bulk_archive(api_app, monkeypatch):
+    """测试批量任务中一名患者的报告渲染失败时，清单只列出成功的报告，压缩包仍可下载"""
+    user, headers = make_user('partial')
+    kept = make_patient(user, 'K001')
+    broken = make_patient(user, 'F001')
+    render_report = report_service.render_report
+
+    def flaky_render(data, path, tiles=None):
+        if data['patient']['patient_id'] == 'F001':
+            raise RuntimeError('渲染失败')
+        return render_report(data, path, tiles)
+    # 线程池中的渲染调用能看到替换后的函数
+    pool = ThreadPoolExecutor(max_workers=2)
+    monkeypatch.setattr(report_service, 'render_pool', lambda: pool)
+    monkeypatch.setattr(report_service, 'render_report', flaky_render)
+
+    client = api_app.test_client()
+    job_id = client.post('/api/reports:bulk', headers=headers, json={}).get_json()['job_id']
+    _wait(job_id)
+    pool.shutdown()
+    manifest = report_service.bulk_manifest(job_id)
+    assert manifest['stats']['failed'] == [broken.id] and manifest['stats']['rendered'] == 1
+    assert [name for name, _ in manifest['entries']] == [f'{kept.id}_K001.pdf']
+
+    response = client.get(f'/api/reports/jobs/{job_id}/archive', headers=headers)
+    assert response.status_code == 200
+    assert zipfile.ZipFile(io.BytesIO(response.data)).namelist() == [f'{kept.id}_K001.pdf']
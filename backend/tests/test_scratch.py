@@ -0,0 +1,85 @@
+import os
+import logging
+import pytest
+
+from conftest import make_user, make_patient, make_image
+from app.services import storage
+from app.services.scratch_service import (
+    TaskScratch, ScratchSpaceError, REQUIRED_ARTIFACTS, check_scratch_capacity, scratch_path
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _write_artifacts(scratch, names):
+    for rel in names:
+        path = os.path.join(scratch.path, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(rel)
+
+
+def test_promote_requires_artifacts(tmp_path):
+    """测试缺少必需产物时发布失败，结果目录不被创建，退出时清理临时目录"""
+    dest = str(tmp_path / 'processed' / 'ab' / 'cd' / 't1')
+    with pytest.raises(FileNotFoundError, match='p3input.nii'):
+        with TaskScratch('t1', str(tmp_path / 'scratch')) as scratch:
+            _write_artifacts(scratch, REQUIRED_ARTIFACTS[:-1])
+            scratch.promote(dest)
+    assert not scratch.promoted
+    assert not os.path.exists(dest)
+    assert not os.path.exists(scratch_path(str(tmp_path / 'scratch'), 't1'))
+    assert not os.path.exists(os.path.dirname(dest))
+
+
+def test_cleanup_on_exception(tmp_path):
+    """测试处理过程中抛出异常时删除临时目录并继续抛出"""
+    with pytest.raises(RuntimeError):
+        with TaskScratch('t1', str(tmp_path / 'scratch')) as scratch:
+            _write_artifacts(scratch, ['mri/p1input.nii', 'intermediate.mat'])
+            raise RuntimeError('CAT12失败')
+    assert not os.path.exists(scratch.path)
+
+
+def test_promote_replaces_existing_task_dir(tmp_path):
+    """测试重新处理时整体替换已有的结果目录，只保留声明的产物"""
+    dest = tmp_path / 'processed' / 't1'
+    os.makedirs(dest / 'mri')
+    (dest / 'results.json').write_text('old')
+    (dest / 'stale.txt').write_text('old')
+
+    with TaskScratch('t1', str(tmp_path / 'scratch')) as scratch:
+        _write_artifacts(scratch, REQUIRED_ARTIFACTS + ['preview.png', 'intermediate.mat'])
+        assert scratch.promote(str(dest)) == str(dest)
+    assert scratch.promoted and not os.path.exists(scratch.path)
+    assert (dest / 'results.json').read_text() == 'results.json'
+    assert not (dest / 'stale.txt').exists() and not (dest / 'intermediate.mat').exists()
+    assert (dest / 'preview.png').exists()
+    # 暂存目录和被替换的旧目录都已删除
+    assert sorted(os.listdir(tmp_path / 'processed')) == ['t1']
+
+
+def test_capacity_check(tmp_path, monkeypatch):
+    """测试剩余空间不足时抛出ScratchSpaceError，进入临时目录前就检查"""
+    assert check_scratch_capacity(str(tmp_path), 0) > 0
+    with pytest.raises(ScratchSpaceError):
+        check_scratch_capacity(str(tmp_path), 1 << 60)
+    with pytest.raises(ScratchSpaceError):
+        with TaskScratch('t1', str(tmp_path / 'scratch'), min_free_bytes=1 << 60):
+            pytest.fail('空间不足时不应进入')
+    assert not os.path.exists(scratch_path(str(tmp_path / 'scratch'), 't1'))
+
+
+def test_process_returns_507_when_scratch_is_full(server, monkeypatch):
+    """测试临时目录空间不足时处理接口返回507，不创建任务"""
+    monkeypatch.setitem(server.config, 'SCRATCH_MIN_FREE_BYTES', 1 << 60)
+    user, headers = make_user('u')
+    name, path = storage.new_upload_path('scan.nii')
+    with open(path, 'wb') as f:
+        f.write(b'\0' * 1024)
+    image = make_image(make_patient(user, 'P001'), filename=name)
+
+    response = server.test_client().post('/api/process', headers=headers, json={'image_id': image.id})
+    assert response.status_code == 507
+    assert '空间不足' in response.get_json()['error']
+    assert image.task_id is None
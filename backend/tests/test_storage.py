@@ -0,0 +1,95 @@
+import os
+import logging
+import pytest
+from sqlalchemy import create_engine, text
+
+import migrate_storage
+from app.services import storage
+
+logger = logging.getLogger(__name__)
+
+
+def test_shard_layout(tmp_path):
+    """测试分片路径由键确定，任务目录兼容旧的平铺布局，拒绝跳出根目录的路径"""
+    assert storage.shard_prefix('abc') == storage.shard_prefix('abc')
+    assert len(storage.shard_prefix('abc').split('/')) == storage.SHARD_DEPTH
+    name = storage.make_upload_name('Scan 1.NII.GZ')
+    assert storage.is_sharded(name) and name.endswith('.nii.gz')
+    assert storage.make_upload_name('a.dcm', key='k') == f"{storage.shard_prefix('k')}/k.dcm"
+
+    root = str(tmp_path)
+    assert storage.task_dir('t1', root) == os.path.join(root, storage.task_relpath('t1'))
+    os.makedirs(tmp_path / 't2')
+    assert storage.task_dir('t2', root) == str(tmp_path / 't2')
+    with pytest.raises(ValueError):
+        storage.upload_path('../etc/passwd', root)
+    with pytest.raises(ValueError):
+        storage.task_file('t1', '../../x', processed_root=root)
+
+
+@pytest.fixture
+def legacy_storage(tmp_path):
+    """平铺布局的上传文件、任务目录和对应的image记录"""
+    uploads, processed = tmp_path / 'uploads', tmp_path / 'processed'
+    os.makedirs(uploads)
+    os.makedirs(processed / 'task-1' / 'mri')
+    (processed / 'task-1' / 'segmented.nii.gz').write_bytes(b'seg')
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE image (id INTEGER PRIMARY KEY, filename VARCHAR(255), "
+                          "original_filename VARCHAR(255), task_id VARCHAR(255), processed_filename VARCHAR(255))"))
+        for image_id in (1, 2, 3):
+            (uploads / f'flat_{image_id}.dcm').write_bytes(f'scan {image_id}'.encode())
+            conn.execute(text("INSERT INTO image (id, filename, original_filename) VALUES (:id, :name, 'scan.dcm')"),
+                         {'id': image_id, 'name': f'flat_{image_id}.dcm'})
+        conn.execute(text("UPDATE image SET task_id = 'task-1', processed_filename = 'task-1/segmented.nii.gz' "
+                          "WHERE id = 1"))
+    return engine, str(uploads), str(processed)
+
+
+def _referenced_files(engine, uploads):
+    with engine.connect() as conn:
+        names = conn.execute(text("SELECT filename FROM image ORDER BY id")).scalars().all()
+    on_disk = {os.path.relpath(os.path.join(dirpath, f), uploads).replace(os.sep, '/')
+               for dirpath, _, files in os.walk(uploads) for f in files}
+    return names, on_disk
+
+
+def test_interrupted_upload_migration_resumes(legacy_storage, monkeypatch):
+    """测试在移动文件之后、提交数据库之前中断，重新执行后所有记录都指向存在的文件且没有孤立文件"""
+    engine, uploads, processed = legacy_storage
+    original_move = migrate_storage.move
+    calls = []
+
+    def interrupted_move(src, dst, dry_run):
+        original_move(src, dst, dry_run)
+        calls.append(dst)
+        if len(calls) == 2:
+            raise KeyboardInterrupt
+
+    monkeypatch.setattr(migrate_storage, 'move', interrupted_move)
+    with engine.connect() as conn, pytest.raises(KeyboardInterrupt):
+        migrate_storage.migrate_uploads(conn, uploads, dry_run=False)
+    monkeypatch.setattr(migrate_storage, 'move', original_move)
+
+    with engine.connect() as conn:
+        assert migrate_storage.migrate_uploads(conn, uploads, dry_run=False) == (2, 0)
+        assert migrate_storage.migrate_uploads(conn, uploads, dry_run=False) == (0, 0)
+    names, on_disk = _referenced_files(engine, uploads)
+    assert all(storage.is_sharded(name) for name in names)
+    assert set(names) == on_disk
+    for image_id, name in enumerate(names, start=1):
+        with open(storage.upload_path(name, uploads), 'rb') as f:
+            assert f.read() == f'scan {image_id}'.encode()
+
+
+def test_task_dir_migration(legacy_storage):
+    """测试任务目录迁移到分片布局并更新processed_filename，重复执行不做改动"""
+    engine, uploads, processed = legacy_storage
+    with engine.connect() as conn:
+        assert migrate_storage.migrate_task_dirs(conn, processed, dry_run=False) == (1, 1)
+        assert migrate_storage.migrate_task_dirs(conn, processed, dry_run=False) == (0, 0)
+        name = conn.execute(text("SELECT processed_filename FROM image WHERE id = 1")).scalar()
+    assert name == storage.processed_filename('task-1', 'segmented.nii.gz')
+    assert os.path.exists(storage.processed_path(name, processed))
+    assert storage.task_dir('task-1', processed) == os.path.join(processed, storage.task_relpath('task-1'))
@@ -0,0 +1,41 @@
+import sys
+import subprocess
+import logging
+
+from app.services import task_metrics
+
+logger = logging.getLogger(__name__)
+
+BUSY_CHILD = "import time\nend = time.process_time() + 0.5\nwhile time.process_time() < end: pass\n"
+
+
+def test_stage_timer_accounts_child_process(tmp_path):
+    """测试阶段耗时包含子进程的CPU时间和内存，同名阶段累加，结果可保存到任务目录后读回"""
+    updates = []
+    timer = task_metrics.StageTimer(on_update=updates.append, interval=0.02)
+    with timer.stage('conversion'):
+        sum(range(200000))
+    with timer.stage('cat12'):
+        process = subprocess.Popen([sys.executable, '-c', BUSY_CHILD])
+        timer.watch(process.pid)
+        process.wait()
+    with timer.stage('conversion'):
+        pass
+
+    stages = {stage['stage']: stage for stage in timer.to_dict()['stages']}
+    assert list(stages) == ['conversion', 'cat12'] and stages['conversion']['calls'] == 2
+    cat12 = stages['cat12']
+    # 采样间隔内结束前的CPU时间可能漏计
+    assert 0.3 <= cat12['child_cpu_seconds'] <= cat12['cpu_seconds'] <= cat12['wall_seconds'] + 0.1
+    assert 0 < cat12['child_peak_rss'] < cat12['peak_rss']
+    assert stages['conversion']['child_cpu_seconds'] == 0 and stages['conversion']['peak_rss'] > 0
+    assert len(updates) == 3 and updates[-1] == timer.to_dict()
+
+    task_metrics.write(str(tmp_path), timer, queue_wait=1.5)
+    loaded = task_metrics.load(str(tmp_path))
+    assert loaded['stages'] == timer.to_dict()['stages'] and loaded['queue_wait'] == 1.5
+    assert loaded['host']['cpu_count'] >= 1
+    assert task_metrics.load(str(tmp_path / 'missing')) is None
+
+    task_metrics.record(timer)
+    assert task_metrics.stats()['cat12']['tasks'] >= 1
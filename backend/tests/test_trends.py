@@ -0,0 +1,54 @@
+import logging
+from datetime import datetime
+import pytest
+
+from models import db
+from app.services import summary_service, measurement_service, trend_service
+from conftest import make_user, make_patient, make_image
+
+logger = logging.getLogger(__name__)
+
+
+@pytest.fixture
+def patient(api_app):
+    user, _ = make_user('u')
+    trend_service.trend_cache.clear()
+    return make_patient(user, 'P001', age=70, gender='F')
+
+
+def _scan(patient, check_date, gm, tiv=1500.0):
+    image = make_image(patient, check_date=check_date)
+    before = summary_service.snapshot(image)
+    image.processed = True
+    image.gm_volume, image.wm_volume, image.csf_volume, image.tiv_volume = gm, 500.0, tiv - gm - 500.0, tiv
+    summary_service.image_updated(image, before)
+    measurement_service.record_volumes(image.id, {'gm_volume': gm, 'wm_volume': 500.0,
+                                                  'csf_volume': tiv - gm - 500.0, 'tiv_volume': tiv})
+    db.session.commit()
+    return image
+
+
+def test_trends_are_cached_until_processed_images_change(patient):
+    """测试回归斜率和相邻变化，以及只有已处理图像变化时才重新计算"""
+    patient_id = patient.id
+    _scan(patient, datetime(2020, 1, 1), 620.0)
+    second = _scan(patient, datetime(2021, 1, 1), 610.0)
+    _scan(patient, datetime(2022, 1, 1), 598.0)
+
+    trends = trend_service.get_trends(patient_id)
+    assert trends['scan_count'] == 3
+    gm = trends['metrics']['gm_volume']
+    assert gm['slope_per_year'] == pytest.approx(-11.0, rel=1e-2)
+    assert gm['annual_percent_change'] < 0
+    assert [interval['changes']['gm_volume']['delta'] for interval in trends['intervals']] == [-10.0, -12.0]
+    assert trends['intervals'][0]['to_image_id'] == second.id
+
+    # 版本号不变时直接命中缓存
+    assert trend_service.get_trends(patient_id) is trends
+    # 上传但尚未处理的图像不影响趋势缓存
+    make_image(patient, check_date=datetime(2023, 1, 1))
+    assert trend_service.get_trends(patient_id) is trends
+
+    _scan(patient, datetime(2023, 1, 1), 585.0)
+    updated = trend_service.get_trends(patient_id)
+    assert updated is not trends and updated['scan_count'] == 4
@@ -0,0 +1,100 @@
+import os
+import json
+import zlib
+import logging
+import numpy as np
+import nibabel as nib
+import pytest
+
+from conftest import make_user, make_patient, make_image
+from app.services import storage
+from app.services.volume_store import (
+    build_pyramid, downsample, write_volume_store, write_task_volume_stores,
+    read_store_meta, read_chunk, get_chunk_path
+)
+
+logger = logging.getLogger(__name__)
+
+
+@pytest.fixture
+def task_dir(tmp_path):
+    """创建包含原始图像和分割结果的模拟任务目录"""
+    rng = np.random.default_rng(0)
+    os.makedirs(tmp_path / 'mri')
+    data = rng.random((70, 40, 33)).astype(np.float32)
+    nib.save(nib.Nifti1Image(data, np.eye(4)), str(tmp_path / 'input.nii'))
+    for idx in (1, 2, 3):
+        nib.save(nib.Nifti1Image(data * idx, np.eye(4)), str(tmp_path / 'mri' / f'p{idx}input.nii'))
+    return tmp_path
+
+
+def test_downsample_odd_shape():
+    """测试奇数边长的降采样"""
+    data = np.arange(27, dtype=np.int16).reshape(3, 3, 3)
+    reduced = downsample(data)
+    assert reduced.shape == (2, 2, 2)
+    assert reduced.dtype == np.int16
+
+
+def test_build_pyramid_levels():
+    """测试金字塔在最粗层级可放入单个块时停止"""
+    levels = build_pyramid(np.zeros((130, 64, 20), dtype=np.float32), chunk_size=64)
+    assert [lvl.shape for lvl in levels] == [(130, 64, 20), (65, 32, 10), (33, 16, 5)]
+
+
+def test_chunk_round_trip(task_dir, tmp_path):
+    """测试写入后的块可以还原原始数据"""
+    store_dir = str(tmp_path / 'store')
+    meta = write_volume_store(str(task_dir / 'input.nii'), store_dir, chunk_size=32)
+    assert meta['chunks'] == [32, 32, 32]
+    assert meta['levels'][0]['chunk_grid'] == [3, 2, 2]
+
+    original = nib.load(str(task_dir / 'input.nii')).get_fdata(dtype=np.float32)
+    with open(os.path.join(store_dir, 'meta.json')) as f:
+        assert json.load(f)['dtype'] == '<f4'
+    with open(os.path.join(store_dir, '0', '2.1.1'), 'rb') as f:
+        chunk = np.frombuffer(zlib.decompress(f.read()), dtype='<f4').reshape(32, 32, 32)
+    np.testing.assert_array_equal(chunk[:6, :8, :1], original[64:70, 32:40, 32:33])
+    assert not chunk[6:].any()
+
+
+def test_task_stores(task_dir):
+    """测试任务目录的分块存储生成与读取"""
+    stores = write_task_volume_stores(str(task_dir), chunk_size=32)
+    assert set(stores) == {'original', 'gm', 'wm', 'csf'}
+    assert read_store_meta(str(task_dir), 'gm')['shape'] == [70, 40, 33]
+    assert read_store_meta(str(task_dir), '../etc') is None
+
+    coarsest = len(stores['wm']['levels']) - 1
+    chunk = read_chunk(str(task_dir), 'wm', coarsest, '0.0.0')
+    assert chunk.shape == (32, 32, 32)
+    assert get_chunk_path(str(task_dir), 'wm', 0, '9.0.0') is None
+    assert get_chunk_path(str(task_dir), 'wm', 0, '../../x') is None
+
+
+def test_missing_chunk_served_as_fill_chunk(api_app):
+    """测试未落盘的块以200返回填充块，可以长期缓存；非法坐标的错误响应不长期缓存"""
+    user, headers = make_user('u')
+    make_image(make_patient(user, 'P001'), task_id='t1')
+    task_dir = storage.task_dir('t1')
+    os.makedirs(task_dir)
+    data = np.zeros((40, 40, 40), dtype=np.int16)
+    data[:20, :20, :20] = 7
+    nib.save(nib.Nifti1Image(data, np.eye(4)), os.path.join(task_dir, 'input.nii'))
+    write_task_volume_stores(task_dir, chunk_size=32)
+
+    client = api_app.test_client()
+    response = client.get('/api/volumes/t1/original/0/1.1.1', headers=headers)
+    assert response.status_code == 200
+    assert response.headers['X-Chunk-Fill'] == 'true'
+    assert 'immutable' in response.headers['Cache-Control']
+    chunk = np.frombuffer(zlib.decompress(response.data), dtype='<i2')
+    assert chunk.shape == (32 ** 3,) and not chunk.any()
+    cached = client.get('/api/volumes/t1/original/0/1.1.1',
+                        headers={**headers, 'If-None-Match': response.headers['ETag']})
+    assert cached.status_code == 304
+
+    written = client.get('/api/volumes/t1/original/0/0.0.0', headers=headers)
+    assert written.status_code == 200 and 'X-Chunk-Fill' not in written.headers
+    invalid = client.get('/api/volumes/t1/original/0/5.0.0', headers=headers)
+    assert invalid.status_code == 400 and 'immutable' not in invalid.headers.get('Cache-Control', '')
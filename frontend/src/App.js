@@ -153,7 +153,6 @@ const MainApp = () => {
     const [matlabLog, setMatlabLog] = useState('');
     const [processedImages, setProcessedImages] = useState({});
     const [analysisResults, setAnalysisResults] = useState(null);
-    const [patients, setPatients] = useState([]);
     const [selectedPatient, setSelectedPatient] = useState(null);
     const [showPatientModal, setShowPatientModal] = useState(false);
     const [newPatient, setNewPatient] = useState({
@@ -170,42 +169,6 @@ const MainApp = () => {
     const [imageLoading, setImageLoading] = useState(false);
     const [previewError, setPreviewError] = useState(null);
 
-    useEffect(() => {
-        const fetchPatients = async () => {
-            try {
-                const token = localStorage.getItem('token');
-                if (!token) {
-                    navigate('/login');
-                    return;
-                }
-
-                const response = await axios.get(`${API_BASE}/api/patients`, {
-                    headers: {
-                        'Authorization': `Bearer ${token}`,
-                        'Content-Type': 'application/json'
-                    },
-                    withCredentials: true
-                });
-
-                if (response.data.success) {
-                    setPatients(response.data.patients);
-                } else {
-                    console.error('获取患者列表失败:', response.data.error);
-                }
-            } catch (error) {
-                console.error('获取患者列表失败:', error);
-                if (error.response?.status === 401) {
-                    localStorage.removeItem('token');
-                    navigate('/login');
-                }
-            }
-        };
-
-        if (authState.isAuthenticated) {
-            fetchPatients();
-        }
-    }, [authState.isAuthenticated, navigate]);
-
     useEffect(() => {
         const token = localStorage.getItem('token');
         if (token) {
@@ -257,8 +220,6 @@ const MainApp = () => {
                     age: '',
                     gender: 'M'
                 });
-
-                setPatients(prevPatients => [...prevPatients, response.data.patient]);
             } else {
                 throw new Error('服务器响应格式不正确');
             }
@@ -2,12 +2,12 @@ import React, { useState, useEffect } from 'react';
 import axios from 'axios';
 import './DataManager.css';
 import { Spin, message } from 'antd';
+import { usePatientPages } from '../../utils/patients';
 
 // 添加API基础URL常量
 const API_BASE_URL = process.env.REACT_APP_API_BASE || 'http://localhost:5000';
 
 function DataManager() {
-  const [patients, setPatients] = useState([]);
   const [searchTerm, setSearchTerm] = useState('');
   const [selectedPatient, setSelectedPatient] = useState(null);
   const [loading, setLoading] = useState(false);
@@ -19,51 +19,33 @@ function DataManager() {
     wm: null,
     csf: null
   });
-
-  useEffect(() => {
-    fetchPatients();
-  }, []);
-
-  const fetchPatients = async () => {
-    try {
-      setLoading(true);
-      const token = localStorage.getItem('token');
-      if (!token) {
-        setError('未登录或登录已过期');
-        return;
-      }
-
-      const response = await axios.get(`${API_BASE_URL}/api/patients`, {
-        headers: {
-          'Authorization': `Bearer ${token}`,
-          'Content-Type': 'application/json'
-        }
-      });
-
-      if (response.data.success && Array.isArray(response.data.patients)) {
-        setPatients(response.data.patients);
-      } else {
-        setError('获取患者数据失败：数据格式不正确');
-        console.error('API返回数据格式不正确:', response.data);
-      }
-    } catch (err) {
-      if (err.response?.status === 401) {
-        setError('未登录或登录已过期，请重新登录');
-        // 可以在这里添加重定向到登录页面的逻辑
-      } else {
-        setError('获取患者数据失败');
-        console.error('获取患者数据错误:', err);
-      }
-    } finally {
-      setLoading(false);
-    }
-  };
+  // 患者按页加载，搜索交给服务端，不在已加载的一页里过滤
+  const {
+    patients,
+    loading: patientsLoading,
+    error: patientsError,
+    hasMore,
+    loadMore
+  } = usePatientPages(searchTerm);
 
   const handleSearch = (e) => {
     setSearchTerm(e.target.value);
   };
 
   const handlePatientSelect = async (patient) => {
+    // 患者列表只返回摘要，选中时再获取完整图像列表
+    if (patient && !patient.images && patient.image_count > 0) {
+      try {
+        const response = await axios.get(`${API_BASE_URL}/api/patients/${patient.id}/images`, {
+          headers: {
+            'Authorization': `Bearer ${localStorage.getItem('token')}`
+          }
+        });
+        patient = { ...patient, images: response.data.images || [] };
+      } catch (err) {
+        console.error('获取患者图像列表错误:', err);
+      }
+    }
     setSelectedPatient(patient);
     
     // 重置状态
@@ -297,12 +279,29 @@ function DataManager() {
   const generateReport = async (patientId) => {
     try {
       setLoading(true);
-      const response = await axios.get(`${API_BASE_URL}/api/reports/${patientId}`, {
+      const requestReport = () => axios.get(`${API_BASE_URL}/api/reports/${patientId}`, {
         responseType: 'blob',
         headers: {
           'Accept': 'application/pdf'
         }
       });
+      let response = await requestReport();
+      if (response.status === 202) {
+        // 报告在后台生成，轮询任务状态直到完成后再下载
+        const job = JSON.parse(await response.data.text());
+        message.info('报告正在生成，请稍候...');
+        for (;;) {
+          await new Promise(resolve => setTimeout(resolve, 1000));
+          const { data } = await axios.get(`${API_BASE_URL}${job.status_url}`);
+          if (data.status === 'failed') {
+            throw new Error(data.details?.error || '报告生成失败');
+          }
+          if (data.status === 'completed') {
+            break;
+          }
+        }
+        response = await requestReport();
+      }
       // 处理报告下载
       const blob = new Blob([response.data], { type: 'application/pdf' });
       const url = window.URL.createObjectURL(blob);
@@ -322,11 +321,6 @@ function DataManager() {
     }
   };
 
-  const filteredPatients = patients.filter(patient =>
-    patient.name?.toLowerCase().includes(searchTerm.toLowerCase()) ||
-    patient.patient_id?.toLowerCase().includes(searchTerm.toLowerCase())
-  );
-
   // 渲染分割图像部分
   const renderSegmentationImages = () => {
     if (!selectedImage) {
@@ -425,11 +419,16 @@ function DataManager() {
         />
       </div>
 
-      {loading && <div className="loading">加载中...</div>}
+      {(loading || (patientsLoading && patients.length === 0)) && <div className="loading">加载中...</div>}
       {error && <div className="error">{error}</div>}
+      {patientsError && (
+        <div className="error">
+          {patientsError.response?.status === 401 ? '未登录或登录已过期，请重新登录' : '获取患者数据失败'}
+        </div>
+      )}
 
       <div className="patients-list">
-        {filteredPatients.map(patient => (
+        {patients.map(patient => (
           <div
             key={patient.id}
             className={`patient-card ${selectedPatient?.id === patient.id ? 'selected' : ''}`}
@@ -440,7 +439,7 @@ function DataManager() {
             <p>年龄: {patient.age}</p>
             <p>性别: {patient.gender}</p>
             <p>检查日期: {new Date(patient.created_at).toLocaleDateString()}</p>
-            <p>图像数: {patient.images?.length || 0}</p>
+            <p>图像数: {patient.image_count ?? 0}</p>
             <button onClick={(e) => {
               e.stopPropagation();
               generateReport(patient.id);
@@ -449,6 +448,14 @@ function DataManager() {
         ))}
       </div>
 
+      {hasMore && (
+        <div className="patients-more">
+          <button onClick={loadMore} disabled={patientsLoading}>
+            {patientsLoading ? '加载中...' : '加载更多'}
+          </button>
+        </div>
+      )}
+
       {selectedPatient && (
         <div className="patient-details">
           <h2>患者详细信息</h2>
@@ -4,6 +4,8 @@ import { ZoomInOutlined, ZoomOutOutlined, FullscreenOutlined, SyncOutlined, EyeO
 import { TransformWrapper, TransformComponent } from 'react-zoom-pan-pinch';
 import { useSearchParams, useNavigate } from 'react-router-dom';
 import { axiosInstance } from '../../utils/axiosConfig';
+import { fetchPatientPage } from '../../utils/patients';
+import PatientSelect from '../Patient/PatientSelect';
 import './ImageCompare.css';
 
 // 添加内联样式
@@ -33,10 +35,10 @@ const ImageCompare = () => {
   const [opacity, setOpacity] = useState(0.5);
   const [syncZoom, setSyncZoom] = useState(true);
   const [showDifference, setShowDifference] = useState(false);
-  const [patients, setPatients] = useState([]);
   const [loading, setLoading] = useState(true);
   const [imageData, setImageData] = useState([]);
   const [selectedPatient, setSelectedPatient] = useState(null);
+  const [trends, setTrends] = useState(null);
   const [searchParams] = useSearchParams();
   const navigate = useNavigate();
   
@@ -72,26 +74,14 @@ const ImageCompare = () => {
     }
   }, [searchParams]);
   
-  // 获取患者列表
+  // 未指定患者时自动选择第一个患者；下拉框本身按页加载并使用服务端搜索
   const fetchPatients = async () => {
     try {
       setLoading(true);
-      console.log('开始获取患者列表');
-      const response = await axiosInstance.get('/api/patients');
-      console.log('患者列表响应:', response.data);
-      
-      if (response.data.success && Array.isArray(response.data.patients)) {
-        setPatients(response.data.patients);
-        console.log(`成功获取${response.data.patients.length}名患者`);
-        
-        // 如果有患者但没有选择患者，自动选择第一个
-        if (response.data.patients.length > 0 && !selectedPatient) {
-          const firstPatient = response.data.patients[0];
-          console.log('自动选择第一个患者:', firstPatient.id);
-          handlePatientChange(firstPatient.id);
-        }
-      } else {
-        message.error('获取患者列表失败');
+      const { patients: firstPage } = await fetchPatientPage({ limit: 1 });
+      if (firstPage.length > 0 && !selectedPatient) {
+        console.log('自动选择第一个患者:', firstPage[0].id);
+        handlePatientChange(firstPage[0].id);
       }
     } catch (error) {
       console.error('获取患者列表错误:', error);
@@ -145,7 +135,11 @@ const ImageCompare = () => {
   const fetchPatientImages = async (patientId) => {
     try {
       setLoading(true);
-      const response = await axiosInstance.get(`/api/patients/${patientId}`);
+      const [response, trendResponse] = await Promise.all([
+        axiosInstance.get(`/api/patients/${patientId}`),
+        axiosInstance.get(`/api/patients/${patientId}/trends`).catch(() => null)
+      ]);
+      setTrends(trendResponse?.data?.success ? trendResponse.data.trends : null);
       if (response.data.success) {
         const patientData = response.data.patient;
         const processedImages = patientData.images.filter(img => img.processed && img.task_id);
@@ -299,6 +293,20 @@ const ImageCompare = () => {
     return ((newValue - oldValue) / oldValue * 100).toFixed(2);
   };
   
+  // 服务端计算的年化变化率（多次检查的线性回归）
+  const renderAnnualChange = (metric) => {
+    const fit = trends?.metrics?.[metric];
+    if (!fit || fit.annual_percent_change === null || fit.annual_percent_change === undefined) return null;
+    const rate = fit.annual_percent_change;
+    return (
+      <Tooltip title={`基于${fit.n}次检查的线性回归，R² = ${fit.r2.toFixed(2)}`}>
+        <div className={`volume-change ${rate > 0 ? 'increase' : rate < 0 ? 'decrease' : 'neutral'}`}>
+          {rate > 0 ? '+' : ''}{rate.toFixed(2)}%/年
+        </div>
+      </Tooltip>
+    );
+  };
+  
   // 获取变化类型的CSS类
   const getChangeClass = (oldValue, newValue) => {
     if (!oldValue || !newValue) return 'neutral';
@@ -704,6 +712,7 @@ const ImageCompare = () => {
                       {calculateChange(selectedImages[0].gm_volume, selectedImages[1].gm_volume)}%
                     </div>
                   )}
+                  {renderAnnualChange('gm_volume')}
                 </div>
               </Col>
               <Col span={6}>
@@ -715,6 +724,7 @@ const ImageCompare = () => {
                       {calculateChange(selectedImages[0].wm_volume, selectedImages[1].wm_volume)}%
                     </div>
                   )}
+                  {renderAnnualChange('wm_volume')}
                 </div>
               </Col>
               <Col span={6}>
@@ -726,6 +736,7 @@ const ImageCompare = () => {
                       {calculateChange(selectedImages[0].csf_volume, selectedImages[1].csf_volume)}%
                     </div>
                   )}
+                  {renderAnnualChange('csf_volume')}
                 </div>
               </Col>
               <Col span={6}>
@@ -737,6 +748,7 @@ const ImageCompare = () => {
                       {calculateChange(selectedImages[0].tiv_volume, selectedImages[1].tiv_volume)}%
                     </div>
                   )}
+                  {renderAnnualChange('tiv_volume')}
                 </div>
               </Col>
             </Row>
@@ -752,12 +764,11 @@ const ImageCompare = () => {
         <div className="controls-section">
           <Row gutter={[16, 16]} align="middle">
             <Col xs={24} md={8}>
-              <Select
+              <PatientSelect
                 placeholder="选择患者"
                 style={{ width: '100%' }}
                 value={selectedPatient}
                 onChange={handlePatientChange}
-                options={patients.map(p => ({ label: p.name, value: p.id }))}
               />
             </Col>
             
@@ -4,6 +4,7 @@ import { axiosInstance } from '../../utils/axiosConfig';
 import { message, Upload, Button, Space, Card, Progress, List, Select, Modal, Form, Input, InputNumber, Radio, Alert, Row, Col, Spin, Typography, Divider } from 'antd';
 import { UploadOutlined, PlusOutlined, InboxOutlined, FileImageOutlined, LoadingOutlined } from '@ant-design/icons';
 import './ImageUpload.css';
+import PatientSelect from '../Patient/PatientSelect';
 import { useNavigate } from 'react-router-dom';
 import { v4 as uuidv4 } from 'uuid';
 import { API_BASE, ALLOWED_EXTENSIONS, MAX_FILE_SIZE, FALLBACK_IMAGE } from '../../utils/constants';
@@ -64,7 +65,6 @@ const ImageUpload = ({ selectedPatient, onUploadSuccess, hidePatientSelect, auto
   const [uploadedImageId, setUploadedImageId] = useState(null);
   const [progress, setProgress] = useState(0);
   const [processingLogs, setProcessingLogs] = useState([]);
-  const [patients, setPatients] = useState([]);
   const [imageLoading, setImageLoading] = useState({ gm: false, wm: false, csf: false });
   const [showPatientModal, setShowPatientModal] = useState(false);
   const [form] = Form.useForm();
@@ -75,7 +75,7 @@ const ImageUpload = ({ selectedPatient, onUploadSuccess, hidePatientSelect, auto
   const [processingStatus, setProcessingStatus] = useState(null);
   const [volumeData, setVolumeData] = useState(null);
   const [selectedPatientState, setSelectedPatientState] = useState(selectedPatient || null);
-  const [patientsLoading, setPatientsLoading] = useState(false);
+  const [patientReloadKey, setPatientReloadKey] = useState(0);
   const [pollingTimer, setPollingTimer] = useState(null);
   const [previewLoading, setPreviewLoading] = useState(false);
   const [previewError, setPreviewError] = useState(null);
@@ -106,15 +106,6 @@ const ImageUpload = ({ selectedPatient, onUploadSuccess, hidePatientSelect, auto
     });
   }, []);
 
-  // 获取患者列表
-  useEffect(() => {
-    if (!hidePatientSelect) {
-      console.log('开始获取患者列表...');
-      setPatientsLoading(true);
-      fetchPatients();
-    }
-  }, [hidePatientSelect]);
-
   // 添加处理URL中patient_id参数的效果
   useEffect(() => {
     // 尝试从URL参数中获取patient_id
@@ -131,52 +122,6 @@ const ImageUpload = ({ selectedPatient, onUploadSuccess, hidePatientSelect, auto
     }
   }, [form]);
 
-  const fetchPatients = async () => {
-    try {
-      const token = localStorage.getItem('token');
-      if (!token) {
-        message.error('请先登录');
-        navigate('/login');
-        return;
-      }
-      
-      console.log('获取患者列表...');
-      setPatientsLoading(true);
-      
-      const response = await axiosInstance.get('/api/patients');
-      
-      if (response.data.success && Array.isArray(response.data.patients)) {
-        setPatients(response.data.patients);
-        console.log('获取到', response.data.patients.length, '个患者');
-        setPatientsLoading(false);
-        
-        // 检查如果是从URL传入的patient_id，确保在获取患者列表后设置选中状态
-        const queryParams = new URLSearchParams(window.location.search);
-        const patientIdFromUrl = queryParams.get('patient_id');
-        
-        if (patientIdFromUrl) {
-          const patientId = parseInt(patientIdFromUrl, 10);
-          setSelectedPatientState(patientId);
-          form.setFieldsValue({ patient: patientId });
-          console.log('从URL设置患者选中状态:', patientId);
-        }
-      } else {
-        console.error('患者数据格式不正确:', response.data);
-        message.error('获取患者列表失败');
-        setPatientsLoading(false);
-      }
-    } catch (error) {
-      console.error('获取患者列表错误:', error);
-      message.error('获取患者列表失败');
-      setPatientsLoading(false);
-      
-      // 如果是未授权错误，重定向到登录页面
-      if (error.response && error.response.status === 401) {
-        navigate('/login');
-      }
-    }
-  };
-
   const handlePatientChange = (value) => {
     console.log('选择患者:', value);
     setSelectedPatientState(value);
@@ -195,8 +140,8 @@ const ImageUpload = ({ selectedPatient, onUploadSuccess, hidePatientSelect, auto
         setShowPatientModal(false);
         addPatientForm.resetFields();
         
-        // 刷新患者列表
-        await fetchPatients();
+        // 刷新患者下拉框
+        setPatientReloadKey(key => key + 1);
         
         // 自动选择新创建的患者
         const newPatientId = response.data.patient.id;
@@ -1138,14 +1083,12 @@ const ImageUpload = ({ selectedPatient, onUploadSuccess, hidePatientSelect, auto
               initialValue={selectedPatientState}
             >
           <div className="patient-selector">
-            <Select
+            <PatientSelect
               style={{ width: '100%' }}
               placeholder="请选择患者"
               value={selectedPatientState}
               onChange={handlePatientChange}
-              options={patients.map(p => ({ label: p.name, value: p.id }))}
-              loading={patientsLoading}
-              notFoundContent={patientsLoading ? <Spin size="small" /> : "没有找到患者"}
+              reloadKey={patientReloadKey}
             />
             <Button 
               type="primary" 
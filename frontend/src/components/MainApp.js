@@ -1,4 +1,4 @@
-import React, { useReducer, useEffect, useState } from 'react';
+import React, { useReducer } from 'react';
 import { Link, useNavigate } from 'react-router-dom';
 import './MainApp.css';
 import axios from 'axios';
@@ -48,41 +48,6 @@ const MainApp = ({ user, onLogout }) => {
         user: user
     });
     const navigate = useNavigate();
-    const [loading, setLoading] = useState(false);
-    const [patients, setPatients] = useState([]);
-
-    // 获取患者列表
-    useEffect(() => {
-        const fetchPatients = async () => {
-            try {
-                setLoading(true);
-                const token = localStorage.getItem('token');
-                if (!token) {
-                    throw new Error('未找到认证令牌');
-                }
-                
-                const response = await axiosInstance.get('/api/patients');
-                setPatients(response.data.patients);
-            } catch (error) {
-                console.error('获取患者列表失败:', error);
-                if (error.response?.status === 401) {
-                    localStorage.removeItem('token');
-                    delete axiosInstance.defaults.headers.common['Authorization'];
-                    if (onLogout) {
-                        onLogout();
-                    }
-                    navigate('/login', { replace: true });
-                }
-            } finally {
-                setLoading(false);
-            }
-        };
-
-        if (authState.isAuthenticated) {
-            fetchPatients();
-        }
-    }, [authState.isAuthenticated, navigate, onLogout]);
-
     // 处理登出
     const handleLogout = () => {
         localStorage.removeItem('token');
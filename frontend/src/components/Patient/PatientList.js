@@ -3,50 +3,24 @@ import axios from 'axios';
 import { Link, useNavigate } from 'react-router-dom';
 import '../../styles/Patient.css';
 import { message } from 'antd';
+import { usePatientPages } from '../../utils/patients';
 
 const API_BASE = process.env.REACT_APP_API_BASE || 'http://localhost:5000';
 
 function PatientList() {
-    const [patients, setPatients] = useState([]);
-    const [loading, setLoading] = useState(true);
-    const [error, setError] = useState('');
     const [searchTerm, setSearchTerm] = useState('');
     const [deleteConfirm, setDeleteConfirm] = useState(null);
     const navigate = useNavigate();
+    // 患者列表按页加载，输入搜索词时改用服务端搜索
+    const { patients, loading, error, hasMore, loadMore, reload } = usePatientPages(searchTerm);
 
     useEffect(() => {
-        fetchPatients();
-    }, []);
-
-    const fetchPatients = async () => {
-        try {
-            const token = localStorage.getItem('token');
-            if (!token) {
-                navigate('/login');
-                return;
-            }
-
-            const response = await axios.get(`${API_BASE}/api/patients`, {
-                headers: {
-                    'Authorization': `Bearer ${token}`,
-                    'Content-Type': 'application/json',
-                    'Accept': 'application/json'
-                }
-            });
-
-            if (response.data && Array.isArray(response.data.patients)) {
-                setPatients(response.data.patients);
-            }
-            setLoading(false);
-        } catch (error) {
+        if (!localStorage.getItem('token') || error?.response?.status === 401) {
+            navigate('/login');
+        } else if (error) {
             console.error('获取患者列表失败:', error);
-            setError('获取患者列表失败');
-            setLoading(false);
-            if (error.response?.status === 401) {
-                navigate('/login');
-            }
         }
-    };
+    }, [error, navigate]);
 
     const handleDelete = async (patientId) => {
         try {
@@ -76,7 +50,7 @@ function PatientList() {
                 // 关闭确认对话框
                 setDeleteConfirm(null);
                 // 刷新患者列表
-                await fetchPatients();
+                await reload();
             } else {
                 console.error('删除失败:', response.data.error);
                 message.error(response.data.error || '删除失败');
@@ -95,11 +69,6 @@ function PatientList() {
         }
     };
 
-    const filteredPatients = patients.filter(patient =>
-        patient.name.toLowerCase().includes(searchTerm.toLowerCase()) ||
-        patient.patient_id.toLowerCase().includes(searchTerm.toLowerCase())
-    );
-
     return (
         <div className="patient-list-container">
             <div className="patient-list-header">
@@ -114,18 +83,18 @@ function PatientList() {
                 </div>
             </div>
 
-            {loading && <div className="loading">加载中...</div>}
-            {error && <div className="error-message">{error}</div>}
+            {loading && patients.length === 0 && <div className="loading">加载中...</div>}
+            {error && <div className="error-message">获取患者列表失败</div>}
 
             <div className="patient-grid">
-                {filteredPatients.map(patient => (
+                {patients.map(patient => (
                     <div key={patient.id} className="patient-card">
                         <h3>{patient.name}</h3>
                         <div className="patient-info">
                             <p><strong>患者ID：</strong>{patient.patient_id}</p>
                             <p><strong>年龄：</strong>{patient.age}</p>
                             <p><strong>性别：</strong>{patient.gender}</p>
-                            <p><strong>检查次数：</strong>{patient.images?.length || 0}</p>
+                            <p><strong>检查次数：</strong>{patient.image_count ?? 0}</p>
                             <p><strong>首次检查：</strong>{new Date(patient.created_at).toLocaleDateString()}</p>
                         </div>
                         <div className="patient-actions">
@@ -149,6 +118,14 @@ function PatientList() {
                 ))}
             </div>
 
+            {hasMore && (
+                <div className="patient-list-more">
+                    <button className="load-more-button" onClick={loadMore} disabled={loading}>
+                        {loading ? '加载中...' : '加载更多'}
+                    </button>
+                </div>
+            )}
+
             <div className="patient-list-footer">
                 <Link to="/patients/new" className="add-patient-button">
                     添加新患者
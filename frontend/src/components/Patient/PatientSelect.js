@@ -0,0 +1,70 @@
+import React, { useState, useEffect } from 'react';
+import { Select, Spin } from 'antd';
+import { usePatientPages, fetchPatient } from '../../utils/patients';
+
+// 患者下拉选择：输入时使用服务端搜索，滚动到底部时加载下一页
+function PatientSelect({ value, onChange, onLoaded, reloadKey, ...selectProps }) {
+    const [searchTerm, setSearchTerm] = useState('');
+    const [selected, setSelected] = useState(null);
+    const { patients, loading, hasMore, loadMore, reload } = usePatientPages(searchTerm);
+
+    // 新建患者等场景下由调用方改变reloadKey来刷新第一页
+    useEffect(() => {
+        if (reloadKey !== undefined) {
+            reload();
+        }
+        // eslint-disable-next-line react-hooks/exhaustive-deps
+    }, [reloadKey]);
+
+    useEffect(() => {
+        if (onLoaded && !searchTerm) {
+            onLoaded(patients);
+        }
+        // eslint-disable-next-line react-hooks/exhaustive-deps
+    }, [patients]);
+
+    // 选中的患者可能不在已加载的页里，单独获取其名称用于显示
+    useEffect(() => {
+        if (value === null || value === undefined || patients.some(p => p.id === value)) {
+            return;
+        }
+        if (selected?.id === value) {
+            return;
+        }
+        let cancelled = false;
+        fetchPatient(value)
+            .then(patient => { if (!cancelled && patient) setSelected(patient); })
+            .catch(err => console.error('获取选中患者失败:', err));
+        return () => { cancelled = true; };
+    }, [value, patients, selected]);
+
+    const handlePopupScroll = (e) => {
+        const { scrollTop, scrollHeight, clientHeight } = e.target;
+        if (hasMore && scrollTop + clientHeight >= scrollHeight - 20) {
+            loadMore();
+        }
+    };
+
+    const options = patients.map(p => ({ label: p.name, value: p.id }));
+    if (selected && selected.id === value && !patients.some(p => p.id === value)) {
+        options.unshift({ label: selected.name, value: selected.id });
+    }
+
+    return (
+        <Select
+            {...selectProps}
+            showSearch
+            filterOption={false}
+            value={value}
+            onChange={onChange}
+            onSearch={setSearchTerm}
+            onBlur={() => setSearchTerm('')}
+            onPopupScroll={handlePopupScroll}
+            options={options}
+            loading={loading}
+            notFoundContent={loading ? <Spin size="small" /> : '没有找到患者'}
+        />
+    );
+}
+
+export default PatientSelect;
@@ -81,9 +81,14 @@ export const imageAPI = {
 
 // 患者相关API
 export const patientAPI = {
-    // 获取患者列表
-    getPatients: () => {
-        return axiosInstance.get('/api/patients');
+    // 获取一页患者列表，下一页用响应中的next_cursor作为cursor
+    getPatients: ({ limit, cursor } = {}) => {
+        return axiosInstance.get('/api/patients', { params: { limit, cursor: cursor ?? undefined } });
+    },
+
+    // 服务端搜索患者，同样按游标分页
+    searchPatients: (q, { limit, cursor } = {}) => {
+        return axiosInstance.get('/api/patients/search', { params: { q, limit, cursor: cursor ?? undefined } });
     },
 
     // 创建新患者
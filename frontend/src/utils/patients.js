@@ -0,0 +1,89 @@
+import { useState, useEffect, useCallback, useRef } from 'react';
+import axios from 'axios';
+import { API_BASE } from './constants';
+
+// 搜索输入停止多久后再请求服务端（毫秒）
+const SEARCH_DELAY = 300;
+
+const requestConfig = (params) => ({
+    baseURL: API_BASE,
+    params,
+    headers: {
+        'Authorization': `Bearer ${localStorage.getItem('token')}`,
+        'Accept': 'application/json'
+    }
+});
+
+// 获取一页患者摘要（按患者ID键集分页），没有下一页时nextCursor为null
+export const fetchPatientPage = async ({ cursor = null, limit } = {}) => {
+    const response = await axios.get('/api/patients', requestConfig({ limit, cursor: cursor ?? undefined }));
+    return { patients: response.data.patients || [], nextCursor: response.data.next_cursor ?? null };
+};
+
+// 服务端搜索患者姓名和编号（前缀匹配，按相关度排序），同样按游标分页
+export const searchPatients = async (q, { cursor = null, limit } = {}) => {
+    const response = await axios.get('/api/patients/search', requestConfig({ q, limit, cursor: cursor ?? undefined }));
+    return { patients: response.data.patients || [], nextCursor: response.data.next_cursor ?? null };
+};
+
+// 获取单个患者，用于已选中但不在已加载页中的患者
+export const fetchPatient = async (patientId) => {
+    const response = await axios.get(`/api/patients/${patientId}`, requestConfig());
+    return response.data.patient;
+};
+
+// 分页加载的患者列表：searchTerm为空时按ID列出，否则使用服务端搜索；loadMore加载下一页
+export const usePatientPages = (searchTerm = '', { limit } = {}) => {
+    const [patients, setPatients] = useState([]);
+    const [nextCursor, setNextCursor] = useState(null);
+    const [loading, setLoading] = useState(false);
+    const [error, setError] = useState(null);
+    // 只采用最近一次请求的结果，搜索词变化后旧的响应直接丢弃
+    const latestRequest = useRef(0);
+    const term = searchTerm.trim();
+
+    const load = useCallback(async (cursor = null) => {
+        const requestId = ++latestRequest.current;
+        setLoading(true);
+        try {
+            const page = term
+                ? await searchPatients(term, { cursor, limit })
+                : await fetchPatientPage({ cursor, limit });
+            if (requestId !== latestRequest.current) {
+                return;
+            }
+            setPatients(prev => (cursor === null ? page.patients : [...prev, ...page.patients]));
+            setNextCursor(page.nextCursor);
+            setError(null);
+        } catch (err) {
+            if (requestId === latestRequest.current) {
+                setError(err);
+            }
+        } finally {
+            if (requestId === latestRequest.current) {
+                setLoading(false);
+            }
+        }
+    }, [term, limit]);
+
+    useEffect(() => {
+        const timer = setTimeout(() => load(null), term ? SEARCH_DELAY : 0);
+        return () => clearTimeout(timer);
+    }, [load, term]);
+
+    const loadMore = useCallback(() => {
+        if (nextCursor !== null && !loading) {
+            load(nextCursor);
+        }
+    }, [load, nextCursor, loading]);
+
+    return {
+        patients,
+        setPatients,
+        loading,
+        error,
+        hasMore: nextCursor !== null,
+        loadMore,
+        reload: () => load(null)
+    };
+};